@@ -0,0 +1,617 @@
+# -*- coding: utf-8 -*-
+# acquisition.py
+# Helpful Engineering
+#
+# Purpose:
+# Serial acquisition for the ventsense client. Reading the serial port and logging it runs on a
+# dedicated thread, so a slow plot redraw (window drag, resize, autoscale redraw) never holds up
+# the serial stream. Parsed samples are handed to the plotting code through a bounded queue that
+# the render loop drains once per frame. The log data itself is written to disk by the client's
+# log writer thread (see logwriter.py), so a slow disk does not hold up the serial stream either.
+#
+# Notes:
+# SampleQueue is built on collections.deque, whose append() and popleft() are atomic in CPython,
+# so the reader thread never takes a lock that the GUI thread could be holding.
+#
+# The columns of a serial line are described by a channels.ChannelSchema. It starts out as the
+# schema given when the thread is created and is replaced whenever the firmware prints a header
+# line, so every log file gets the columns of the data that is actually being received. Each log
+# file writes its own header (see logwriter.py), so header lines received from the firmware are not
+# logged as data.
+#
+# When the client reads several devices at once, each one gets its own AcquisitionThread, with its
+# own log files, reset detection and counters. Serial reads block with a timeout and release the
+# GIL while waiting, so a slow or silent device never holds up the others.
+#
+# Alarm rules (see alarms.py) are evaluated on this thread as soon as each sample has been parsed, so
+# they keep working when the plot is off or has fallen behind. The read timeout also lets the thread
+# check for dropout while nothing arrives.
+#
+# The timestamp of every parsed sample is fed to a timing.SampleClock, which keeps track of the
+# device's sample rate, gaps, repeated timestamps and resets as they are received (see clock).
+#
+# With a stream server (see stream.py), every parsed sample is also handed to the device's
+# publisher, which, like SampleQueue, only appends it to a deque for the server's own thread.
+#
+# With --filter, the parsed samples are filtered (see filters.py) before they go to breath analysis
+# and the plot. The log files, the stream server, alarms and the sample timing get the raw values.
+#
+# With --profile, each pass of the read loop is timed stage by stage (see profiling.py and
+# ACQUISITION_STAGES). Without it, the thread's profile is None and the stages are not timed.
+#
+# NumPy is only needed for bulk ingest, so it is only imported when bulk ingest is used. That keeps
+# the logging-only client quick to start on small machines.
+
+import collections
+import sys
+import threading
+import time
+import traceback
+
+from channels import ChannelSchema, DEFAULT_NUM_SENSORS
+from timing import SampleClock
+from profiling import clock
+
+#what to do when a sample arrives and the queue is full
+OVERFLOW_DROP_OLDEST = 'drop-oldest'
+OVERFLOW_DROP_NEWEST = 'drop-newest'
+OVERFLOW_POLICIES = [OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST]
+
+#how the serial port is read. Line mode reads and parses one line per call. Bulk mode reads
+#everything the port has buffered in one call and parses the complete lines as one batch
+INGEST_LINE = 'line'
+INGEST_BULK = 'bulk'
+INGEST_MODES = [INGEST_LINE, INGEST_BULK]
+
+#how long a single serial read may block before the reader thread checks whether it should stop
+READ_TIMEOUT = 0.1 #seconds
+
+#stages of the read loop timed with --profile. Split is only used by bulk ingest, echo only with console output
+STAGE_READ = 0          #reading the serial port (and checking for alarm dropout)
+STAGE_SPLIT = 1         #splitting the data read into lines
+STAGE_DECODE = 2        #decoding lines to text
+STAGE_ECHO = 3          #echoing lines to the console
+STAGE_LOG = 4           #handing lines (or parsed samples, for a binary log) to the log writer
+STAGE_PARSE = 5         #parsing lines into samples
+STAGE_FILTER = 6        #filtering samples
+STAGE_ANALYZE = 7       #sample timing, alarms and breath analysis
+STAGE_QUEUE = 8         #putting samples on the plot queue
+STAGE_PUBLISH = 9       #handing samples to the stream server
+ACQUISITION_STAGES = ['read', 'split', 'decode', 'echo', 'log', 'parse', 'filter', 'analyze', 'queue', 'publish']
+
+
+class SampleQueue(object):
+    #bounded single-producer/single-consumer queue of samples
+    def __init__(self, maxsize, policy=OVERFLOW_DROP_OLDEST):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: ' + str(policy))
+
+        self.maxsize = int(maxsize)
+        self.policy = policy
+        self._items = collections.deque()
+
+        #counters. 'dropped' is updated only by the producer, 'coalesced' and 'drained' only by
+        #the consumer, so no locking is needed
+        self.received = 0       #samples offered to the queue
+        self.dropped = 0        #samples discarded because the queue was full
+        self.drained = 0        #samples handed to the consumer
+        self.coalesced = 0      #samples that shared a frame with an earlier sample
+        self.max_depth = 0      #largest number of samples seen waiting in the queue
+
+    def __len__(self):
+        return len(self._items)
+
+    #called from the reader thread
+    def put(self, item):
+        self.received += 1
+        depth = len(self._items)
+
+        if depth >= self.maxsize:
+            self.dropped += 1
+
+            if self.policy == OVERFLOW_DROP_NEWEST:
+                return
+
+            try:
+                self._items.popleft()
+            except IndexError:
+                #consumer emptied the queue in the meantime
+                pass
+        elif depth >= self.max_depth:
+            self.max_depth = depth + 1
+
+        self._items.append(item)
+
+    #called from the reader thread. Adds a list of samples, applying the overflow policy to the
+    #whole batch at once
+    def putMany(self, items):
+        n = len(items)
+        self.received += n
+
+        free = self.maxsize - len(self._items)
+
+        if n > free:
+            if self.policy == OVERFLOW_DROP_NEWEST:
+                keep = max(free, 0)
+                self.dropped += n - keep
+                items = items[:keep]
+            elif n > self.maxsize:
+                #only the newest maxsize samples of the batch can survive
+                self.dropped += n - self.maxsize
+                items = items[n - self.maxsize:]
+
+        self._items.extend(items)
+
+        #drop the oldest queued samples until the queue is back within its bound
+        excess = len(self._items) - self.maxsize
+        try:
+            for _ in range(excess):
+                self._items.popleft()
+                self.dropped += 1
+        except IndexError:
+            #consumer emptied the queue in the meantime
+            pass
+
+        depth = min(len(self._items), self.maxsize)
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    #called from the render loop. Returns every sample pending right now, oldest first
+    def drain(self):
+        batch = []
+        items = self._items
+
+        try:
+            for _ in range(len(items)):
+                batch.append(items.popleft())
+        except IndexError:
+            pass
+
+        if batch:
+            self.drained += len(batch)
+            self.coalesced += len(batch) - 1
+
+        return batch
+
+    def stats(self):
+        return ('received: ' + str(self.received) + ', dropped: ' + str(self.dropped) +
+                ', coalesced: ' + str(self.coalesced) + ', max queue depth: ' + str(self.max_depth))
+
+
+class AcquisitionThread(threading.Thread):
+    #reads lines from 'ser', echoes them to the console if requested, logs them to the file
+    #returned by 'start_log_file' (called with the column names of the current schema, which the
+    #file is expected to start with; a new file is started every time the Arduino resets; it may
+    #be a text file such as a logwriter.LogFile, or a binlog.BinLogWriter) and,
+    #if 'sample_queue' is given, puts each parsed sample on it as a sequence of floats.
+    #'ingest_mode' selects between reading one line per call (INGEST_LINE) and reading everything
+    #the port has buffered and parsing it as a batch (INGEST_BULK). 'schema' is the ChannelSchema
+    #to assume until the firmware's header line is seen. 'device_name', if given, identifies the
+    #device when several are read at once; it is used to prefix the lines echoed to the console.
+    #'breath_analyzer', if given, is a breath.BreathAnalyzer that is fed every parsed sample; unless it
+    #has its own, the breaths it reports are echoed to the console the same way. 'alarm_engine', if given, is an
+    #alarms.AlarmEngine that is fed every parsed sample, with the time it was read. 'publisher', if given, is a
+    #stream.StreamPublisher that is given the schema whenever the Arduino resets, and every parsed sample. 'profile', if
+    #given, is a profiling.StageProfile with the stages in ACQUISITION_STAGES, to which the time spent in each stage is added.
+    #'filters', if given, is a filters.FilterChain through which the samples for the breath analyzer and the queue are passed
+    def __init__(self, ser, start_log_file, console_output=False, sample_queue=None, ingest_mode=INGEST_LINE,
+                 schema=None, device_name=None, breath_analyzer=None, alarm_engine=None, publisher=None, profile=None,
+                 filters=None):
+        thread_name = 'ventsense-acquisition'
+        if device_name is not None:
+            thread_name += '-' + device_name
+
+        threading.Thread.__init__(self, name=thread_name)
+        self.daemon = True
+
+        if ingest_mode not in INGEST_MODES:
+            raise ValueError('Unknown ingest mode: ' + str(ingest_mode))
+
+        self.ser = ser
+        self.start_log_file = start_log_file
+        self.console_output = console_output
+        self.sample_queue = sample_queue
+        self.ingest_mode = ingest_mode
+        self.device_name = device_name
+        self.breath_analyzer = breath_analyzer
+        self.alarm_engine = alarm_engine
+        self.publisher = publisher
+        self.profile = profile
+        self.filters = filters
+
+        self._console_prefix = ''
+        if device_name is not None:
+            self._console_prefix = '[' + device_name + '] '
+
+        if schema is None:
+            schema = ChannelSchema.forSensors(DEFAULT_NUM_SENSORS)
+
+        #replaced (never modified) when a header line with different columns is received, so other threads
+        #can safely compare it by identity
+        self.schema = schema
+
+        if self.breath_analyzer is not None:
+            if self.breath_analyzer.echo is None:
+                self.breath_analyzer.echo = self._echo
+
+            self.breath_analyzer.setSchema(self.schema)
+
+        if self.alarm_engine is not None:
+            self.alarm_engine.setEcho(self._echo)
+            self.alarm_engine.setSchema(self.schema)
+
+        if self.filters is not None:
+            self.filters.setSchema(self.schema)
+
+        self.lines_read = 0
+        self.bad_lines = 0      #lines that could not be parsed as a sample (e.g. partial or corrupt)
+
+        #timing of the samples as received, from their timestamps. Read by other threads while running
+        self.clock = SampleClock()
+        self.error = None
+        self.error_traceback = None
+
+        self.start_time = None
+        self.end_time = None
+
+        self._file = None
+        self._binary_log = False
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    #seconds from the start of acquisition until it ended (or until now, if still running)
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+
+        end = self.end_time
+        if end is None:
+            end = time.perf_counter()
+
+        return end - self.start_time
+
+    #average number of lines read per second
+    def lineRate(self):
+        elapsed = self.elapsed()
+        return self.lines_read / elapsed if elapsed > 0 else 0.0
+
+    def stats(self):
+        return ('lines: ' + str(self.lines_read) + ', malformed: ' + str(self.bad_lines) +
+                ', lines/s: ' + '{:.1f}'.format(self.lineRate()))
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        self._startLogFile()
+
+        if self.publisher is not None:
+            self.publisher.setSchema(self.schema.field_names)
+
+        try:
+            if self.ingest_mode == INGEST_BULK:
+                self._runBulk()
+            else:
+                self._runLines()
+
+        except EOFError:
+            #the data source has no more data (e.g. the end of a replayed log)
+            pass
+
+        except Exception as e:
+            #any other exception ends the session, as it did when this loop ran on the main thread
+            self.error = e
+            self.error_traceback = traceback.format_exc()
+
+        finally:
+            self._file.close()
+            self.end_time = time.perf_counter()
+
+    #echo lines of text (each ending in a newline) to the console. Written in a single call, so that lines
+    #from several devices do not get mixed up
+    def _echo(self, text):
+        if self._console_prefix:
+            text = ''.join(self._console_prefix + line + '\n' for line in text.splitlines())
+
+        sys.stdout.write(text)
+
+    #the log file is either a text file (CSV) or a binary log writer, which only takes parsed samples
+    def _startLogFile(self):
+        self._file = self.start_log_file(self.schema.field_names)
+        self._binary_log = getattr(self._file, 'binary', False)
+
+    #take the channel schema from a header line, unless it does not describe any sensors (e.g. the
+    #line was garbled), in which case the current schema is kept
+    def _updateSchema(self, header):
+        try:
+            schema = ChannelSchema.fromHeader(header)
+        except ValueError:
+            return
+
+        if schema.field_names != self.schema.field_names:
+            self.schema = schema
+
+            if self.breath_analyzer is not None:
+                self.breath_analyzer.setSchema(self.schema)
+
+            if self.alarm_engine is not None:
+                self.alarm_engine.setSchema(self.schema)
+
+            if self.filters is not None:
+                self.filters.setSchema(self.schema)
+
+    #if Arduino resets while listening, then start a new log file, with the columns of the header line
+    def _checkHeader(self, header):
+        self._updateSchema(header)
+
+        #the Arduino's timestamps start over
+        self.clock.reset()
+
+        if self.breath_analyzer is not None:
+            self.breath_analyzer.reset()
+
+        if self.alarm_engine is not None:
+            self.alarm_engine.reset()
+
+        if self.filters is not None:
+            self.filters.reset()
+
+        #subscribers are told of every reset, as the firmware's header line would
+        if self.publisher is not None:
+            self.publisher.setSchema(self.schema.field_names)
+
+        self._file.close()
+        self._startLogFile()
+
+    def _runLines(self):
+        partial = b''
+        alarm_engine = self.alarm_engine
+        profile = self.profile
+        filters = self.filters
+
+        while not self._stop_event.is_set():
+            if profile is not None:
+                t = clock()
+
+            #read serial data. A read that times out returns whatever part of the line has
+            #arrived so far, so hold on to it until the rest of the line comes in
+            ser_bytes = self.ser.readline()
+            t_read = time.perf_counter()
+
+            if alarm_engine is not None:
+                alarm_engine.poll(t_read)
+
+            if profile is not None:
+                t = profile.lap(STAGE_READ, t)
+
+            if not ser_bytes:
+                continue
+
+            if not ser_bytes.endswith(b'\n'):
+                partial += ser_bytes
+                continue
+
+            if partial:
+                ser_bytes = partial + ser_bytes
+                partial = b''
+
+            #if running python 3, convert bytes to string
+            if (sys.version_info > (3, 0)):
+                ser_str = ser_bytes.decode('utf-8', 'ignore')
+            else:
+                ser_str = ser_bytes
+
+            #remove whitespace and line endings
+            ser_str = ser_str.strip()
+
+            if profile is not None:
+                t = profile.lap(STAGE_DECODE, t)
+
+            #if string is empty, skip the rest
+            if not ser_str:
+                continue
+
+            self.lines_read += 1
+
+            #echo data on console, if requested
+            if self.console_output:
+                self._echo(ser_str + '\n')
+
+                if profile is not None:
+                    t = profile.lap(STAGE_ECHO, t)
+
+            if ser_str[0:4] == 'time':
+                self._checkHeader(ser_str)
+                continue
+
+            #log data to CSV
+            if not self._binary_log:
+                self._file.write(ser_str + '\n')
+
+                if profile is not None:
+                    t = profile.lap(STAGE_LOG, t)
+
+            #parse the sample. Partial or corrupt lines are counted and skipped
+            str_tokens = ser_str.split(',')
+            num_fields = self.schema.num_fields
+
+            if len(str_tokens) < num_fields:
+                self.bad_lines += 1
+                continue
+
+            try:
+                sample = [float(tok) for tok in str_tokens[0:num_fields]]
+            except ValueError:
+                self.bad_lines += 1
+                continue
+
+            if profile is not None:
+                t = profile.lap(STAGE_PARSE, t)
+
+            #the filtered sample, or None if the filters decimated it away
+            filtered = sample
+            if filters is not None:
+                filters.setRate(self.clock.nominalRate())
+                filtered = filters.filterSample(sample)
+
+                if profile is not None:
+                    t = profile.lap(STAGE_FILTER, t)
+
+            self.clock.addSample(sample[0])
+
+            if alarm_engine is not None:
+                alarm_engine.addSample(sample, t_read)
+
+            if (self.breath_analyzer is not None) and (filtered is not None):
+                self.breath_analyzer.addSample(filtered)
+
+            if profile is not None:
+                t = profile.lap(STAGE_ANALYZE, t)
+
+            if self._binary_log:
+                self._file.writeSample(sample)
+
+                if profile is not None:
+                    t = profile.lap(STAGE_LOG, t)
+
+            #pass parsed sample on to the plot
+            if (self.sample_queue is not None) and (filtered is not None):
+                self.sample_queue.put(filtered)
+
+                if profile is not None:
+                    t = profile.lap(STAGE_QUEUE, t)
+
+            if self.publisher is not None:
+                self.publisher.put(sample)
+
+                if profile is not None:
+                    profile.lap(STAGE_PUBLISH, t)
+
+    def _runBulk(self):
+        #imported here, so that line mode does not need NumPy
+        import lineparser
+
+        splitter = lineparser.LineSplitter()
+        dtype = lineparser.sampleDtype(self.schema.field_names)
+        read_available = lineparser.readAvailable
+        profile = self.profile
+        t = None
+
+        while not self._stop_event.is_set():
+            if profile is not None:
+                t = clock()
+
+            data = read_available(self.ser)
+            t_read = time.perf_counter()
+
+            if self.alarm_engine is not None:
+                self.alarm_engine.poll(t_read)
+
+            if profile is not None:
+                t = profile.lap(STAGE_READ, t)
+
+            lines = splitter.feed(data)
+
+            if profile is not None:
+                t = profile.lap(STAGE_SPLIT, t)
+
+            if not lines:
+                continue
+
+            #split the batch wherever the Arduino has reset, so that every log file gets exactly the
+            #lines that belong to it
+            start = 0
+            if any(line.startswith(b'time') for line in lines):
+                for idx, line in enumerate(lines):
+                    if line.startswith(b'time'):
+                        t = self._handleBatch(lines[start:idx], dtype, t_read, t)
+
+                        self.lines_read += 1
+                        ser_str = line.decode('utf-8', 'ignore')
+                        self._checkHeader(ser_str)
+                        dtype = lineparser.sampleDtype(self.schema.field_names)
+
+                        if self.console_output:
+                            self._echo(ser_str + '\n')
+
+                        start = idx + 1
+
+            self._handleBatch(lines[start:], dtype, t_read, t)
+
+    #log, echo and parse a batch of sample lines that contains no reset, read at 't_read' (the time.perf_counter() time).
+    #With a profile, the stages are timed from 't' (a profiling.clock() time), and the end of the last one is returned
+    def _handleBatch(self, lines, dtype, t_read, t=None):
+        import lineparser
+
+        if not lines:
+            return t
+
+        profile = self.profile
+        self.lines_read += len(lines)
+
+        text = b'\n'.join(lines).decode('utf-8', 'ignore') + '\n'
+
+        if profile is not None:
+            t = profile.lap(STAGE_DECODE, t)
+
+        if self.console_output:
+            self._echo(text)
+
+            if profile is not None:
+                t = profile.lap(STAGE_ECHO, t)
+
+        if not self._binary_log:
+            self._file.write(text)
+
+            if profile is not None:
+                t = profile.lap(STAGE_LOG, t)
+
+        records, num_bad = lineparser.parseLines(lines, dtype)
+        self.bad_lines += num_bad
+
+        if len(records) == 0:
+            return t
+
+        values = lineparser.recordValues(records)
+
+        if profile is not None:
+            t = profile.lap(STAGE_PARSE, t)
+
+        filtered = values
+        if self.filters is not None:
+            self.filters.setRate(self.clock.nominalRate())
+            filtered = self.filters.filterSamples(values)
+
+            if profile is not None:
+                t = profile.lap(STAGE_FILTER, t)
+
+        self.clock.addSamples(values[:, 0])
+
+        if self.alarm_engine is not None:
+            self.alarm_engine.addSamples(values, t_read)
+
+        if (self.breath_analyzer is not None) and len(filtered):
+            self.breath_analyzer.addSamples(filtered)
+
+        if profile is not None:
+            t = profile.lap(STAGE_ANALYZE, t)
+
+        if self._binary_log:
+            self._file.writeRecords(values)
+
+            if profile is not None:
+                t = profile.lap(STAGE_LOG, t)
+
+        if (self.sample_queue is not None) and len(filtered):
+            self.sample_queue.putMany(filtered.tolist())
+
+            if profile is not None:
+                t = profile.lap(STAGE_QUEUE, t)
+
+        if self.publisher is not None:
+            self.publisher.putMany(values)
+
+            if profile is not None:
+                t = profile.lap(STAGE_PUBLISH, t)
+
+        return t
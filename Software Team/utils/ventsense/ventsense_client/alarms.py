@@ -0,0 +1,496 @@
+# -*- coding: utf-8 -*-
+# alarms.py
+# Helpful Engineering
+#
+# Purpose:
+# Rule-based alarms for the ventsense client, evaluated on every parsed sample on the acquisition
+# thread, so an alarm is raised within a bounded time of its sample arriving whether or not the
+# plot is enabled or keeping up. The rules are:
+#     high:<sensor>:<limit>     pressure above limit (e.g. over-pressure)
+#     low:<sensor>:<limit>      pressure below limit (e.g. pressure collapse on disconnection)
+#     rate:<sensor>:<limit>     pressure changing faster than limit per second, either way
+#     dropout:<ms>              no valid sample for this many milliseconds (e.g. cable or sensor fault)
+# where <sensor> is a sensor ID, counted from 1 in the order of the channel schema (as for the -a
+# option), and pressures are relative to the atmospheric sensor, in the units the client is set to
+# (hPa or cmH2O).
+#
+# Alarms are raised and cleared through sinks: the console, an alarm log file, JSON lines on stdout
+# (for another program to read through a pipe) and UDP datagrams (one JSON object each) to a local
+# port, e.g. for a separate alarm panel.
+#
+# Notes:
+# An alarm is raised on the first sample that breaks its rule, and cleared once the rule has held
+# again for CLEAR_TIME of device time (or, for dropout, on the next valid sample), so a value that
+# sits right on a limit does not raise a stream of alarms.
+#
+# A sample is valid if it was parsed and the pressures the rules watch are numbers. Dropout is timed
+# on the host clock, as there are no device timestamps while nothing arrives. The acquisition thread
+# checks it on every pass of its read loop, which serial read timeouts keep going at least every
+# READ_TIMEOUT (see acquisition.py).
+#
+# Latency is measured from the moment the serial read of a sample returned: decision latency until
+# the rules have been evaluated (for every sample, or every batch in bulk ingest), and alarm latency
+# until every sink has been told. A dropout alarm's latency is counted from the moment its timeout
+# ran out. Both are kept in LatencyHistograms (see histogram.py), which take a fixed amount of memory
+# however long the client runs.
+
+import collections
+import json
+import socket
+import sys
+import time
+
+from channels import PRESS_IDX
+from histogram import LatencyHistogram
+
+ALARM_HIGH = 'high'
+ALARM_LOW = 'low'
+ALARM_RATE = 'rate'
+ALARM_DROPOUT = 'dropout'
+ALARM_KINDS = [ALARM_HIGH, ALARM_LOW, ALARM_RATE, ALARM_DROPOUT]
+
+ALARM_RAISED = 'raised'
+ALARM_CLEARED = 'cleared'
+
+SINK_CONSOLE = 'console'
+SINK_LOG = 'log'
+SINK_JSON = 'json'
+SINK_UDP_PREFIX = 'udp://'
+SINK_NAMES = [SINK_CONSOLE, SINK_LOG, SINK_JSON]
+
+ALARM_CSV_HEADER = 'time,device,state,alarm,value,limit,units,device_time,latency_ms'
+
+CLEAR_TIME = 1000.0                 #ms the rule must hold again before an alarm clears
+DEFAULT_LATENCY_BUDGET = 0.1        #seconds
+
+#a raised or cleared alarm. 'time' is the host time (seconds since the epoch), 'device_time' the timestamp of the
+#sample that raised or cleared it (None for dropout) and 'latency' the decision latency, in seconds
+AlarmEvent = collections.namedtuple('AlarmEvent', ['time', 'device', 'state', 'alarm', 'value', 'limit', 'units',
+                                                   'device_time', 'latency'])
+
+
+class AlarmRule(object):
+    #one alarm rule (see above). 'sensor' is a sensor number from 0 (None for dropout)
+    def __init__(self, kind, limit, sensor=None):
+        if kind not in ALARM_KINDS:
+            raise ValueError('Unknown alarm: ' + str(kind))
+
+        if (kind == ALARM_DROPOUT) != (sensor is None):
+            raise ValueError('Only dropout alarms have no sensor')
+
+        if (kind in (ALARM_RATE, ALARM_DROPOUT)) and (limit <= 0):
+            raise ValueError('Limit of ' + kind + ' alarm must be greater than 0')
+
+        self.kind = kind
+        self.limit = float(limit)
+        self.sensor = sensor
+
+        if sensor is None:
+            self.name = kind
+        else:
+            self.name = kind + ' ' + str(sensor + 1)
+
+    def spec(self):
+        if self.sensor is None:
+            return self.kind + ':' + '{:g}'.format(self.limit)
+
+        return self.kind + ':' + str(self.sensor + 1) + ':' + '{:g}'.format(self.limit)
+
+    #whether 'value' (a pressure, or a rate for rate alarms) breaks the rule
+    def tripped(self, value):
+        if self.kind == ALARM_HIGH:
+            return value > self.limit
+        if self.kind == ALARM_LOW:
+            return value < self.limit
+
+        return abs(value) > self.limit
+
+
+#parse a list of alarm rules, e.g. "high:3:40,low:3:2,dropout:500" (see above). Raises ValueError if the list is not
+#valid. An empty string (or "none") means no rules
+def parseAlarmRules(rules_str):
+    rules = []
+
+    if rules_str.strip().lower() in ('', 'none', 'off'):
+        return rules
+
+    for rule_str in rules_str.split(','):
+        fields = [field.strip() for field in rule_str.strip().lower().split(':')]
+
+        try:
+            if (fields[0] == ALARM_DROPOUT) and (len(fields) == 2):
+                rules.append(AlarmRule(ALARM_DROPOUT, float(fields[1])))
+            elif (fields[0] in ALARM_KINDS) and (len(fields) == 3) and fields[1].isdigit() and (int(fields[1]) >= 1):
+                rules.append(AlarmRule(fields[0], float(fields[2]), int(fields[1]) - 1))
+            else:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('Invalid alarm rule: ' + rule_str)
+
+    return rules
+
+
+#format a list of alarm rules as parseAlarmRules() takes it
+def formatAlarmRules(rules):
+    return ','.join(rule.spec() for rule in rules)
+
+
+#parse a list of alarm sinks, e.g. "console,log,udp://127.0.0.1:5005". Raises ValueError if the list is not valid
+def parseAlarmSinks(sinks_str):
+    sinks = []
+
+    for sink in sinks_str.split(','):
+        sink = sink.strip()
+
+        if sink.lower() in SINK_NAMES:
+            sinks.append(sink.lower())
+        elif sink.lower().startswith(SINK_UDP_PREFIX):
+            parseUdpAddress(sink)
+            sinks.append(sink)
+        elif sink.lower() not in ('', 'none'):
+            raise ValueError('Invalid alarm sink: ' + sink)
+
+    return sinks
+
+
+#(host, port) of a udp://<host>:<port> sink. Raises ValueError if it is not valid
+def parseUdpAddress(sink):
+    host, sep, port = sink[len(SINK_UDP_PREFIX):].rpartition(':')
+
+    if (not sep) or (not host) or (not port.isdigit()) or not (0 < int(port) < 65536):
+        raise ValueError('Invalid alarm sink: ' + sink)
+
+    return host, int(port)
+
+
+#e.g. "ALARM high 3: 41.2 cmH2O (limit 40)" or "Alarm cleared: high 3"
+def formatAlarm(event):
+    if event.state == ALARM_CLEARED:
+        return 'Alarm cleared: ' + event.alarm
+
+    if event.value is None:
+        return 'ALARM ' + event.alarm + ': no valid sample for ' + '{:g}'.format(event.limit) + ' ms'
+
+    return ('ALARM ' + event.alarm + ': ' + '{:.1f}'.format(event.value) + ' ' + event.units +
+            ' (limit ' + '{:g}'.format(event.limit) + ')')
+
+
+def alarmCsvLine(event):
+    millis = int((event.time % 1) * 1000)
+    time_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event.time)) + '.' + '{:03d}'.format(millis)
+
+    fields = [time_str, event.device or '', event.state, event.alarm,
+              '' if event.value is None else '{:.2f}'.format(event.value), '{:g}'.format(event.limit), event.units,
+              '' if event.device_time is None else '{:.0f}'.format(event.device_time),
+              '{:.3f}'.format(event.latency * 1000.0)]
+
+    return ','.join(fields)
+
+
+class ConsoleAlarmSink(object):
+    #prints alarms with 'echo' (a function taking lines of text). AlarmEngine.setEcho() sets it if not given
+    def __init__(self, echo=None):
+        self.echo = echo
+
+    def alarm(self, event):
+        if self.echo is not None:
+            self.echo(formatAlarm(event) + '\n')
+        else:
+            sys.stdout.write(formatAlarm(event) + '\n')
+
+    def close(self):
+        pass
+
+
+class LogAlarmSink(object):
+    #writes alarms to 'file' (a text file), one CSV line each. Every line is flushed as it is written
+    def __init__(self, file):
+        self.file = file
+        self.file.write(ALARM_CSV_HEADER + '\n')
+        self.file.flush()
+
+    def alarm(self, event):
+        self.file.write(alarmCsvLine(event) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class JsonAlarmSink(object):
+    #writes alarms to 'stream' (stdout by default) as JSON, one object per line
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+
+    def alarm(self, event):
+        self.stream.write(json.dumps(event._asdict()) + '\n')
+        self.stream.flush()
+
+    def close(self):
+        pass
+
+
+class UdpAlarmSink(object):
+    #sends alarms as UDP datagrams, one JSON object each, to 'address' (udp://<host>:<port>). Sending never blocks;
+    #alarms that cannot be sent are counted in 'errors'
+    def __init__(self, address):
+        self.address = parseUdpAddress(address)
+        self.errors = 0
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def alarm(self, event):
+        try:
+            self._socket.sendto(json.dumps(event._asdict()).encode('utf-8'), self.address)
+        except (OSError, socket.error):
+            self.errors += 1
+
+    def close(self):
+        self._socket.close()
+
+
+class AlarmEngine(object):
+    #evaluates 'rules' (a list of AlarmRules) on the samples of one device, with pressures relative to
+    #'atmospheric_sensor' (a sensor number from 0) and scaled by 'scale' (e.g. to convert hPa to cmH2O). Alarms are
+    #passed to each of 'sinks'. 'device_name', if given, is added to every alarm. Latencies over 'latency_budget'
+    #(seconds) are counted separately
+    def __init__(self, rules, atmospheric_sensor, scale=1.0, units_str='hPa', sinks=None, device_name=None,
+                 latency_budget=DEFAULT_LATENCY_BUDGET):
+        self.rules = [rule for rule in rules if rule.kind != ALARM_DROPOUT]
+        self.atmospheric_sensor = atmospheric_sensor
+        self.scale = scale
+        self.units_str = units_str
+        self.sinks = sinks if sinks is not None else []
+        self.device_name = device_name
+        self.latency_budget = latency_budget
+
+        #the shortest dropout rule is the only one that can matter
+        dropouts = [rule for rule in rules if rule.kind == ALARM_DROPOUT]
+        self.dropout = min(dropouts, key=lambda rule: rule.limit) if dropouts else None
+
+        self.decision_latency = LatencyHistogram()
+        self.alarm_latency = LatencyHistogram()
+        self.raised = 0
+        self.sink_errors = 0
+
+        #rules whose sensors are not in the schema (see setSchema())
+        self.missing = []
+
+        self._columns = []
+        self._active = [False] * len(self.rules)
+        self._clear_since = [None] * len(self.rules)
+        self._dropout_active = False
+        self._last_valid = None
+        self.reset()
+
+    #give console sinks that have no echo function of their own 'echo'
+    def setEcho(self, echo):
+        for sink in self.sinks:
+            if isinstance(sink, ConsoleAlarmSink) and (sink.echo is None):
+                sink.echo = echo
+
+    #look up the columns of each rule's sensor and of the atmospheric sensor in a ChannelSchema. Rules whose sensors
+    #are not in it are left out until the schema changes again
+    def setSchema(self, schema):
+        self._columns = []
+        self.missing = []
+
+        for rule in self.rules:
+            if max(rule.sensor, self.atmospheric_sensor) < schema.num_sensors:
+                self._columns.append((schema.channel(rule.sensor, PRESS_IDX) + 1,
+                                      schema.channel(self.atmospheric_sensor, PRESS_IDX) + 1))
+            else:
+                self._columns.append(None)
+                self.missing.append(rule)
+
+        self.reset()
+
+    #the Arduino's timestamps start over. Alarms stay raised until their rule holds again
+    def reset(self):
+        self._last = [None] * len(self.rules)      #(time, pressure) of the last good sample, for rate alarms
+        self._clear_since = [None] * len(self.rules)
+
+    #add one parsed sample (timestamp first, in column order), read from the serial port at 't_read' (the
+    #time.perf_counter() time)
+    def addSample(self, sample, t_read):
+        t = sample[0]
+        valid = True
+
+        for idx, rule in enumerate(self.rules):
+            columns = self._columns[idx]
+            if columns is None:
+                continue
+
+            p = (sample[columns[0]] - sample[columns[1]]) * self.scale
+
+            #NaN: the sensor has no reading
+            if p != p:
+                valid = False
+                continue
+
+            if rule.kind == ALARM_RATE:
+                last = self._last[idx]
+                self._last[idx] = (t, p)
+
+                if (last is None) or (t <= last[0]):
+                    continue
+
+                value = (p - last[1]) * 1000.0 / (t - last[0])
+            else:
+                value = p
+
+            self._update(idx, rule.tripped(value), value, t, t_read)
+
+        if valid:
+            self._validSample(t_read)
+
+        self.decision_latency.recordSeconds(time.perf_counter() - t_read)
+
+    #add a batch of parsed samples, given as a 2-D NumPy array with one row per sample, all read from the serial port
+    #at 't_read'. The rules are evaluated for the whole batch at once; only samples that raise or clear an alarm
+    #are then handled one by one
+    def addSamples(self, values, t_read):
+        import numpy as np
+
+        times = values[:, 0]
+        valid = np.ones(len(times), dtype=bool)
+
+        for idx, rule in enumerate(self.rules):
+            columns = self._columns[idx]
+            if columns is None:
+                continue
+
+            p = (values[:, columns[0]] - values[:, columns[1]]) * self.scale
+            numbers = ~np.isnan(p)
+            valid &= numbers
+
+            if rule.kind == ALARM_RATE:
+                #rate from one good sample to the next, carrying the previous batch's last good sample over
+                good = np.flatnonzero(numbers)
+                value = np.full(len(times), np.nan)
+
+                if len(good):
+                    last = self._last[idx]
+                    good_t = times[good]
+                    good_p = p[good]
+                    prev_t = np.concatenate(([np.nan if last is None else last[0]], good_t[:-1]))
+                    prev_p = np.concatenate(([np.nan if last is None else last[1]], good_p[:-1]))
+
+                    with np.errstate(invalid='ignore', divide='ignore'):
+                        dt = good_t - prev_t
+                        value[good] = np.where(dt > 0, (good_p - prev_p) * 1000.0 / dt, np.nan)
+
+                    self._last[idx] = (float(good_t[-1]), float(good_p[-1]))
+            else:
+                value = p
+
+            with np.errstate(invalid='ignore'):
+                if rule.kind == ALARM_HIGH:
+                    tripped = value > rule.limit
+                elif rule.kind == ALARM_LOW:
+                    tripped = value < rule.limit
+                else:
+                    tripped = np.abs(value) > rule.limit
+
+            #nothing to do if the alarm is not raised and no sample breaks the rule
+            if (not self._active[idx]) and (not tripped.any()):
+                continue
+
+            known = ~np.isnan(value)
+            for row in np.flatnonzero(known).tolist():
+                self._update(idx, bool(tripped[row]), float(value[row]), float(times[row]), t_read)
+
+        if valid.any():
+            self._validSample(t_read)
+
+        self.decision_latency.recordSeconds(time.perf_counter() - t_read)
+
+    #check for dropout. Called regularly by the acquisition thread with the time.perf_counter() time, whether or not
+    #anything has arrived
+    def poll(self, now):
+        if self.dropout is None:
+            return
+
+        #until the first sample, time the dropout from the first poll
+        if self._last_valid is None:
+            self._last_valid = now
+
+        deadline = self._last_valid + self.dropout.limit / 1000.0
+
+        if (not self._dropout_active) and (now >= deadline):
+            self._dropout_active = True
+            self._raise(self.dropout, None, None, deadline)
+
+    def _validSample(self, t_read):
+        self._last_valid = t_read
+
+        if self._dropout_active:
+            self._dropout_active = False
+            self._clear(self.dropout, None, t_read)
+
+    #raise or clear the alarm of rule 'idx' for a sample at device time 't' whose value is 'value'
+    def _update(self, idx, tripped, value, t, t_read):
+        if tripped:
+            self._clear_since[idx] = None
+
+            if not self._active[idx]:
+                self._active[idx] = True
+                self._raise(self.rules[idx], value, t, t_read)
+
+        elif self._active[idx]:
+            #the device's time went back (millis() wrapped around), so the rule is timed again from this sample
+            if (self._clear_since[idx] is None) or (t < self._clear_since[idx]):
+                self._clear_since[idx] = t
+            elif t - self._clear_since[idx] >= CLEAR_TIME:
+                self._active[idx] = False
+                self._clear_since[idx] = None
+                self._clear(self.rules[idx], t, t_read)
+
+    def _units(self, rule):
+        if rule.kind == ALARM_RATE:
+            return self.units_str + '/s'
+        if rule.kind == ALARM_DROPOUT:
+            return 'ms'
+
+        return self.units_str
+
+    def _raise(self, rule, value, t, t_start):
+        self.raised += 1
+        self._send(AlarmEvent(time.time(), self.device_name, ALARM_RAISED, rule.name, value, rule.limit,
+                              self._units(rule), t, time.perf_counter() - t_start))
+
+        self.alarm_latency.recordSeconds(time.perf_counter() - t_start)
+
+    def _clear(self, rule, t, t_start):
+        self._send(AlarmEvent(time.time(), self.device_name, ALARM_CLEARED, rule.name, None, rule.limit,
+                              self._units(rule), t, time.perf_counter() - t_start))
+
+    #a sink that fails must not hold up the others, or acquisition
+    def _send(self, event):
+        for sink in self.sinks:
+            try:
+                sink.alarm(event)
+            except Exception:
+                self.sink_errors += 1
+
+    #alarms currently raised, by name
+    def activeAlarms(self):
+        names = [rule.name for idx, rule in enumerate(self.rules) if self._active[idx]]
+
+        if self._dropout_active:
+            names.append(self.dropout.name)
+
+        return names
+
+    def stats(self):
+        budget_ms = '{:g}'.format(self.latency_budget * 1000.0)
+
+        return ('raised: ' + str(self.raised) + ', decision latency ' + self.decision_latency.summary() +
+                ', alarm latency ' + self.alarm_latency.summary() + ', over ' + budget_ms + ' ms budget: ' +
+                str(self.alarm_latency.countOver(self.latency_budget * 1e9)) +
+                (', sink errors: ' + str(self.sink_errors) if self.sink_errors else ''))
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+# analyze.py
+# Helpful Engineering
+#
+# Purpose:
+# Batch statistics over a directory of ventsense logs (ventsense_log_*.csv and .bin, as written by
+# the client). Each log is analyzed in a pool of worker processes, and the results are merged into
+# one report with, for the whole archive (and for each device, if several were logged at once):
+#     - the number of samples, the time they span and the number of malformed lines
+#     - the number of Arduino resets
+#     - sensor dropout gaps, i.e. stretches of more than --gap ms without a sample
+#     - the min, mean and max of every temperature and pressure column (in the units of the logs)
+#     - with --breath-sensor, the number of breaths (see breath.py)
+# E.g.:
+#     python ventsense.py analyze logs --jobs=4 --breath-sensor=3 --out=logs.csv
+# or, the same:
+#     python analyze.py logs --jobs=4 --breath-sensor=3 --out=logs.csv
+#
+# Usage:
+#     python analyze.py <log directory> [-a <sensor ID>] [--breath-sensor=<sensor ID>] [--gap=<ms>]
+#                       [--jobs=<number>] [--out=<file.csv>] [--no-cache]
+#
+# Notes:
+# The results of each log are cached in ventsense_analysis.json, next to the logs, with the log's size
+# and modification time. When the analysis is run again with the same options, only the logs that
+# are new or have changed (e.g. the one still being written) are read again.
+#
+# CSV logs are read in chunks of READ_CHUNK bytes, each converted in one go (see
+# lineparser.parseBlock()), so a worker's memory use does not depend on the size of the log. Binary logs
+# are memory mapped (see binlog.loadBinLog()) and converted a chunk at a time as well. The largest
+# logs are handed out first, so that the workers finish at about the same time.
+#
+# The client starts a new log whenever the Arduino resets, so a log normally starts with the
+# Arduino's timestamps close to zero. Resets are counted from those, and from timestamps that go
+# backwards within a log (e.g. two sessions appended to the same file), except for millis()
+# wraparounds (after about 49.7 days), which are told apart as timing.SampleClock does and counted
+# as the step forward they are.
+
+import concurrent.futures
+import getopt
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from breath import BreathAnalyzer
+from channels import ChannelSchema
+from logindex import LOG_NAME_RE, LOG_FORMAT_BIN
+from timing import MILLIS_WRAP, WRAP_WINDOW
+import binlog
+import lineparser
+
+CACHE_NAME = 'ventsense_analysis.json'
+CACHE_VERSION = 2
+
+READ_CHUNK = 16 * 1024 * 1024   #bytes of a CSV log parsed at a time
+BIN_CHUNK = 1024 * 1024         #samples of a binary log converted at a time
+
+DEFAULT_GAP = 500.0             #ms without a sample that count as a dropout
+RESET_START_TIME = 10000.0      #ms. A log whose first timestamp is below this started with an Arduino reset
+
+CSV_HEADER = 'name,device,samples,bad_lines,duration,resets,gaps,gap_time,longest_gap,breaths'
+
+
+class LogStats(object):
+    #running statistics of one log, fed a chunk of samples at a time. 'breath_sensor' and 'atmospheric_sensor'
+    #are sensor numbers of the log's schema (from 0); breaths are only counted if 'breath_sensor' is not None
+    def __init__(self, schema, gap=DEFAULT_GAP, breath_sensor=None, atmospheric_sensor=0):
+        self.schema = schema
+        self.gap = gap
+
+        self.samples = 0
+        self.bad_lines = 0
+        self.duration = 0.0
+        self.resets = 0
+        self.gaps = 0
+        self.gap_time = 0.0
+        self.longest_gap = 0.0
+
+        #per column: [count, sum, min, max] of the values that are numbers
+        self.fields = dict((name, [0, 0.0, None, None]) for name in schema.channel_names)
+
+        self._last_t = None
+
+        self._breaths = None
+        if breath_sensor is not None:
+            self._breaths = BreathAnalyzer(breath_sensor, atmospheric_sensor)
+            self._breaths.setSchema(schema)
+
+    #add a 2-D array of samples (one row per sample, timestamp first, in column order)
+    def addValues(self, values):
+        if len(values) == 0:
+            return
+
+        timestamps = values[:, 0]
+
+        if self._last_t is None:
+            if timestamps[0] < RESET_START_TIME:
+                self.resets += 1
+            last = timestamps[:-1]
+            steps = np.diff(timestamps)
+        else:
+            last = np.concatenate(([self._last_t], timestamps[:-1]))
+            steps = timestamps - last
+
+        #a step back from near the wrap point to near 0 is a millis() wraparound, not a reset
+        wraps = (steps < 0) & (last >= MILLIS_WRAP - WRAP_WINDOW) & (last + steps < WRAP_WINDOW)
+        if wraps.any():
+            steps = np.where(wraps, steps + MILLIS_WRAP, steps)
+
+        self._last_t = timestamps[-1]
+        self.samples += len(values)
+
+        forward = steps[steps >= 0]
+        gaps = forward[forward > self.gap]
+
+        self.resets += len(steps) - len(forward)
+        self.duration += float(forward.sum()) / 1000.0
+        self.gaps += len(gaps)
+
+        if len(gaps):
+            self.gap_time += float(gaps.sum()) / 1000.0
+            self.longest_gap = max(self.longest_gap, float(gaps.max()) / 1000.0)
+
+        for ch, name in enumerate(self.schema.channel_names):
+            column = values[:, ch + 1]
+            column = column[~np.isnan(column)]
+
+            if len(column):
+                stats = self.fields[name]
+                low = float(column.min())
+                high = float(column.max())
+
+                stats[0] += len(column)
+                stats[1] += float(column.sum())
+                stats[2] = low if stats[2] is None else min(stats[2], low)
+                stats[3] = high if stats[3] is None else max(stats[3], high)
+
+        if self._breaths is not None:
+            self._breaths.addSamples(values)
+
+    #the statistics as a dict that can be stored in the cache and merged with mergeResults()
+    def result(self):
+        return {'samples': self.samples, 'bad_lines': self.bad_lines, 'duration': self.duration,
+                'resets': self.resets, 'gaps': self.gaps, 'gap_time': self.gap_time,
+                'longest_gap': self.longest_gap,
+                'breaths': self._breaths.detector.breaths_detected if self._breaths is not None else None,
+                'fields': self.fields}
+
+
+#schema of a CSV log from its first line, which is the header line unless the client started listening mid-stream
+def _csvSchema(first_line):
+    if first_line.startswith(b'time'):
+        return ChannelSchema.fromHeader(first_line)
+
+    #no header line: assume the firmware's layout for the number of columns
+    return ChannelSchema.forSensors(first_line.count(b',') // 2)
+
+
+def _analyzeCsv(path, options):
+    with open(path, 'rb') as file:
+        first_line = file.readline()
+
+        if not first_line.strip():
+            return None
+
+        schema = _csvSchema(first_line.strip())
+        if not first_line.startswith(b'time'):
+            file.seek(0)
+
+        stats = _newStats(schema, options)
+        dtype = lineparser.sampleDtype(schema.field_names)
+        partial = b''
+
+        while partial is not None:
+            data = file.read(READ_CHUNK)
+
+            if data:
+                #parse up to the last complete line, and carry the rest over to the next chunk. A chunk without a line
+                #ending only adds to the line carried over
+                end = data.rfind(b'\n') + 1
+                if end:
+                    block = partial + data[:end]
+                    partial = data[end:]
+                else:
+                    block = b''
+                    partial += data
+            else:
+                #end of the file: finish off a last line without a line ending
+                block = partial + b'\n' if partial.strip() else b''
+                partial = None
+
+            if block:
+                records, num_bad = lineparser.parseBlock(block, dtype)
+                stats.bad_lines += num_bad
+                stats.addValues(lineparser.recordValues(records))
+
+    return stats
+
+
+def _analyzeBin(path, options):
+    records = binlog.loadBinLog(path)
+    stats = _newStats(ChannelSchema(records.dtype.names), options)
+
+    for start in range(0, len(records), BIN_CHUNK):
+        chunk = records[start:start + BIN_CHUNK]
+        stats.addValues(np.column_stack([chunk[name].astype(np.float64) for name in records.dtype.names]))
+
+    return stats
+
+
+def _newStats(schema, options):
+    breath_sensor = options['breath_sensor']
+    atmospheric_sensor = options['atmospheric_sensor']
+
+    #breaths are counted on logs that have both sensors
+    if (breath_sensor is None) or (max(breath_sensor, atmospheric_sensor) >= schema.num_sensors):
+        breath_sensor = None
+
+    return LogStats(schema, options['gap'], breath_sensor, atmospheric_sensor)
+
+
+#statistics of one log, as a result dict (see LogStats.result()), with 'error' set instead if it could not be read.
+#Runs in a worker process
+def analyzeLog(path, options):
+    try:
+        if path.endswith('.' + LOG_FORMAT_BIN):
+            stats = _analyzeBin(path, options)
+        else:
+            stats = _analyzeCsv(path, options)
+    except (IOError, OSError, ValueError) as e:
+        return {'error': str(e)}
+
+    if stats is None:
+        #empty log
+        return LogStats(ChannelSchema.forSensors(1)).result()
+
+    return stats.result()
+
+
+#merge result dicts into one (as the result of a log covering all of them). Logs that could not be read are skipped
+def mergeResults(results):
+    merged = {'logs': 0, 'samples': 0, 'bad_lines': 0, 'duration': 0.0, 'resets': 0, 'gaps': 0, 'gap_time': 0.0,
+              'longest_gap': 0.0, 'breaths': None, 'fields': {}}
+    names = []
+
+    for result in results:
+        if 'error' in result:
+            continue
+
+        merged['logs'] += 1
+        for key in ('samples', 'bad_lines', 'duration', 'resets', 'gaps', 'gap_time'):
+            merged[key] += result[key]
+        merged['longest_gap'] = max(merged['longest_gap'], result['longest_gap'])
+
+        if result['breaths'] is not None:
+            merged['breaths'] = (merged['breaths'] or 0) + result['breaths']
+
+        for name, stats in result['fields'].items():
+            if stats[0] == 0:
+                continue
+
+            if name not in merged['fields']:
+                merged['fields'][name] = list(stats)
+                names.append(name)
+            else:
+                total = merged['fields'][name]
+                total[0] += stats[0]
+                total[1] += stats[1]
+                total[2] = min(total[2], stats[2])
+                total[3] = max(total[3], stats[3])
+
+    merged['field_order'] = names
+    return merged
+
+
+class AnalysisCache(object):
+    #results of earlier analyses of the logs in 'directory', kept in CACHE_NAME with the log's size and modification
+    #time. Results are only kept for the same 'options'
+    def __init__(self, directory, options):
+        self.path = os.path.join(directory, CACHE_NAME)
+        self.options = options
+        self.results = {}
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                cache = json.load(file)
+        except (IOError, OSError, ValueError):
+            return
+
+        if (cache.get('version') == CACHE_VERSION) and (cache.get('options') == self.options):
+            self.results = cache['results']
+
+    #written to a temporary file first, so a reader never sees half of it
+    def save(self):
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': CACHE_VERSION, 'options': self.options, 'results': self.results}, file)
+
+        os.replace(tmp_path, self.path)
+
+    #cached result of a log, or None if the log has changed since
+    def get(self, name, stat):
+        result = self.results.get(name)
+
+        if (result is None) or (result['size'] != stat.st_size) or (result['mtime'] != stat.st_mtime):
+            return None
+
+        return result
+
+    def put(self, name, stat, result):
+        result['size'] = stat.st_size
+        result['mtime'] = stat.st_mtime
+        self.results[name] = result
+
+
+#analyze the logs in 'directory' with 'jobs' worker processes (1 analyzes them in this process). 'options' are the
+#options of analyzeLog(). Returns the list of (name, device, result) of every log, oldest first, and the number of logs
+#that were read (i.e. not taken from the cache)
+def analyzeDirectory(directory, options, jobs=None, use_cache=True):
+    cache = AnalysisCache(directory, options)
+    if use_cache:
+        cache.load()
+
+    logs = []
+    results = {}
+    todo = []
+
+    for name in sorted(os.listdir(directory)):
+        match = LOG_NAME_RE.match(name)
+        if not match:
+            continue
+
+        stat = os.stat(os.path.join(directory, name))
+        logs.append((name, match.group(3)))
+
+        result = cache.get(name, stat)
+        if result is not None:
+            results[name] = result
+        else:
+            todo.append((stat.st_size, name, stat))
+
+    #largest first
+    todo.sort(reverse=True)
+
+    if (jobs == 1) or (len(todo) <= 1):
+        done = [(name, stat, analyzeLog(os.path.join(directory, name), options)) for size, name, stat in todo]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [(name, stat, executor.submit(analyzeLog, os.path.join(directory, name), options))
+                       for size, name, stat in todo]
+            done = [(name, stat, future.result()) for name, stat, future in futures]
+
+    for name, stat, result in done:
+        results[name] = result
+
+        if 'error' not in result:
+            cache.put(name, stat, result)
+
+    if use_cache and done:
+        cache.save()
+
+    return [(name, device, results[name]) for name, device in logs], len(todo)
+
+
+def _fmt(value, fmt='{:.2f}'):
+    return '' if value is None else fmt.format(value)
+
+
+def printReport(title, merged):
+    print(title + ': ' + str(merged['logs']) + ' logs, ' + str(merged['samples']) + ' samples over ' +
+          '{:.1f} h'.format(merged['duration'] / 3600.0) + ', ' + str(merged['bad_lines']) + ' bad lines')
+    print('    resets: ' + str(merged['resets']) + ', dropout gaps: ' + str(merged['gaps']) + ' (' +
+          '{:.1f} s in total, longest {:.1f} s'.format(merged['gap_time'], merged['longest_gap']) + ')' +
+          ('' if merged['breaths'] is None else ', breaths: ' + str(merged['breaths'])))
+
+    for name in merged['field_order']:
+        count, total, low, high = merged['fields'][name]
+        print('    {:<10} min {:9.2f}  mean {:9.2f}  max {:9.2f}'.format(name, low, total / count, high))
+
+
+#one line per log, with the min, mean and max of every column found in any log
+def writeCsv(path, logs, merged):
+    names = merged['field_order']
+
+    with open(path, 'w', newline='') as file:
+        file.write(CSV_HEADER + ''.join(',' + name + ' ' + stat for name in names for stat in ('min', 'mean', 'max')) +
+                   ',error\n')
+
+        for name, device, result in logs:
+            if 'error' in result:
+                file.write(name + ',' + (device or '') + ',' * (CSV_HEADER.count(',') - 1 + 3 * len(names)) + ',' +
+                           '"' + result['error'].replace('"', "'") + '"\n')
+                continue
+
+            line = [name, device or '', str(result['samples']), str(result['bad_lines']),
+                    _fmt(result['duration'], '{:.3f}'), str(result['resets']), str(result['gaps']),
+                    _fmt(result['gap_time'], '{:.3f}'), _fmt(result['longest_gap'], '{:.3f}'),
+                    _fmt(result['breaths'], '{:d}')]
+
+            for field in names:
+                stats = result['fields'].get(field)
+
+                if (stats is None) or (stats[0] == 0):
+                    line += ['', '', '']
+                else:
+                    line += [_fmt(stats[2]), _fmt(stats[1] / stats[0]), _fmt(stats[3])]
+
+            file.write(','.join(line) + ',\n')
+
+
+def printHelp():
+    print('usage: python analyze.py <log directory> [-a <sensor ID>] [--breath-sensor=<sensor ID>] [--gap=<ms>]\n' +
+          '                         [--jobs=<number>] [--out=<file.csv>] [--no-cache]')
+    print('   or: python ventsense.py analyze <log directory> [OPTIONS]')
+    print('')
+    print('options:')
+    print('    -a, --atmospheric=<sensor ID>   Sensor the breath sensor\'s pressure is taken relative to. Defaults to 1')
+    print('    -h                              Help. I.e., print this screen')
+    print('    --breath-sensor=<sensor ID>     Count the breaths in the pressure of this sensor. Defaults to off')
+    print('    --gap=<ms>                      Time without a sample that counts as a dropout. Defaults to 500')
+    print('    --jobs=<number>                 Number of worker processes. Defaults to the number of CPUs')
+    print('    --no-cache                      Analyze every log again, and do not update the cache')
+    print('    --out=<file.csv>                Also write the results of each log to a .csv file')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv, "ha:", ["atmospheric=", "breath-sensor=", "gap=", "jobs=", "out=",
+                                                     "no-cache"])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    if len(args) != 1:
+        printHelp()
+        sys.exit(2)
+
+    atmospheric_sensor = 0
+    breath_sensor = None
+    gap = DEFAULT_GAP
+    jobs = None
+    out_path = None
+    use_cache = True
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt in ('-a', '--atmospheric', '--breath-sensor'):
+            if not arg.isdigit() or (int(arg) < 1):
+                print('Sensor value must be at least 1. Invalid sensor: ' + arg)
+                sys.exit(2)
+
+            if opt == '--breath-sensor':
+                breath_sensor = int(arg) - 1
+            else:
+                atmospheric_sensor = int(arg) - 1
+        elif opt == '--gap':
+            try:
+                gap = float(arg)
+            except ValueError:
+                gap = -1.0
+
+            if gap <= 0:
+                print('gap value must be a number of ms greater than 0')
+                sys.exit(2)
+        elif opt == '--jobs':
+            if not arg.isdigit() or (int(arg) < 1):
+                print('jobs value must be at least 1')
+                sys.exit(2)
+
+            jobs = int(arg)
+        elif opt == '--out':
+            out_path = arg
+        elif opt == '--no-cache':
+            use_cache = False
+
+    directory = args[0]
+    if not os.path.isdir(directory):
+        print('Not a directory: ' + directory)
+        sys.exit(2)
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    options = {'gap': gap, 'breath_sensor': breath_sensor, 'atmospheric_sensor': atmospheric_sensor}
+
+    start_time = time.perf_counter()
+    logs, num_read = analyzeDirectory(directory, options, jobs, use_cache)
+    elapsed = time.perf_counter() - start_time
+
+    print('Analyzed ' + str(len(logs)) + ' logs (' + str(num_read) + ' read, ' + str(len(logs) - num_read) +
+          ' from the cache) in {:.2f} s with '.format(elapsed) + str(jobs) + ' processes')
+
+    for name, device, result in logs:
+        if 'error' in result:
+            print(name + ': ' + result['error'])
+
+    merged = mergeResults([result for name, device, result in logs])
+    printReport('All logs', merged)
+
+    devices = sorted(set(device for name, device, result in logs if device is not None))
+    if devices:
+        for device in [None] + devices:
+            printReport(device or 'No device name',
+                        mergeResults([result for name, log_device, result in logs if log_device == device]))
+
+    if out_path is not None:
+        writeCsv(out_path, logs, merged)
+        print('Wrote the results of each log to ' + out_path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# bench_alarms.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the alarm engine (see alarms.py). Runs the real client (ventsense.main), headless,
+# on simulated sensor data from simulator.py whose peak pressure breaks a high pressure alarm on
+# every breath, and reports for each ingest mode, with and without alarm rules:
+#   - sustained lines/sec, with the simulator running as fast as the client can take the data
+#   - decision latency percentiles at a fixed sample rate, from the client's own histogram (from the
+#     moment the serial read returned until the rules have been evaluated)
+#   - end-to-end alarm latency percentiles at a fixed sample rate, measured from the moment the line
+#     that breaks the rule becomes available on the (simulated) serial port until the alarm has
+#     reached the sinks
+#
+# Usage:
+#     python bench_alarms.py [--lines=<number>] [--rate=<Hz>] [--duration=<seconds>]
+#                            [--rules=<alarm rules>] [--ingest=line,bulk]
+#
+# Notes:
+# Every measurement runs in its own child process, in a temporary directory, as in bench_client.py.
+# The default rules are the kind a ventilator monitor would use, at limits the simulator's breaths
+# (PIP 20, PEEP 5 cmH2O) cross several times a second: high:3:15,low:3:10,rate:3:200,dropout:500.
+
+import getopt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+from bench_client import percentile
+
+INGEST_MODES = ['line', 'bulk']
+
+DEFAULT_LINES = 100000
+DEFAULT_RATE = 200.0
+DEFAULT_DURATION = 10.0
+DEFAULT_RULES = 'high:3:15,low:3:10,rate:3:200,dropout:500'
+
+PERCENTILES = [50, 99]
+
+
+#runs inside the child process: run the client once and write the measurements to result_path
+def runChild(rules, ingest, url, speed, result_path):
+    sys.path.insert(0, CLIENT_DIR)
+
+    import ventsense
+
+    due_times = {}
+    latencies = []
+    sources = []
+    engines = []
+
+    #record when each line becomes available on the simulated port, by its timestamp...
+    open_data_source = ventsense.openDataSource
+
+    def onLine(line, due):
+        try:
+            due_times[float(line[:line.index(b',')])] = due
+        except ValueError:
+            pass
+
+    def openDataSource(port_name, replay_speed):
+        ser = open_data_source(port_name, replay_speed)
+        ser.on_line = onLine
+        sources.append(ser)
+        return ser
+
+    #...and when the alarm it raised has reached the sinks
+    class LatencySink(object):
+        def alarm(self, event):
+            now = time.perf_counter()
+
+            if (event.state == 'raised') and (event.device_time in due_times):
+                latencies.append(now - due_times[event.device_time])
+
+        def close(self):
+            pass
+
+    start_alarm_sinks = ventsense.startAlarmSinks
+    ventsense.startAlarmSinks = lambda *args: start_alarm_sinks(*args) + [LatencySink()]
+
+    alarm_engine = ventsense.AlarmEngine
+
+    def AlarmEngine(*args, **kwargs):
+        engine = alarm_engine(*args, **kwargs)
+        engines.append(engine)
+        return engine
+
+    ventsense.openDataSource = openDataSource
+    ventsense.AlarmEngine = AlarmEngine
+
+    argv = ['-p', url, '--speed=' + speed, '--ingest=' + ingest, '--log-format=csv', '-d', 'false', '-c', 'false',
+            '-a', '1', '--use-cmh2o=true', '--alarms=' + rules, '--alarm-sinks=log']
+
+    ventsense.main(argv)
+
+    ser = sources[0]
+    result = {'lines': ser.lines_replayed, 'elapsed': ser.elapsed(), 'latencies': latencies}
+
+    if engines:
+        histogram = engines[0].decision_latency
+        result['decision'] = [histogram.percentile(pct) / 1e9 for pct in PERCENTILES] + [histogram.max / 1e9]
+        result['raised'] = engines[0].raised
+
+    with open(result_path, 'w') as file:
+        json.dump(result, file)
+
+
+#runs in the parent: start a child process for one measurement and collect its results
+def runOne(rules, ingest, url, speed):
+    work_dir = tempfile.mkdtemp(prefix='ventsense_bench_')
+    result_path = os.path.join(work_dir, 'result.json')
+
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', rules, ingest, url, speed, result_path]
+
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(cmd, cwd=work_dir, stdout=devnull)
+
+        if not os.path.isfile(result_path):
+            raise RuntimeError('benchmark run failed: ' + ' '.join(cmd))
+
+        with open(result_path) as file:
+            return json.load(file)
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def simUrl(rate, count):
+    return 'sim://?rate=' + str(rate) + '&sensors=3&count=' + str(count) + '&seed=1'
+
+
+def formatMs(seconds):
+    if seconds is None:
+        return '%9s' % 'n/a'
+
+    return '%9.3f' % (seconds * 1000.0)
+
+
+def printHelp():
+    print('usage: python bench_alarms.py [--lines=<number>] [--rate=<Hz>] [--duration=<seconds>]\n' +
+          '                              [--rules=<alarm rules>] [--ingest=line,bulk]')
+
+
+def main(argv):
+    if argv and argv[0] == '--child':
+        runChild(*argv[1:])
+        return
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["lines=", "rate=", "duration=", "rules=", "ingest="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    num_lines = DEFAULT_LINES
+    rate = DEFAULT_RATE
+    duration = DEFAULT_DURATION
+    rules = DEFAULT_RULES
+    ingest_modes = INGEST_MODES
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--lines':
+            num_lines = int(arg)
+        elif opt == '--rate':
+            rate = float(arg)
+        elif opt == '--duration':
+            duration = float(arg)
+        elif opt == '--rules':
+            rules = arg
+        elif opt == '--ingest':
+            ingest_modes = arg.split(',')
+
+    print('ventsense alarm benchmark: ' + str(num_lines) + ' lines at max speed, latency at ' + str(rate) +
+          ' Hz for ' + str(duration) + ' s, rules ' + rules)
+    print('')
+    print('%-6s %-6s %12s %9s %9s %9s %7s %9s %9s %9s' %
+          ('ingest', 'alarms', 'lines/s', 'dec p50', 'dec p99', 'dec max', 'raised', 'alm p50', 'alm p99', 'alm max'))
+
+    for ingest in ingest_modes:
+        for run_rules in ('none', rules):
+            throughput = runOne(run_rules, ingest, simUrl(rate, num_lines), 'max')
+            lines_per_sec = throughput['lines'] / throughput['elapsed']
+
+            if run_rules == 'none':
+                print('%-6s %-6s %12.0f' % (ingest, 'off', lines_per_sec))
+                continue
+
+            paced = runOne(run_rules, ingest, simUrl(rate, int(rate * duration)), '1')
+            latencies = sorted(paced['latencies'])
+            alarm_pcts = [percentile(latencies, pct) if latencies else None for pct in PERCENTILES]
+
+            print('%-6s %-6s %12.0f %s %s %s %7d %s %s %s' %
+                  tuple([ingest, 'on', lines_per_sec] + [formatMs(value) for value in paced['decision']] +
+                        [paced['raised']] + [formatMs(value) for value in alarm_pcts] +
+                        [formatMs(latencies[-1] if latencies else None)]))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# bench_analyze.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the batch analysis of archived logs (see analyze.py). Writes an archive of synthetic
+# ventsense logs (as in bench_logindex.py) to a temporary directory and reports:
+#   - the time to analyze the whole archive with 1, 2, 4, ... worker processes (up to the number of
+#     CPUs, or as given with --jobs), in MB/s and as a speedup over a single process
+#   - the time to run the analysis again when nothing has changed, and when a log has been added, with
+#     the results of the other logs taken from the cache
+#
+# Usage:
+#     python bench_analyze.py [--size=<MB>] [--sessions=<number>] [--jobs=<numbers>]
+#                             [--format=csv|bin] [--breaths=<true/false>]
+#
+# Notes:
+# With --breaths=true (the default), breaths are counted on sensor 2, relative to sensor 1. Breath
+# detection runs sample by sample (see breath.py); --breaths=false measures the reading and the
+# vectorized statistics alone.
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, CLIENT_DIR)
+
+import analyze
+import logindex
+from bench_logindex import writeSession, CSV_LINE_BYTES, RATE
+
+DEFAULT_SIZE = 200          #MB
+DEFAULT_SESSIONS = 32
+
+
+#1, 2, 4, ... up to the number of CPUs
+def defaultJobs():
+    num_cpus = os.cpu_count() or 1
+    jobs = [1]
+
+    while jobs[-1] * 2 <= num_cpus:
+        jobs.append(jobs[-1] * 2)
+
+    if jobs[-1] != num_cpus:
+        jobs.append(num_cpus)
+
+    return jobs
+
+
+def printHelp():
+    print('usage: python bench_analyze.py [--size=<MB>] [--sessions=<number>] [--jobs=<numbers>]\n' +
+          '                               [--format=csv|bin] [--breaths=<true/false>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["size=", "sessions=", "jobs=", "format=", "breaths="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    size = DEFAULT_SIZE
+    sessions = DEFAULT_SESSIONS
+    jobs_list = defaultJobs()
+    log_format = logindex.LOG_FORMAT_CSV
+    breaths = True
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--size':
+            size = float(arg)
+        elif opt == '--sessions':
+            sessions = int(arg)
+        elif opt == '--jobs':
+            jobs_list = [int(jobs) for jobs in arg.split(',')]
+        elif opt == '--format':
+            log_format = arg
+        elif opt == '--breaths':
+            breaths = arg.lower() in ['true', 'yes', 'y', '1', 'on']
+
+    record_bytes = CSV_LINE_BYTES if log_format == logindex.LOG_FORMAT_CSV else 28
+    samples_per_session = int(size * 1e6 / record_bytes / sessions)
+    options = {'gap': analyze.DEFAULT_GAP, 'breath_sensor': 1 if breaths else None, 'atmospheric_sensor': 0}
+
+    directory = tempfile.mkdtemp(prefix='ventsense_logs_')
+
+    try:
+        start_time = time.time() - 7 * 86400
+        for session in range(sessions):
+            writeSession(directory, log_format, start_time, samples_per_session, session)
+            start_time += samples_per_session / RATE + 60.0
+
+        total_mb = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1e6
+
+        print('ventsense batch analysis benchmark: ' + str(sessions) + ' ' + log_format + ' logs, ' +
+              '{:.1f} MB, '.format(total_mb) + str(os.cpu_count()) + ' CPUs, breaths ' + ('on' if breaths else 'off'))
+        print('')
+        print('%-24s %10s %10s %12s %8s' % ('run', 'seconds', 'MB/s', 'samples/s', 'speedup'))
+
+        single = None
+        for jobs in jobs_list:
+            t0 = time.perf_counter()
+            logs, _ = analyze.analyzeDirectory(directory, options, jobs, use_cache=False)
+            elapsed = time.perf_counter() - t0
+
+            if single is None:
+                single = elapsed
+
+            samples = analyze.mergeResults([result for name, device, result in logs])['samples']
+            print('%-24s %10.3f %10.1f %12.0f %7.2fx' % (str(jobs) + ' processes', elapsed, total_mb / elapsed,
+                                                         samples / elapsed, single / elapsed))
+            sys.stdout.flush()
+
+        #fill the cache, then run again with nothing changed, and with one new log
+        jobs = jobs_list[-1]
+        analyze.analyzeDirectory(directory, options, jobs)
+
+        t0 = time.perf_counter()
+        analyze.analyzeDirectory(directory, options, jobs)
+        print('%-24s %10.3f' % ('cached, no changes', time.perf_counter() - t0))
+
+        names = sorted(name for name in os.listdir(directory) if logindex.LOG_NAME_RE.match(name))
+        writeSession(directory, log_format, start_time, samples_per_session, sessions)
+
+        t0 = time.perf_counter()
+        logs, num_read = analyze.analyzeDirectory(directory, options, jobs)
+        print('%-24s %10.3f (%d of %d logs read)' % ('cached, one new log', time.perf_counter() - t0, num_read,
+                                                     len(names) + 1))
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+# bench_autoscale.py
+# Helpful Engineering
+#
+# Purpose:
+# Microbenchmark for the Y autoscale range calculation. Compares the cost of keeping the running
+# window min/max of every plot channel up to date with SlidingMinMax (samples are added a frame's
+# worth at a time and the extremes are read once per frame, as the client does) with the cost of
+# scanning the whole visible window for its min/max (paid on every autoscale check), at increasing
+# window lengths.
+#
+# Usage:
+#     python bench_autoscale.py
+#
+# The cost of SlidingMinMax per sample should stay about flat as the window grows, while the cost
+# of a full scan grows linearly with the window length.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from samplebuffer import SampleRingBuffer
+from windowminmax import SlidingMinMax
+
+NUM_CHANNELS = 6
+WINDOW_LENGTHS = [201, 2001, 20001, 100001]     #20 s to 1000 s at 10 Hz, and 1000 s at 100 Hz
+NUM_SAMPLES = 100000
+NUM_SCANS = 200
+SAMPLES_PER_FRAME = 10
+
+
+#returns an array of shape (num_samples, NUM_CHANNELS)
+def makeSamples(num_samples):
+    rng = np.random.RandomState(1)
+    return 1013.0 + rng.normal(0.0, 5.0, (num_samples, NUM_CHANNELS))
+
+
+def benchSliding(window_len, data):
+    extremes = SlidingMinMax(NUM_CHANNELS, window_len)
+    frames = [data[i:i + SAMPLES_PER_FRAME].T for i in range(0, len(data), SAMPLES_PER_FRAME)]
+
+    start = time.perf_counter()
+    for values in frames:
+        extremes.extend(values)
+        extremes.extremes()
+    elapsed = time.perf_counter() - start
+
+    return elapsed / len(data)
+
+
+def benchFullScan(window_len, data):
+    buf = SampleRingBuffer(window_len, NUM_CHANNELS)
+    for i, values in enumerate(data[:window_len]):
+        buf.append(i, values)
+
+    start = time.perf_counter()
+    for _ in range(NUM_SCANS):
+        y_data = buf.window(window_len)[1]
+        for ch in range(NUM_CHANNELS):
+            y_data[ch].min()
+            y_data[ch].max()
+    elapsed = time.perf_counter() - start
+
+    return elapsed / NUM_SCANS
+
+
+def main():
+    data = makeSamples(max(NUM_SAMPLES, max(WINDOW_LENGTHS)))
+
+    print('Window min/max of %d channels:' % NUM_CHANNELS)
+    print('    %9s %22s %22s' % ('window', 'SlidingMinMax', 'full scan'))
+
+    for window_len in WINDOW_LENGTHS:
+        sliding = benchSliding(window_len, data[:NUM_SAMPLES])
+        scan = benchFullScan(window_len, data)
+
+        print('    %9d %14.2f us/sample %16.2f us/check' % (window_len, sliding * 1e6, scan * 1e6))
+
+
+if __name__ == "__main__":
+    main()
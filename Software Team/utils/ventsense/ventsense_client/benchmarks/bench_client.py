@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# bench_client.py
+# Helpful Engineering
+#
+# Purpose:
+# Throughput benchmark suite for the ventsense client. Runs the real client (ventsense.main) on
+# simulated sensor data from simulator.py, in headless, console and plot modes, and reports for
+# each mode:
+#   - sustained lines/sec, with the simulator running as fast as the client can take the data
+#   - end-to-end latency percentiles at a fixed sample rate, measured from the moment a line
+#     becomes available on the (simulated) serial port until it has been written to the log
+#   - peak resident memory of the client process
+#
+# Usage:
+#     python bench_client.py [--lines=<number>] [--rate=<Hz>] [--duration=<seconds>]
+#                            [--sensors=<number>] [--modes=headless,console,plot] [--ingest=line,bulk]
+#
+# Notes:
+# Every measurement runs in its own child process, in a temporary directory (so log files and
+# settings.ini do not end up in the working directory), so that peak memory is per run. Plot mode
+# uses matplotlib's non-interactive Agg backend. Peak memory is only reported on Linux and macOS.
+
+import collections
+import getopt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+MODES = ['headless', 'console', 'plot']
+INGEST_MODES = ['line', 'bulk']
+
+DEFAULT_LINES = 100000
+DEFAULT_RATE = 200.0
+DEFAULT_DURATION = 5.0
+DEFAULT_SENSORS = 3
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return float('nan')
+
+    idx = int(round((pct / 100.0) * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+#runs inside the child process: run the client once and write the measurements to result_path
+def runChild(mode, ingest, url, speed, result_path):
+    sys.path.insert(0, CLIENT_DIR)
+
+    if mode == 'plot':
+        import matplotlib
+        matplotlib.use('Agg')
+
+    import ventsense
+
+    due_times = collections.deque()
+    latencies = []
+    sources = []
+
+    #record when each sample line becomes available on the simulated port (header lines start a new log rather than
+    #being written to it)...
+    open_data_source = ventsense.openDataSource
+
+    def onLine(line, due):
+        if not line.startswith(b'time'):
+            due_times.append(due)
+
+    def openDataSource(port_name, replay_speed):
+        ser = open_data_source(port_name, replay_speed)
+        ser.on_line = onLine
+        sources.append(ser)
+        return ser
+
+    #...and when it has been written to the log
+    start_new_log_file = ventsense.startNewLogFile
+
+    class LatencyLog(object):
+        def __init__(self, file):
+            self._file = file
+
+        def write(self, text):
+            now = time.perf_counter()
+            for _ in range(text.count('\n')):
+                if due_times:
+                    latencies.append(now - due_times.popleft())
+            return self._file.write(text)
+
+        def close(self):
+            self._file.close()
+
+    ventsense.openDataSource = openDataSource
+    ventsense.startNewLogFile = lambda *args: LatencyLog(start_new_log_file(*args))
+
+    argv = ['-p', url, '--speed=' + speed, '--ingest=' + ingest, '--log-format=csv',
+            '-d', str(mode == 'plot'), '-c', str(mode == 'console')]
+
+    ventsense.main(argv)
+
+    ser = sources[0]
+
+    with open(result_path, 'w') as file:
+        json.dump({'lines': ser.lines_replayed, 'elapsed': ser.elapsed(), 'latencies': latencies}, file)
+
+
+#runs in the parent: start a child process for one measurement and collect its results
+def runOne(mode, ingest, url, speed):
+    work_dir = tempfile.mkdtemp(prefix='ventsense_bench_')
+    result_path = os.path.join(work_dir, 'result.json')
+
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', mode, ingest, url, speed, result_path]
+
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(cmd, cwd=work_dir, stdout=devnull)
+
+            peak_rss = None
+            if hasattr(os, 'wait4'):
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = status
+
+                #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+                peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            else:
+                proc.wait()
+
+        if not os.path.isfile(result_path):
+            raise RuntimeError('benchmark run failed: ' + ' '.join(cmd))
+
+        with open(result_path) as file:
+            result = json.load(file)
+
+        result['peak_rss'] = peak_rss
+        return result
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def simUrl(rate, sensors, count):
+    return 'sim://?rate=' + str(rate) + '&sensors=' + str(sensors) + '&count=' + str(count) + '&seed=1'
+
+
+def printHelp():
+    print('usage: python bench_client.py [--lines=<number>] [--rate=<Hz>] [--duration=<seconds>]\n' +
+          '                              [--sensors=<number>] [--modes=headless,console,plot] [--ingest=line,bulk]')
+
+
+def main(argv):
+    if argv and argv[0] == '--child':
+        runChild(*argv[1:])
+        return
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["lines=", "rate=", "duration=", "sensors=", "modes=", "ingest="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    num_lines = DEFAULT_LINES
+    rate = DEFAULT_RATE
+    duration = DEFAULT_DURATION
+    sensors = DEFAULT_SENSORS
+    modes = MODES
+    ingest_modes = INGEST_MODES
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--lines':
+            num_lines = int(arg)
+        elif opt == '--rate':
+            rate = float(arg)
+        elif opt == '--duration':
+            duration = float(arg)
+        elif opt == '--sensors':
+            sensors = int(arg)
+        elif opt == '--modes':
+            modes = arg.split(',')
+        elif opt == '--ingest':
+            ingest_modes = arg.split(',')
+
+    print('ventsense client benchmark: ' + str(num_lines) + ' lines at max speed, latency at ' + str(rate) +
+          ' Hz for ' + str(duration) + ' s, ' + str(sensors) + ' sensors')
+    print('')
+    print('%-9s %-6s %12s %10s %10s %10s %10s %10s' %
+          ('mode', 'ingest', 'lines/s', 'p50 ms', 'p90 ms', 'p99 ms', 'p99.9 ms', 'peak MB'))
+
+    for mode in modes:
+        for ingest in ingest_modes:
+            throughput = runOne(mode, ingest, simUrl(rate, sensors, num_lines), 'max')
+            paced = runOne(mode, ingest, simUrl(rate, sensors, int(rate * duration)), '1')
+
+            lines_per_sec = throughput['lines'] / throughput['elapsed']
+            latencies = sorted(paced['latencies'])
+            pcts = [percentile(latencies, pct) * 1000.0 for pct in PERCENTILES]
+
+            peak = [r['peak_rss'] for r in (throughput, paced) if r['peak_rss'] is not None]
+            peak_str = '%10.1f' % (max(peak) / 1e6) if peak else '%10s' % 'n/a'
+
+            print('%-9s %-6s %12.0f %10.2f %10.2f %10.2f %10.2f %s' %
+                  tuple([mode, ingest, lines_per_sec] + pcts + [peak_str]))
+            sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+# bench_decimate.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the display decimation of long plot windows (see decimate.py). For increasing
+# window lengths, draws 6 lines (the pressure and temperature of 3 sensors) on an off-screen
+# matplotlib canvas the way the client does on every frame (set the line data, then redraw the
+# lines), once with every sample in the window and once with the min/max envelope from
+# MinMaxDecimator, and reports the time per frame of each, along with the number of points drawn
+# and the cost of keeping the decimator up to date.
+#
+# Usage:
+#     python bench_decimate.py [--width=<pixels>]
+#
+# Notes:
+# The plot is --width pixels wide (600 by default, about the width of one of the client's plots),
+# with one bucket per pixel column. Windows shorter than MIN_DECIMATION samples per pixel are not
+# decimated by the client; they are included here to show where decimation starts to pay off.
+
+import getopt
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+
+from decimate import MinMaxDecimator
+
+NUM_CHANNELS = 6
+WINDOW_LENGTHS = [201, 2001, 5001, 10001, 100001]   #20 s to 1000 s at 10 Hz, and 1000 s at 100 Hz
+SAMPLES_PER_FRAME = 10
+NUM_FRAMES = 50
+DEFAULT_WIDTH = 600         #pixels
+DPI = 100
+
+
+#returns an array of shape (NUM_CHANNELS, num_samples): breathing-like pressure with noise
+def makeSamples(num_samples):
+    rng = np.random.RandomState(1)
+    t = np.arange(num_samples) / 10.0
+    breath = 15.0 * (np.sin(2.0 * np.pi * t / 3.8) > 0)
+    return 1013.0 + breath + rng.normal(0.0, 0.5, (NUM_CHANNELS, num_samples))
+
+
+#time per frame of drawing the newest window_len samples at every frame, decimated or not
+def benchDraw(data, window_len, width, decimate):
+    fig = plt.figure(figsize=(width / float(DPI), 3.0), dpi=DPI)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_xlim(window_len, 0)
+    ax.set_ylim(data.min(), data.max())
+    lines = [ax.plot([], [], animated=True)[0] for ch in range(NUM_CHANNELS)]
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(ax.bbox)
+
+    decimator = None
+    if decimate:
+        decimator = MinMaxDecimator(NUM_CHANNELS, window_len, max(window_len // width, 1))
+        decimator.extend(data[:, :window_len])
+
+    ages = np.arange(window_len)
+    num_points = 0
+
+    start = time.perf_counter()
+    for frame in range(NUM_FRAMES):
+        end = window_len + (frame + 1) * SAMPLES_PER_FRAME
+
+        if decimator is not None:
+            decimator.extend(data[:, end - SAMPLES_PER_FRAME:end])
+            x_data, y_data = decimator.envelope()
+        else:
+            y_data = data[:, end - window_len:end][:, ::-1]
+            x_data = np.broadcast_to(ages, y_data.shape)
+
+        fig.canvas.restore_region(background)
+        for ch in range(NUM_CHANNELS):
+            lines[ch].set_data(x_data[ch], y_data[ch])
+            ax.draw_artist(lines[ch])
+        fig.canvas.blit(ax.bbox)
+
+        num_points = y_data.shape[1]
+    elapsed = time.perf_counter() - start
+
+    plt.close(fig)
+
+    return elapsed / NUM_FRAMES, num_points
+
+
+#time per frame of adding a frame's worth of samples to the decimator and reading its envelope
+def benchDecimator(data, window_len, width):
+    decimator = MinMaxDecimator(NUM_CHANNELS, window_len, max(window_len // width, 1))
+    decimator.extend(data[:, :window_len])
+
+    num_frames = NUM_FRAMES * 10
+    start = time.perf_counter()
+    for frame in range(num_frames):
+        end = window_len + (frame + 1) * SAMPLES_PER_FRAME
+        decimator.extend(data[:, end - SAMPLES_PER_FRAME:end])
+        decimator.envelope()
+    elapsed = time.perf_counter() - start
+
+    return elapsed / num_frames
+
+
+def printHelp():
+    print('usage: python bench_decimate.py [--width=<pixels>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["width="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    width = DEFAULT_WIDTH
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--width':
+            width = int(arg)
+
+    data = makeSamples(max(WINDOW_LENGTHS) + NUM_FRAMES * 10 * SAMPLES_PER_FRAME)
+
+    print('Drawing %d lines, %d pixels wide, %d new samples per frame:' % (NUM_CHANNELS, width, SAMPLES_PER_FRAME))
+    print('    %9s %20s %20s %16s' % ('window', 'all samples', 'decimated', 'decimator'))
+
+    for window_len in WINDOW_LENGTHS:
+        full, full_points = benchDraw(data, window_len, width, False)
+        decimated, decimated_points = benchDraw(data, window_len, width, True)
+        update = benchDecimator(data, window_len, width)
+
+        print('    %9d %8.2f ms %6d pts %8.2f ms %6d pts %10.3f ms' % (window_len, full * 1e3, full_points,
+                                                                       decimated * 1e3, decimated_points, update * 1e3))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# bench_filters.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the --filter noise filters (see filters.py). Filters a stream of synthetic samples
+# (noisy breaths with spikes) with a chain of filters, one sample at a time (as line ingest does) and
+# in blocks of increasing size (as bulk ingest does), and reports for each the time per sample and
+# the share of a sample period at --rate it takes. Also checks that every block size gives the same
+# result as filtering one sample at a time, and reports the largest difference.
+#
+# Usage:
+#     python bench_filters.py [--filter=<filters>] [--samples=<number>] [--sensors=<number>]
+#                             [--blocks=1,10,100,1000] [--rate=<Hz>] [--repeat=<number>]
+#
+# Notes:
+# A block size of 1 here means FilterChain.filterSample(), the pure Python version; the other block
+# sizes use FilterChain.filterSamples(), the NumPy version. Each run is repeated --repeat times and
+# the fastest is reported.
+
+import getopt
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from channels import ChannelSchema
+from filters import FilterChain, parseFilters
+
+DEFAULT_FILTERS = 'median:p:5,biquad:all:8,decimate:2'
+DEFAULT_SAMPLES = 20000
+DEFAULT_SENSORS = 16
+DEFAULT_BLOCKS = [1, 10, 100, 1000]
+DEFAULT_RATE = 200.0    #Hz
+DEFAULT_REPEAT = 3
+
+BREATH_PERIOD = 4.0     #seconds
+NOISE = 0.2             #hPa
+SPIKE_EVERY = 97        #samples
+
+
+#'num_samples' samples of 'num_sensors' sensors at 'rate', one row per sample, timestamp first
+def makeSamples(num_samples, num_sensors, rate):
+    rng = np.random.RandomState(1)
+    t = np.arange(num_samples) / rate
+
+    samples = np.empty((num_samples, 1 + 2 * num_sensors))
+    samples[:, 0] = np.round(t * 1000.0)
+
+    for idx in range(num_sensors):
+        samples[:, 1 + 2 * idx] = 23.5 + 0.01 * idx + rng.normal(0.0, 0.02, num_samples)
+        samples[:, 2 + 2 * idx] = (1013.0 + 20.0 * np.maximum(np.sin(2 * math.pi * t / BREATH_PERIOD), 0.0) +
+                                   rng.normal(0.0, NOISE, num_samples))
+
+    samples[::SPIKE_EVERY, 2::2] += 50.0
+    return samples
+
+
+#filter 'samples' with a new chain, in blocks of 'block' samples (one at a time if 1). Returns (seconds, output)
+def runOne(specs, schema, samples, rate, block):
+    chain = FilterChain(specs, schema)
+    chain.setRate(rate)
+
+    if block == 1:
+        rows = samples.tolist()
+
+        start = time.perf_counter()
+        out = []
+        for row in rows:
+            filtered = chain.filterSample(row)
+            if filtered is not None:
+                out.append(filtered)
+        elapsed = time.perf_counter() - start
+
+        return elapsed, np.array(out)
+
+    start = time.perf_counter()
+    out = [chain.filterSamples(samples[idx:idx + block]) for idx in range(0, len(samples), block)]
+    elapsed = time.perf_counter() - start
+
+    return elapsed, np.concatenate(out)
+
+
+def printHelp():
+    print('usage: python bench_filters.py [--filter=<filters>] [--samples=<number>] [--sensors=<number>]\n' +
+          '                               [--blocks=1,10,100,1000] [--rate=<Hz>] [--repeat=<number>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["filter=", "samples=", "sensors=", "blocks=", "rate=", "repeat="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    filters_str = DEFAULT_FILTERS
+    num_samples = DEFAULT_SAMPLES
+    num_sensors = DEFAULT_SENSORS
+    blocks = DEFAULT_BLOCKS
+    rate = DEFAULT_RATE
+    repeat = DEFAULT_REPEAT
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--filter':
+            filters_str = arg
+        elif opt == '--samples':
+            num_samples = int(arg)
+        elif opt == '--sensors':
+            num_sensors = int(arg)
+        elif opt == '--blocks':
+            blocks = [int(n) for n in arg.split(',')]
+        elif opt == '--rate':
+            rate = float(arg)
+        elif opt == '--repeat':
+            repeat = int(arg)
+
+    specs = parseFilters(filters_str)
+    schema = ChannelSchema.forSensors(num_sensors)
+    samples = makeSamples(num_samples, num_sensors, rate)
+
+    print('ventsense filter benchmark: ' + filters_str + ', ' + str(num_samples) + ' samples of ' + str(num_sensors) +
+          ' sensors at ' + '{:g}'.format(rate) + ' Hz, best of ' + str(repeat))
+    print('')
+    print('%-8s %14s %14s %12s %14s' % ('block', 'us/sample', 'samples/s', 'of period', 'max diff'))
+
+    reference = None
+    for block in blocks:
+        best = None
+        for _ in range(repeat):
+            elapsed, out = runOne(specs, schema, samples, rate, block)
+            best = elapsed if best is None else min(best, elapsed)
+
+        #every block size is compared with filtering one sample at a time
+        if reference is None:
+            reference = runOne(specs, schema, samples, rate, 1)[1]
+
+        if out.shape == reference.shape:
+            diff = '%.3g' % np.max(np.abs(out - reference)) if len(out) else '0'
+        else:
+            diff = 'shape ' + str(out.shape)
+
+        per_sample = best / num_samples
+        print('%-8d %14.2f %14.0f %11.2f%% %14s' %
+              (block, per_sample * 1e6, 1.0 / per_sample, 100.0 * per_sample * rate, diff))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
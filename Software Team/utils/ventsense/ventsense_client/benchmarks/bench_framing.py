@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+# bench_framing.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark and check of the --wire=frames binary protocol (see framing.py). Reports:
+#   - the bytes per sample of text lines and of frames, and the most samples per second each fits
+#     through the serial link
+#   - the time FrameDecoder takes per frame, for reads of several sizes
+#   - for several rates of corrupted and lost frames (see the simulator's --corrupt and --drop), how
+#     many frames were decoded and counted as lost against how many should have been, and how many
+#     decoded samples differ from the ones that were sent (which should be none)
+#
+# Usage:
+#     python bench_framing.py [--samples=<number>] [--sensors=1,3,8] [--baud=<rate>] [--reads=29,4096]
+#                             [--errors=0,0.001,0.01,0.05] [--repeat=<number>]
+#
+# Notes:
+# The frames come from the simulator's FrameEncoder (see simulator.py), which encodes exactly as
+# the firmware does. Each decoded line is checked against the text line the simulator sends for the
+# same sample in text mode, so frames and text must decode to the same values. A corrupted frame is
+# lost (its CRC fails) and is counted as lost by the next good frame, as is a frame dropped on the
+# wire. Each timing is repeated --repeat times and the fastest is reported.
+
+import getopt
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from framing import FrameDecoder, frameSize, DEFAULT_BAUD_RATE, BITS_PER_BYTE
+from simulator import SensorSimulator
+
+DEFAULT_SAMPLES = 100000
+DEFAULT_SENSORS = [1, 3, 8]
+DEFAULT_READS = [29, 256, 4096, 65536]   #bytes per read
+DEFAULT_ERRORS = [0.0, 0.001, 0.01, 0.05]
+DEFAULT_REPEAT = 3
+
+#sample rate of the simulated data. Its timestamps must all differ, to match each decoded sample with the one sent
+SAMPLE_RATE = 200.0 #Hz
+
+
+#the simulator's output for 'num_samples' samples, as one block of bytes, and the simulator
+def generate(num_samples, sensors, frames, corrupt=0.0, drop=0.0):
+    sim = SensorSimulator(rate=SAMPLE_RATE, sensors=sensors, count=num_samples, frames=frames, corrupt=corrupt,
+                          drop=drop, seed=1)
+    return b''.join(line for line, ts in sim.lines()), sim
+
+
+#feed 'data' to a new decoder 'read_size' bytes at a time. Returns (seconds, decoded lines, decoder)
+def decode(data, read_size):
+    decoder = FrameDecoder()
+
+    start = time.perf_counter()
+    out = [decoder.feed(data[idx:idx + read_size]) for idx in range(0, len(data), read_size)]
+    elapsed = time.perf_counter() - start
+
+    return elapsed, b''.join(out), decoder
+
+
+def printHelp():
+    print('usage: python bench_framing.py [--samples=<number>] [--sensors=1,3,8] [--baud=<rate>] [--reads=29,4096]\n' +
+          '                               [--errors=0,0.001,0.01,0.05] [--repeat=<number>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["samples=", "sensors=", "baud=", "reads=", "errors=", "repeat="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    num_samples = DEFAULT_SAMPLES
+    sensor_counts = DEFAULT_SENSORS
+    baud_rate = DEFAULT_BAUD_RATE
+    read_sizes = DEFAULT_READS
+    error_rates = DEFAULT_ERRORS
+    repeat = DEFAULT_REPEAT
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--samples':
+            num_samples = int(arg)
+        elif opt == '--sensors':
+            sensor_counts = [int(n) for n in arg.split(',')]
+        elif opt == '--baud':
+            baud_rate = int(arg)
+        elif opt == '--reads':
+            read_sizes = [int(n) for n in arg.split(',')]
+        elif opt == '--errors':
+            error_rates = [float(p) for p in arg.split(',')]
+        elif opt == '--repeat':
+            repeat = int(arg)
+
+    print('ventsense framing benchmark: ' + str(num_samples) + ' samples, ' + str(baud_rate) + ' baud, best of ' +
+          str(repeat))
+    print('')
+    print('%-8s %12s %12s %14s %14s' % ('sensors', 'text B/smp', 'frame B/smp', 'text smp/s', 'frames smp/s'))
+
+    link_bytes = float(baud_rate) / BITS_PER_BYTE
+    for sensors in sensor_counts:
+        text = generate(num_samples, sensors, False)[0]
+        text_size = float(len(text)) / num_samples
+
+        print('%-8d %12.1f %12d %14.0f %14.0f' %
+              (sensors, text_size, frameSize(sensors), link_bytes / text_size, link_bytes / frameSize(sensors)))
+
+    sensors = 3 if 3 in sensor_counts else sensor_counts[0]
+    reference = generate(num_samples, sensors, False)[0].split(b'\r\n')[1:-1]
+    by_timestamp = dict((line.split(b',', 1)[0], line) for line in reference)
+
+    print('')
+    print('decoding frames of ' + str(sensors) + ' sensors:')
+    print('%-8s %12s %14s %14s' % ('read B', 'us/frame', 'frames/s', 'of link time'))
+
+    data = generate(num_samples, sensors, True)[0]
+    for read_size in read_sizes:
+        best = min(decode(data, read_size)[0] for _ in range(repeat))
+        per_frame = best / num_samples
+
+        print('%-8d %12.2f %14.0f %13.1f%%' %
+              (read_size, per_frame * 1e6, 1.0 / per_frame, 100.0 * per_frame * link_bytes / frameSize(sensors)))
+        sys.stdout.flush()
+
+    print('')
+    print('corrupted and lost frames of ' + str(sensors) + ' sensors (corrupt and drop probability each):')
+    print('%-8s %9s %9s %9s %9s %10s %9s %9s %9s' %
+          ('errors', 'corrupt', 'dropped', 'decoded', 'expected', 'CRC errors', 'lost', 'expected', 'wrong'))
+
+    for rate in error_rates:
+        data, sim = generate(num_samples, sensors, True, rate, rate)
+        elapsed, out, decoder = decode(data, 4096)
+        decoded = out.split(b'\r\n')[1:-1]
+
+        #every decoded sample must be the one sent
+        wrong = sum(1 for line in decoded if by_timestamp.get(line.split(b',', 1)[0]) != line)
+
+        print('%-8g %9d %9d %9d %9d %10d %9d %9d %9d' %
+              (rate, sim.corrupt_generated, sim.dropped_generated, len(decoded),
+               num_samples - sim.corrupt_generated - sim.dropped_generated, decoder.crc_errors, decoder.lost,
+               sim.corrupt_generated + sim.dropped_generated, wrong))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# bench_logindex.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the log index (see logindex.py). Writes an archive of synthetic ventsense logs
+# (one per simulated Arduino session, CSV or binary) to a temporary directory and reports:
+#   - the time to build the index from scratch, and to bring it up to date when nothing changed
+#   - the size of the index file
+#   - the time of range queries of a given length at random times, compared with loading a whole
+#     log the way a script without the index would (np.genfromtxt for CSV)
+#
+# Usage:
+#     python bench_logindex.py [--size=<MB>] [--sessions=<number>] [--query=<seconds>]
+#                              [--format=csv|bin] [--keep]
+#
+# Notes:
+# Logs are written at 100 Hz with 3 sensors: sensor 1 open to the air, and sensors 2 and 3 on an
+# airway with a breath every 3.8 s. The first session starts at midnight, a week ago. Generating a
+# large archive takes a while; --keep leaves it in place (and prints where) to rerun queries on it.
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, CLIENT_DIR)
+
+import numpy as np
+
+import binlog
+import logindex
+from channels import ChannelSchema
+
+DEFAULT_SIZE = 200          #MB
+DEFAULT_SESSIONS = 20
+DEFAULT_QUERY = 180.0       #seconds
+NUM_QUERIES = 20
+
+RATE = 100.0                #Hz
+CSV_LINE_BYTES = 49         #approximate length of a CSV sample line
+WRITE_CHUNK = 100000        #samples written at a time
+
+
+#write 'num_samples' samples of one session to a new log in 'directory', starting at 'start_time' (seconds since
+#the epoch)
+def writeSession(directory, log_format, start_time, num_samples, seed):
+    field_names = ChannelSchema.forSensors(3).field_names
+    name = 'ventsense_log_' + time.strftime(logindex.LOG_TIME_FORMAT, time.localtime(start_time)) + '.' + log_format
+    path = os.path.join(directory, name)
+    rng = np.random.RandomState(seed)
+
+    if log_format == logindex.LOG_FORMAT_BIN:
+        writer = binlog.BinLogWriter(path, field_names)
+    else:
+        writer = open(path, 'w')
+        writer.write(','.join(field_names) + '\n')
+
+    millis = 1000 + seed
+    for offset in range(0, num_samples, WRITE_CHUNK):
+        count = min(WRITE_CHUNK, num_samples - offset)
+        timestamps = millis + (offset + np.arange(count)) * (1000.0 / RATE)
+        atmospheric = 1013.0 + rng.normal(0, 0.02, count)
+        pressure = atmospheric + 5.0 + 15.0 * (np.sin(timestamps / 600.0) > 0)
+        values = np.column_stack([timestamps, np.full(count, 23.5), atmospheric, np.full(count, 24.0), pressure,
+                                  np.full(count, 24.5), pressure + 1.0])
+
+        if log_format == logindex.LOG_FORMAT_BIN:
+            writer.writeRecords(values)
+        else:
+            np.savetxt(writer, values, fmt=['%d'] + ['%.2f'] * 6, delimiter=',')
+
+    writer.close()
+
+
+def printHelp():
+    print('usage: python bench_logindex.py [--size=<MB>] [--sessions=<number>] [--query=<seconds>]\n' +
+          '                                [--format=csv|bin] [--keep]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["size=", "sessions=", "query=", "format=", "keep"])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    size = DEFAULT_SIZE
+    sessions = DEFAULT_SESSIONS
+    query_len = DEFAULT_QUERY
+    log_format = logindex.LOG_FORMAT_CSV
+    keep = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--size':
+            size = float(arg)
+        elif opt == '--sessions':
+            sessions = int(arg)
+        elif opt == '--query':
+            query_len = float(arg)
+        elif opt == '--format':
+            log_format = arg
+        elif opt == '--keep':
+            keep = True
+
+    record_bytes = CSV_LINE_BYTES if log_format == logindex.LOG_FORMAT_CSV else 28
+    samples_per_session = int(size * 1e6 / record_bytes / sessions)
+    session_len = samples_per_session / RATE
+
+    directory = tempfile.mkdtemp(prefix='ventsense_logs_')
+
+    try:
+        print('ventsense log index benchmark: ' + str(sessions) + ' ' + log_format + ' logs, about ' + str(size) +
+              ' MB, ' + str(query_len) + ' s queries')
+        print('')
+
+        start_time = logindex.parseTime(time.strftime('%Y-%m-%d')) - 7 * 86400
+        session_starts = []
+        for session in range(sessions):
+            session_starts.append(start_time)
+            writeSession(directory, log_format, start_time, samples_per_session, session)
+            start_time += session_len + 60.0
+
+        total_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+        print('%-32s %10.1f MB' % ('archive size', total_bytes / 1e6))
+
+        t0 = time.perf_counter()
+        index = logindex.openIndex(directory)
+        print('%-32s %10.3f s' % ('build index', time.perf_counter() - t0))
+
+        t0 = time.perf_counter()
+        logindex.openIndex(directory)
+        print('%-32s %10.3f s' % ('update index (no changes)', time.perf_counter() - t0))
+        print('%-32s %10.1f kB' % ('index size', os.path.getsize(index.path) / 1e3))
+
+        #queries at random times within the sessions
+        rng = np.random.RandomState(1)
+        elapsed = []
+        num_samples = 0
+        for _ in range(NUM_QUERIES):
+            session_start = session_starts[rng.randint(sessions)]
+            start = session_start + rng.uniform(0, max(session_len - query_len, 0))
+
+            t0 = time.perf_counter()
+            data = index.query(start, start + query_len)
+            elapsed.append(time.perf_counter() - t0)
+            num_samples += len(data)
+
+        elapsed.sort()
+        print('%-32s %10.2f ms (%d samples each)' % ('range query, median', elapsed[len(elapsed) // 2] * 1000.0,
+                                                      num_samples // NUM_QUERIES))
+        print('%-32s %10.2f ms' % ('range query, max', elapsed[-1] * 1000.0))
+
+        #without the index: load the whole log holding the range
+        path = os.path.join(directory, index.files[0]['name'])
+        t0 = time.perf_counter()
+        if log_format == logindex.LOG_FORMAT_BIN:
+            np.array(binlog.loadBinLog(path, mmap=False))
+        else:
+            np.genfromtxt(path, delimiter=',', skip_header=1)
+        print('%-32s %10.2f ms' % ('load one whole log', (time.perf_counter() - t0) * 1000.0))
+
+    finally:
+        if keep:
+            print('')
+            print('logs kept in ' + directory)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
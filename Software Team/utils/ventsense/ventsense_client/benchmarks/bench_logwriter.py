@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# bench_logwriter.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the log writer (see logwriter.py). Writes CSV sample lines from one thread, as an
+# acquisition thread does, to a temporary directory, and compares:
+#   - a plain file with default buffering (the client's logging before logwriter.py: fast, but with
+#     no telling how much is lost in a crash)
+#   - a plain file flushed and synced after every line (safe, but a write and a sync per sample)
+#   - a LogWriter with a sync interval of 1000, 100 and 10 ms
+# For each, it reports the lines/s the writing thread can sustain, the worst time a single write held
+# it up, and the number of syncs, along with the LogWriter's write and sync latency.
+#
+# Usage:
+#     python bench_logwriter.py [--lines=<number>] [--sync-lines=<number>]
+#
+# Notes:
+# Syncing every line takes as long as the disk takes to sync, so it is run for --sync-lines lines
+# only (1000 by default). On a disk with a volatile write cache that is not flushed by fsync, syncs are
+# quick and the figures say little about durability.
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from logwriter import LogWriter
+
+DEFAULT_LINES = 200000
+DEFAULT_SYNC_LINES = 1000
+SYNC_INTERVALS = [1.0, 0.1, 0.01]   #seconds
+
+HEADER = 'timestamp,temp 1,press 1,temp 2,press 2,temp 3,press 3\n'
+
+
+def makeLines(num_lines):
+    return ['%d,23.51,1013.24,23.87,%.2f,24.02,1018.31\n' % (idx * 10, 1018.0 + (idx % 40) * 0.25)
+            for idx in range(num_lines)]
+
+
+#write every line with write(), returning (elapsed seconds, longest single write in seconds)
+def timeWrites(write, lines):
+    longest = 0.0
+
+    start = time.perf_counter()
+    for line in lines:
+        t0 = time.perf_counter()
+        write(line)
+        t1 = time.perf_counter()
+
+        if t1 - t0 > longest:
+            longest = t1 - t0
+    elapsed = time.perf_counter() - start
+
+    return elapsed, longest
+
+
+def printRow(name, num_lines, elapsed, longest, syncs):
+    print('%-26s %12.0f %14.3f %8d' % (name, num_lines / elapsed, longest * 1000.0, syncs))
+    sys.stdout.flush()
+
+
+def benchPlain(directory, lines, sync):
+    path = os.path.join(directory, 'plain_sync.csv' if sync else 'plain.csv')
+
+    with open(path, 'a') as file:
+        file.write(HEADER)
+
+        if sync:
+            def write(line):
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+        else:
+            write = file.write
+
+        elapsed, longest = timeWrites(write, lines)
+
+    return elapsed, longest, len(lines) if sync else 0
+
+
+def benchLogWriter(directory, lines, sync_interval):
+    writer = LogWriter(sync_interval, directory=directory)
+    writer.start()
+    log_file = writer.open('ventsense_log', 'csv', HEADER)
+
+    elapsed, longest = timeWrites(log_file.write, lines)
+
+    log_file.close()
+    writer.close()
+
+    return elapsed, longest, writer
+
+
+def printHelp():
+    print('usage: python bench_logwriter.py [--lines=<number>] [--sync-lines=<number>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["lines=", "sync-lines="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    num_lines = DEFAULT_LINES
+    num_sync_lines = DEFAULT_SYNC_LINES
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--lines':
+            num_lines = int(arg)
+        elif opt == '--sync-lines':
+            num_sync_lines = int(arg)
+
+    lines = makeLines(num_lines)
+    directory = tempfile.mkdtemp(prefix='ventsense_logs_')
+
+    try:
+        print('ventsense log writer benchmark: ' + str(num_lines) + ' CSV lines from one thread')
+        print('')
+        print('%-26s %12s %14s %8s' % ('writer', 'lines/s', 'max write ms', 'syncs'))
+
+        elapsed, longest, syncs = benchPlain(directory, lines, False)
+        printRow('buffered file', num_lines, elapsed, longest, syncs)
+
+        elapsed, longest, syncs = benchPlain(directory, lines[:num_sync_lines], True)
+        printRow('fsync every line', num_sync_lines, elapsed, longest, syncs)
+
+        writers = []
+        for sync_interval in SYNC_INTERVALS:
+            elapsed, longest, writer = benchLogWriter(directory, lines, sync_interval)
+            printRow('LogWriter, sync ' + '{:g}'.format(sync_interval * 1000.0) + ' ms', num_lines, elapsed, longest,
+                     writer.syncs)
+            writers.append(writer)
+
+        print('')
+        for sync_interval, writer in zip(SYNC_INTERVALS, writers):
+            print('LogWriter, sync ' + '{:g}'.format(sync_interval * 1000.0) + ' ms: ' + writer.stats())
+
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# bench_multidevice.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for reading several devices at once. Runs the real client (ventsense.main), headless,
+# on a number of simulated devices (see simulator.py), each producing data at a fixed rate in real
+# time, and reports for each number of devices:
+#   - the total and the lowest per-device sustained line rate
+#   - end-to-end latency percentiles over all devices, measured from the moment a line becomes
+#     available on its (simulated) serial port until it has been written to that device's log
+#   - peak resident memory of the client process
+#
+# Usage:
+#     python bench_multidevice.py [--devices=1,4,8,16] [--rate=<Hz>] [--duration=<seconds>]
+#                                 [--sensors=<number>] [--ingest=line|bulk]
+#
+# Notes:
+# Every measurement runs in its own child process, in a temporary directory, as in bench_client.py.
+# A device keeps up if its line rate matches the simulated rate and its latency stays low.
+
+import collections
+import getopt
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+from bench_client import percentile
+
+DEFAULT_DEVICES = [1, 4, 8, 16]
+DEFAULT_RATE = 100.0
+DEFAULT_DURATION = 5.0
+DEFAULT_SENSORS = 3
+
+PERCENTILES = [50, 99, 99.9]
+
+
+def simUrl(rate, sensors, count, seed):
+    return ('sim://?rate=' + str(rate) + '&sensors=' + str(sensors) + '&count=' + str(count) +
+            '&seed=' + str(seed))
+
+
+#runs inside the child process: run the client once on num_devices simulated devices and write the
+#measurements to result_path
+def runChild(num_devices, rate, duration, sensors, ingest, result_path):
+    sys.path.insert(0, CLIENT_DIR)
+
+    import ventsense
+
+    num_devices = int(num_devices)
+    rate = float(rate)
+    urls = [simUrl(rate, int(sensors), int(rate * float(duration)), idx + 1) for idx in range(num_devices)]
+
+    #due times and latencies of each device, in the order of the -p options
+    due_times = [collections.deque() for _ in urls]
+    latencies = [[] for _ in urls]
+    sources = []
+
+    #record when each sample line becomes available on its simulated port (header lines start a new log rather than
+    #being written to it)...
+    open_data_source = ventsense.openDataSource
+
+    def onLine(line, due, queue):
+        if not line.startswith(b'time'):
+            queue.append(due)
+
+    def openDataSource(port_name, replay_speed):
+        ser = open_data_source(port_name, replay_speed)
+        ser.on_line = lambda line, due, queue=due_times[len(sources)]: onLine(line, due, queue)
+        sources.append(ser)
+        return ser
+
+    #...and when it has been written to that device's log
+    start_new_log_file = ventsense.startNewLogFile
+    device_idx = dict((name, idx) for idx, name in enumerate(ventsense.deviceNames(urls)))
+
+    class LatencyLog(object):
+        def __init__(self, file, idx):
+            self._file = file
+            self._due = due_times[idx]
+            self._latencies = latencies[idx]
+
+        def write(self, text):
+            now = time.perf_counter()
+            for _ in range(text.count('\n')):
+                if self._due:
+                    self._latencies.append(now - self._due.popleft())
+            return self._file.write(text)
+
+        def close(self):
+            self._file.close()
+
+    def startNewLogFile(log_writer, log_format, field_names=None, device_name=None):
+        return LatencyLog(start_new_log_file(log_writer, log_format, field_names, device_name),
+                          device_idx.get(device_name, 0))
+
+    ventsense.openDataSource = openDataSource
+    ventsense.startNewLogFile = startNewLogFile
+
+    argv = []
+    for url in urls:
+        argv += ['-p', url]
+    argv += ['--speed=1', '--ingest=' + ingest, '--log-format=csv', '-d', 'false', '-c', 'false']
+
+    ventsense.main(argv)
+
+    with open(result_path, 'w') as file:
+        json.dump({'lines': [ser.lines_replayed for ser in sources],
+                   'elapsed': [ser.elapsed() for ser in sources],
+                   'latencies': latencies}, file)
+
+
+#runs in the parent: start a child process for one measurement and collect its results
+def runOne(num_devices, rate, duration, sensors, ingest):
+    work_dir = tempfile.mkdtemp(prefix='ventsense_bench_')
+    result_path = os.path.join(work_dir, 'result.json')
+
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', str(num_devices), str(rate), str(duration),
+               str(sensors), ingest, result_path]
+
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(cmd, cwd=work_dir, stdout=devnull)
+
+            peak_rss = None
+            if hasattr(os, 'wait4'):
+                _, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = status
+
+                #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+                peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+            else:
+                proc.wait()
+
+        if not os.path.isfile(result_path):
+            raise RuntimeError('benchmark run failed: ' + ' '.join(cmd))
+
+        with open(result_path) as file:
+            result = json.load(file)
+
+        result['peak_rss'] = peak_rss
+        return result
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def printHelp():
+    print('usage: python bench_multidevice.py [--devices=1,4,8,16] [--rate=<Hz>] [--duration=<seconds>]\n' +
+          '                                   [--sensors=<number>] [--ingest=line|bulk]')
+
+
+def main(argv):
+    if argv and argv[0] == '--child':
+        runChild(*argv[1:])
+        return
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["devices=", "rate=", "duration=", "sensors=", "ingest="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    device_counts = DEFAULT_DEVICES
+    rate = DEFAULT_RATE
+    duration = DEFAULT_DURATION
+    sensors = DEFAULT_SENSORS
+    ingest = 'line'
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--devices':
+            device_counts = [int(n) for n in arg.split(',')]
+        elif opt == '--rate':
+            rate = float(arg)
+        elif opt == '--duration':
+            duration = float(arg)
+        elif opt == '--sensors':
+            sensors = int(arg)
+        elif opt == '--ingest':
+            ingest = arg
+
+    print('ventsense multi-device benchmark: ' + str(rate) + ' Hz per device for ' + str(duration) + ' s, ' +
+          str(sensors) + ' sensors, ' + ingest + ' ingest')
+    print('')
+    print('%-8s %12s %12s %10s %10s %10s %10s' %
+          ('devices', 'total lin/s', 'min lin/s', 'p50 ms', 'p99 ms', 'p99.9 ms', 'peak MB'))
+
+    for num_devices in device_counts:
+        result = runOne(num_devices, rate, duration, sensors, ingest)
+
+        rates = [lines / elapsed for lines, elapsed in zip(result['lines'], result['elapsed']) if elapsed > 0]
+        latencies = sorted(lat for device in result['latencies'] for lat in device)
+        pcts = [percentile(latencies, pct) * 1000.0 for pct in PERCENTILES]
+
+        if result['peak_rss'] is not None:
+            peak_str = '%10.1f' % (result['peak_rss'] / 1e6)
+        else:
+            peak_str = '%10s' % 'n/a'
+
+        print('%-8d %12.0f %12.1f %10.2f %10.2f %10.2f %s' %
+              tuple([num_devices, sum(rates), min(rates)] + pcts + [peak_str]))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# bench_profile.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the --profile stage timing (see profiling.py). Runs an acquisition thread on
+# simulated sensor data (see simulator.py) as fast as it can take it, in line and bulk ingest, with
+# profiling off and on, and reports the lines/s of each, so the cost of the timing probes can be
+# checked: with profiling off it should be lost in the noise. Also reports the cost of timing a
+# single stage, and the per-stage breakdown of the last profiled run.
+#
+# Usage:
+#     python bench_profile.py [--lines=<number>] [--repeat=<number>] [--sensors=<number>] [--ingest=line,bulk]
+#
+# Notes:
+# The log file is discarded rather than written, and nothing reads the plot queue (which only keeps
+# its newest samples), so the figures are those of the acquisition thread alone. Each run is repeated
+# --repeat times and the fastest is reported, as the others are slowed down by whatever else the
+# machine is doing.
+
+import getopt
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from acquisition import AcquisitionThread, SampleQueue, ACQUISITION_STAGES, READ_TIMEOUT
+from profiling import Profiler, StageProfile, clock
+from simulator import SimulatedSerial
+
+DEFAULT_LINES = 100000
+DEFAULT_REPEAT = 3
+DEFAULT_SENSORS = 3
+INGEST_MODES = ['line', 'bulk']
+
+QUEUE_SIZE = 1000
+
+LAP_CALLS = 200000
+
+
+class NullLogFile(object):
+    #log file that discards what is written to it
+    def write(self, text):
+        pass
+
+    def close(self):
+        pass
+
+
+#run one acquisition thread over 'num_lines' simulated lines, returning (lines/s, thread)
+def runOne(ingest, num_lines, sensors, profile):
+    ser = SimulatedSerial('sim://?rate=1000&sensors=' + str(sensors) + '&count=' + str(num_lines) + '&seed=1',
+                          None, timeout=READ_TIMEOUT)
+    ser.open()
+
+    acq = AcquisitionThread(ser, lambda field_names: NullLogFile(), sample_queue=SampleQueue(QUEUE_SIZE),
+                            ingest_mode=ingest, profile=profile)
+    acq.start()
+    acq.join()
+    ser.close()
+
+    if acq.error is not None:
+        raise RuntimeError(acq.error_traceback)
+
+    return acq.lineRate(), acq
+
+
+#average time (ns) to time one stage
+def lapCost():
+    profile = StageProfile('bench', ['stage'])
+
+    t = clock()
+    start = clock()
+    for _ in range(LAP_CALLS):
+        t = profile.lap(0, t)
+
+    return float(clock() - start) / LAP_CALLS
+
+
+def printHelp():
+    print('usage: python bench_profile.py [--lines=<number>] [--repeat=<number>] [--sensors=<number>] [--ingest=line,bulk]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["lines=", "repeat=", "sensors=", "ingest="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    num_lines = DEFAULT_LINES
+    repeat = DEFAULT_REPEAT
+    sensors = DEFAULT_SENSORS
+    ingest_modes = INGEST_MODES
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--lines':
+            num_lines = int(arg)
+        elif opt == '--repeat':
+            repeat = int(arg)
+        elif opt == '--sensors':
+            sensors = int(arg)
+        elif opt == '--ingest':
+            ingest_modes = arg.split(',')
+
+    print('ventsense profiling benchmark: ' + str(num_lines) + ' lines at max speed, ' + str(sensors) +
+          ' sensors, best of ' + str(repeat))
+    print('')
+    print('timing one stage: ' + '{:.0f}'.format(lapCost()) + ' ns')
+    print('')
+    print('%-6s %14s %14s %10s' % ('ingest', 'off lines/s', 'on lines/s', 'overhead'))
+
+    profiler = None
+    for ingest in ingest_modes:
+        rate_off = 0.0
+        rate_on = 0.0
+
+        #alternate the runs, so that both see the same conditions
+        for _ in range(repeat):
+            rate_off = max(rate_off, runOne(ingest, num_lines, sensors, None)[0])
+
+            profiler = Profiler()
+            profile = profiler.addProfile('acquisition', ACQUISITION_STAGES)
+            rate, acq = runOne(ingest, num_lines, sensors, profile)
+            rate_on = max(rate_on, rate)
+
+        print('%-6s %14.0f %14.0f %9.1f%%' % (ingest, rate_off, rate_on, 100.0 * (rate_off / rate_on - 1.0)))
+        sys.stdout.flush()
+
+    #the breakdown of the last profiled run
+    if profiler is not None:
+        print('')
+        print(profiler.report(acq.clock.samples))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# bench_samplebuffer.py
+# Helpful Engineering
+#
+# Purpose:
+# Microbenchmark for the plot history ring buffer. Measures the per-sample cost of appending
+# to SampleRingBuffer (and of taking the window view handed to matplotlib) at increasing
+# session lengths, and compares it with the old prepend-to-list approach.
+#
+# Usage:
+#     python bench_samplebuffer.py
+#
+# The per-sample cost of the ring buffer should stay flat from 1k to 1M samples, while the
+# list approach grows linearly with the number of samples already stored.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from samplebuffer import SampleRingBuffer
+
+NUM_CHANNELS = 6
+WINDOW_LEN = 201                #20 s at 10 Hz, the client's default
+SESSION_LENGTHS = [1000, 10000, 100000, 1000000]
+LIST_SESSION_LENGTHS = [1000, 10000, 30000]
+
+
+def benchRingBuffer(num_samples):
+    buf = SampleRingBuffer(int(WINDOW_LEN * 1.25) + 1, NUM_CHANNELS)
+    values = [1013.0, 23.0, 1014.0, 24.0, 1015.0, 25.0]
+
+    start = time.perf_counter()
+    for i in range(num_samples):
+        buf.append(i, values)
+
+        #the reversed view of the window the plot takes
+        buf.window(WINDOW_LEN)[1][:, ::-1]
+    elapsed = time.perf_counter() - start
+
+    return elapsed / num_samples
+
+
+def benchPrependList(num_samples):
+    y_data = [[] for _ in range(NUM_CHANNELS)]
+    values = [1013.0, 23.0, 1014.0, 24.0, 1015.0, 25.0]
+
+    start = time.perf_counter()
+    for i in range(num_samples):
+        for ch in range(NUM_CHANNELS):
+            y_data[ch] = [values[ch]] + y_data[ch]
+    elapsed = time.perf_counter() - start
+
+    return elapsed / num_samples
+
+
+def main():
+    print('SampleRingBuffer append + window view (%d channels, window %d):' % (NUM_CHANNELS, WINDOW_LEN))
+    for n in SESSION_LENGTHS:
+        print('    %9d samples: %8.2f us/sample' % (n, benchRingBuffer(n) * 1e6))
+
+    print('')
+    print('Prepend-to-list history (%d channels):' % NUM_CHANNELS)
+    for n in LIST_SESSION_LENGTHS:
+        print('    %9d samples: %8.2f us/sample' % (n, benchPrependList(n) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
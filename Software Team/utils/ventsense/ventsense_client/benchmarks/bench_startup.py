@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+# bench_startup.py
+# Helpful Engineering
+#
+# Purpose:
+# Startup benchmark for the ventsense client. Launches ventsense.py as a fresh process on simulated
+# sensor data (see simulator.py), and reports, for the logging-only (headless) and plot modes:
+#   - time from starting the process until the client reports that the serial port is open and
+#     logging has started
+#   - resident memory of the client process at that point
+#   - peak resident memory of the client process after it has been running for a while (by which
+#     time plot mode has loaded matplotlib and drawn its window)
+#
+# Usage:
+#     python bench_startup.py [--runs=<number>] [--duration=<seconds>] [--modes=headless,plot]
+#
+# Notes:
+# Every run uses a new process and a temporary working directory, so log files and settings.ini do
+# not end up in the working directory and settings from one run do not carry over to the next. The
+# median over all runs is reported. Plot mode uses matplotlib's non-interactive Agg backend.
+#
+# Memory at startup is read from /proc and is only reported on Linux. Peak memory is reported on
+# Linux and macOS.
+
+import getopt
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ventsense.py')
+
+#line the client prints once the serial port is open
+READY_MARKER = b'Listening on '
+
+MODES = ['headless', 'plot']
+
+DEFAULT_RUNS = 5
+DEFAULT_DURATION = 2.0
+
+SIM_URL = 'sim://?rate=100&seed=1'
+
+
+def median(values):
+    values = sorted(values)
+
+    if not values:
+        return float('nan')
+
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+
+    return (values[mid - 1] + values[mid]) / 2.0
+
+
+#current resident memory of a process in bytes, or None if it cannot be read
+def currentRss(pid):
+    try:
+        with open('/proc/' + str(pid) + '/status') as file:
+            for line in file:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+
+    return None
+
+
+#start the client once, wait until it is logging, let it run for 'duration' seconds and stop it
+def runOne(mode, duration):
+    work_dir = tempfile.mkdtemp(prefix='ventsense_bench_')
+
+    env = dict(os.environ)
+    env['MPLBACKEND'] = 'Agg'
+
+    cmd = [sys.executable, CLIENT, '-p', SIM_URL, '-d', str(mode == 'plot'), '-c', 'false']
+
+    try:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=subprocess.PIPE)
+
+        startup = None
+        for line in iter(proc.stdout.readline, b''):
+            if line.startswith(READY_MARKER):
+                startup = time.perf_counter() - start
+                break
+
+        if startup is None:
+            proc.wait()
+            raise RuntimeError('client exited before opening the serial port: ' + ' '.join(cmd))
+
+        startup_rss = currentRss(proc.pid)
+
+        time.sleep(duration)
+
+        #stop the client the same way a user would, with CTRL+C
+        if sys.platform == 'win32':
+            proc.terminate()
+        else:
+            proc.send_signal(signal.SIGINT)
+
+        proc.stdout.read()
+
+        peak_rss = None
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = status
+
+            #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        else:
+            proc.wait()
+
+        proc.stdout.close()
+
+        return startup, startup_rss, peak_rss
+
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def formatMb(values):
+    values = [v for v in values if v is not None]
+
+    if not values:
+        return '%10s' % 'n/a'
+
+    return '%10.1f' % (median(values) / 1e6)
+
+
+def printHelp():
+    print('usage: python bench_startup.py [--runs=<number>] [--duration=<seconds>] [--modes=headless,plot]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["runs=", "duration=", "modes="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    runs = DEFAULT_RUNS
+    duration = DEFAULT_DURATION
+    modes = MODES
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--runs':
+            runs = int(arg)
+        elif opt == '--duration':
+            duration = float(arg)
+        elif opt == '--modes':
+            modes = arg.split(',')
+
+    print('ventsense client startup benchmark: median of ' + str(runs) + ' runs, ' + str(duration) +
+          ' s each')
+    print('')
+    print('%-9s %12s %10s %10s' % ('mode', 'startup ms', 'start MB', 'peak MB'))
+
+    for mode in modes:
+        results = [runOne(mode, duration) for _ in range(runs)]
+
+        print('%-9s %12.0f %s %s' % (mode, median([r[0] for r in results]) * 1000.0,
+                                    formatMb([r[1] for r in results]), formatMb([r[2] for r in results])))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
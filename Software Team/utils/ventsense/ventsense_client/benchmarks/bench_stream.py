@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# bench_stream.py
+# Helpful Engineering
+#
+# Purpose:
+# Benchmark for the live sample stream (see stream.py). Publishes samples through a StreamServer on
+# loopback at a fixed rate, the way an acquisition thread in bulk ingest mode does, to an
+# increasing number of subscribers in another process, and reports for each number of subscribers:
+#   - the total rate at which samples were delivered to all subscribers (fan-out throughput), and
+#     the smallest share of the published samples any one subscriber received
+#   - the samples the server dropped for subscribers that did not keep up
+#   - latency percentiles from publishing a batch until a subscriber has received it
+#   - the longest a single publish call held up the publishing thread
+# With --stalled, that many extra subscribers connect but never read, to show that they only lose
+# their own samples.
+#
+# Usage:
+#     python bench_stream.py [--subscribers=1,10,50,100] [--rate=<samples/s>] [--duration=<seconds>]
+#                            [--batch=<samples>] [--buffer=<kB>] [--stalled=<number>]
+#
+# Notes:
+# The subscribers all run in one child process, reading their sockets through a selector, with
+# StreamSubscriber only counting the samples of each frame (not unpacking them), so the figures are
+# those of the server and the transport rather than of any one consumer. Latency is measured from
+# the timestamp of the newest sample of each frame received, which the benchmark sets to the time
+# the sample was published, so it has a resolution of 1 ms.
+
+import getopt
+import json
+import os
+import selectors
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import numpy as np
+
+from bench_client import percentile
+from stream import StreamServer, StreamSubscriber, StreamClosed, FRAME_SAMPLES, DEFAULT_BUFFER_BYTES
+
+DEFAULT_SUBSCRIBERS = [1, 10, 50, 100]
+DEFAULT_RATE = 10000.0      #samples/s, e.g. 100 devices at 100 Hz
+DEFAULT_DURATION = 5.0      #seconds
+DEFAULT_BATCH = 100         #samples per publish call
+
+FIELD_NAMES = ['timestamp', 'temp 1', 'press 1', 'temp 2', 'press 2', 'temp 3', 'press 3']
+
+PERCENTILES = [50, 99]
+
+#how long to wait for every subscriber to connect
+CONNECT_TIMEOUT = 30.0 #seconds
+
+
+#milliseconds since 'epoch' (a time.time()), as a millis() timestamp
+def millisSince(epoch):
+    return int((time.time() - epoch) * 1000.0) & 0xFFFFFFFF
+
+
+#runs inside the child process: connect the subscribers, read until the server closes the stream and write what each
+#one received to result_path
+def runChild(port, num_subscribers, num_stalled, epoch, result_path):
+    epoch = float(epoch)
+    selector = selectors.DefaultSelector()
+
+    subscribers = [StreamSubscriber('localhost', int(port), decode=False) for _ in range(int(num_subscribers))]
+    for subscriber in subscribers:
+        selector.register(subscriber.sock, selectors.EVENT_READ, subscriber)
+
+    #stalled subscribers connect with a small receive buffer, and never read
+    stalled = []
+    for _ in range(int(num_stalled)):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.connect(('localhost', int(port)))
+        stalled.append(sock)
+
+    latencies = []
+    num_open = len(subscribers)
+
+    while num_open:
+        for key, mask in selector.select():
+            subscriber = key.data
+
+            try:
+                frames = subscriber.receive()
+            except StreamClosed:
+                selector.unregister(subscriber.sock)
+                num_open -= 1
+                continue
+
+            now = millisSince(epoch)
+            for frame_type, device, data in frames:
+                if frame_type == FRAME_SAMPLES:
+                    latencies.append((now - subscriber.last_timestamps[device]) & 0xFFFFFFFF)
+
+    for sock in stalled:
+        sock.close()
+
+    with open(result_path, 'w') as file:
+        json.dump({'received': [subscriber.samples_received for subscriber in subscribers],
+                   'dropped': [subscriber.samples_dropped for subscriber in subscribers],
+                   'latencies': latencies}, file)
+
+
+#runs in the parent: publish 'rate' samples/s for 'duration' seconds to the subscribers of a child process
+def runOne(num_subscribers, num_stalled, rate, duration, batch, buffer_bytes):
+    work_dir = tempfile.mkdtemp(prefix='ventsense_bench_')
+    result_path = os.path.join(work_dir, 'result.json')
+
+    server = StreamServer(0, 'localhost', buffer_bytes)
+    publisher = server.publisher('bench')
+    server.start()
+
+    epoch = time.time()
+    proc = None
+
+    try:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', str(server.port), str(num_subscribers),
+               str(num_stalled), repr(epoch), result_path]
+        proc = subprocess.Popen(cmd, cwd=work_dir)
+
+        deadline = time.perf_counter() + CONNECT_TIMEOUT
+        while server.numSubscribers() < num_subscribers + num_stalled:
+            if (time.perf_counter() > deadline) or (proc.poll() is not None):
+                raise RuntimeError('subscribers did not connect: ' + ' '.join(cmd))
+            time.sleep(0.01)
+
+        publisher.setSchema(FIELD_NAMES)
+
+        values = np.tile(np.array([0.0, 23.5, 1013.2, 23.9, 1018.4, 24.0, 1018.3]), (batch, 1))
+        num_batches = int(rate * duration / batch)
+        longest = 0.0
+
+        start = time.perf_counter()
+        for idx in range(num_batches):
+            delay = start + idx * batch / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            samples = values.copy()
+            samples[:, 0] = millisSince(epoch)
+
+            t0 = time.perf_counter()
+            publisher.putMany(samples)
+            longest = max(longest, time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+
+        server.close()
+        proc.wait()
+
+        if not os.path.isfile(result_path):
+            raise RuntimeError('benchmark run failed: ' + ' '.join(cmd))
+
+        with open(result_path) as file:
+            result = json.load(file)
+
+        result['published'] = publisher.published
+        result['elapsed'] = elapsed
+        result['longest_publish'] = longest
+        result['dropped_total'] = server.samples_dropped
+        result['bytes_sent'] = server.bytes_sent
+        return result
+
+    finally:
+        server.close()
+        if (proc is not None) and (proc.poll() is None):
+            proc.kill()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def printHelp():
+    print('usage: python bench_stream.py [--subscribers=1,10,50,100] [--rate=<samples/s>] [--duration=<seconds>]\n' +
+          '                              [--batch=<samples>] [--buffer=<kB>] [--stalled=<number>]')
+
+
+def main(argv):
+    if argv and argv[0] == '--child':
+        runChild(*argv[1:])
+        return
+
+    try:
+        opts, args = getopt.getopt(argv, "h", ["subscribers=", "rate=", "duration=", "batch=", "buffer=", "stalled="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    subscriber_counts = DEFAULT_SUBSCRIBERS
+    rate = DEFAULT_RATE
+    duration = DEFAULT_DURATION
+    batch = DEFAULT_BATCH
+    buffer_bytes = DEFAULT_BUFFER_BYTES
+    num_stalled = 0
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--subscribers':
+            subscriber_counts = [int(n) for n in arg.split(',')]
+        elif opt == '--rate':
+            rate = float(arg)
+        elif opt == '--duration':
+            duration = float(arg)
+        elif opt == '--batch':
+            batch = int(arg)
+        elif opt == '--buffer':
+            buffer_bytes = int(float(arg) * 1024)
+        elif opt == '--stalled':
+            num_stalled = int(arg)
+
+    print('ventsense stream benchmark: ' + '{:g}'.format(rate) + ' samples/s in batches of ' + str(batch) + ' for ' +
+          '{:g}'.format(duration) + ' s, ' + str(buffer_bytes // 1024) + ' kB per subscriber' +
+          (', ' + str(num_stalled) + ' stalled subscribers' if num_stalled else ''))
+    print('')
+    print('%-12s %14s %10s %10s %9s %9s %14s %10s' %
+          ('subscribers', 'delivered/s', 'min share', 'dropped', 'p50 ms', 'p99 ms', 'max publish us', 'MB/s sent'))
+
+    for num_subscribers in subscriber_counts:
+        result = runOne(num_subscribers, num_stalled, rate, duration, batch, buffer_bytes)
+
+        published = float(max(result['published'], 1))
+        latencies = sorted(result['latencies'])
+
+        print('%-12d %14.0f %9.1f%% %10d %9.1f %9.1f %14.1f %10.2f' %
+              (num_subscribers, sum(result['received']) / result['elapsed'],
+               100.0 * min(result['received']) / published, result['dropped_total'],
+               percentile(latencies, PERCENTILES[0]), percentile(latencies, PERCENTILES[1]),
+               result['longest_publish'] * 1e6, result['bytes_sent'] / result['elapsed'] / 1e6))
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
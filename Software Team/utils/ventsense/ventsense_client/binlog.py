@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# binlog.py
+# Helpful Engineering
+#
+# Purpose:
+# Compact binary log format for the ventsense client (--log-format=bin), and a converter from
+# binary logs back to the usual ventsense CSV format, so existing tooling keeps working.
+#
+# Usage:
+#     python binlog.py <log file.bin> [<output file.csv>]
+#
+# If no output file is given, the CSV file is written next to the binary one, with the same name
+# and a .csv extension.
+#
+# Notes:
+# A binary log starts with a small self-describing header:
+#     magic       6 bytes    b'VSBLOG'
+#     version     uint8      currently 1
+#     reserved    uint8
+#     header_len  uint16     total header length in bytes, including the field list
+#     num_fields  uint16
+#     fields      utf-8      comma-separated "<name>:<numpy type>" entries, NUL padded
+# followed by fixed-width little-endian records, one per sample. Records written by the client
+# are a uint32 millis timestamp followed by float32 temperature and pressure for each sensor,
+# i.e. 28 bytes per sample for 3 sensors.
+#
+# Loading a binary log with loadBinLog() maps the file into memory with np.memmap, so there is no
+# parse step at all.
+
+import os
+import struct
+import sys
+
+import numpy as np
+
+MAGIC = b'VSBLOG'
+VERSION = 1
+PREFIX = struct.Struct('<6sBBHH')
+HEADER_ALIGN = 16
+
+BLOCK_SIZE = 65536 #bytes buffered before a write to disk
+
+#type of the first (timestamp) field and of every other field in records written by the client
+TIMESTAMP_TYPE = '<u4'
+VALUE_TYPE = '<f4'
+
+#number of records converted to CSV at a time
+CONVERT_CHUNK = 65536
+
+
+#record dtype used by the client for the given CSV column names
+def recordDtype(field_names):
+    return np.dtype([(field_names[0], TIMESTAMP_TYPE)] + [(name, VALUE_TYPE) for name in field_names[1:]])
+
+
+def _packHeader(dtype):
+    fields = ','.join(name + ':' + dtype.fields[name][0].str for name in dtype.names).encode('utf-8')
+
+    header_len = PREFIX.size + len(fields)
+    header_len += (-header_len) % HEADER_ALIGN
+
+    prefix = PREFIX.pack(MAGIC, VERSION, 0, header_len, len(dtype.names))
+
+    return (prefix + fields).ljust(header_len, b'\0')
+
+
+#read a binary log header from an open file. Returns (record dtype, header length)
+def readHeader(file):
+    prefix = file.read(PREFIX.size)
+
+    if len(prefix) < PREFIX.size:
+        raise ValueError('File is too short to be a ventsense binary log')
+
+    magic, version, _, header_len, num_fields = PREFIX.unpack(prefix)
+
+    if magic != MAGIC:
+        raise ValueError('Not a ventsense binary log')
+    if version != VERSION:
+        raise ValueError('Unsupported ventsense binary log version: ' + str(version))
+
+    fields = file.read(header_len - PREFIX.size).rstrip(b'\0').decode('utf-8').split(',')
+
+    if len(fields) != num_fields:
+        raise ValueError('Corrupt ventsense binary log header')
+
+    dtype = np.dtype([tuple(field.rsplit(':', 1)) for field in fields])
+
+    return dtype, header_len
+
+
+#header of a binary log of samples with the given CSV column names, as written by BinLogWriter
+def fileHeader(field_names):
+    return _packHeader(recordDtype(field_names))
+
+
+class BinLogWriter(object):
+    #writes samples to a new binary log file. 'field_names' are the CSV column names, timestamp first. 'file', if given,
+    #is an open binary file-like object to write the records to instead of creating 'path' (e.g. a logwriter.LogFile,
+    #which writes the header itself; see fileHeader())
+    binary = True
+
+    def __init__(self, path, field_names, block_size=BLOCK_SIZE, file=None):
+        self.path = path
+        self.dtype = recordDtype(field_names)
+        self.block_size = block_size
+        self.records_written = 0
+
+        self._struct = struct.Struct('<I' + 'f' * (len(field_names) - 1))
+        self._buf = bytearray()
+
+        if file is not None:
+            self._file = file
+        else:
+            self._file = open(path, 'wb')
+            self._file.write(_packHeader(self.dtype))
+
+    #add one sample, given as a sequence of numbers in column order
+    def writeSample(self, values):
+        self._buf += self._struct.pack(int(values[0]) & 0xFFFFFFFF, *values[1:])
+        self.records_written += 1
+
+        if len(self._buf) >= self.block_size:
+            self.flush()
+
+    #add a batch of samples, given as a 2-D array with one row per sample, in column order
+    def writeRecords(self, values):
+        values = np.asarray(values)
+        records = np.empty(values.shape[0], dtype=self.dtype)
+
+        for idx, name in enumerate(self.dtype.names):
+            records[name] = values[:, idx]
+
+        self._buf += records.tobytes()
+        self.records_written += values.shape[0]
+
+        if len(self._buf) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if self._buf:
+            self._file.write(self._buf)
+            del self._buf[:]
+
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+#return the records of a binary log as a structured array. With mmap=True the array is a read-only
+#memory map of the file, so even very large logs load instantly
+def loadBinLog(path, mmap=True):
+    with open(path, 'rb') as file:
+        dtype, header_len = readHeader(file)
+
+        if not mmap:
+            return np.fromfile(file, dtype=dtype)
+
+    num_records = (os.path.getsize(path) - header_len) // dtype.itemsize
+
+    if num_records == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=header_len, shape=(num_records,))
+
+
+#convert a binary log to CSV, a chunk of records at a time, so files of any size can be converted
+#in constant memory. Returns the number of records converted
+def convertToCsv(bin_path, csv_path):
+    num_records = 0
+
+    with open(bin_path, 'rb') as src, open(csv_path, 'w', newline='') as dst:
+        dtype, _ = readHeader(src)
+
+        #match the firmware's formatting: integer timestamp, values with two decimals
+        fmt = ['%d'] + ['%.2f'] * (len(dtype.names) - 1)
+
+        dst.write(','.join(dtype.names) + '\n')
+
+        while True:
+            data = src.read(dtype.itemsize * CONVERT_CHUNK)
+            count = len(data) // dtype.itemsize
+
+            if count == 0:
+                break
+
+            records = np.frombuffer(data, dtype=dtype, count=count)
+            columns = np.column_stack([records[name].astype(np.float64) for name in dtype.names])
+            np.savetxt(dst, columns, fmt=fmt, delimiter=',')
+
+            num_records += count
+
+    return num_records
+
+
+def main(argv):
+    if len(argv) < 1:
+        print('usage: python binlog.py <log file.bin> [<output file.csv>]')
+        sys.exit(2)
+
+    bin_path = argv[0]
+
+    if len(argv) > 1:
+        csv_path = argv[1]
+    else:
+        csv_path = os.path.splitext(bin_path)[0] + '.csv'
+
+    num_records = convertToCsv(bin_path, csv_path)
+    print('Wrote ' + str(num_records) + ' samples to ' + csv_path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+# breath.py
+# Helpful Engineering
+#
+# Purpose:
+# Streaming breath-cycle analysis for the ventsense client. Splits the airway pressure (the
+# pressure of one sensor relative to the atmospheric sensor) into breaths as the samples arrive,
+# and reports for every breath:
+#     pip        peak inspiratory pressure
+#     peep       positive end-expiratory pressure
+#     plateau    mean pressure over the last PLATEAU_TIME of inspiration
+#     rate       respiratory rate, from the length of the breath (breaths per minute)
+#     ie_ratio   expiratory time divided by inspiratory time (i.e. 2.0 means I:E = 1:2)
+# and, if a flow sensor pair is given (see flow.py):
+#     vt         tidal volume, i.e. the inspired volume corrected for drift (mL)
+#     vti        inspired volume, as measured (mL)
+#     vte        expired volume, as measured (mL)
+# Pressures are in the units the client is set to (hPa or cmH2O).
+#
+# A breath runs from the start of one inspiration to the start of the next, and is reported as soon
+# as the pressure has risen halfway into the next breath, i.e. within a few samples of its end.
+#
+# Notes:
+# A breath is detected when the pressure rises above a threshold halfway between the previous
+# breath's PEEP and PIP (plus some hysteresis), and its expiration when it falls below it (minus
+# the hysteresis). PEEP is the mean pressure over the last END_EXPIRATION_TIME of expiration.
+# Until the first breaths have been seen, the thresholds are learnt from the range of the pressure,
+# which must span at least min_amplitude to count as breathing. If no breath has been seen for
+# max_breath_time seconds (e.g. the circuit was disconnected), the thresholds are learnt again.
+#
+# The volumes come from the running integral of the flow, where the flow changes direction: its
+# lowest point before the breath, its highest point during inspiration and its lowest point during
+# expiration. A flow sensor's zero offset makes that integral
+# drift. Over a whole breath, the air that goes in comes back out, so whatever volume is left over
+# at the end of the breath is drift. The tidal volume is corrected for it, on the assumption that
+# the drift is steady through the breath.
+#
+# BreathDetector keeps a fixed amount of state and does a fixed amount of work per sample (plus two
+# short scans of a fixed-size sample history once per breath), so it keeps up with the full sample
+# rate on the acquisition thread.
+
+import collections
+
+from channels import PRESS_IDX
+from flow import FlowChannels, VolumeIntegrator
+
+BREATH_CSV_HEADER = 'start,end,pip,peep,plateau,rate,ie_ratio,insp_time,exp_time,vt,vti,vte'
+
+DEFAULT_MIN_AMPLITUDE = 2.0     #minimum PIP - PEEP for a breath
+DEFAULT_HYSTERESIS = 0.1        #fraction of PIP - PEEP
+PLATEAU_TIME = 0.1              #seconds
+END_EXPIRATION_TIME = 0.2       #seconds, averaged for PEEP
+MAX_BREATH_TIME = 20.0          #seconds
+HISTORY_LEN = 1024              #samples kept for the plateau and PEEP calculations
+
+#detector phases
+PHASE_LEARN = 0
+PHASE_INSP = 1
+PHASE_EXP = 2
+
+#'start' and 'end' are device timestamps (ms), times are in seconds. The volumes are None without flow
+BreathRecord = collections.namedtuple('BreathRecord', ['start', 'end', 'pip', 'peep', 'plateau', 'rate', 'ie_ratio',
+                                                       'insp_time', 'exp_time', 'vt', 'vti', 'vte'])
+
+
+#one line summary of a breath, for the console and the plot
+def formatBreath(breath, units_str):
+    text = ('PIP {:.1f}, PEEP {:.1f}, plateau {:.1f} {}, rate {:.1f}/min, I:E 1:{:.1f}'.format(
+            breath.pip, breath.peep, breath.plateau, units_str, breath.rate, breath.ie_ratio))
+
+    if breath.vt is not None:
+        text += ', VT {:.0f} mL'.format(breath.vt)
+
+    return text
+
+
+#breath as a line of the breath CSV file (see BREATH_CSV_HEADER). Volumes are left empty without flow
+def breathCsvLine(breath):
+    line = ('{:d},{:d},{:.2f},{:.2f},{:.2f},{:.2f},{:.2f},{:.3f},{:.3f}'.format(
+            int(breath.start), int(breath.end), breath.pip, breath.peep, breath.plateau, breath.rate,
+            breath.ie_ratio, breath.insp_time, breath.exp_time))
+
+    if breath.vt is not None:
+        line += ',{:.1f},{:.1f},{:.1f}'.format(breath.vt, breath.vti, breath.vte)
+    else:
+        line += ',,,'
+
+    return line
+
+
+class BreathDetector(object):
+    def __init__(self, min_amplitude=DEFAULT_MIN_AMPLITUDE, hysteresis=DEFAULT_HYSTERESIS,
+                 max_breath_time=MAX_BREATH_TIME):
+        self.min_amplitude = min_amplitude
+        self.hysteresis = hysteresis
+        self.max_breath_time = max_breath_time
+
+        self.breaths_detected = 0
+
+        self._history = collections.deque(maxlen=HISTORY_LEN)
+        self.reset()
+
+    #forget everything, e.g. when the Arduino resets and its timestamps start over
+    def reset(self):
+        self._history.clear()
+        self._last_t = None
+        self._v = None
+        self._learn()
+
+    #start learning the thresholds from the range of the pressure
+    def _learn(self):
+        self._phase = PHASE_LEARN
+        self._phase_start = self._last_t
+        self._low = None
+        self._high = None
+        self._breath_start = None
+
+    #thresholds for the next breath. The phases switch at the rise/fall levels, around the middle of the
+    #pressure swing. The breath itself is timed from the last sample near PEEP (below the base level) to the last
+    #sample near PIP (above the top level) and on to the next breath, so that a slow rise or fall does not skew
+    #the I:E ratio
+    def _setLevels(self, peep, pip):
+        amplitude = pip - peep
+        self._rise_level = peep + amplitude * (0.5 + self.hysteresis)
+        self._fall_level = peep + amplitude * (0.5 - self.hysteresis)
+        self._base_level = peep + amplitude * self.hysteresis
+        self._top_level = pip - amplitude * self.hysteresis
+
+    #add one sample: device timestamp in ms, airway pressure and, if there is a flow sensor, the running integral
+    #of the flow in mL. Returns a BreathRecord when the sample starts the next breath (i.e. completes one), else None
+    def update(self, t, p, v=None):
+        t = t / 1000.0
+
+        #timestamps going backwards mean that the Arduino has reset
+        if (self._last_t is not None) and (t < self._last_t):
+            self.reset()
+
+        self._last_t = t
+        self._v = v
+        self._history.append((t, p))
+
+        if self._phase_start is None:
+            self._phase_start = t
+
+        breath = None
+
+        if self._phase == PHASE_INSP:
+            if p > self._insp_max:
+                self._insp_max = p
+            if p >= self._top_level:
+                self._insp_end = t
+            if (v is not None) and ((self._v_insp_max is None) or (v > self._v_insp_max)):
+                self._v_insp_max = v
+
+            if p < self._fall_level:
+                self._startExpiration(t)
+
+        elif self._phase == PHASE_EXP:
+            if p > self._rise_level:
+                breath = self._endBreath(t)
+                self._startInspiration(t, p)
+            else:
+                #while learning, the thresholds follow the pressure down to the end of the first expiration
+                if (self._breath_start is None) and (p < self._low):
+                    self._low = p
+                    self._setLevels(self._low, self._high)
+
+                if p <= self._base_level:
+                    self._exp_end = t
+                if (v is not None) and ((self._v_exp_min is None) or (v < self._v_exp_min)):
+                    self._v_exp_min = v
+
+        else:
+            #learning: wait for the pressure to span min_amplitude, then for the start of an expiration. The first
+            #breath is not reported, as its start was not seen
+            if (self._low is None) or (p < self._low):
+                self._low = p
+            if (self._high is None) or (p > self._high):
+                self._high = p
+
+            if self._high - self._low >= self.min_amplitude:
+                self._setLevels(self._low, self._high)
+
+                if p < self._fall_level:
+                    self._startExpiration(t)
+
+        if (self._phase != PHASE_LEARN) and (t - self._phase_start > self.max_breath_time):
+            self._learn()
+
+        return breath
+
+    def _startInspiration(self, t, p):
+        #the breath started at the last sample near PEEP (if the pressure got there at all)
+        self._breath_start = self._exp_end if self._exp_end is not None else t
+        self._v_start = self._v_exp_min
+        self._v_insp_max = self._v
+        self._phase = PHASE_INSP
+        self._phase_start = t
+        self._insp_max = p
+        self._insp_end = None
+
+    def _startExpiration(self, t):
+        self._phase = PHASE_EXP
+        self._phase_start = t
+        self._exp_end = None
+        self._v_exp_min = self._v
+
+        if self._breath_start is not None:
+            #inspiration ended at the last sample near PIP
+            if self._insp_end is None:
+                self._insp_end = t
+
+            self._plateau = self._meanPressure(max(self._insp_end - PLATEAU_TIME, self._breath_start), self._insp_end)
+
+    #mean pressure of the samples in the history from time 'start' to 'end' (inclusive), or None if there are none.
+    #Scans back from the newest sample, so it only looks at samples from 'start' onwards
+    def _meanPressure(self, start, end):
+        total = 0.0
+        count = 0
+
+        for t, p in reversed(self._history):
+            if t < start:
+                break
+            if t <= end:
+                total += p
+                count += 1
+
+        return total / count if count else None
+
+    def _endBreath(self, t):
+        if self._breath_start is None:
+            #end of a breath whose start was not seen
+            return None
+
+        exp_end = self._exp_end if self._exp_end is not None else t
+        insp_time = self._insp_end - self._breath_start
+        exp_time = exp_end - self._insp_end
+        pip = self._insp_max
+        peep = self._meanPressure(max(exp_end - END_EXPIRATION_TIME, self._insp_end), exp_end)
+
+        if (peep is None) or (pip - peep < self.min_amplitude) or (insp_time <= 0) or (exp_time <= 0):
+            self._learn()
+            return None
+
+        self._setLevels(peep, pip)
+        self.breaths_detected += 1
+
+        plateau = self._plateau if self._plateau is not None else pip
+
+        vt = None
+        vti = None
+        vte = None
+        if (self._v_start is not None) and (self._v_insp_max is not None) and (self._v_exp_min is not None):
+            vti = self._v_insp_max - self._v_start
+            vte = self._v_insp_max - self._v_exp_min
+
+            #remove the part of the inspired volume due to drift, i.e. the share of the breath's net volume
+            #that built up during inspiration
+            drift = (self._v_exp_min - self._v_start) / (exp_end - self._breath_start)
+            vt = vti - drift * insp_time
+
+        return BreathRecord(self._breath_start * 1000.0, exp_end * 1000.0, pip, peep, plateau,
+                            60.0 / (exp_end - self._breath_start), exp_time / insp_time, insp_time, exp_time,
+                            vt, vti, vte)
+
+
+class BreathAnalyzer(object):
+    #runs a BreathDetector on the pressure of 'sensor' relative to 'atmospheric_sensor' (sensor numbers of the
+    #channel schema, from 0), scaled by 'scale' (e.g. to convert hPa to cmH2O). If 'flow_pair' (an (upstream,
+    #downstream) pair of sensor numbers, see flow.py) is given, the flow through it, with 'flow_calibration', is
+    #used for the breath volumes. Every breath is written to 'breath_log' (a text file, if given), echoed with
+    #'echo' (a function taking a line of text, if given), and kept in 'recent' for the plot
+    def __init__(self, sensor, atmospheric_sensor, scale=1.0, units_str='hPa', breath_log=None, echo=None,
+                 detector=None, flow_pair=None, flow_calibration=None):
+        self.sensor = sensor
+        self.atmospheric_sensor = atmospheric_sensor
+        self.flow_pair = flow_pair
+        self.flow_calibration = flow_calibration
+        self.scale = scale
+        self.units_str = units_str
+        self.breath_log = breath_log
+        self.echo = echo
+        self.detector = detector if detector is not None else BreathDetector()
+
+        #newest breaths, for the render loop to pick up with takeRecent()
+        self.recent = collections.deque(maxlen=16)
+
+        self._columns = None
+        self._flows = None
+        self._volume = VolumeIntegrator(1)
+
+        if self.breath_log is not None:
+            self.breath_log.write(BREATH_CSV_HEADER + '\n')
+
+    #look up the columns to analyze in a ChannelSchema. Analysis is paused while the schema does not have
+    #the sensors
+    def setSchema(self, schema):
+        if max(self.sensor, self.atmospheric_sensor) < schema.num_sensors:
+            self._columns = (schema.channel(self.sensor, PRESS_IDX) + 1,
+                             schema.channel(self.atmospheric_sensor, PRESS_IDX) + 1)
+        else:
+            self._columns = None
+
+        self._flows = None
+        if self.flow_pair is not None:
+            flows = FlowChannels(schema, [self.flow_pair], self.flow_calibration)
+
+            if flows.num_flows > 0:
+                self._flows = flows
+
+        self.reset()
+
+    def reset(self):
+        self.detector.reset()
+        self._volume.reset()
+
+    #add one parsed sample (timestamp first, in column order)
+    def addSample(self, sample):
+        if self._columns is None:
+            return
+
+        v = None
+        if self._flows is not None:
+            v = self._volume.add(sample[0], self._flows.computeSample(sample))[0]
+
+        breath = self.detector.update(sample[0], (sample[self._columns[0]] - sample[self._columns[1]]) * self.scale, v)
+
+        if breath is not None:
+            self._report(breath)
+
+    #add a batch of parsed samples, given as a 2-D NumPy array with one row per sample
+    def addSamples(self, values):
+        if self._columns is None:
+            return
+
+        times = values[:, 0].tolist()
+        pressures = ((values[:, self._columns[0]] - values[:, self._columns[1]]) * self.scale).tolist()
+
+        if self._flows is not None:
+            volumes = self._volume.integrate(values[:, 0], self._flows.compute(values[:, 1:].T))[0].tolist()
+        else:
+            volumes = [None] * len(times)
+
+        update = self.detector.update
+        for t, p, v in zip(times, pressures, volumes):
+            breath = update(t, p, v)
+
+            if breath is not None:
+                self._report(breath)
+
+    #return the breaths reported since the last call, oldest first
+    def takeRecent(self):
+        breaths = []
+
+        try:
+            for _ in range(len(self.recent)):
+                breaths.append(self.recent.popleft())
+        except IndexError:
+            pass
+
+        return breaths
+
+    def _report(self, breath):
+        self.recent.append(breath)
+
+        if self.breath_log is not None:
+            self.breath_log.write(breathCsvLine(breath) + '\n')
+            self.breath_log.flush()
+
+        if self.echo is not None:
+            self.echo('Breath ' + str(self.detector.breaths_detected) + ': ' + formatBreath(breath, self.units_str) + '\n')
+
+    def close(self):
+        if self.breath_log is not None:
+            self.breath_log.close()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# channels.py
+# Helpful Engineering
+#
+# Purpose:
+# Channel schema of the ventsense serial data, i.e. which column of a serial line holds which
+# sensor's temperature or pressure. The firmware announces the columns in the header line it prints
+# at startup (e.g. "timestamp,temp 1,press 1,temp 2,press 2,temp 3,press 3"), so the client takes
+# the schema from that line when it sees it. Until then (e.g. when the client starts listening
+# while the Arduino is already running) it assumes the firmware's default layout for a configured
+# number of sensors.
+#
+# Notes:
+# The first column is always the timestamp. The remaining columns are the "channels", numbered
+# from 0 in column order. A sensor is a pair of "temp <id>" and "press <id>" columns with the same
+# <id>; sensors are numbered from 0 in the order they first appear. Any other columns are kept
+# (and logged) but are not part of a sensor.
+
+import re
+
+DEFAULT_NUM_SENSORS = 3
+MAX_NUM_SENSORS = 32
+
+TEMP_IDX = 0
+PRESS_IDX = 1
+
+#column name prefixes for each kind of value, indexed by TEMP_IDX/PRESS_IDX
+KIND_PREFIXES = ['temp', 'press']
+
+_COLUMN_RE = re.compile(r'^(temp|press)[a-z]*\s*(.*)$', re.IGNORECASE)
+
+
+class ChannelSchema(object):
+    #'field_names' are the column names of a serial line, timestamp first
+    def __init__(self, field_names):
+        field_names = [name.strip() for name in field_names]
+
+        if len(field_names) < 2:
+            raise ValueError('Channel schema needs a timestamp and at least one channel')
+
+        self.field_names = field_names
+        self.channel_names = field_names[1:]
+        self.num_fields = len(field_names)
+        self.num_channels = len(self.channel_names)
+
+        #group the temperature and pressure columns by sensor id
+        sensor_ids = []
+        columns = {}
+
+        for ch, name in enumerate(self.channel_names):
+            match = _COLUMN_RE.match(name)
+            if not match:
+                continue
+
+            kind = KIND_PREFIXES.index(match.group(1).lower())
+            sensor_id = match.group(2).strip()
+
+            if sensor_id not in columns:
+                sensor_ids.append(sensor_id)
+                columns[sensor_id] = [None, None]
+
+            if columns[sensor_id][kind] is None:
+                columns[sensor_id][kind] = ch
+
+        self.sensor_ids = [sid for sid in sensor_ids if None not in columns[sid]]
+        self.num_sensors = len(self.sensor_ids)
+
+        if self.num_sensors == 0:
+            raise ValueError('No sensors (temp/press column pairs) in: ' + ','.join(field_names))
+
+        if self.num_sensors > MAX_NUM_SENSORS:
+            raise ValueError('Too many sensors: ' + str(self.num_sensors))
+
+        #channel numbers of each sensor's values, indexed by [TEMP_IDX/PRESS_IDX][sensor]
+        self.kind_channels = [[columns[sid][kind] for sid in self.sensor_ids] for kind in (TEMP_IDX, PRESS_IDX)]
+        self.temp_channels = self.kind_channels[TEMP_IDX]
+        self.press_channels = self.kind_channels[PRESS_IDX]
+
+    #header line for this schema, as the firmware prints it
+    def header(self):
+        return ','.join(self.field_names)
+
+    #channel number of a sensor's temperature (TEMP_IDX) or pressure (PRESS_IDX) value
+    def channel(self, sensor, kind):
+        return self.kind_channels[kind][sensor]
+
+    #name of a sensor's temperature or pressure column, e.g. "press 2"
+    def channelName(self, sensor, kind):
+        return self.channel_names[self.channel(sensor, kind)]
+
+    #the id the firmware uses for a sensor, e.g. "2"
+    def sensorLabel(self, sensor):
+        return self.sensor_ids[sensor]
+
+    #schema of the firmware's default layout for the given number of sensors
+    @classmethod
+    def forSensors(cls, num_sensors):
+        num_sensors = int(num_sensors)
+
+        if (num_sensors < 1) or (num_sensors > MAX_NUM_SENSORS):
+            raise ValueError('Number of sensors must be between 1 and ' + str(MAX_NUM_SENSORS))
+
+        names = ['timestamp']
+        for j in range(num_sensors):
+            names.append('temp ' + str(j + 1))
+            names.append('press ' + str(j + 1))
+
+        return cls(names)
+
+    #schema from a header line (str or bytes)
+    @classmethod
+    def fromHeader(cls, line):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'ignore')
+
+        return cls(line.strip().split(','))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+# decimate.py
+# Helpful Engineering
+#
+# Purpose:
+# Display decimation for long plot windows. With a wide --x-width, the visible window holds many
+# more samples than the plot is pixels wide, and drawing every one of them makes every frame slow.
+# MinMaxDecimator keeps the minimum and maximum of each channel over every bucket of bucket_len
+# samples, along with the bucket's first and last samples, updated as samples arrive, and hands the
+# plot just those four points per bucket. With one bucket per pixel column, the lines look the same
+# as if every sample were drawn (every spike still reaches its peak, and the lines between buckets
+# join up as they would), but the cost of drawing them depends on the width of the plot rather
+# than on the length of the window.
+#
+# Notes:
+# Buckets are aligned to the sample count, not to the newest sample, so a bucket's points do not
+# change once it is full, and the lines do not flicker as the plot scrolls. The points of a bucket
+# are drawn in the order their samples arrived, each at its own sample's position, so the line
+# still goes through real samples. The oldest bucket can reach up to bucket_len - 1 samples further
+# back than the window, i.e. just past the edge of the plot.
+#
+# Bucket summaries are kept in a ring, like the blocks of windowminmax.py. The whole buckets of a
+# batch are summarized with NumPy in one step; only the partly filled buckets at either end of a
+# batch are handled on their own. NaN values (failed sensor readings) are left out of the min and
+# max; a bucket that only holds NaN values gives NaN points, i.e. a gap in the line, as it would
+# without decimation.
+
+import numpy as np
+
+
+class MinMaxDecimator(object):
+    #min/max envelope of each of 'num_channels' channels over the newest 'window_len' samples, in buckets of
+    #'bucket_len' samples
+    def __init__(self, num_channels, window_len, bucket_len):
+        if window_len < 1:
+            raise ValueError('window_len must be at least 1')
+
+        self.num_channels = int(num_channels)
+        self.window_len = int(window_len)
+        self.bucket_len = max(1, int(bucket_len))
+
+        #enough buckets to cover the window wherever it starts within a bucket
+        self.num_buckets = -(-self.window_len // self.bucket_len) + 1
+
+        shape = (self.num_channels, self.num_buckets)
+        self._min = np.zeros(shape, dtype=np.float64)
+        self._max = np.zeros(shape, dtype=np.float64)
+        self._min_pos = np.zeros(shape, dtype=np.int64)
+        self._max_pos = np.zeros(shape, dtype=np.int64)
+        self._first = np.zeros(shape, dtype=np.float64)
+        self._first_pos = np.zeros(self.num_buckets, dtype=np.int64)
+        self._last = np.zeros(shape, dtype=np.float64)
+
+        self.total = 0      #number of samples appended since creation/clear
+        self._start = 0     #value of total at the last clear
+
+    #forget all samples. 'total' is the sample count to carry on from, e.g. to start from the middle of a stream and
+    #keep its buckets aligned with another decimator's
+    def clear(self, total=0):
+        self.total = int(total)
+        self._start = self.total
+
+    #add a batch of samples. 'values' has shape (num_channels, n), oldest sample first
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = values.shape[1]
+
+        if n == 0:
+            return
+
+        b_len = self.bucket_len
+        end = self.total + n
+
+        #only the buckets that can still be in the window matter. Skip the rest, starting at a bucket boundary
+        first = max((end - 1) // b_len - self.num_buckets + 1, 0) * b_len
+        if first > self.total:
+            values = values[:, first - self.total:]
+            self.total = first
+
+        done = 0
+        n = values.shape[1]
+
+        while done < n:
+            offset = self.total % b_len
+            bucket = self.total // b_len
+
+            #a bucket is started afresh at its first sample, or at the first sample after a clear
+            fresh = (offset == 0) or (self.total == self._start)
+
+            if offset == 0:
+                #as many whole buckets as there are, else the start of a new one
+                m = (n - done) // b_len
+                length = b_len if m else n - done
+                m = max(m, 1)
+            else:
+                #the rest of a bucket started by an earlier batch
+                m = 1
+                length = min(n - done, b_len - offset)
+
+            chunk = values[:, done:done + m * length].reshape(self.num_channels, m, length)
+            slots = np.arange(bucket, bucket + m) % self.num_buckets
+
+            low = np.where(np.isnan(chunk), np.inf, chunk)
+            high = np.where(np.isnan(chunk), -np.inf, chunk)
+            starts = self.total + np.arange(m) * length
+
+            chunk_min = low.min(axis=2)
+            chunk_max = high.max(axis=2)
+            chunk_min_pos = starts + low.argmin(axis=2)
+            chunk_max_pos = starts + high.argmax(axis=2)
+
+            if fresh:
+                self._min[:, slots] = chunk_min
+                self._max[:, slots] = chunk_max
+                self._min_pos[:, slots] = chunk_min_pos
+                self._max_pos[:, slots] = chunk_max_pos
+                self._first[:, slots] = chunk[:, :, 0]
+                self._first_pos[slots] = starts
+            else:
+                #the earlier sample is kept on a tie
+                slot = slots[0]
+                lower = chunk_min[:, 0] < self._min[:, slot]
+                higher = chunk_max[:, 0] > self._max[:, slot]
+
+                self._min[lower, slot] = chunk_min[lower, 0]
+                self._min_pos[lower, slot] = chunk_min_pos[lower, 0]
+                self._max[higher, slot] = chunk_max[higher, 0]
+                self._max_pos[higher, slot] = chunk_max_pos[higher, 0]
+
+            self._last[:, slots] = chunk[:, :, -1]
+
+            self.total += m * length
+            done += m * length
+
+    #return (ages, values), the envelope of 'values' (shape (channels, n), oldest sample first), taken to be the newest
+    #n samples of the stream this decimator has been fed, in the same buckets. For a series that cannot be decimated as
+    #it arrives because it changes after the fact (like the client's breath volumes, which start over at breath starts
+    #found a little later), at the cost of going through all of 'values'
+    def envelopeOf(self, values):
+        values = np.asarray(values, dtype=np.float64)
+
+        decimator = MinMaxDecimator(values.shape[0], self.window_len, self.bucket_len)
+        decimator.clear(self.total - values.shape[1])
+        decimator.extend(values)
+
+        return decimator.envelope()
+
+    #return (ages, values), the envelope of the newest n samples (all of the window if n is None). Both have shape
+    #(num_channels, 4 * number of buckets), four points per bucket, newest first. 'ages' are the number of samples
+    #between each point and the newest sample (0 for the newest), so that each channel can be plotted against its
+    #own ages, like the client plots the full window against sample age
+    def envelope(self, n=None):
+        if (n is None) or (n > self.window_len):
+            n = self.window_len
+        n = min(n, self.total - self._start)
+
+        if n == 0:
+            empty = np.zeros((self.num_channels, 0))
+            return empty.astype(np.int64), empty
+
+        last = (self.total - 1) // self.bucket_len
+        first = (self.total - n) // self.bucket_len
+        slots = np.arange(last, first - 1, -1) % self.num_buckets
+
+        mins = self._min[:, slots]
+        maxs = self._max[:, slots]
+        min_pos = self._min_pos[:, slots]
+        max_pos = self._max_pos[:, slots]
+
+        #newest point of each bucket first: its last sample, the newer and the older of its min and max, its first
+        #sample
+        max_newer = max_pos >= min_pos
+
+        ages = np.empty((self.num_channels, 4 * len(slots)), dtype=np.int64)
+        ages[:, 0::4] = np.minimum((self._first_pos[slots] // self.bucket_len + 1) * self.bucket_len, self.total) - 1
+        ages[:, 1::4] = np.maximum(min_pos, max_pos)
+        ages[:, 2::4] = np.minimum(min_pos, max_pos)
+        ages[:, 3::4] = self._first_pos[slots]
+        ages = (self.total - 1) - ages
+
+        values = np.empty((self.num_channels, 4 * len(slots)), dtype=np.float64)
+        values[:, 0::4] = self._last[:, slots]
+        values[:, 1::4] = np.where(max_newer, maxs, mins)
+        values[:, 2::4] = np.where(max_newer, mins, maxs)
+        values[:, 3::4] = self._first[:, slots]
+
+        #only NaN values in the bucket
+        values[np.isinf(values)] = np.nan
+
+        return ages, values
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+# filters.py
+# Helpful Engineering
+#
+# Purpose:
+# Noise filters for the ventsense client, applied to the parsed samples on the acquisition thread,
+# so that the plot, flow and breath analysis all see the filtered values. The log files (and the
+# stream server and alarms) keep the raw values. The filters are:
+#     median:<channels>:<width>     moving median of the last <width> samples (removes spikes)
+#     lowpass:<channels>:<Hz>       one-pole IIR low-pass filter with a cutoff of <Hz>
+#     biquad:<channels>:<Hz>        second-order Butterworth IIR low-pass filter with a cutoff of <Hz>
+#     decimate:<factor>             FIR low-pass (anti-aliasing) filter of every channel, keeping one
+#                                   sample in <factor>
+# where <channels> is one or more of p (every pressure), t (every temperature), p<sensor> or
+# t<sensor> (one sensor's pressure or temperature, the sensor ID counted from 1 in the order of the
+# channel schema, as for the -a option) or all (every channel), joined with +. Several filters are
+# separated by commas and applied in order, e.g. "median:p:5,biquad:p2+p3:8,decimate:2".
+#
+# Notes:
+# Every filter keeps its state (the samples or outputs it still needs) from one call to the next,
+# so a stream of samples is filtered the same whether it is given one sample at a time or in blocks
+# of any size. Each filter has a NumPy version for blocks of samples (process()), used by bulk
+# ingest, and a pure Python version for single samples (processSample()), used by line ingest, which
+# does not otherwise need NumPy. The two give the same results, to within rounding (see
+# benchmarks/bench_filters.py).
+#
+# The IIR filters are recursive, so they cannot be vectorized sample by sample. For a block, the
+# output is instead the sum of the filter's response to the block's samples (a lower triangular
+# matrix of its impulse response) and its response to the state carried over from the previous
+# block, computed IIR_BLOCK samples at a time with two matrix products.
+#
+# A filter starts out in the steady state of the first sample it is given (as if every earlier
+# sample had had the same value), so it does not ramp up from zero, and starts over that way when
+# the Arduino resets.
+#
+# The IIR cutoffs are relative to the sample rate, which is measured from the timestamps (see
+# timing.py). Until it is known the filters are designed for DEFAULT_SAMPLE_RATE, and they are
+# designed again, keeping their state, whenever it changes by more than RATE_TOLERANCE.
+#
+# All the filters are causal, so they delay the signal: a median by about half its width, a
+# low-pass filter by about 1/(2*pi*cutoff) seconds, and decimate by (FIR_TAPS_PER_FACTOR * factor) / 2
+# samples.
+
+import math
+
+FILTER_MEDIAN = 'median'
+FILTER_LOWPASS = 'lowpass'
+FILTER_BIQUAD = 'biquad'
+FILTER_DECIMATE = 'decimate'
+FILTER_KINDS = [FILTER_MEDIAN, FILTER_LOWPASS, FILTER_BIQUAD, FILTER_DECIMATE]
+
+CHANNELS_ALL = 'all'
+CHANNEL_PREFIXES = ['t', 'p']   #indexed by TEMP_IDX/PRESS_IDX
+
+MAX_MEDIAN_WIDTH = 101          #samples
+MAX_DECIMATION = 100
+
+#sample rate the IIR filters are designed for until it has been measured
+DEFAULT_SAMPLE_RATE = 10.0 #Hz
+
+#the IIR filters are designed again when the measured sample rate changes by more than this fraction
+RATE_TOLERANCE = 0.1
+
+#IIR cutoffs are limited to this fraction of the sample rate (just below the Nyquist frequency)
+MAX_CUTOFF_FRACTION = 0.45
+
+#number of samples of a block the IIR filters compute with one matrix product
+IIR_BLOCK = 64
+
+#length of the decimation FIR filter, per unit of decimation factor
+FIR_TAPS_PER_FACTOR = 8
+
+
+class FilterSpec(object):
+    #one filter (see above). 'param' is the median width, the cutoff (Hz) or the decimation factor. 'channels' is a list
+    #of (kind, sensor) selectors: kind is TEMP_IDX, PRESS_IDX or None for every channel, sensor a sensor number from 0 or
+    #None for every sensor. Decimation applies to every channel, so it has no channels
+    def __init__(self, kind, param, channels=None):
+        if kind not in FILTER_KINDS:
+            raise ValueError('Unknown filter: ' + str(kind))
+
+        if (kind == FILTER_DECIMATE) != (channels is None):
+            raise ValueError('Only decimation applies to every channel')
+
+        if kind == FILTER_MEDIAN:
+            if (param != int(param)) or not (1 <= param <= MAX_MEDIAN_WIDTH):
+                raise ValueError('Median width must be between 1 and ' + str(MAX_MEDIAN_WIDTH))
+            param = int(param)
+        elif kind == FILTER_DECIMATE:
+            if (param != int(param)) or not (2 <= param <= MAX_DECIMATION):
+                raise ValueError('Decimation factor must be between 2 and ' + str(MAX_DECIMATION))
+            param = int(param)
+        elif param <= 0:
+            raise ValueError('Cutoff must be greater than 0')
+
+        self.kind = kind
+        self.param = param
+        self.channels = channels
+
+    def spec(self):
+        if self.channels is None:
+            return self.kind + ':' + '{:g}'.format(self.param)
+
+        selectors = []
+        for kind, sensor in self.channels:
+            if kind is None:
+                selectors.append(CHANNELS_ALL)
+            else:
+                selectors.append(CHANNEL_PREFIXES[kind] + ('' if sensor is None else str(sensor + 1)))
+
+        return self.kind + ':' + '+'.join(selectors) + ':' + '{:g}'.format(self.param)
+
+    #field numbers (timestamp = 0) of the channels of 'schema' the filter applies to, and whether any of its sensors
+    #are not in the schema
+    def columns(self, schema):
+        if self.channels is None:
+            return list(range(1, schema.num_fields)), False
+
+        channels = []
+        missing = False
+
+        for kind, sensor in self.channels:
+            if kind is None:
+                selected = range(schema.num_channels)
+            elif sensor is None:
+                selected = schema.kind_channels[kind]
+            elif sensor < schema.num_sensors:
+                selected = [schema.channel(sensor, kind)]
+            else:
+                missing = True
+                selected = []
+
+            channels.extend(ch for ch in selected if ch not in channels)
+
+        return [ch + 1 for ch in channels], missing
+
+
+#parse the <channels> of a filter, e.g. "p2+p3", into a list of (kind, sensor) selectors. Raises ValueError if not valid
+def parseChannels(channels_str):
+    channels = []
+
+    for selector in channels_str.split('+'):
+        selector = selector.strip()
+        sensor = selector[1:]
+
+        if selector == CHANNELS_ALL:
+            channels.append((None, None))
+        elif (selector[:1] in CHANNEL_PREFIXES) and ((sensor == '') or (sensor.isdigit() and int(sensor) >= 1)):
+            channels.append((CHANNEL_PREFIXES.index(selector[:1]), int(sensor) - 1 if sensor else None))
+        else:
+            raise ValueError('Invalid channels: ' + channels_str)
+
+    return channels
+
+
+#parse a list of filters, e.g. "median:p:5,biquad:p:8" (see above). Raises ValueError if the list is not valid. An
+#empty string (or "none") means no filters
+def parseFilters(filters_str):
+    specs = []
+
+    if filters_str.strip().lower() in ('', 'none', 'off'):
+        return specs
+
+    for filter_str in filters_str.split(','):
+        fields = [field.strip() for field in filter_str.strip().lower().split(':')]
+
+        try:
+            if (fields[0] == FILTER_DECIMATE) and (len(fields) == 2):
+                specs.append(FilterSpec(FILTER_DECIMATE, float(fields[1])))
+            elif (fields[0] in FILTER_KINDS) and (len(fields) == 3):
+                specs.append(FilterSpec(fields[0], float(fields[2]), parseChannels(fields[1])))
+            else:
+                raise ValueError()
+        except ValueError:
+            raise ValueError('Invalid filter: ' + filter_str)
+
+    return specs
+
+
+#format a list of filters as parseFilters() takes it
+def formatFilters(specs):
+    return ','.join(spec.spec() for spec in specs)
+
+
+#(b, a) coefficients of a one-pole low-pass filter, y[n] = y[n-1] + alpha * (x[n] - y[n-1])
+def onePoleCoefficients(cutoff, rate):
+    alpha = 1.0 - math.exp(-2.0 * math.pi * min(cutoff, rate * MAX_CUTOFF_FRACTION) / rate)
+    return [alpha, 0.0, 0.0], [1.0, alpha - 1.0, 0.0]
+
+
+#(b, a) coefficients of a second-order Butterworth low-pass filter, by the bilinear transform
+def butterworthCoefficients(cutoff, rate):
+    w0 = 2.0 * math.pi * min(cutoff, rate * MAX_CUTOFF_FRACTION) / rate
+    cos_w0 = math.cos(w0)
+    alpha = math.sin(w0) / math.sqrt(2.0)
+    a0 = 1.0 + alpha
+
+    b = [(1.0 - cos_w0) / 2.0 / a0, (1.0 - cos_w0) / a0, (1.0 - cos_w0) / 2.0 / a0]
+    a = [1.0, -2.0 * cos_w0 / a0, (1.0 - alpha) / a0]
+    return b, a
+
+
+#taps of a Hamming-windowed sinc low-pass filter for decimating by 'factor', with a gain of 1 at 0 Hz
+def decimationTaps(factor):
+    num_taps = FIR_TAPS_PER_FACTOR * factor + 1
+    cutoff = 0.5 / factor   #cycles per sample
+    middle = (num_taps - 1) / 2.0
+
+    taps = []
+    for t in range(num_taps):
+        x = 2.0 * cutoff * (t - middle)
+        sinc = math.sin(math.pi * x) / (math.pi * x) if x != 0 else 1.0
+        taps.append(2.0 * cutoff * sinc * (0.54 - 0.46 * math.cos(2.0 * math.pi * t / (num_taps - 1))))
+
+    total = sum(taps)
+    return [tap / total for tap in taps]
+
+
+class MedianFilter(object):
+    #moving median of the last 'width' samples of each of 'num_channels' channels. The state is the previous width - 1
+    #samples, oldest first
+    def __init__(self, num_channels, width):
+        self.num_channels = num_channels
+        self.width = width
+        self.reset()
+
+    def reset(self):
+        self._state = None
+
+    #filter a block of samples: 'x' has one row per sample and one column per channel. Returns an array of the same shape
+    def process(self, x):
+        import numpy as np
+
+        if (self.width == 1) or (len(x) == 0):
+            return x
+
+        if self._state is None:
+            self._state = np.repeat(x[:1], self.width - 1, axis=0)
+
+        ext = np.concatenate((np.asarray(self._state, dtype=np.float64), x))
+        windows = ext[np.arange(len(x))[:, None] + np.arange(self.width)[None, :]]
+
+        self._state = ext[len(x):]
+        return np.median(windows, axis=1)
+
+    #filter one sample, given as a list of channel values. Returns a list
+    def processSample(self, values):
+        if self.width == 1:
+            return values
+
+        if self._state is None:
+            self._state = [list(values) for _ in range(self.width - 1)]
+        elif not isinstance(self._state, list):
+            self._state = self._state.tolist()
+
+        state = self._state
+        state.append(list(values))
+
+        middle = self.width // 2
+        out = []
+        for ch in range(len(values)):
+            window = sorted(row[ch] for row in state)
+
+            if self.width % 2:
+                out.append(window[middle])
+            else:
+                out.append((window[middle - 1] + window[middle]) / 2.0)
+
+        del state[0]
+        return out
+
+
+class IirFilter(object):
+    #second-order (or one-pole) IIR filter of each of 'num_channels' channels, in direct form I. 'design' is a function of
+    #the cutoff and the sample rate returning the (b, a) coefficients (e.g. butterworthCoefficients). The state is the
+    #previous two inputs and outputs: rows x[n-1], x[n-2], y[n-1], y[n-2], one column per channel
+    def __init__(self, num_channels, cutoff, design, rate=DEFAULT_SAMPLE_RATE):
+        self.num_channels = num_channels
+        self.cutoff = cutoff
+        self.design = design
+        self.setRate(rate)
+        self.reset()
+
+    def reset(self):
+        self._state = None
+
+    #design the filter for 'rate' (Hz), keeping its state
+    def setRate(self, rate):
+        self.rate = rate
+        self.b, self.a = self.design(self.cutoff, rate)
+        self._matrices = None
+
+    #filter a block of samples: 'x' has one row per sample and one column per channel. Returns an array of the same shape
+    def process(self, x):
+        import numpy as np
+
+        n = len(x)
+        if n == 0:
+            return x
+
+        if self._state is None:
+            self._state = np.repeat(x[:1], 4, axis=0)
+
+        if self._matrices is None:
+            self._matrices = self._blockMatrices()
+
+        impulse, carry = self._matrices
+        state = np.asarray(self._state, dtype=np.float64)
+        y = np.empty_like(x)
+
+        for start in range(0, n, IIR_BLOCK):
+            xb = x[start:start + IIR_BLOCK]
+            m = len(xb)
+
+            yb = impulse[:m, :m].dot(xb) + carry[:m].dot(state)
+            y[start:start + m] = yb
+
+            if m >= 2:
+                state = np.array([xb[m - 1], xb[m - 2], yb[m - 1], yb[m - 2]])
+            else:
+                state = np.array([xb[0], state[0], yb[0], state[2]])
+
+        self._state = state
+        return y
+
+    #filter one sample, given as a list of channel values. Returns a list
+    def processSample(self, values):
+        if self._state is None:
+            self._state = [list(values) for _ in range(4)]
+        elif not isinstance(self._state, list):
+            self._state = self._state.tolist()
+
+        b0, b1, b2 = self.b
+        a1, a2 = self.a[1], self.a[2]
+        x1, x2, y1, y2 = self._state
+
+        out = []
+        for ch, x in enumerate(values):
+            y = b0 * x + b1 * x1[ch] + b2 * x2[ch] - a1 * y1[ch] - a2 * y2[ch]
+
+            x2[ch] = x1[ch]
+            x1[ch] = x
+            y2[ch] = y1[ch]
+            y1[ch] = y
+            out.append(y)
+
+        return out
+
+    #the matrices giving a block's output (up to IIR_BLOCK samples) from its input and from the state before it: the
+    #filter's impulse response as a lower triangular (Toeplitz) matrix, and its response to each row of the state
+    def _blockMatrices(self):
+        import numpy as np
+
+        def response(x, x1, x2, y1, y2):
+            out = []
+            for n in range(IIR_BLOCK):
+                xn = x[n] if n < len(x) else 0.0
+                y = self.b[0] * xn + self.b[1] * x1 + self.b[2] * x2 - self.a[1] * y1 - self.a[2] * y2
+                x2, x1, y2, y1 = x1, xn, y1, y
+                out.append(y)
+            return out
+
+        h = response([1.0], 0.0, 0.0, 0.0, 0.0)
+        impulse = np.zeros((IIR_BLOCK, IIR_BLOCK))
+        for k in range(IIR_BLOCK):
+            impulse[k:, k] = h[:IIR_BLOCK - k]
+
+        carry = np.array([response([], 1.0, 0.0, 0.0, 0.0), response([], 0.0, 1.0, 0.0, 0.0),
+                          response([], 0.0, 0.0, 1.0, 0.0), response([], 0.0, 0.0, 0.0, 1.0)]).T
+
+        return impulse, carry
+
+
+class FirDecimator(object):
+    #low-pass FIR filter of each of 'num_channels' channels that keeps one sample in 'factor' (see decimationTaps()). The
+    #first sample is kept. The state is the previous len(taps) - 1 samples, oldest first
+    def __init__(self, num_channels, factor):
+        self.num_channels = num_channels
+        self.factor = factor
+        self.taps = decimationTaps(factor)
+        self.reset()
+
+    def reset(self):
+        self._state = None
+        self._skip = 0      #samples to go until the next one that is kept
+
+    #filter a block of samples: 'x' has one row per sample and one column per channel. Returns the positions in 'x' of
+    #the samples that are kept, and their filtered values (one row per sample kept)
+    def process(self, x):
+        import numpy as np
+
+        n = len(x)
+        num_taps = len(self.taps)
+
+        if n == 0:
+            return np.arange(0), x
+
+        if self._state is None:
+            self._state = np.repeat(x[:1], num_taps - 1, axis=0)
+
+        kept = np.arange(self._skip, n, self.factor)
+        ext = np.concatenate((np.asarray(self._state, dtype=np.float64), x))
+
+        #y[n] = sum of taps[t] * x[n - t]; the window of each kept sample is oldest first, so the taps are reversed
+        windows = ext[kept[:, None] + np.arange(num_taps)[None, :]]
+        y = np.tensordot(windows, np.array(self.taps[::-1]), axes=([1], [0]))
+
+        self._skip = (self._skip - n) % self.factor
+        self._state = ext[n:]
+        return kept, y
+
+    #filter one sample, given as a list of channel values. Returns a list, or None if the sample is not kept
+    def processSample(self, values):
+        if self._state is None:
+            self._state = [list(values) for _ in range(len(self.taps) - 1)]
+        elif not isinstance(self._state, list):
+            self._state = self._state.tolist()
+
+        state = self._state
+        state.append(list(values))
+
+        out = None
+        if self._skip == 0:
+            taps = self.taps[::-1]
+            out = [sum(tap * row[ch] for tap, row in zip(taps, state)) for ch in range(len(values))]
+            self._skip = self.factor - 1
+        else:
+            self._skip -= 1
+
+        del state[0]
+        return out
+
+
+class FilterChain(object):
+    #the filters 'specs' (FilterSpecs, applied in order) of one device's samples, laid out as in 'schema' (a
+    #ChannelSchema, replaced with setSchema() when the Arduino resets with different columns)
+    def __init__(self, specs, schema):
+        self.specs = specs
+        self.rate = DEFAULT_SAMPLE_RATE
+
+        self.samples_in = 0
+        self.samples_out = 0
+
+        self.setSchema(schema)
+
+    #lay the filters out for the columns of 'schema', starting them over. Filters whose sensors are not in the schema
+    #are listed in 'missing' (and applied to the sensors that are). Each filter is designed for the rate of the samples
+    #it is given, i.e. the measured rate divided by the factors of the decimate filters before it
+    def setSchema(self, schema):
+        self.schema = schema
+        self.missing = []
+        self._filters = []
+        self._decimation = []   #product of the decimation factors before each filter
+
+        decimation = 1
+        for spec in self.specs:
+            columns, missing = spec.columns(schema)
+            if missing:
+                self.missing.append(spec)
+
+            if not columns:
+                continue
+
+            if spec.kind == FILTER_MEDIAN:
+                flt = MedianFilter(len(columns), spec.param)
+            elif spec.kind == FILTER_LOWPASS:
+                flt = IirFilter(len(columns), spec.param, onePoleCoefficients, self.rate / decimation)
+            elif spec.kind == FILTER_BIQUAD:
+                flt = IirFilter(len(columns), spec.param, butterworthCoefficients, self.rate / decimation)
+            else:
+                flt = FirDecimator(len(columns), spec.param)
+
+            self._filters.append((flt, columns))
+            self._decimation.append(decimation)
+
+            if spec.kind == FILTER_DECIMATE:
+                decimation *= spec.param
+
+    #start every filter over, e.g. when the Arduino resets
+    def reset(self):
+        for flt, columns in self._filters:
+            flt.reset()
+
+    #the measured sample rate (Hz), or None if it is not known yet. The IIR filters are designed again if it has changed
+    #by more than RATE_TOLERANCE
+    def setRate(self, rate):
+        if (rate is None) or (abs(rate - self.rate) <= self.rate * RATE_TOLERANCE):
+            return
+
+        self.rate = rate
+        for (flt, columns), decimation in zip(self._filters, self._decimation):
+            if isinstance(flt, IirFilter):
+                flt.setRate(rate / decimation)
+
+    #filter a block of samples (a NumPy array with one row per sample, timestamp first, in column order). Returns a new
+    #array, with fewer rows if a filter decimates
+    def filterSamples(self, samples):
+        samples = samples.copy()
+        self.samples_in += len(samples)
+
+        for flt, columns in self._filters:
+            if len(samples) == 0:
+                break
+
+            if isinstance(flt, FirDecimator):
+                kept, y = flt.process(samples[:, columns])
+                samples = samples[kept]
+                samples[:, columns] = y
+            else:
+                samples[:, columns] = flt.process(samples[:, columns])
+
+        self.samples_out += len(samples)
+        return samples
+
+    #filter one parsed sample (a list, timestamp first, in column order). Returns a new list, or None if a filter
+    #decimates it away
+    def filterSample(self, sample):
+        sample = list(sample)
+        self.samples_in += 1
+
+        for flt, columns in self._filters:
+            y = flt.processSample([sample[col] for col in columns])
+            if y is None:
+                return None
+
+            for col, value in zip(columns, y):
+                sample[col] = value
+
+        self.samples_out += 1
+        return sample
+
+    def stats(self):
+        return (formatFilters(self.specs) + ', samples in: ' + str(self.samples_in) + ', out: ' +
+                str(self.samples_out) + ', designed for: ' + '{:.1f}'.format(self.rate) + ' Hz')
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# flow.py
+# Helpful Engineering
+#
+# Purpose:
+# Flow and volume channels derived from the pressure sensors. A pair of sensors on either side of a
+# flow element (an orifice or a venturi) measures the pressure drop across it, which is turned into
+# flow with the element's calibration:
+#     flow = k * sign(dp) * |dp|^exponent,   dp = (upstream pressure - downstream pressure) - offset
+# with dp in hPa and flow in L/min. An orifice or venturi has an exponent of 0.5; a laminar flow
+# element (pneumotachograph) has an exponent of 1. Flow is positive from the upstream sensor to the
+# downstream sensor (i.e. inspiration, when the upstream sensor is on the ventilator side).
+#
+# Flow is integrated to volume (mL) with the trapezoidal rule, using the device timestamps.
+#
+# Notes:
+# Sensor pairs are given as "<upstream>-<downstream>" sensor IDs, counted from 1 in the order of the
+# channel schema (as for the -a option), e.g. "2-3". Several pairs are separated by commas.
+#
+# Every calculation is done for a whole batch of samples at once with NumPy (compute() and
+# VolumeIntegrator.integrate()), as the plot and bulk ingest see them. Line ingest, which does not
+# otherwise need NumPy, uses the per-sample versions (computeSample() and VolumeIntegrator.add()).
+
+import math
+
+from channels import PRESS_IDX
+
+DEFAULT_FLOW_K = 100.0          #L/min per hPa^exponent
+DEFAULT_FLOW_EXPONENT = 0.5
+DEFAULT_FLOW_OFFSET = 0.0       #hPa
+
+ML_PER_LPM_MS = 1.0 / 60.0      #mL per (L/min * ms)
+
+
+#parse a list of sensor pairs, e.g. "2-3" or "1-3,2-3", into a list of (upstream, downstream) sensor numbers,
+#from 0. Raises ValueError if the list is not valid. An empty string (or "none") means no pairs
+def parseSensorPairs(pairs_str):
+    pairs = []
+
+    if pairs_str.strip().lower() in ('', 'none', 'off'):
+        return pairs
+
+    for pair_str in pairs_str.split(','):
+        sensors = pair_str.strip().split('-')
+
+        if (len(sensors) != 2) or not (sensors[0].strip().isdigit() and sensors[1].strip().isdigit()):
+            raise ValueError('Invalid sensor pair: ' + pair_str)
+
+        upstream = int(sensors[0]) - 1
+        downstream = int(sensors[1]) - 1
+
+        if (upstream < 0) or (downstream < 0) or (upstream == downstream):
+            raise ValueError('Invalid sensor pair: ' + pair_str)
+
+        pairs.append((upstream, downstream))
+
+    return pairs
+
+
+#format a list of sensor pairs as parseSensorPairs() takes it
+def formatSensorPairs(pairs):
+    return ','.join(str(upstream + 1) + '-' + str(downstream + 1) for upstream, downstream in pairs)
+
+
+class FlowCalibration(object):
+    def __init__(self, k=DEFAULT_FLOW_K, exponent=DEFAULT_FLOW_EXPONENT, offset=DEFAULT_FLOW_OFFSET):
+        self.k = float(k)
+        self.exponent = float(exponent)
+        self.offset = float(offset)
+
+    #flow (L/min) for an array of pressure differences (hPa)
+    def flow(self, dp):
+        import numpy as np
+
+        dp = dp - self.offset
+        return self.k * np.sign(dp) * np.abs(dp) ** self.exponent
+
+    #flow (L/min) for a single pressure difference (hPa)
+    def flowAt(self, dp):
+        dp = dp - self.offset
+        return math.copysign(self.k * abs(dp) ** self.exponent, dp)
+
+
+class FlowChannels(object):
+    #flow through each of the sensor 'pairs' (see parseSensorPairs()) of a channels.ChannelSchema. Pairs whose
+    #sensors are not in the schema are left out (see 'missing')
+    def __init__(self, schema, pairs, calibration=None):
+        self.calibration = calibration if calibration is not None else FlowCalibration()
+
+        self.pairs = [pair for pair in pairs if max(pair) < schema.num_sensors]
+        self.missing = [pair for pair in pairs if max(pair) >= schema.num_sensors]
+        self.num_flows = len(self.pairs)
+
+        #channel numbers of the upstream and downstream pressures of each pair
+        self.upstream_channels = [schema.channel(upstream, PRESS_IDX) for upstream, downstream in self.pairs]
+        self.downstream_channels = [schema.channel(downstream, PRESS_IDX) for upstream, downstream in self.pairs]
+
+        #e.g. "flow 2-3" and "volume 2-3", using the sensor IDs of the schema
+        labels = [schema.sensorLabel(upstream) + '-' + schema.sensorLabel(downstream) for upstream, downstream in self.pairs]
+        self.flow_names = ['flow ' + label for label in labels]
+        self.volume_names = ['volume ' + label for label in labels]
+
+    #flows for a batch of samples. 'values' holds the channel values in hPa, one row per channel and one column
+    #per sample. Returns an array with one row per pair
+    def compute(self, values):
+        return self.calibration.flow(values[self.upstream_channels] - values[self.downstream_channels])
+
+    #flows for one parsed sample (timestamp first, in column order, pressures in hPa), as a list
+    def computeSample(self, sample):
+        return [self.calibration.flowAt(sample[up + 1] - sample[down + 1])
+                for up, down in zip(self.upstream_channels, self.downstream_channels)]
+
+
+class VolumeIntegrator(object):
+    #running volume (mL) of each of 'num_channels' flows (L/min), from the time of the first sample. It keeps adding
+    #up (and drifting with any offset in the flow), so volumes are taken as differences, e.g. with breathVolumes()
+    def __init__(self, num_channels):
+        self.num_channels = num_channels
+        self.reset()
+
+    def reset(self):
+        self._last_t = None
+        self._last_flows = [0.0] * self.num_channels
+        self._volumes = [0.0] * self.num_channels
+
+    #integrate a batch of samples: 'times' are device timestamps (ms) and 'flows' has one row per channel and one
+    #column per sample. Returns the volume at every sample, in the same shape as 'flows'
+    def integrate(self, times, flows):
+        import numpy as np
+
+        times = np.asarray(times, dtype=np.float64)
+        flows = np.asarray(flows, dtype=np.float64)
+
+        if times.shape[0] == 0:
+            return flows.copy()
+
+        #carry the previous batch's last sample over, so the first interval of this batch is counted too
+        if self._last_t is None:
+            prev_t = times[0]
+        else:
+            prev_t = self._last_t
+
+        all_times = np.concatenate(([prev_t], times))
+        all_flows = np.hstack((np.array(self._last_flows).reshape(self.num_channels, 1), flows))
+
+        #timestamps that go backwards (the Arduino has reset) add nothing
+        dt = np.maximum(np.diff(all_times), 0.0)
+        dv = (all_flows[:, 1:] + all_flows[:, :-1]) * (0.5 * ML_PER_LPM_MS) * dt
+
+        volumes = np.array(self._volumes).reshape(self.num_channels, 1) + np.cumsum(dv, axis=1)
+
+        self._last_t = float(times[-1])
+        self._last_flows = flows[:, -1].tolist()
+        self._volumes = volumes[:, -1].tolist()
+
+        return volumes
+
+    #integrate one sample: device timestamp (ms) and a list of flows, one per channel. Returns the list of volumes
+    def add(self, t, flows):
+        if self._last_t is not None:
+            dt = max(t - self._last_t, 0.0)
+
+            for ch in range(self.num_channels):
+                self._volumes[ch] += (flows[ch] + self._last_flows[ch]) * (0.5 * ML_PER_LPM_MS) * dt
+
+        self._last_t = t
+        self._last_flows = list(flows)
+
+        return list(self._volumes)
+
+
+#volume since the start of the breath, as a ventilator shows it. 'times' (oldest first) and 'volumes' (one row per
+#channel) are samples of the running volume from VolumeIntegrator, 'start_times' are the times the breaths started
+#(oldest first) and 'start_volumes' the running volumes at those times (one column per breath). Samples from before
+#the first breath start are left as they are
+def breathVolumes(times, volumes, start_times, start_volumes):
+    import numpy as np
+
+    if len(start_times) == 0:
+        return volumes
+
+    breath = np.searchsorted(start_times, times, side='right') - 1
+    base = np.where(breath >= 0, start_volumes[:, np.maximum(breath, 0)], 0.0)
+
+    return volumes - base
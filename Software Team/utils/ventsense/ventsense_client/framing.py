@@ -0,0 +1,399 @@
+# -*- coding: utf-8 -*-
+# framing.py
+# Helpful Engineering
+#
+# Purpose:
+# Compact binary wire protocol between ventsense_fw and the client, for the --wire=frames option.
+# By default the firmware prints every sample as a line of text, about 50 bytes for 3 sensors, which
+# limits the link to a couple of hundred samples per second at 115200 baud and costs the Arduino its
+# float formatting. In frame mode, it sends each sample as a fixed size binary frame instead (29
+# bytes for 3 sensors), so the same link carries several hundred samples per second.
+#
+# FrameSerial wraps the client's serial port, asks the firmware for frames, and turns the frames it
+# receives back into the firmware's lines, so the client logs, parses and plots them exactly like
+# text. FrameEncoder builds frames on the host the way the firmware does, for the simulator (see
+# simulator.py) and for benchmarks/bench_framing.py, which checks the decoder against it.
+#
+# Notes:
+# The client asks for frames by sending the command line "F<interval>\n", where <interval> is the
+# sample interval to use in ms, and for text (the default) with "T\n". The firmware answers with the
+# line "#frames <interval>" or "#text", then sends samples in the new mode. The firmware starts in
+# text mode, printing its header line, whenever the Arduino resets, so FrameSerial asks for frames
+# again every time it sees a header line. Firmware that does not know the commands ignores them and
+# carries on sending text, which FrameSerial passes through unchanged.
+#
+# Each frame is, little-endian:
+#     sync        2 bytes    SYNC (0xA5 0x5A)
+#     sensors     uint8      number of sensors in the frame
+#     sequence    uint16     frame number, counting up from 0 and wrapping around at 65536
+#     millis      uint32     timestamp, the firmware's millis()
+# then, for each sensor:
+#     temp        int16      temperature, in 0.01 degrees C
+#     press       uint32     pressure, in Pa
+# and last:
+#     crc         uint16     CRC-16/CCITT-FALSE of everything between the sync word and the crc
+#
+# The values have the same resolution as the text lines (temperatures and pressures in hPa to 2
+# decimal places), so a sample decodes to the same line either way.
+#
+# FrameDecoder reads a stream that may mix frames and lines of text (e.g. the header line after a
+# reset, or the acknowledgement of a command). A frame whose CRC does not match, or that was cut
+# short, is skipped one byte at a time until the next sync word, so the decoder finds the next good
+# frame after any corruption. The sync word's first byte is not ASCII, so it never appears in text.
+# The sequence numbers tell how many frames were lost between two good ones, and which were sent
+# twice; duplicates are dropped. A sequence number more than half the range behind the last one is
+# taken as the firmware having started counting again.
+
+import binascii
+import struct
+
+SYNC = b'\xa5\x5a'
+
+#sync, sensors, sequence, millis
+FRAME_HEADER = struct.Struct('<2sBHI')
+FRAME_SENSOR_SIZE = 6 #bytes
+FRAME_CRC = struct.Struct('<H')
+
+CRC_INIT = 0xFFFF
+
+SEQUENCE_WRAP = 2 ** 16
+
+TEMP_SCALE = 100.0      #counts per degree C
+PRESS_SCALE = 100.0     #counts (Pa) per hPa
+
+TEMP_MIN = -32768
+TEMP_MAX = 32767
+PRESS_MAX = 2 ** 32 - 1
+
+#most sensors a frame may have; anything more is taken as corruption
+MAX_FRAME_SENSORS = 32
+
+#a line of text longer than this without a newline is taken as corruption
+MAX_LINE_LENGTH = 1024 #bytes
+
+WIRE_TEXT = 'text'
+WIRE_FRAMES = 'frames'
+WIRE_MODES = [WIRE_TEXT, WIRE_FRAMES]
+
+COMMAND_FRAMES = 'F'
+COMMAND_TEXT = 'T'
+
+REPLY_FRAMES = b'#frames'
+REPLY_TEXT = b'#text'
+
+#sample interval asked of the firmware in frame mode. The sensors give a new reading every 5 ms (200 Hz)
+DEFAULT_FRAME_INTERVAL = 5 #ms
+MIN_FRAME_INTERVAL = 1     #ms
+MAX_FRAME_INTERVAL = 1000  #ms
+
+#the link sends 10 bits per byte (8 data bits, a start and a stop bit)
+BITS_PER_BYTE = 10
+DEFAULT_BAUD_RATE = 115200
+
+
+#number of bytes in a frame of 'num_sensors' sensors
+def frameSize(num_sensors):
+    return FRAME_HEADER.size + num_sensors * FRAME_SENSOR_SIZE + FRAME_CRC.size
+
+
+#CRC-16/CCITT-FALSE of 'data'
+def crc16(data):
+    return binascii.crc_hqx(data, CRC_INIT)
+
+
+#the command line asking the firmware for frames every 'interval' ms
+def framesCommand(interval=DEFAULT_FRAME_INTERVAL):
+    return (COMMAND_FRAMES + str(int(interval)) + '\n').encode('ascii')
+
+
+#the command line asking the firmware for text
+def textCommand():
+    return (COMMAND_TEXT + '\n').encode('ascii')
+
+
+class FrameEncoder(object):
+    #builds the frames of one device's samples, as the firmware does
+    def __init__(self, num_sensors):
+        self.num_sensors = num_sensors
+        self.sequence = 0
+
+        self._struct = struct.Struct('<' + 'hI' * num_sensors)
+
+    #start numbering the frames from 0 again, as the firmware does when the Arduino resets
+    def reset(self):
+        self.sequence = 0
+
+    #frame of one sample: its millis() timestamp and 'values', the temperature (degrees C) and pressure (hPa) of each
+    #sensor in turn, as in a line of text
+    def encode(self, millis, values):
+        counts = []
+        for idx, value in enumerate(values):
+            if idx % 2 == 0:
+                counts.append(min(max(int(round(value * TEMP_SCALE)), TEMP_MIN), TEMP_MAX))
+            else:
+                counts.append(min(max(int(round(value * PRESS_SCALE)), 0), PRESS_MAX))
+
+        body = (FRAME_HEADER.pack(SYNC, self.num_sensors, self.sequence, int(millis) & 0xFFFFFFFF) +
+                self._struct.pack(*counts))
+
+        self.sequence = (self.sequence + 1) % SEQUENCE_WRAP
+
+        return body + FRAME_CRC.pack(crc16(body[len(SYNC):]))
+
+
+class FrameDecoder(object):
+    #streaming decoder of a mix of frames and lines of text (see Notes above). feed() takes the bytes as they are read
+    #and returns the complete lines they hold, with every frame turned into the firmware's line for its sample
+    def __init__(self):
+        self.frames = 0             #good frames decoded, duplicates included
+        self.crc_errors = 0         #frames skipped because their CRC did not match
+        self.lost = 0               #frames missing from the sequence numbers
+        self.duplicates = 0         #frames received again, and dropped
+        self.bytes_skipped = 0      #bytes that were neither a good frame nor a line of text
+        self.lines = 0              #lines of text passed through
+        self.replies = 0            #replies to commands
+
+        #true while the firmware is sending frames: after its reply to the frames command, or a good frame, and until it
+        #replies to the text command or resets
+        self.frames_active = False
+
+        #set when a header line is seen (the Arduino has reset, so it is sending text again). Cleared by the caller
+        self.reset_seen = False
+
+        self._buf = bytearray()
+        self._last_sequence = None
+        self._structs = {}
+        self._formats = {}
+
+    #add newly read bytes, and return the complete lines now available (bytes, each ending in \r\n)
+    def feed(self, data):
+        buf = self._buf
+        buf += data
+
+        out = []
+        pos = 0
+        end = len(buf)
+        sync_byte = SYNC[0:1]
+
+        #position of the next sync byte, only looked for again once it has been passed (-1 if there is none)
+        sync = -2
+
+        while pos < end:
+            if buf[pos] == SYNC[0]:
+                if end - pos < FRAME_HEADER.size:
+                    break
+
+                num_sensors = buf[pos + 2]
+                if (buf[pos + 1] != SYNC[1]) or (num_sensors == 0) or (num_sensors > MAX_FRAME_SENSORS):
+                    self.bytes_skipped += 1
+                    pos += 1
+                    continue
+
+                size = frameSize(num_sensors)
+                if end - pos < size:
+                    break
+
+                crc = FRAME_CRC.unpack_from(buf, pos + size - FRAME_CRC.size)[0]
+                if crc16(bytes(buf[pos + len(SYNC):pos + size - FRAME_CRC.size])) != crc:
+                    #a corrupt frame, or a sync word that was really part of one: look for the next sync word
+                    self.crc_errors += 1
+                    self.bytes_skipped += 1
+                    pos += 1
+                    continue
+
+                line = self._decodeFrame(buf, pos, num_sensors)
+                if line is not None:
+                    out.append(line)
+
+                pos += size
+                continue
+
+            #text, up to the end of the line unless a sync word comes first
+            newline = buf.find(b'\n', pos)
+            if (sync != -1) and (sync < pos):
+                sync = buf.find(sync_byte, pos)
+
+            if (sync >= 0) and ((newline < 0) or (sync < newline)):
+                self.bytes_skipped += sync - pos
+                pos = sync
+                continue
+
+            if newline < 0:
+                if end - pos > MAX_LINE_LENGTH:
+                    self.bytes_skipped += end - pos
+                    pos = end
+                break
+
+            line = self._textLine(bytes(buf[pos:newline]))
+            if line is not None:
+                out.append(line)
+
+            pos = newline + 1
+
+        del buf[:pos]
+        return b''.join(out)
+
+    def stats(self):
+        return ('frames: ' + str(self.frames) + ', CRC errors: ' + str(self.crc_errors) + ', lost: ' + str(self.lost) +
+                ', duplicates: ' + str(self.duplicates) + ', bytes skipped: ' + str(self.bytes_skipped) +
+                ', text lines: ' + str(self.lines))
+
+    #the line of a good frame at 'pos' in 'buf', or None if it is a duplicate
+    def _decodeFrame(self, buf, pos, num_sensors):
+        st = self._structs.get(num_sensors)
+        if st is None:
+            st = struct.Struct('<3xHI' + 'hI' * num_sensors)
+            self._structs[num_sensors] = st
+            self._formats[num_sensors] = '%d' + ',%.2f' * (2 * num_sensors) + '\r\n'
+
+        fields = st.unpack_from(buf, pos)
+        sequence = fields[0]
+
+        self.frames += 1
+        self.frames_active = True
+
+        if self._last_sequence is not None:
+            step = (sequence - self._last_sequence) % SEQUENCE_WRAP
+
+            if step == 0:
+                self.duplicates += 1
+                return None
+
+            if step < SEQUENCE_WRAP // 2:
+                self.lost += step - 1
+
+        self._last_sequence = sequence
+
+        #both temperatures (0.01 degrees C) and pressures (Pa, to hPa) are scaled by 100
+        values = tuple([fields[1]] + [count / 100.0 for count in fields[2:]])
+        return (self._formats[num_sensors] % values).encode('ascii')
+
+    #a line of text (without its newline) to pass on, or None if it is a reply to a command or not text at all
+    def _textLine(self, line):
+        line = line.strip()
+        if not line:
+            return None
+
+        if (min(line) < 0x20) or (max(line) > 0x7E):
+            self.bytes_skipped += len(line) + 1
+            return None
+
+        if line.startswith(b'#'):
+            self.replies += 1
+
+            if line.startswith(REPLY_FRAMES):
+                self.frames_active = True
+            elif line.startswith(REPLY_TEXT):
+                self.frames_active = False
+
+            return None
+
+        if line.startswith(b'time'):
+            #the Arduino has reset: it sends text, and numbers its frames from 0 again
+            self.frames_active = False
+            self.reset_seen = True
+            self._last_sequence = None
+
+        self.lines += 1
+        return line + b'\r\n'
+
+
+class FrameSerial(object):
+    #pySerial-like port over 'ser' (an open serial port, or a simulator.SimulatedSerial) that asks the firmware for
+    #frames every 'interval' ms, and turns them back into the firmware's lines, so the client reads it like the port
+    #itself. Asks for text again when closed, so the port can be used with a serial terminal afterwards
+    def __init__(self, ser, interval=DEFAULT_FRAME_INTERVAL):
+        self.port = ser
+        self.interval = interval
+        self.timeout = getattr(ser, 'timeout', None)
+
+        self.decoder = FrameDecoder()
+        self.requests = 0
+
+        self._pending = bytearray()
+
+    @property
+    def is_open(self):
+        return self.port.is_open
+
+    def open(self):
+        if not self.port.is_open:
+            self.port.open()
+
+        self._request()
+
+    def close(self):
+        if self.port.is_open:
+            try:
+                self.port.write(textCommand())
+            except Exception:
+                #e.g. the device was unplugged
+                pass
+
+        self.port.close()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def reset_input_buffer(self):
+        self.port.reset_input_buffer()
+        self._pending = bytearray()
+
+    #number of bytes of lines decoded and ready to read right now
+    @property
+    def in_waiting(self):
+        self._fill(False)
+        return len(self._pending)
+
+    def readline(self):
+        idx = self._pending.find(b'\n')
+
+        if idx < 0:
+            self._fill(True)
+            idx = self._pending.find(b'\n')
+
+        if idx < 0:
+            return b''
+
+        return self._take(idx + 1)
+
+    def read(self, size=1):
+        if not self._pending:
+            self._fill(True)
+
+        return self._take(min(size, len(self._pending)))
+
+    def stats(self):
+        if self.decoder.frames_active:
+            mode = 'frames'
+        elif self.decoder.frames:
+            mode = 'text'
+        else:
+            mode = 'text (no frames received)'
+
+        return ('mode: ' + mode + ', frame requests: ' + str(self.requests) + ', ' + self.decoder.stats())
+
+    def _request(self):
+        self.port.write(framesCommand(self.interval))
+        self.requests += 1
+
+    def _take(self, size):
+        out = bytes(self._pending[:size])
+        del self._pending[:size]
+        return out
+
+    #decode what the port has received. If 'block' is set, wait (up to the port's timeout) for at least one byte
+    def _fill(self, block):
+        waiting = self.port.in_waiting
+        if waiting or block:
+            self._pending += self.decoder.feed(self.port.read(max(1, waiting)))
+
+        #the Arduino has reset, and gone back to text
+        if self.decoder.reset_seen:
+            self.decoder.reset_seen = False
+            self._request()
+
+
+#most samples per second 'baud_rate' carries in frames of 'num_sensors' sensors
+def frameCapacity(num_sensors, baud_rate=DEFAULT_BAUD_RATE):
+    return float(baud_rate) / BITS_PER_BYTE / frameSize(num_sensors)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# histogram.py
+# Helpful Engineering
+#
+# Purpose:
+# Histogram of times, in a fixed amount of memory however long the client runs. Used for the
+# latencies of alarms (see alarms.py), the write and sync latencies of the log writer (see
+# logwriter.py) and the stage times of --profile (see profiling.py).
+#
+# Notes:
+# Times are integer nanoseconds, or seconds (e.g. the difference of two time.perf_counter() values)
+# given to recordSeconds(). The histogram is HDR-style (as in HdrHistogram): each power of 2 is split
+# into 2^SUB_BUCKET_BITS linear buckets, so every time is kept to within 1/2^SUB_BUCKET_BITS (about
+# 3%) of its value, from 1 ns to MAX_TIME. The bucket of a time is found with integer operations only
+# (no logarithm), so recording a time costs a few hundred nanoseconds. The total, the count and the
+# longest time are kept exactly.
+
+#each power of 2 is split into this many linear buckets (as a power of 2)
+SUB_BUCKET_BITS = 5
+
+#largest time kept in its own bucket. Longer times are counted in the last bucket
+MAX_TIME = 2 ** 36 #ns (about 69 s)
+
+HISTOGRAM_BUCKETS = ((MAX_TIME.bit_length() - SUB_BUCKET_BITS) << SUB_BUCKET_BITS) + 1
+
+
+#index of the bucket holding 'ns'
+def bucketIndex(ns):
+    shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+    if shift <= 0:
+        return ns
+
+    return min((shift << SUB_BUCKET_BITS) + (ns >> shift), HISTOGRAM_BUCKETS - 1)
+
+
+#largest time (ns) in bucket 'idx'
+def bucketLimit(idx):
+    shift = (idx >> SUB_BUCKET_BITS) - 1
+    if shift <= 0:
+        return idx
+
+    return (((idx - (shift << SUB_BUCKET_BITS)) + 1) << shift) - 1
+
+
+class LatencyHistogram(object):
+    #histogram of times (integer ns), see Notes above
+    def __init__(self):
+        self.counts = [0] * HISTOGRAM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+        if shift > 0:
+            idx = (shift << SUB_BUCKET_BITS) + (ns >> shift)
+            if idx >= HISTOGRAM_BUCKETS:
+                idx = HISTOGRAM_BUCKETS - 1
+        else:
+            idx = ns
+
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += ns
+
+        if ns > self.max:
+            self.max = ns
+
+    #record a time in seconds. Negative times (e.g. from a clock that was stepped) are recorded as 0
+    def recordSeconds(self, seconds):
+        self.record(max(int(seconds * 1e9), 0))
+
+    def copy(self):
+        histogram = LatencyHistogram()
+        histogram.counts = list(self.counts)
+        histogram.count = self.count
+        histogram.total = self.total
+        histogram.max = self.max
+        return histogram
+
+    #histogram of the times recorded since 'earlier' (a copy of this histogram). The longest time is then only known
+    #to within a bucket
+    def since(self, earlier):
+        histogram = LatencyHistogram()
+        histogram.counts = [now - then for now, then in zip(self.counts, earlier.counts)]
+        histogram.count = sum(histogram.counts)
+        histogram.total = self.total - earlier.total
+
+        for idx in range(HISTOGRAM_BUCKETS - 1, -1, -1):
+            if histogram.counts[idx]:
+                histogram.max = min(bucketLimit(idx), self.max)
+                break
+
+        return histogram
+
+    #upper bound (ns) of the bucket holding the 'pct' percentile, or None if nothing has been recorded
+    def percentile(self, pct):
+        if self.count == 0:
+            return None
+
+        target = pct / 100.0 * self.count
+        total = 0
+        for idx, n in enumerate(self.counts):
+            total += n
+
+            if (total >= target) and (n > 0):
+                return min(bucketLimit(idx), self.max)
+
+        return self.max
+
+    #number of times over 'limit' (ns), to within a bucket
+    def countOver(self, limit):
+        return sum(self.counts[bucketIndex(int(limit)) + 1:])
+
+    #median, 99th percentile, longest time and count, e.g. 'p50 0.012 ms, p99 0.140 ms, max 1.203 ms (5120)'
+    def summary(self):
+        if self.count == 0:
+            return 'none'
+
+        return ('p50 ' + '{:.3f}'.format(self.percentile(50) / 1e6) + ' ms, p99 ' +
+                '{:.3f}'.format(self.percentile(99) / 1e6) + ' ms, max ' +
+                '{:.3f}'.format(self.max / 1e6) + ' ms (' + str(self.count) + ')')
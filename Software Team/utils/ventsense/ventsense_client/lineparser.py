@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# lineparser.py
+# Helpful Engineering
+#
+# Purpose:
+# Bulk parsing of the ventsense serial line protocol. Instead of reading, decoding, splitting and
+# converting one line at a time, the acquisition thread reads everything the serial port has
+# buffered in one call, splits off the complete lines (carrying any partial line over to the next
+# read) and converts the whole batch of records to a NumPy structured array in one step.
+#
+# Notes:
+# Each record is <timestamp>,<temp 1>,<pressure 1>,<temp 2>,<pressure 2>,<temp 3>,<pressure 3>.
+# Lines with too few fields or with values that are not numbers (e.g. the fragment of a line caught
+# mid-stream, or a line corrupted on the wire) are counted and skipped. Fields after the ones in use
+# are ignored, as they are by line ingest (see acquisition.py), so both ingest modes and the log
+# tools accept the same lines.
+#
+# Large blocks of lines read from a log file can be converted with parseBlock(), which hands the
+# whole block to NumPy's text parser in one call instead of splitting it into lines and tokens.
+
+import warnings
+
+import numpy as np
+
+MAX_READ_SIZE = 65536 #bytes
+
+#line endings become separators for parseBlock()
+_BLOCK_TABLE = bytes.maketrans(b'\r\n', b' ,')
+
+
+#structured dtype with one float64 field per column name
+def sampleDtype(field_names):
+    return np.dtype([(name, np.float64) for name in field_names])
+
+
+class LineSplitter(object):
+    #accumulates raw serial bytes in a reusable bytearray and hands back the complete lines
+    def __init__(self):
+        self._buf = bytearray()
+
+    #number of bytes of the partial line currently carried over
+    def pending(self):
+        return len(self._buf)
+
+    #add newly read bytes and return the list of complete, non-empty lines (without line endings
+    #or surrounding whitespace) that are now available
+    def feed(self, data):
+        self._buf += data
+
+        end = self._buf.rfind(b'\n')
+        if end < 0:
+            return []
+
+        chunk = bytes(self._buf[:end])
+        del self._buf[:end + 1]
+
+        return [line for line in (l.strip() for l in chunk.split(b'\n')) if line]
+
+
+#read whatever the serial port has buffered (waiting up to the port's timeout for at least one byte)
+def readAvailable(ser):
+    return ser.read(min(max(1, ser.in_waiting), MAX_READ_SIZE))
+
+
+#convert a list of record lines (bytes) to a structured array of the given dtype, from the first field of each line
+#for each field of the dtype. Returns the array and the number of malformed lines that were skipped
+def parseLines(lines, dtype):
+    num_fields = len(dtype.names)
+    num_commas = num_fields - 1
+
+    good = [line for line in lines if line.count(b',') == num_commas]
+    num_bad = len(lines) - len(good)
+
+    #some lines have too few fields, or more than are used, which are cut off
+    if num_bad:
+        good = [line if line.count(b',') == num_commas else b','.join(line.split(b',', num_fields)[:num_fields])
+                for line in lines if line.count(b',') >= num_commas]
+        num_bad = len(lines) - len(good)
+
+    if not good:
+        return np.zeros(0, dtype=dtype), num_bad
+
+    try:
+        #fast path: convert every token of the batch in one go
+        tokens = np.array(b','.join(good).split(b','))
+        values = tokens.astype(np.float64).reshape(-1, num_fields)
+    except ValueError:
+        #at least one token is not a number. Fall back to converting line by line so that only
+        #the bad lines are dropped
+        rows = []
+        for line in good:
+            try:
+                rows.append([float(tok) for tok in line.split(b',')])
+            except ValueError:
+                num_bad += 1
+
+        values = np.array(rows, dtype=np.float64).reshape(-1, num_fields)
+
+    return np.ascontiguousarray(values).view(dtype).reshape(-1), num_bad
+
+
+#convert a block of complete lines (bytes, each line ending in a newline, e.g. a chunk of a CSV log) to a structured
+#array of the given dtype, as parseLines() does. Returns the array and the number of malformed lines that were skipped.
+#Several times faster than parseLines() on a large block, as long as every line is well formed and has the same number
+#of fields; if not, the block is converted with parseLines()
+def parseBlock(data, dtype):
+    num_fields = len(dtype.names)
+
+    #every line must have the same number of commas, and enough of them...
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n'))
+    commas = np.diff(np.concatenate(([0], np.searchsorted(np.flatnonzero(buf == ord(',')), ends))))
+    del buf
+
+    line_fields = int(commas[0]) + 1 if len(commas) else num_fields
+
+    values = None
+    if (line_fields >= num_fields) and np.all(commas == line_fields - 1):
+        #...and every field a number. Depending on the NumPy version, the parser either raises an error at the first
+        #field that is not a number or warns and returns the values before it
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+
+            try:
+                values = np.fromstring(data.translate(_BLOCK_TABLE), dtype=np.float64, sep=',')
+            except (ValueError, DeprecationWarning):
+                values = None
+
+    if (values is None) or (len(values) != len(ends) * line_fields):
+        return parseLines([line for line in (l.strip() for l in data.split(b'\n')) if line], dtype)
+
+    #fields after the ones in use are cut off
+    if line_fields > num_fields:
+        values = np.ascontiguousarray(values.reshape(-1, line_fields)[:, :num_fields]).reshape(-1)
+
+    return values.view(dtype), 0
+
+
+#2-D float64 view (one row per sample, one column per field) of an array returned by parseLines()
+def recordValues(records):
+    return records.view(np.float64).reshape(-1, len(records.dtype.names))
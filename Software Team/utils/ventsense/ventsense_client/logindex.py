@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+# logindex.py
+# Helpful Engineering
+#
+# Purpose:
+# Time index over a directory of ventsense logs (ventsense_log_*.csv and .bin, as written by the
+# client, one per Arduino session), and range queries that read only the part of each log that
+# falls in the requested time range. E.g. to get the data from 14:02 to 14:05 on 13 October out of
+# a week of logs:
+#     python logindex.py logs --from="2026-10-13 14:02" --to="2026-10-13 14:05" --out=range.csv
+# or, from Python:
+#     index = logindex.openIndex('logs')
+#     data = index.query(start, end)      #start and end in seconds since the epoch
+# which returns a NumPy structured array with a 'time' field (seconds since the epoch), the
+# device's 'millis' timestamp, the number of the 'file' the sample came from (in index.files) and
+# one field per sensor value.
+#
+# Usage:
+#     python logindex.py <log directory> [--from=<time>] [--to=<time>] [--device=<name>]
+#                        [--fields=<names>] [--out=<file.csv>]
+#
+# Without --from or --to, the index is brought up to date and the logs it covers are listed. Times
+# are local, as "YYYY-MM-DD HH:MM[:SS]" or as in the log file names ("YYYY-MM-DD_HHhMMmSSs").
+#
+# Notes:
+# The index is kept next to the logs, in ventsense_index.json. For each log it holds the file's size
+# and modification time (to tell when it needs indexing again), its columns, its device (from the
+# file name, when several devices were logged at once), its first and last timestamps and, for CSV
+# logs, a sparse table of the byte offset and timestamp of every BLOCK_LINES-th line. Only logs that
+# are new or have changed are indexed again; a log that has grown (e.g. the one being written) is
+# indexed from where the last indexing stopped.
+#
+# A query looks up the blocks holding the requested range and parses just those bytes, from a
+# memory map of the file, so it reads at most two blocks more than it returns. Binary logs are
+# fixed-width, so they are memory mapped as a whole (see binlog.loadBinLog()) and searched directly.
+#
+# The logs hold the Arduino's timestamps (milliseconds since it started), not the time of day. The
+# time of a sample is taken from the time in the log's file name, when the log's first sample was
+# written (to the second), plus the time since the log's first sample. A reset starts a new log, but
+# millis() can wrap around (after about 49.7 days) within one, so the timestamps are made continuous
+# across the wrap as timing.SampleClock does: the index and the searches work on the timestamps plus
+# MILLIS_WRAP for every wraparound before them. The 'millis' field of a query holds the timestamps as
+# logged. Only the lines of the block in which a timestamp steps back are read to find the wraparound.
+
+import getopt
+import json
+import mmap
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+from channels import ChannelSchema
+from timing import MILLIS_WRAP, WRAP_WINDOW
+import binlog
+import lineparser
+
+INDEX_NAME = 'ventsense_index.json'
+INDEX_VERSION = 2
+
+BLOCK_LINES = 1024              #lines per block of the CSV block table
+SCAN_CHUNK = 16 * 1024 * 1024   #bytes scanned for line endings at a time while indexing
+
+LOG_FORMAT_CSV = 'csv'
+LOG_FORMAT_BIN = 'bin'
+
+#ventsense_log_<YYYY-MM-DD_hhmmss>[_<n>][_<device>].<csv/bin>, as written by ventsense.startNewLogFile(). <n> numbers
+#the logs started within the same second
+LOG_NAME_RE = re.compile(r'^ventsense_log_(\d{4}-\d{2}-\d{2}_\d{2}h\d{2}m\d{2}s)(?:_(\d+))?(?:_(.+))?\.(csv|bin)$')
+LOG_TIME_FORMAT = '%Y-%m-%d_%Hh%Mm%Ss'
+
+#time formats accepted by parseTime()
+TIME_FORMATS = [LOG_TIME_FORMAT, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']
+
+
+#parse a local time given as in TIME_FORMATS, or as seconds since the epoch. Raises ValueError if it is not valid
+def parseTime(time_str):
+    time_str = time_str.strip()
+
+    for fmt in TIME_FORMATS:
+        try:
+            return time.mktime(time.strptime(time_str, fmt))
+        except ValueError:
+            pass
+
+    return float(time_str)
+
+
+def formatTime(seconds):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(seconds))
+
+
+#true if the step from timestamp 'last' to 'millis' is a millis() wraparound, as timing.SampleClock tells them
+def _isWrap(last, millis):
+    return (millis < last) and (last >= MILLIS_WRAP - WRAP_WINDOW) and (millis < WRAP_WINDOW)
+
+
+#timestamps (oldest first) of consecutive samples, made continuous across millis() wraparounds
+def unwrapMillis(timestamps):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+
+    if len(timestamps) < 2:
+        return timestamps
+
+    last = timestamps[:-1]
+    wraps = (timestamps[1:] < last) & (last >= MILLIS_WRAP - WRAP_WINDOW) & (timestamps[1:] < WRAP_WINDOW)
+
+    if not wraps.any():
+        return timestamps
+
+    return timestamps + np.concatenate(([0], np.cumsum(wraps))) * float(MILLIS_WRAP)
+
+
+#timestamp of the line starting at 'offset' in 'data' (bytes or a memory map), or None if it is not a sample line
+def _lineMillis(data, offset):
+    end = data.find(b',', offset, offset + 32)
+
+    if end < 0:
+        return None
+
+    try:
+        return float(data[offset:end])
+    except ValueError:
+        return None
+
+
+class LogIndex(object):
+    #index of the logs in 'directory'. Call load() and update() (or use openIndex()) before querying. 'files' is the
+    #list of indexed logs, oldest first, each a dict as stored in the index file (see above)
+    def __init__(self, directory, block_lines=BLOCK_LINES):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_NAME)
+        self.block_lines = block_lines
+        self.files = []
+
+    #read the index file, if there is one and it was built the same way
+    def load(self):
+        try:
+            with open(self.path) as file:
+                index = json.load(file)
+        except (IOError, OSError, ValueError):
+            return
+
+        if (index.get('version') == INDEX_VERSION) and (index.get('block_lines') == self.block_lines):
+            self.files = index['files']
+
+    #write the index file. It is written to a temporary file first, so a reader never sees half of it
+    def save(self):
+        tmp_path = self.path + '.tmp'
+
+        with open(tmp_path, 'w') as file:
+            json.dump({'version': INDEX_VERSION, 'block_lines': self.block_lines, 'files': self.files}, file)
+
+        os.replace(tmp_path, self.path)
+
+    #bring the index up to date with the logs in the directory. Returns the number of logs that were (re)indexed
+    def update(self):
+        known = dict((entry['name'], entry) for entry in self.files)
+        files = []
+        num_indexed = 0
+
+        for name in sorted(os.listdir(self.directory)):
+            match = LOG_NAME_RE.match(name)
+            if not match:
+                continue
+
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            entry = known.get(name)
+
+            #a log that has only grown is indexed from where indexing stopped, anything else from the start
+            if ((entry is None) or (stat.st_size < entry['indexed_size']) or
+                    ((stat.st_size == entry['indexed_size']) and (stat.st_mtime != entry.get('mtime')))):
+                entry = {'name': name, 'format': match.group(4), 'device': match.group(3),
+                         'start_time': time.mktime(time.strptime(match.group(1), LOG_TIME_FORMAT)),
+                         'fields': None, 'first_millis': None, 'last_millis': None, 'lines': 0, 'indexed_size': 0,
+                         'header_len': 0, 'blocks': [], 'wraps': 0, 'last_line': None}
+
+            if (stat.st_size != entry.get('size')) or (stat.st_mtime != entry.get('mtime')):
+                if entry['format'] == LOG_FORMAT_BIN:
+                    self._indexBin(entry, path)
+                else:
+                    self._indexCsv(entry, path, stat.st_size)
+
+                entry['size'] = stat.st_size
+                entry['mtime'] = stat.st_mtime
+                num_indexed += 1
+
+            files.append(entry)
+
+        #oldest first, whatever the device
+        files.sort(key=lambda entry: (entry['start_time'], entry['name']))
+
+        self.files = files
+        return num_indexed
+
+    def _indexBin(self, entry, path):
+        records = binlog.loadBinLog(path)
+
+        with open(path, 'rb') as file:
+            dtype, entry['header_len'] = binlog.readHeader(file)
+
+        entry['fields'] = list(dtype.names)
+        entry['lines'] = len(records)
+        entry['indexed_size'] = entry['header_len'] + len(records) * dtype.itemsize
+
+        if len(records):
+            timestamps = unwrapMillis(records[dtype.names[0]])
+            entry['first_millis'] = float(timestamps[0])
+            entry['last_millis'] = float(timestamps[-1])
+
+    #index the complete lines of a CSV log from 'indexed_size' on. The file is scanned for line endings a chunk at a
+    #time, with NumPy, and only the lines that start a block (and the first and last sample lines) are parsed
+    def _indexCsv(self, entry, path, size):
+        if size == 0:
+            return
+
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if entry['fields'] is None:
+                first_line = data[:data.find(b'\n')].strip()
+
+                if first_line.startswith(b'time'):
+                    entry['fields'] = [name.strip() for name in first_line.decode('utf-8', 'ignore').split(',')]
+                else:
+                    #no header line: assume the firmware's layout for the number of columns
+                    entry['fields'] = ChannelSchema.forSensors(first_line.count(b',') // 2).field_names
+
+            pos = entry['indexed_size']
+            lines = entry['lines']
+
+            while pos < size:
+                chunk = np.frombuffer(data, dtype=np.uint8, count=min(SCAN_CHUNK, size - pos), offset=pos)
+                ends = np.flatnonzero(chunk == ord('\n'))
+                del chunk
+
+                #only a partial last line is left
+                if len(ends) == 0:
+                    break
+
+                starts = np.concatenate(([0], ends[:-1] + 1)) + pos
+
+                #the lines are looked at in order, as each is timed from the one looked at before it
+                if entry['first_millis'] is None:
+                    for start in starts.tolist():
+                        entry['first_millis'] = self._lineTime(entry, data, start)
+
+                        if entry['first_millis'] is not None:
+                            break
+
+                for start in starts[(-lines) % self.block_lines::self.block_lines].tolist():
+                    millis = self._lineTime(entry, data, start)
+
+                    if millis is not None:
+                        entry['blocks'].append([start, millis])
+
+                for start in starts[::-1].tolist():
+                    millis = self._lineTime(entry, data, start)
+
+                    if millis is not None:
+                        entry['last_millis'] = millis
+                        break
+
+                lines += len(ends)
+                pos += int(ends[-1]) + 1
+
+            entry['lines'] = lines
+            entry['indexed_size'] = pos
+
+        finally:
+            data.close()
+
+    #timestamp of the line starting at 'start' in a CSV log, made continuous across millis() wraparounds, or None if it is
+    #not a sample line. Lines must be given in order. If the timestamp is lower than that of the line given before, the
+    #lines in between are read to find the step back and tell whether it is a wraparound
+    def _lineTime(self, entry, data, start):
+        millis = _lineMillis(data, start)
+
+        if millis is None:
+            return None
+
+        last_line = entry['last_line']
+
+        if (last_line is not None) and (start > last_line):
+            prev = _lineMillis(data, last_line)
+
+            if millis < prev:
+                line = last_line
+                while line < start:
+                    line = data.find(b'\n', line) + 1
+                    line_millis = _lineMillis(data, line)
+
+                    if line_millis is None:
+                        continue
+
+                    if line_millis < prev:
+                        if _isWrap(prev, line_millis):
+                            entry['wraps'] += 1
+                        break
+
+                    prev = line_millis
+
+        if (last_line is None) or (start > last_line):
+            entry['last_line'] = start
+
+        return millis + entry['wraps'] * float(MILLIS_WRAP)
+
+    #start and end time (seconds since the epoch) of an indexed log, or None if it has no samples
+    def timeRange(self, entry):
+        if entry['first_millis'] is None:
+            return None
+
+        return entry['start_time'], entry['start_time'] + (entry['last_millis'] - entry['first_millis']) / 1000.0
+
+    #samples from 'start' to 'end' (seconds since the epoch, both included), oldest first, as a structured array (see
+    #above). 'device' limits the query to the logs of one device. 'fields' are the sensor value fields to return;
+    #by default, every field of the logs in the range. Logs that do not have a field get NaN for it
+    def query(self, start, end, device=None, fields=None):
+        entries = []
+
+        for file_idx, entry in enumerate(self.files):
+            time_range = self.timeRange(entry)
+
+            if (time_range is None) or (time_range[0] > end) or (time_range[1] < start):
+                continue
+            if (device is not None) and (entry['device'] != device):
+                continue
+
+            entries.append((file_idx, entry))
+
+        if fields is None:
+            fields = []
+            for _, entry in entries:
+                fields += [name for name in entry['fields'][1:] if name not in fields]
+
+        dtype = np.dtype([('time', np.float64), ('millis', np.float64), ('file', np.int32)] +
+                         [(name, np.float64) for name in fields])
+        parts = []
+
+        for file_idx, entry in entries:
+            #the range in the log's own timestamps
+            first_millis = entry['first_millis'] + (start - entry['start_time']) * 1000.0
+            last_millis = entry['first_millis'] + (end - entry['start_time']) * 1000.0
+
+            if entry['format'] == LOG_FORMAT_BIN:
+                records, timestamps = self._readBin(entry, first_millis, last_millis)
+            else:
+                records, timestamps = self._readCsv(entry, first_millis, last_millis)
+
+            if len(records) == 0:
+                continue
+
+            part = np.empty(len(records), dtype=dtype)
+            part['millis'] = records[entry['fields'][0]]
+            part['time'] = entry['start_time'] + (timestamps - entry['first_millis']) / 1000.0
+            part['file'] = file_idx
+
+            for name in fields:
+                part[name] = records[name] if name in records.dtype.names else np.nan
+
+            parts.append(part)
+
+        if not parts:
+            return np.zeros(0, dtype=dtype)
+
+        return np.concatenate(parts)
+
+    #the records of a log from 'first_millis' to 'last_millis' (continuous timestamps, see Notes above), and their
+    #continuous timestamps
+    def _readBin(self, entry, first_millis, last_millis):
+        records = binlog.loadBinLog(os.path.join(self.directory, entry['name']))
+
+        #only the part that was indexed, so that the answer does not depend on a log that is still being written
+        records = records[:entry['lines']]
+        timestamps = unwrapMillis(records[entry['fields'][0]])
+
+        lo = np.searchsorted(timestamps, first_millis, side='left')
+        hi = np.searchsorted(timestamps, last_millis, side='right')
+
+        return records[lo:hi], timestamps[lo:hi]
+
+    def _readCsv(self, entry, first_millis, last_millis):
+        blocks = entry['blocks']
+        block_millis = [millis for _, millis in blocks]
+
+        #from the last block starting before the range, to the first block starting after it
+        idx = np.searchsorted(block_millis, first_millis, side='right') - 1
+        lo, lo_millis = blocks[idx] if idx >= 0 else (0, None)
+
+        idx = np.searchsorted(block_millis, last_millis, side='right')
+        hi = blocks[idx][0] if idx < len(blocks) else entry['indexed_size']
+
+        dtype = lineparser.sampleDtype(entry['fields'])
+
+        if hi <= lo:
+            return np.zeros(0, dtype=dtype), np.zeros(0)
+
+        with open(os.path.join(self.directory, entry['name']), 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            lines = [line.strip() for line in data[lo:hi].split(b'\n')]
+
+            #the wraparounds before the first block read (none before the start of the log)
+            wrapped = (lo_millis - _lineMillis(data, lo)) if lo_millis is not None else 0.0
+        finally:
+            data.close()
+
+        #header and partial lines are dropped by the parser
+        records, _ = lineparser.parseLines([line for line in lines if line], dtype)
+        timestamps = unwrapMillis(records[entry['fields'][0]]) + wrapped
+
+        selected = (timestamps >= first_millis) & (timestamps <= last_millis)
+        return records[selected], timestamps[selected]
+
+
+#load the index of 'directory', update it and save it if anything changed
+def openIndex(directory):
+    index = LogIndex(directory)
+    index.load()
+
+    if index.update() or not os.path.isfile(index.path):
+        index.save()
+
+    return index
+
+
+def printHelp():
+    print('usage: python logindex.py <log directory> [--from=<time>] [--to=<time>] [--device=<name>]\n' +
+          '                          [--fields=<names>] [--out=<file.csv>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.gnu_getopt(argv, "h", ["from=", "to=", "device=", "fields=", "out="])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    if len(args) != 1:
+        printHelp()
+        sys.exit(2)
+
+    start = None
+    end = None
+    device = None
+    fields = None
+    out_path = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt in ('--from', '--to'):
+            try:
+                seconds = parseTime(arg)
+            except ValueError:
+                print('Invalid time: ' + arg + '. Use YYYY-MM-DD HH:MM[:SS]')
+                sys.exit(2)
+
+            if opt == '--from':
+                start = seconds
+            else:
+                end = seconds
+        elif opt == '--device':
+            device = arg
+        elif opt == '--fields':
+            fields = [name.strip() for name in arg.split(',')]
+        elif opt == '--out':
+            out_path = arg
+
+    index = openIndex(args[0])
+
+    #no range: list the logs
+    if (start is None) and (end is None):
+        for entry in index.files:
+            time_range = index.timeRange(entry)
+
+            if time_range is None:
+                print(entry['name'] + ': no samples')
+            else:
+                print(entry['name'] + ': ' + formatTime(time_range[0]) + ' to ' + formatTime(time_range[1]) +
+                      ', ' + str(entry['lines']) + ' lines')
+
+        print(str(len(index.files)) + ' logs')
+        return
+
+    if start is None:
+        start = float('-inf')
+    if end is None:
+        end = float('inf')
+
+    data = index.query(start, end, device, fields)
+
+    #the device's timestamps as integers and the values with two decimals, as in the logs
+    fmt = ['%.3f', '%d'] + ['%.2f'] * (len(data.dtype.names) - 3)
+    names = ['time', 'millis'] + list(data.dtype.names[3:])
+    columns = np.column_stack([data[name] for name in names]) if len(data) else np.zeros((0, len(names)))
+
+    if out_path is None:
+        print(','.join(names))
+        np.savetxt(sys.stdout, columns, fmt=fmt, delimiter=',')
+    else:
+        with open(out_path, 'w', newline='') as file:
+            file.write(','.join(names) + '\n')
+            np.savetxt(file, columns, fmt=fmt, delimiter=',')
+
+        print('Wrote ' + str(len(data)) + ' samples to ' + out_path)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# logwriter.py
+# Helpful Engineering
+#
+# Purpose:
+# Log file writing for the ventsense client. The acquisition threads hand their log data to a
+# LogWriter, which writes it to disk on its own thread in large blocks, and makes it durable with
+# fsync at a fixed interval or after a set amount of data, whichever comes first (group commit). A
+# crash or power loss then loses at most about one sync interval's worth of data, without a write
+# and a sync for every sample on the threads that read the serial ports. Log files can also be
+# rotated by size and by age, so that long unattended runs give files of a manageable size.
+#
+# Notes:
+# Each log stream (the log of one device, from one Arduino reset to the next) is a LogFile, returned
+# by LogWriter.open(). Writing to it only appends to a list, under a lock that the writer thread holds
+# just long enough to take the list, so a slow disk never holds up the serial port. The file itself
+# is created when the first data arrives, so a stream that is restarted before it gets any data (e.g.
+# when the Arduino resets right after the client starts) leaves no empty file behind. Every file of
+# a stream starts with the stream's header (the CSV header line, or the binary log header), so each
+# file of a rotated log can be read on its own.
+#
+# Files are named after the time their first data was written, to the second. That time is taken
+# by LogFile.write(), on the thread that writes, so it is the time the first sample arrived however
+# long the data waits for the writer thread (logindex.py dates every sample of a log from it). If
+# that name is already taken (e.g. a log was rotated, or the Arduino reset, twice within a second),
+# _1, _2, ... is added after the time, so a log is never appended to or overwritten by another and
+# the names still sort in order.
+#
+# If writing fails (e.g. the disk is full), the writer thread stops, and the error is raised by the
+# next write to any of its LogFiles, which ends that device's session as any other logging error.
+
+import os
+import threading
+import time
+import traceback
+
+from histogram import LatencyHistogram
+
+DEFAULT_SYNC_INTERVAL = 1.0         #seconds
+DEFAULT_SYNC_BYTES = 1024 * 1024
+
+#amount of data waiting to be written at which the writer thread wakes up early to write it
+BLOCK_SIZE = 65536 #bytes
+
+#log file names: <prefix>_<YYYY-MM-DD_hhmmss>[_<n>][_<device>].<extension>
+LOG_TIME_FORMAT = '%Y-%m-%d_%Hh%Mm%Ss'
+
+
+class LogFile(object):
+    #one log stream of a LogWriter (see LogWriter.open()). Takes text (CSV lines) or bytes, which are written in the
+    #order they are given
+    binary = False
+
+    def __init__(self, writer, prefix, extension, header=b'', device_name=None):
+        self.writer = writer
+        self.prefix = prefix
+        self.extension = extension
+        self.header = header
+        self.device_name = device_name
+        self.closed = False
+
+        #path of the stream's current file, once it has one
+        self.path = None
+
+        #only used by the writer thread
+        self._file = None
+        self._size = 0
+        self._created = 0.0
+        self._unsynced = 0
+
+    def write(self, data):
+        if self.writer.error is not None:
+            raise self.writer.error
+
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        else:
+            #the caller may reuse its buffer
+            data = bytes(data)
+
+        self.writer._put(self, data, time.time())
+
+    #data is written and synced by the writer thread
+    def flush(self):
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer._put(self, None, None)
+
+
+class LogWriter(threading.Thread):
+    #writes the data of any number of LogFiles on its own thread, in the directory 'directory'. Data is written at least
+    #every 'sync_interval' seconds (and as soon as BLOCK_SIZE bytes are waiting), and synced to disk every
+    #'sync_interval' seconds or whenever 'sync_bytes' bytes have been written to a file since it was last synced. A file
+    #is rotated (closed, and its stream carried on in a new file) once it holds 'rotate_bytes' bytes or is 'rotate_time'
+    #seconds old (0 for never)
+    def __init__(self, sync_interval=DEFAULT_SYNC_INTERVAL, sync_bytes=DEFAULT_SYNC_BYTES, rotate_bytes=0, rotate_time=0,
+                 directory='.'):
+        threading.Thread.__init__(self, name='ventsense-logwriter')
+        self.daemon = True
+
+        if sync_interval <= 0:
+            raise ValueError('sync_interval must be greater than 0')
+
+        self.sync_interval = float(sync_interval)
+        self.sync_bytes = int(sync_bytes)
+        self.rotate_bytes = int(rotate_bytes)
+        self.rotate_time = float(rotate_time)
+        self.directory = directory
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_bytes = 0
+        self._stopping = False
+
+        #streams that have a file open. Only used by the writer thread
+        self._open_files = []
+        self._directory_synced = True
+
+        #counters. 'max_backlog' is updated by the threads that write, the rest only by the writer thread
+        self.bytes_written = 0
+        self.files_created = 0
+        self.syncs = 0
+        self.max_backlog = 0    #largest number of bytes seen waiting to be written
+        self.write_latency = LatencyHistogram()
+        self.sync_latency = LatencyHistogram()
+
+        self.error = None
+        self.error_traceback = None
+
+        self.start_time = None
+        self.end_time = None
+
+    #start a new log stream. Its files are named <prefix>_<YYYY-MM-DD_hhmmss>[_<n>][_<device_name>].<extension> and each
+    #starts with 'header' (text or bytes)
+    def open(self, prefix, extension, header=b'', device_name=None):
+        if isinstance(header, str):
+            header = header.encode('utf-8')
+
+        return LogFile(self, prefix, extension, header, device_name)
+
+    #write and sync everything still waiting, close every file and stop the thread
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+
+        if self.is_alive():
+            self.join()
+        elif self.start_time is None:
+            #never started
+            self.run()
+
+    #seconds from the start of the writer thread until it ended (or until now, if still running)
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+
+        end = self.end_time
+        if end is None:
+            end = time.perf_counter()
+
+        return end - self.start_time
+
+    def stats(self):
+        elapsed = self.elapsed()
+        rate = self.bytes_written / elapsed if elapsed > 0 else 0.0
+
+        return ('files: ' + str(self.files_created) + ', bytes: ' + str(self.bytes_written) + ', bytes/s: ' +
+                '{:.0f}'.format(rate) + ', syncs: ' + str(self.syncs) + ', max backlog: ' + str(self.max_backlog) +
+                ' bytes, write latency: ' + self.write_latency.summary() + ', sync latency: ' +
+                self.sync_latency.summary())
+
+    #called from the threads that write, 'when' being the time.time() the data was written at. 'data' None closes the
+    #stream
+    def _put(self, log_file, data, when):
+        with self._cond:
+            self._pending.append((log_file, data, when))
+
+            if data is None:
+                return
+
+            self._pending_bytes += len(data)
+
+            if self._pending_bytes > self.max_backlog:
+                self.max_backlog = self._pending_bytes
+
+            if self._pending_bytes >= BLOCK_SIZE:
+                self._cond.notify()
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        next_sync = self.start_time + self.sync_interval
+
+        try:
+            while True:
+                with self._cond:
+                    if (not self._stopping) and (self._pending_bytes < BLOCK_SIZE):
+                        self._cond.wait(max(next_sync - time.perf_counter(), 0.0))
+
+                    pending = self._pending
+                    self._pending = []
+                    self._pending_bytes = 0
+                    stopping = self._stopping
+
+                self._writePending(pending)
+
+                now = time.perf_counter()
+                if stopping or (now >= next_sync):
+                    self._syncAll()
+                    next_sync = now + self.sync_interval
+
+                if stopping:
+                    break
+
+        except Exception as e:
+            self.error = e
+            self.error_traceback = traceback.format_exc()
+
+        finally:
+            for log_file in list(self._open_files):
+                try:
+                    self._closeFile(log_file)
+                except Exception:
+                    pass
+
+            self.end_time = time.perf_counter()
+
+    #write a batch of (LogFile, data, time) entries, in order for each file, one block per file
+    def _writePending(self, pending):
+        chunks = {}
+        order = []
+
+        for log_file, data, when in pending:
+            if log_file not in chunks:
+                chunks[log_file] = []
+                order.append(log_file)
+
+            chunks[log_file].append((data, when))
+
+        for log_file in order:
+            block = []
+            block_len = 0
+
+            for data, when in chunks[log_file]:
+                if data is None:
+                    self._writeBlock(log_file, block)
+                    self._closeFile(log_file)
+                    block = []
+                    block_len = 0
+                    continue
+
+                if (log_file._file is not None) and self._rotateDue(log_file, block_len):
+                    self._writeBlock(log_file, block)
+                    self._closeFile(log_file)
+                    block = []
+                    block_len = 0
+
+                if log_file._file is None:
+                    self._createFile(log_file, when)
+
+                block.append(data)
+                block_len += len(data)
+
+            self._writeBlock(log_file, block)
+
+    def _rotateDue(self, log_file, block_len):
+        if (self.rotate_bytes > 0) and (log_file._size + block_len >= self.rotate_bytes):
+            return True
+
+        return (self.rotate_time > 0) and (time.perf_counter() - log_file._created >= self.rotate_time)
+
+    #create the next file of a stream, named after 'when', the time.time() its first data was written at, and numbered
+    #if that name is taken
+    def _createFile(self, log_file, when):
+        timestr = time.strftime(LOG_TIME_FORMAT, time.localtime(when))
+        number = 0
+
+        while True:
+            name = log_file.prefix + '_' + timestr
+            if number > 0:
+                name += '_' + str(number)
+            if log_file.device_name is not None:
+                name += '_' + log_file.device_name
+            path = os.path.join(self.directory, name + '.' + log_file.extension)
+
+            try:
+                file = open(path, 'xb')
+                break
+            except FileExistsError:
+                number += 1
+
+        log_file.path = path
+        log_file._file = file
+        log_file._size = 0
+        log_file._created = time.perf_counter()
+        log_file._unsynced = 0
+
+        self._open_files.append(log_file)
+        self._directory_synced = False
+        self.files_created += 1
+
+        self._writeBlock(log_file, [log_file.header])
+
+    def _writeBlock(self, log_file, block):
+        data = b''.join(block)
+
+        if not data:
+            return
+
+        t0 = time.perf_counter()
+        log_file._file.write(data)
+        log_file._file.flush()
+        self.write_latency.recordSeconds(time.perf_counter() - t0)
+
+        log_file._size += len(data)
+        log_file._unsynced += len(data)
+        self.bytes_written += len(data)
+
+        if log_file._unsynced >= self.sync_bytes:
+            self._syncFile(log_file)
+
+    def _syncFile(self, log_file):
+        t0 = time.perf_counter()
+        os.fsync(log_file._file.fileno())
+        self.sync_latency.recordSeconds(time.perf_counter() - t0)
+
+        self.syncs += 1
+        log_file._unsynced = 0
+
+    def _syncAll(self):
+        for log_file in self._open_files:
+            if log_file._unsynced > 0:
+                self._syncFile(log_file)
+
+        self._syncDirectory()
+
+    #a new file is only sure to be found after a crash once the directory holding it has been synced too. This can
+    #only be done on POSIX systems
+    def _syncDirectory(self):
+        if self._directory_synced or (not hasattr(os, 'O_DIRECTORY')):
+            return
+
+        self._directory_synced = True
+
+        try:
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+
+        try:
+            os.fsync(fd)
+        except OSError:
+            #not supported by every file system
+            pass
+        finally:
+            os.close(fd)
+
+    def _closeFile(self, log_file):
+        if log_file._file is None:
+            return
+
+        if log_file._unsynced > 0:
+            self._syncFile(log_file)
+
+        log_file._file.close()
+        log_file._file = None
+        self._open_files.remove(log_file)
+        self._syncDirectory()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# profiling.py
+# Helpful Engineering
+#
+# Purpose:
+# Per-stage timing of the ventsense client's hot paths, for the --profile option. The acquisition
+# threads and the render loop are split into stages (reading the serial port, decoding, logging,
+# parsing, ..., autoscaling, drawing, blitting, handling window events) and the time each pass spends
+# in each stage is added to a histogram. The client prints a breakdown of the stages periodically,
+# along with the plot queue depth and samples per second, and writes a summary of the whole run to a
+# JSON file on exit, named as follows:
+#     ventsense_profile_<YYYY-MM-DD_hhmmss>.json
+# so a run with a replayed log or simulated data (e.g. -p "sim://?rate=1000&count=60000" --speed=max)
+# can be compared with earlier ones, for instance in CI.
+#
+# Usage:
+#     profile = profiler.addProfile('acquisition', ['read', 'decode', 'parse'])
+#     t = clock()
+#     ...read...
+#     t = profile.lap(STAGE_READ, t)
+#     ...decode...
+#     t = profile.lap(STAGE_DECODE, t)
+#
+# Notes:
+# Times are integer nanoseconds from time.perf_counter_ns() (monotonic, and not subject to the
+# rounding of a float), or from time.perf_counter() before Python 3.7.
+#
+# The histograms are the HDR-style LatencyHistograms of histogram.py, which keep every time to within
+# about 3% in a fixed amount of memory, and find its bucket with integer operations only, so timing a
+# stage costs a few hundred nanoseconds.
+#
+# Code that is profiled holds a StageProfile, or None when profiling is off, and only times its stages
+# if it is not None, so with --profile off the cost is one comparison per stage.
+#
+# Each histogram is only written by the thread that owns its profile. The periodic report takes a
+# copy of the counts from the main thread without a lock, so a report can be off by the odd sample
+# recorded while it was being taken, but nothing is lost from the totals.
+
+import json
+import time
+
+from histogram import LatencyHistogram, SUB_BUCKET_BITS, HISTOGRAM_BUCKETS
+
+#monotonic time in integer nanoseconds
+try:
+    clock = time.perf_counter_ns
+except AttributeError:
+    def clock():
+        return int(time.perf_counter() * 1e9)
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+DEFAULT_PROFILE_INTERVAL = 5.0 #seconds between reports
+
+
+#count, total, mean, percentiles and longest time of a stage's LatencyHistogram, in microseconds (total in
+#milliseconds), for the JSON summary
+def stageSummary(histogram):
+    count = histogram.count
+    result = {'count': count, 'total_ms': histogram.total / 1e6,
+              'mean_us': histogram.total / 1e3 / count if count else None}
+
+    for pct in PERCENTILES:
+        value = histogram.percentile(pct)
+        result['p' + '{:g}'.format(pct) + '_us'] = value / 1e3 if value is not None else None
+
+    result['max_us'] = histogram.max / 1e3
+    return result
+
+
+class StageProfile(object):
+    #times of the stages of one thread's loop. 'stages' are the names of the stages, which are timed by their index
+    def __init__(self, name, stages):
+        self.name = name
+        self.stages = list(stages)
+        self.histograms = [LatencyHistogram() for _ in self.stages]
+
+        self._previous = [histogram.copy() for histogram in self.histograms]
+
+    #record the time from 't0' (a clock() time) until now as a pass through stage 'stage', and return now, so that the
+    #next stage can be timed from it
+    def lap(self, stage, t0):
+        t1 = clock()
+        ns = t1 - t0
+
+        #LatencyHistogram.record(), inlined as this is called several times per sample
+        histogram = self.histograms[stage]
+        shift = ns.bit_length() - SUB_BUCKET_BITS - 1
+        if shift > 0:
+            idx = (shift << SUB_BUCKET_BITS) + (ns >> shift)
+            if idx >= HISTOGRAM_BUCKETS:
+                idx = HISTOGRAM_BUCKETS - 1
+        else:
+            idx = ns
+
+        histogram.counts[idx] += 1
+        histogram.count += 1
+        histogram.total += ns
+
+        if ns > histogram.max:
+            histogram.max = ns
+
+        return t1
+
+    #histograms of the times recorded since the previous call (or since the start), one per stage
+    def takeInterval(self):
+        current = [histogram.copy() for histogram in self.histograms]
+        interval = [now.since(then) for now, then in zip(current, self._previous)]
+        self._previous = current
+        return interval
+
+
+class Profiler(object):
+    #the StageProfiles of the client's threads, with a periodic report every 'interval' seconds
+    def __init__(self, interval=DEFAULT_PROFILE_INTERVAL):
+        self.interval = interval
+        self.profiles = []
+
+        self.start_time = time.perf_counter()
+        self.reports = 0
+
+        self._next_report = self.start_time + interval
+        self._last_report = self.start_time
+        self._last_samples = 0
+        self._last_frames = 0
+
+    def addProfile(self, name, stages):
+        profile = StageProfile(name, stages)
+        self.profiles.append(profile)
+        return profile
+
+    #true once it is time for the next report
+    def due(self):
+        return time.perf_counter() >= self._next_report
+
+    #breakdown of the time spent in each stage since the previous report, as a share of the time that has passed, with
+    #the median and 99th percentile of a single pass. 'samples' is the number of samples read so far, 'frames' the
+    #number of plot frames drawn so far, and 'sample_queue' the plot's SampleQueue (or None)
+    def report(self, samples, frames=0, sample_queue=None):
+        now = time.perf_counter()
+        elapsed = max(now - self._last_report, 1e-9)
+
+        line = ('Profile ' + '{:.1f}'.format(now - self.start_time) + ' s: ' +
+                '{:.1f}'.format((samples - self._last_samples) / elapsed) + ' samples/s')
+        if sample_queue is not None:
+            line += (', ' + '{:.1f}'.format((frames - self._last_frames) / elapsed) + ' frames/s, plot queue ' +
+                     str(len(sample_queue)) + ' (max ' + str(sample_queue.max_depth) + ', dropped ' +
+                     str(sample_queue.dropped) + ')')
+
+        lines = [line, '    %-28s %9s %7s %10s %10s %10s' % ('stage', 'calls', 'share', 'p50 us', 'p99 us', 'max us')]
+
+        for profile in self.profiles:
+            for stage, histogram in zip(profile.stages, profile.takeInterval()):
+                count = histogram.count
+                if count == 0:
+                    continue
+
+                lines.append('    %-28s %9d %6.1f%% %10.1f %10.1f %10.1f' %
+                             (profile.name + '.' + stage, count, 100.0 * histogram.total / 1e9 / elapsed,
+                              histogram.percentile(50) / 1e3, histogram.percentile(99) / 1e3, histogram.max / 1e3))
+
+        self.reports += 1
+        self._next_report = max(self._next_report + self.interval, now)
+        self._last_report = now
+        self._last_samples = samples
+        self._last_frames = frames
+
+        return '\n'.join(lines)
+
+    #summary of the whole run, as a dict that can be written as JSON. Arguments as for report()
+    def summary(self, samples, frames=0, sample_queue=None):
+        elapsed = time.perf_counter() - self.start_time
+
+        result = {'elapsed_s': elapsed, 'samples': samples, 'samples_per_s': samples / elapsed if elapsed > 0 else 0.0,
+                  'frames': frames, 'stages': {}}
+
+        if sample_queue is not None:
+            result['queue'] = {'received': sample_queue.received, 'dropped': sample_queue.dropped,
+                               'max_depth': sample_queue.max_depth, 'maxsize': sample_queue.maxsize}
+
+        for profile in self.profiles:
+            for stage, histogram in zip(profile.stages, profile.histograms):
+                result['stages'][profile.name + '.' + stage] = stageSummary(histogram)
+
+        return result
+
+    #write summary() to the JSON file 'path'
+    def dump(self, path, samples, frames=0, sample_queue=None, **extra):
+        result = self.summary(samples, frames, sample_queue)
+        result.update(extra)
+
+        with open(path, 'w') as file:
+            json.dump(result, file, indent=2, sort_keys=True)
+            file.write('\n')
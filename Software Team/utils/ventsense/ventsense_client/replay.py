@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+# replay.py
+# Helpful Engineering
+#
+# Purpose:
+# Offline replay of recorded ventsense logs. ReplaySerial behaves like the pySerial port the client
+# normally reads from, but streams the lines of a ventsense_log_*.csv (or .bin) file, paced by the
+# file's timestamp column. That way a recorded session goes through exactly the same parsing,
+# logging and plotting code as live data, with no hardware attached. Used by the client when the
+# serial port is given as replay://<path to log file>.
+#
+# Notes:
+# speed is a multiple of real time (1 = as recorded, 10 = ten times faster). A speed of None
+# replays as fast as the client can take the data, which is useful for measuring throughput.
+#
+# When a recorded timestamp goes backwards (the Arduino was reset during the session), pacing
+# starts again from the new timestamp.
+#
+# Once the whole file has been read, reads raise ReplayFinished, an EOFError, which the acquisition
+# thread treats as the normal end of the data.
+
+import os
+import time
+
+URL_PREFIX = 'replay://'
+
+SPEED_MAX = 'max'
+
+READ_CHUNK = 65536 #bytes
+
+
+class ReplayFinished(EOFError):
+    pass
+
+
+#parse a --speed argument. Returns a positive float, or None for 'max'
+def parseSpeed(arg):
+    if str(arg).lower() == SPEED_MAX:
+        return None
+
+    speed = float(arg)
+    if speed <= 0:
+        raise ValueError('speed must be greater than 0')
+
+    return speed
+
+
+class ReplaySerial(object):
+    #word used in summary(), so that subclasses producing data from other sources can describe themselves
+    SUMMARY_VERB = 'Replayed'
+
+    def __init__(self, path, speed=1.0, timeout=None):
+        self.path = path
+        self.speed = speed
+        self.timeout = timeout
+        self.dtr = 0
+        self.rts = 0
+
+        self.lines_replayed = 0
+        self.bytes_replayed = 0
+
+        #optional callback, called with (line, due time) as each line becomes available to read
+        self.on_line = None
+
+        self._lines = None
+        self._next = None
+        self._pending = bytearray()
+        self._anchor = None         #(device timestamp, wall clock time) that pacing is relative to
+        self._last_ts = None
+        self._start_time = None
+        self._end_time = None
+        self.is_open = False
+
+    def open(self):
+        self._lines = self._openLines()
+        self._advance()
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+        self._lines = None
+
+    def flushInput(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    #number of bytes that are due and ready to read right now
+    @property
+    def in_waiting(self):
+        self._fill(READ_CHUNK, False)
+        return len(self._pending)
+
+    def readline(self):
+        idx = self._pending.find(b'\n')
+
+        if idx < 0:
+            self._fill(1, True)
+            idx = self._pending.find(b'\n')
+
+        if idx < 0:
+            if self._next is None:
+                if self._pending:
+                    return self._take(len(self._pending))
+                self._finish()
+            return b''
+
+        return self._take(idx + 1)
+
+    def read(self, size=1):
+        if not self._pending:
+            self._fill(size, True)
+
+        if not self._pending:
+            if self._next is None:
+                self._finish()
+            return b''
+
+        return self._take(min(size, len(self._pending)))
+
+    #seconds from the first read until the end of the data (or until now, if not at the end yet)
+    def elapsed(self):
+        if self._start_time is None:
+            return 0.0
+
+        end = self._end_time
+        if end is None:
+            end = time.perf_counter()
+
+        return end - self._start_time
+
+    #summary of the replay, for printing at the end of a session
+    def summary(self):
+        if self._start_time is None:
+            return self.SUMMARY_VERB + ' 0 lines'
+
+        elapsed = self.elapsed()
+        rate = self.lines_replayed / elapsed if elapsed > 0 else 0.0
+
+        return (self.SUMMARY_VERB + ' ' + str(self.lines_replayed) + ' lines in ' + '{:.2f}'.format(elapsed) + ' s (' +
+                '{:.0f}'.format(rate) + ' samples/s)')
+
+    def _finish(self):
+        if self._end_time is None:
+            self._end_time = time.perf_counter()
+        raise ReplayFinished('End of data: ' + self.path)
+
+    def _take(self, size):
+        out = bytes(self._pending[:size])
+        del self._pending[:size]
+        return out
+
+    def _advance(self):
+        try:
+            self._next = next(self._lines)
+        except StopIteration:
+            self._next = None
+
+    #wall clock time at which a line with the given device timestamp (ms) is due
+    def _dueTime(self, ts, now):
+        if (self.speed is None) or (ts is None):
+            return now
+
+        if (self._anchor is None) or (ts < self._last_ts):
+            self._anchor = (ts, now)
+
+        self._last_ts = ts
+
+        return self._anchor[1] + (ts - self._anchor[0]) / 1000.0 / self.speed
+
+    #move lines that are due onto the pending buffer, until at least 'size' bytes are pending. If
+    #'block' is set and nothing is pending yet, wait (up to the timeout) for the next line to be due
+    def _fill(self, size, block):
+        now = time.perf_counter()
+
+        if self._start_time is None:
+            self._start_time = now
+
+        while (self._next is not None) and (len(self._pending) < size):
+            line, ts, due = self._next
+
+            if due is None:
+                due = self._dueTime(ts, now)
+                self._next = (line, ts, due)
+
+            if due > now:
+                if not block or self._pending:
+                    break
+
+                wait = due - now
+                if (self.timeout is not None) and (wait > self.timeout):
+                    time.sleep(self.timeout)
+                    break
+
+                time.sleep(wait)
+                now = time.perf_counter()
+                continue
+
+            self._pending += line
+            self.lines_replayed += 1
+            self.bytes_replayed += len(line)
+
+            if self.on_line is not None:
+                self.on_line(line, due)
+
+            self._advance()
+
+    #return an iterator over the (line, timestamp, None) tuples to replay
+    def _openLines(self):
+        if not os.path.isfile(self.path):
+            raise IOError('Replay file not found: ' + self.path)
+
+        if os.path.splitext(self.path)[1].lower() == '.bin':
+            return self._binLines()
+
+        return self._csvLines()
+
+    def _csvLines(self):
+        with open(self.path, 'rb') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+
+                try:
+                    ts = float(line.split(b',', 1)[0])
+                except ValueError:
+                    ts = None
+
+                yield (line, ts, None)
+
+    def _binLines(self):
+        #imported here, so that replaying CSV logs does not need NumPy
+        from binlog import loadBinLog
+
+        records = loadBinLog(self.path)
+        names = records.dtype.names
+
+        yield ((','.join(names) + '\r\n').encode('utf-8'), None, None)
+
+        for record in records:
+            ts = int(record[0])
+            line = str(ts) + ',' + ','.join('{:.2f}'.format(v) for v in list(record)[1:]) + '\r\n'
+
+            yield (line.encode('utf-8'), float(ts), None)
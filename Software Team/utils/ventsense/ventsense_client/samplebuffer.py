@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# samplebuffer.py
+# Helpful Engineering
+#
+# Purpose:
+# Fixed-capacity sample history used by the ventsense client for plotting. Replaces the old
+# approach of prepending every sample to a Python list (which copied the whole history on every
+# sample and grew without bound) with a preallocated NumPy-backed circular buffer.
+#
+# Notes:
+# Every sample is written twice, at position p and at position p + capacity of an array that is
+# twice as long as the capacity. That way the most recent N samples are always one contiguous
+# slice of the array, no matter where the write position has wrapped to, and can be handed to
+# matplotlib as a view without copying. Appends are O(1) and memory use is fixed at creation.
+
+import numpy as np
+
+
+class SampleRingBuffer(object):
+    #create a buffer holding up to 'capacity' samples, each made of one time value and
+    #'num_channels' data values
+    def __init__(self, capacity, num_channels, dtype=np.float64):
+        if capacity < 1:
+            raise ValueError('capacity must be at least 1')
+
+        self.capacity = int(capacity)
+        self.num_channels = int(num_channels)
+
+        #one row per channel, so that each channel's window is a contiguous view
+        self._data = np.zeros((self.num_channels, 2 * self.capacity), dtype=dtype)
+        self._time = np.zeros(2 * self.capacity, dtype=np.float64)
+
+        self._pos = 0       #next write position, always in [0, capacity)
+        self.count = 0      #number of valid samples, saturates at capacity
+        self.total = 0      #number of samples appended since creation/clear
+
+    def __len__(self):
+        return self.count
+
+    def clear(self):
+        self._pos = 0
+        self.count = 0
+        self.total = 0
+
+    #append one sample. 'values' is a sequence of num_channels numbers
+    def append(self, t, values):
+        p = self._pos
+        q = p + self.capacity
+
+        self._time[p] = t
+        self._time[q] = t
+        self._data[:, p] = values
+        self._data[:, q] = values
+
+        p += 1
+        if p == self.capacity:
+            p = 0
+        self._pos = p
+
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+
+    #append a batch of samples. 't' has shape (n,) and 'values' has shape (num_channels, n)
+    def extend(self, t, values):
+        t = np.asarray(t, dtype=np.float64)
+        values = np.asarray(values)
+        n = t.shape[0]
+
+        if n == 0:
+            return
+
+        self.total += n
+
+        #only the newest 'capacity' samples can survive, so skip the rest
+        if n > self.capacity:
+            t = t[n - self.capacity:]
+            values = values[:, n - self.capacity:]
+            self._pos = (self._pos + n - self.capacity) % self.capacity
+            n = self.capacity
+
+        idx = (self._pos + np.arange(n)) % self.capacity
+
+        self._time[idx] = t
+        self._time[idx + self.capacity] = t
+        self._data[:, idx] = values
+        self._data[:, idx + self.capacity] = values
+
+        self._pos = (self._pos + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    #return (time, data) views of the newest n samples (all samples if n is None), ordered from
+    #oldest to newest. data has shape (num_channels, n). The views are only valid until the next
+    #append, as they share memory with the buffer
+    def window(self, n=None):
+        if (n is None) or (n > self.count):
+            n = self.count
+
+        end = self._pos + self.capacity
+        start = end - n
+
+        return self._time[start:end], self._data[:, start:end]
+
+    #return a view of the newest n samples of a single channel, oldest to newest
+    def channel(self, ch, n=None):
+        if (n is None) or (n > self.count):
+            n = self.count
+
+        end = self._pos + self.capacity
+
+        return self._data[ch, end - n:end]
+
+    #return the newest sample as (time, values view)
+    def latest(self):
+        if self.count == 0:
+            raise IndexError('buffer is empty')
+
+        p = self._pos - 1 + self.capacity
+
+        return self._time[p], self._data[:, p]
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+# simulator.py
+# Helpful Engineering
+#
+# Purpose:
+# Host-side generator of synthetic ventsense sensor data, in exactly the line protocol the
+# firmware sends (including the "timestamp,temp 1,press 1,..." header the client uses to detect an
+# Arduino reset), or in its binary frames (see framing.py). Used to exercise and benchmark the
+# client without a board attached.
+#
+# The generator can feed the client in two ways:
+#   - in-process, by giving the client a sim:// URL instead of a serial port, e.g.
+#         python ventsense.py -p "sim://?rate=100&sensors=3&noise=0.05" --speed=max
+#   - through a pseudo-terminal (Linux/macOS), which the client opens like a real serial port:
+#         python simulator.py --pty --rate=100
+#     prints the name of the pty (e.g. /dev/pts/3) to pass to the client with -p.
+#
+# Usage:
+#     python simulator.py [--pty | --stdout] [OPTIONS]
+#
+# Options (also accepted as sim:// URL parameters, without the leading dashes):
+#     --rate=<Hz>          Sample rate. Defaults to 10
+#     --sensors=<number>   Number of sensors. Defaults to 3
+#     --bpm=<number>       Breaths per minute. Defaults to 15
+#     --ie=<number>        Expiratory part of the I:E ratio (i.e. 2 means 1:2). Defaults to 2
+#     --pip=<cmH2O>        Peak inspiratory pressure above atmospheric. Defaults to 20
+#     --peep=<cmH2O>       Positive end-expiratory pressure. Defaults to 5
+#     --compliance=<mL/cmH2O>
+#                          Lung compliance, which sets the flow (and so the tidal volume). Defaults to 30
+#     --orifice=<k>        Calibration of the flow element between neighbouring sensors, in L/min per
+#                          sqrt(hPa) (as for the client's --flow-k). Defaults to 100
+#     --noise=<hPa>        Standard deviation of the noise added to each pressure. Defaults to 0.02
+#     --reset=<seconds>    Simulate an Arduino reset every this many seconds. Defaults to 0 (never)
+#     --corrupt=<number>   Probability that a line is corrupted on the wire. Defaults to 0
+#     --drop=<number>      Probability that a line is lost on the wire. Defaults to 0
+#     --jitter=<ms>        Random delay of up to this much added to each sample's timestamp. Defaults to 0
+#     --millis=<ms>        millis() at the first sample of each session. Defaults to 500. Set it close
+#                          to 4294967296 (2^32) to see millis() wrap around
+#     --frames=<0/1>       Send binary frames rather than lines of text after the header, as the
+#                          firmware does once the client has asked for them. Defaults to 0
+#     --count=<number>     Number of samples to generate before stopping. Defaults to 0 (no limit)
+#     --seed=<number>      Random seed, for repeatable data
+#
+# Notes:
+# Sensor 1 reads ambient pressure (it is the default atmospheric sensor for the client's relative
+# plot). The other sensors sit at points along the breathing circuit, with a flow element (an
+# orifice) between each one and the next, and the last one at the patient. So they all see the
+# airway pressure, plus the pressure drop across the orifices between them and the patient, which
+# follows the flow into and out of the lungs (flow = compliance * rate of change of the airway
+# pressure). E.g. with 3 sensors, the client's --flow=2-3 measures that flow.
+#
+# Timestamps are millis() values, as sent by the firmware: they count from --millis at every
+# simulated reset, and wrap around at 2^32 like the firmware's unsigned long. Lost lines (--drop)
+# leave a gap in the timestamps, as when the firmware's serial buffer overflows.
+#
+# A sim:// source also answers the firmware's commands (see framing.py): the client's --wire=frames
+# switches it to frames, whatever --frames says, and a simulated reset switches it back to text,
+# as on the Arduino. It keeps its own --rate, whatever sample interval the client asks for. Frames
+# are numbered as the firmware numbers them, so lost ones (--drop) leave a gap in the sequence, and
+# corrupted ones (--corrupt) fail their CRC.
+
+import getopt
+import math
+import os
+import random
+import sys
+import time
+
+try:
+    from urllib.parse import parse_qsl
+except ImportError:
+    from urlparse import parse_qsl
+
+from replay import ReplaySerial
+from framing import FrameEncoder, COMMAND_FRAMES, COMMAND_TEXT, REPLY_FRAMES, REPLY_TEXT
+
+URL_PREFIX = 'sim://'
+
+HPA_PER_CMH2O = 1.0 / 1.01974
+ATMOSPHERIC_PRESSURE = 1013.25 #hPa
+
+NOISE_TABLE_SIZE = 8191
+
+#startup time of the firmware, between printing the header and the first sample
+RESET_DELAY = 500 #ms
+
+#millis() is an unsigned long
+MILLIS_WRAP = 2 ** 32
+
+DEFAULTS = {
+    'rate': 10.0,
+    'sensors': 3,
+    'bpm': 15.0,
+    'ie': 2.0,
+    'pip': 20.0,
+    'peep': 5.0,
+    'compliance': 30.0,
+    'orifice': 100.0,
+    'noise': 0.02,
+    'reset': 0.0,
+    'corrupt': 0.0,
+    'drop': 0.0,
+    'jitter': 0.0,
+    'millis': RESET_DELAY,
+    'frames': 0,
+    'count': 0,
+    'seed': None,
+}
+
+
+#convert option values (strings, from the command line or a URL) to their proper types
+def parseOptions(items):
+    options = dict(DEFAULTS)
+
+    for key, value in items:
+        key = key.lstrip('-').lower()
+
+        if key not in DEFAULTS:
+            raise ValueError('Unknown simulator option: ' + key)
+
+        if key in ('sensors', 'count', 'seed', 'millis', 'frames'):
+            options[key] = int(value)
+        else:
+            options[key] = float(value)
+
+    if options['rate'] <= 0:
+        raise ValueError('rate must be greater than 0')
+    if options['sensors'] < 1:
+        raise ValueError('sensors must be at least 1')
+    if options['orifice'] <= 0:
+        raise ValueError('orifice must be greater than 0')
+
+    return options
+
+
+class SensorSimulator(object):
+    def __init__(self, rate=10.0, sensors=3, bpm=15.0, ie=2.0, pip=20.0, peep=5.0, compliance=30.0,
+                 orifice=100.0, noise=0.02, reset=0.0, corrupt=0.0, drop=0.0, jitter=0.0, millis=RESET_DELAY,
+                 frames=0, count=0, seed=None):
+        self.rate = float(rate)
+        self.sensors = int(sensors)
+        self.period = 60.0 / bpm
+        self.insp_time = self.period / (1.0 + ie)
+        self.pip = pip
+        self.peep = peep
+        self.compliance = compliance
+        self.orifice = orifice
+        self.reset = reset
+        self.corrupt = corrupt
+        self.drop = drop
+        self.jitter = jitter
+        self.millis = millis
+        self.frames = bool(frames)
+        self.count = count
+
+        #the firmware starts in text mode at every reset. Switched to frames by --frames or a command (see command())
+        self.send_frames = self.frames
+        self._encoder = FrameEncoder(self.sensors)
+
+        self._rng = random.Random(seed)
+
+        #noise is drawn from a precomputed table, so generating a line costs about the same as
+        #formatting it
+        self._noise = [self._rng.gauss(0.0, noise) for _ in range(NOISE_TABLE_SIZE)]
+        self._noise_idx = 0
+
+        self.lines_generated = 0
+        self.resets_generated = 0
+        self.corrupt_generated = 0
+        self.dropped_generated = 0
+
+    #handle a command line from the client (bytes, without its newline) as the firmware does, returning the reply line
+    #to send, or None if it is not a command
+    def command(self, line):
+        line = line.strip()
+
+        if line[0:1] == COMMAND_FRAMES.encode('ascii'):
+            self.send_frames = True
+            return REPLY_FRAMES + b' ' + line[1:] + b'\r\n'
+
+        if line[0:1] == COMMAND_TEXT.encode('ascii'):
+            self.send_frames = False
+            return REPLY_TEXT + b'\r\n'
+
+        return None
+
+    def header(self):
+        names = ['timestamp']
+        for j in range(self.sensors):
+            names.append('temp ' + str(j + 1))
+            names.append('press ' + str(j + 1))
+
+        return ','.join(names)
+
+    #airway pressure in cmH2O above atmospheric, t seconds into the session
+    def airwayPressure(self, t):
+        phase = t % self.period
+
+        if phase < self.insp_time:
+            #pressure-controlled inspiration: fast rise towards PIP
+            return self.peep + (self.pip - self.peep) * (1.0 - math.exp(-phase / 0.08))
+
+        #passive expiration: exponential decay back to PEEP
+        p_end = self.peep + (self.pip - self.peep) * (1.0 - math.exp(-self.insp_time / 0.08))
+        return self.peep + (p_end - self.peep) * math.exp(-(phase - self.insp_time) / 0.25)
+
+    #flow into the lungs in L/min, t seconds into the session: compliance times the rate of change of the
+    #airway pressure
+    def airwayFlow(self, t):
+        phase = t % self.period
+
+        if phase < self.insp_time:
+            dp_dt = (self.pip - self.peep) / 0.08 * math.exp(-phase / 0.08)
+        else:
+            p_end = self.peep + (self.pip - self.peep) * (1.0 - math.exp(-self.insp_time / 0.08))
+            dp_dt = -(p_end - self.peep) / 0.25 * math.exp(-(phase - self.insp_time) / 0.25)
+
+        #mL/s to L/min
+        return self.compliance * dp_dt * 0.06
+
+    #pressure drop (hPa) across one flow element for a given flow (L/min)
+    def orificeDrop(self, flow):
+        return math.copysign((flow / self.orifice) ** 2, flow)
+
+    #generate (line, timestamp) tuples. Each line is bytes ending in \r\n, as sent by Serial.println(), or a binary frame
+    #when sending frames
+    def lines(self):
+        header = (self.header() + '\r\n').encode('ascii')
+        fmt = '%d' + ',%.2f' * (2 * self.sensors) + '\r\n'
+        noise = self._noise
+        num_samples = 0
+        session_start = 0   #sample index at which the current (simulated) Arduino session started
+
+        yield (header, None)
+
+        while (self.count <= 0) or (num_samples < self.count):
+            t = (num_samples - session_start) / self.rate
+
+            #simulated Arduino reset: header again and millis() starts over
+            if (self.reset > 0) and (t >= self.reset):
+                self.resets_generated += 1
+                session_start = num_samples
+                self.send_frames = self.frames
+                self._encoder.reset()
+                yield (header, None)
+                continue
+
+            millis = self.millis + int(t * 1000.0)
+            if self.jitter > 0:
+                millis += int(self._rng.random() * self.jitter)
+            millis %= MILLIS_WRAP
+
+            airway = self.airwayPressure(num_samples / self.rate) * HPA_PER_CMH2O
+            drop = self.orificeDrop(self.airwayFlow(num_samples / self.rate))
+
+            values = [millis]
+            for j in range(self.sensors):
+                self._noise_idx = (self._noise_idx + 1) % NOISE_TABLE_SIZE
+                n = noise[self._noise_idx]
+
+                if j == 0:
+                    press = ATMOSPHERIC_PRESSURE + n
+                else:
+                    press = ATMOSPHERIC_PRESSURE + airway + drop * (self.sensors - 1 - j) + n
+
+                values.append(23.0 + 0.5 * j + 10.0 * n)
+                values.append(press)
+
+            num_samples += 1
+
+            #a frame lost on the wire has still been numbered
+            if self.send_frames:
+                line = self._encoder.encode(millis, values[1:])
+
+            if (self.drop > 0) and (self._rng.random() < self.drop):
+                self.dropped_generated += 1
+                continue
+
+            if not self.send_frames:
+                line = (fmt % tuple(values)).encode('ascii')
+
+            if (self.corrupt > 0) and (self._rng.random() < self.corrupt):
+                line = self._corruptLine(line)
+
+            self.lines_generated += 1
+
+            yield (line, float(millis))
+
+    #damage a line (or frame) the way a noisy serial link would: lose part of it, or garble a byte
+    def _corruptLine(self, line):
+        self.corrupt_generated += 1
+        pos = self._rng.randrange(1, len(line) - 2)
+
+        if self._rng.random() < 0.5:
+            if self.send_frames:
+                return line[:pos]
+            return line[:pos] + b'\r\n'
+
+        #a frame byte could already be '#', so its bits are flipped instead
+        if self.send_frames:
+            return line[:pos] + bytes([line[pos] ^ 0xFF]) + line[pos + 1:]
+
+        return line[:pos] + b'#' + line[pos + 1:]
+
+
+class SimulatedSerial(ReplaySerial):
+    #pySerial-like port producing simulated data, opened from a sim://?<options> URL. Paced in real
+    #time by the simulated timestamps (scaled by 'speed'), or as fast as possible if speed is None
+    SUMMARY_VERB = 'Generated'
+
+    def __init__(self, url, speed=1.0, timeout=None):
+        ReplaySerial.__init__(self, url, speed, timeout)
+
+        query = url[len(URL_PREFIX):] if url.startswith(URL_PREFIX) else url
+        self.simulator = SensorSimulator(**parseOptions(parse_qsl(query.lstrip('?'))))
+
+        self._command = b''
+
+    #commands from the client, answered as the firmware would (see framing.py). The reply is ready to read at once
+    def write(self, data):
+        self._command += data
+
+        while b'\n' in self._command:
+            line, self._command = self._command.split(b'\n', 1)
+
+            reply = self.simulator.command(line)
+            if reply is not None:
+                self._pending += reply
+
+        return len(data)
+
+    def _openLines(self):
+        return ((line, ts, None) for line, ts in self.simulator.lines())
+
+
+#write simulated lines to a file descriptor, paced in real time
+def streamTo(fd, simulator):
+    start = time.perf_counter()
+    anchor = None
+
+    for line, ts in simulator.lines():
+        if ts is not None:
+            if (anchor is None) or (ts < anchor[0]):
+                anchor = (ts, time.perf_counter())
+
+            delay = anchor[1] + (ts - anchor[0]) / 1000.0 - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        os.write(fd, line)
+
+    return time.perf_counter() - start
+
+
+def printHelp():
+    print('usage: python simulator.py [--pty | --stdout] [--rate=<Hz>] [--sensors=<number>] [--bpm=<number>]\n' +
+          '                           [--ie=<number>] [--pip=<cmH2O>] [--peep=<cmH2O>] [--compliance=<mL/cmH2O>]\n' +
+          '                           [--orifice=<k>] [--noise=<hPa>] [--reset=<seconds>] [--corrupt=<probability>]\n' +
+          '                           [--drop=<probability>] [--jitter=<ms>] [--millis=<ms>] [--count=<number>]\n' +
+          '                           [--frames=<0/1>] [--seed=<number>]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["pty", "stdout"] + [key + '=' for key in DEFAULTS])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    use_pty = False
+    sim_opts = []
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--pty':
+            use_pty = True
+        elif opt == '--stdout':
+            use_pty = False
+        else:
+            sim_opts.append((opt, arg))
+
+    try:
+        simulator = SensorSimulator(**parseOptions(sim_opts))
+    except ValueError as e:
+        print(e)
+        printHelp()
+        sys.exit(2)
+
+    try:
+        if use_pty:
+            import pty
+            import tty
+
+            master, slave = pty.openpty()
+            tty.setraw(slave)
+            print('Simulated sensor data on ' + os.ttyname(slave) + ' (CTRL+C to exit)')
+            sys.stdout.flush()
+            streamTo(master, simulator)
+        else:
+            streamTo(sys.stdout.fileno(), simulator)
+
+    except KeyboardInterrupt:
+        pass
+
+    except OSError as e:
+        #e.g. the reader closed the pipe
+        print(e, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,841 @@
+# -*- coding: utf-8 -*-
+# stream.py
+# Helpful Engineering
+#
+# Purpose:
+# Live sample stream for the ventsense client. Only one process can hold an Arduino's serial port,
+# so the client can publish the samples it parses to other local processes (dashboards, alarm
+# scripts, loggers, or another ventsense client just for the plot) through a small TCP server:
+#     python ventsense.py -p COM10 --serve=8750
+# A subscriber connects to the server and receives the samples of every device the client reads.
+# StreamSubscriber is the subscriber library, and StreamSerial turns one device's stream back into
+# the firmware's line protocol, so the client can read it like a serial port:
+#     python ventsense.py -p stream://localhost:8750
+# Run on its own, this script prints a device's stream as CSV lines (or a summary of it).
+#
+# Usage:
+#     python stream.py [--host=<host>] [--port=<port>] [--device=<number>] [--count=<number>] [--quiet]
+#
+# Options:
+#     --host=<host>        Host the client's stream server runs on. Defaults to localhost
+#     --port=<port>        Port of the stream server. Defaults to 8750
+#     --device=<number>    Device to print, when the client reads several (1 for its first -p, and so
+#                          on). Defaults to 1
+#     --count=<number>     Number of samples to receive before stopping. Defaults to 0 (no limit)
+#     --quiet              Print only the number of samples received (and dropped) at the end
+#
+# Notes:
+# The stream is a sequence of frames, each a little-endian header:
+#     length      uint32     length of the payload, in bytes
+#     type        uint8      FRAME_HELLO, FRAME_SCHEMA, FRAME_SAMPLES or FRAME_DROPPED
+#     device      uint8      device the frame belongs to, counted from 0
+# followed by the payload:
+#     FRAME_HELLO     MAGIC and VERSION, sent once, first
+#     FRAME_SCHEMA    JSON {"device": <name>, "fields": [<column names>]}, sent to every new subscriber
+#                     for each device, and again whenever the device's Arduino resets (even if its
+#                     columns have not changed), like the firmware's header line
+#     FRAME_SAMPLES   records in the binary log format (see binlog.py): a uint32 millis timestamp
+#                     followed by a float32 for each of the other columns of the device's schema
+#     FRAME_DROPPED   uint32 number of the device's samples the server dropped for this subscriber
+#                     (see below), sent where they would have been
+#
+# The acquisition threads only append their samples to a queue, as for the plot (see
+# acquisition.py). The server's own thread encodes them into frames every flush interval (once for
+# all subscribers) and sends them with non-blocking sockets. Each subscriber has a buffer of frames
+# of its own, limited to --serve-buffer kB: when a subscriber does not keep up, its oldest sample
+# frames are dropped (and counted), so a slow or stalled subscriber never holds up acquisition, the
+# logs or the other subscribers. Schema frames are never dropped.
+#
+# The server listens on localhost only by default. The stream has no authentication, so only give
+# it another address on a trusted network.
+
+import collections
+import getopt
+import json
+import select
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+
+try:
+    from urllib.parse import urlsplit, parse_qsl
+except ImportError:
+    from urlparse import urlsplit, parse_qsl
+
+URL_PREFIX = 'stream://'
+
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 8750
+
+MAGIC = b'VSSTRM'
+VERSION = 1
+
+FRAME_HEADER = struct.Struct('<IBB')
+FRAME_HELLO = 0
+FRAME_SCHEMA = 1
+FRAME_SAMPLES = 2
+FRAME_DROPPED = 3
+
+HELLO = struct.Struct('<6sB')
+DROPPED = struct.Struct('<I')
+
+#most devices one server can publish (the device number is a uint8)
+MAX_DEVICES = 256
+
+#frames a subscriber may have waiting to be sent before its oldest sample frames are dropped
+DEFAULT_BUFFER_BYTES = 1024 * 1024
+
+#how often the server thread sends what the acquisition threads have published
+DEFAULT_FLUSH_INTERVAL = 0.01 #seconds
+
+#samples (or bulk batches) a publisher holds for the server thread before it drops new ones. Only reached if the
+#server thread stops or cannot keep up at all
+MAX_PENDING = 100000
+
+SEND_SIZE = 65536 #bytes handed to the socket at a time
+RECV_SIZE = 65536 #bytes
+LISTEN_BACKLOG = 64
+
+
+class StreamClosed(EOFError):
+    pass
+
+
+#parse a --serve argument, [<host>:]<port>. Returns (host, port)
+def parseAddress(arg, default_host=DEFAULT_HOST):
+    host, _, port = str(arg).rpartition(':')
+
+    port = int(port)
+    if (port < 0) or (port > 65535):
+        raise ValueError('port must be between 0 and 65535')
+
+    return (host or default_host), port
+
+
+#sample line format of the firmware (timestamp, then the values to 2 decimal places), for 'num_fields' columns
+def lineFormat(num_fields):
+    return '%d' + ',%.2f' * (num_fields - 1) + '\r\n'
+
+
+def _frame(frame_type, device, payload):
+    return FRAME_HEADER.pack(len(payload), frame_type, device) + payload
+
+
+class StreamPublisher(object):
+    #the samples of one device, published by a StreamServer (see StreamServer.publisher()). Has the same put() and
+    #putMany() as the plot's acquisition.SampleQueue, and is called from the device's acquisition thread the same way
+    def __init__(self, device, name=None):
+        self.device = device
+        self.name = name
+
+        #updated by the acquisition thread
+        self.published = 0
+        self.dropped = 0        #samples dropped because the server thread fell behind
+
+        #taken by the server thread
+        self._pending = collections.deque()
+
+        #only used by the server thread: the schema of the frames encoded so far
+        self.field_names = None
+        self._struct = None
+        self._dtype = None
+
+    #the device's columns, at the start and whenever its Arduino resets
+    def setSchema(self, field_names):
+        self._pending.append((FRAME_SCHEMA, list(field_names)))
+
+    #add one sample, a sequence of numbers in column order
+    def put(self, sample):
+        if len(self._pending) >= MAX_PENDING:
+            self.dropped += 1
+            return
+
+        self._pending.append((FRAME_SAMPLES, (sample,)))
+        self.published += 1
+
+    #add a batch of samples, a 2-D NumPy array (or a list of samples) with one row per sample. The array is not copied,
+    #so it must not be changed afterwards
+    def putMany(self, values):
+        if len(self._pending) >= MAX_PENDING:
+            self.dropped += len(values)
+            return
+
+        self._pending.append((FRAME_SAMPLES, values))
+        self.published += len(values)
+
+    def stats(self):
+        return 'published: ' + str(self.published) + ', dropped: ' + str(self.dropped)
+
+    #take what has been published since the last call and encode it as frames. Returns a list of (frame type, frame
+    #bytes, number of samples) tuples. Called by the server thread
+    def _encodePending(self):
+        frames = []
+        chunks = []
+        num_samples = 0
+
+        #only what is queued now, so that a fast publisher cannot keep the server thread here
+        for _ in range(len(self._pending)):
+            kind, item = self._pending.popleft()
+
+            if kind == FRAME_SCHEMA:
+                if chunks:
+                    frames.append((FRAME_SAMPLES, _frame(FRAME_SAMPLES, self.device, b''.join(chunks)), num_samples))
+                    chunks = []
+                    num_samples = 0
+
+                self._setFields(item)
+                frames.append((FRAME_SCHEMA, self.schemaFrame(), 0))
+                continue
+
+            if self._struct is None:
+                #samples before the first schema cannot be described to subscribers
+                continue
+
+            chunks.append(self._packSamples(item))
+            num_samples += len(item)
+
+        if chunks:
+            frames.append((FRAME_SAMPLES, _frame(FRAME_SAMPLES, self.device, b''.join(chunks)), num_samples))
+
+        return frames
+
+    def schemaFrame(self):
+        payload = json.dumps({'device': self.name, 'fields': self.field_names}).encode('utf-8')
+        return _frame(FRAME_SCHEMA, self.device, payload)
+
+    def _setFields(self, field_names):
+        self.field_names = field_names
+        self._struct = struct.Struct('<I' + 'f' * (len(field_names) - 1))
+        self._dtype = None
+
+    def _packSamples(self, samples):
+        num_fields = len(self.field_names)
+
+        if hasattr(samples, 'dtype'):
+            #bulk ingest, which has NumPy loaded already
+            import numpy as np
+
+            if self._dtype is None:
+                self._dtype = np.dtype([('timestamp', '<u4'), ('values', '<f4', (num_fields - 1,))])
+
+            records = np.empty(len(samples), dtype=self._dtype)
+            records['timestamp'] = samples[:, 0].astype(np.int64) & 0xFFFFFFFF
+            records['values'] = samples[:, 1:num_fields]
+
+            return records.tobytes()
+
+        pack = self._struct.pack
+        return b''.join(pack(int(sample[0]) & 0xFFFFFFFF, *sample[1:num_fields]) for sample in samples)
+
+
+class _Subscriber(object):
+    #a connected subscriber, as seen by the server thread
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.frames = collections.deque()   #(frame type, device, frame bytes, number of samples) waiting to be sent
+        self.buffered = 0                   #bytes in 'frames'
+        self.out = b''                      #bytes being sent, and how far they have got
+        self.offset = 0
+        self.unreported = {}                #samples dropped and not yet reported, by device
+        self.dropped = 0
+        self.events = selectors.EVENT_READ
+
+
+class StreamServer(threading.Thread):
+    #publishes the samples of any number of devices (see publisher()) to the subscribers that connect to 'port' on
+    #'host' (0 for any free port, see 'port' once created), on its own thread. Each subscriber's frames waiting to be
+    #sent are limited to 'buffer_bytes'; what has been published is sent every 'flush_interval' seconds
+    def __init__(self, port=DEFAULT_PORT, host=DEFAULT_HOST, buffer_bytes=DEFAULT_BUFFER_BYTES,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        threading.Thread.__init__(self, name='ventsense-stream')
+        self.daemon = True
+
+        self.buffer_bytes = int(buffer_bytes)
+        self.flush_interval = float(flush_interval)
+
+        #the port is taken here, so that a port already in use is reported before acquisition starts
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            self._listener.bind((host, port))
+            self._listener.listen(LISTEN_BACKLOG)
+        except Exception:
+            self._listener.close()
+            raise
+        self._listener.setblocking(False)
+
+        self.host, self.port = self._listener.getsockname()[:2]
+
+        self.publishers = []
+
+        #only used by the server thread
+        self._subscribers = []
+        self._selector = None
+        self._stop_event = threading.Event()
+
+        #counters, only updated by the server thread
+        self.subscribers_connected = 0
+        self.max_subscribers = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.samples_dropped = 0    #samples dropped for subscribers that did not keep up, over all subscribers
+        self.max_backlog = 0        #most bytes waiting to be sent to one subscriber
+
+        self.error = None
+        self.error_traceback = None
+
+        self.start_time = None
+        self.end_time = None
+
+    #publisher for the next device. 'name' is passed on to subscribers with the device's schema
+    def publisher(self, name=None):
+        if len(self.publishers) >= MAX_DEVICES:
+            raise ValueError('A stream server can publish at most ' + str(MAX_DEVICES) + ' devices')
+
+        publisher = StreamPublisher(len(self.publishers), name)
+        self.publishers.append(publisher)
+
+        return publisher
+
+    #number of subscribers connected right now
+    def numSubscribers(self):
+        return len(self._subscribers)
+
+    #send what is left (as far as the subscribers take it without waiting), disconnect every subscriber and stop
+    def close(self):
+        self._stop_event.set()
+
+        if self.is_alive():
+            self.join()
+        elif self.start_time is None:
+            self._listener.close()
+
+    #seconds from the start of the server thread until it ended (or until now, if still running)
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+
+        end = self.end_time
+        if end is None:
+            end = time.perf_counter()
+
+        return end - self.start_time
+
+    def stats(self):
+        elapsed = self.elapsed()
+        rate = self.bytes_sent / elapsed if elapsed > 0 else 0.0
+
+        return ('subscribers: ' + str(self.subscribers_connected) + ' (max ' + str(self.max_subscribers) +
+                ' at once), published: ' + str(sum(p.published for p in self.publishers)) + ', frames sent: ' +
+                str(self.frames_sent) + ', bytes sent: ' + str(self.bytes_sent) + ', bytes/s: ' + '{:.0f}'.format(rate) +
+                ', dropped for slow subscribers: ' + str(self.samples_dropped) + ', max backlog: ' +
+                str(self.max_backlog) + ' bytes')
+
+    def run(self):
+        self.start_time = time.perf_counter()
+        self._selector = selectors.DefaultSelector()
+
+        try:
+            self._selector.register(self._listener, selectors.EVENT_READ, None)
+
+            while not self._stop_event.is_set():
+                for key, mask in self._selector.select(self.flush_interval):
+                    if key.data is None:
+                        self._accept()
+                    else:
+                        self._service(key.data, mask)
+
+                self._publishPending()
+
+            #whatever was published before the end
+            self._publishPending()
+
+        except Exception as e:
+            self.error = e
+            self.error_traceback = traceback.format_exc()
+
+        finally:
+            for subscriber in list(self._subscribers):
+                self._disconnect(subscriber)
+
+            self._selector.close()
+            self._listener.close()
+            self.end_time = time.perf_counter()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            subscriber = _Subscriber(sock, address)
+            self._subscribers.append(subscriber)
+            self._selector.register(sock, subscriber.events, subscriber)
+
+            self.subscribers_connected += 1
+            self.max_subscribers = max(self.max_subscribers, len(self._subscribers))
+
+            #a new subscriber starts with the schema of every device whose frames it will get
+            self._queue(subscriber, FRAME_HELLO, 0, _frame(FRAME_HELLO, 0, HELLO.pack(MAGIC, VERSION)), 0)
+            for publisher in self.publishers:
+                if publisher.field_names is not None:
+                    self._queue(subscriber, FRAME_SCHEMA, publisher.device, publisher.schemaFrame(), 0)
+
+            self._flush(subscriber)
+
+    def _service(self, subscriber, mask):
+        if mask & selectors.EVENT_READ:
+            #subscribers have nothing to say, so anything read is discarded. An empty read means it has disconnected
+            try:
+                data = subscriber.sock.recv(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                data = None
+            except OSError:
+                data = b''
+
+            if data == b'':
+                self._disconnect(subscriber)
+                return
+
+        if mask & selectors.EVENT_WRITE:
+            self._flush(subscriber)
+
+    def _disconnect(self, subscriber):
+        if subscriber not in self._subscribers:
+            return
+
+        self._subscribers.remove(subscriber)
+
+        try:
+            self._selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+
+        subscriber.sock.close()
+
+    def _publishPending(self):
+        frames = []
+        for publisher in self.publishers:
+            for frame_type, data, num_samples in publisher._encodePending():
+                frames.append((frame_type, publisher.device, data, num_samples))
+
+        if not frames:
+            return
+
+        for subscriber in list(self._subscribers):
+            for frame_type, device, data, num_samples in frames:
+                self._queue(subscriber, frame_type, device, data, num_samples)
+
+            self._flush(subscriber)
+
+    #add a frame to a subscriber's buffer, dropping its oldest sample frames if that takes it over the limit
+    def _queue(self, subscriber, frame_type, device, data, num_samples):
+        subscriber.frames.append((frame_type, device, data, num_samples))
+        subscriber.buffered += len(data)
+
+        if subscriber.buffered > self.max_backlog:
+            self.max_backlog = subscriber.buffered
+
+        while subscriber.buffered > self.buffer_bytes:
+            for idx, (old_type, old_device, old_data, old_samples) in enumerate(subscriber.frames):
+                if old_type == FRAME_SAMPLES:
+                    break
+            else:
+                return
+
+            del subscriber.frames[idx]
+            subscriber.buffered -= len(old_data)
+            subscriber.dropped += old_samples
+            subscriber.unreported[old_device] = subscriber.unreported.get(old_device, 0) + old_samples
+            self.samples_dropped += old_samples
+
+    #send as much of a subscriber's buffer as its socket takes without waiting, and wait for it to be writable again if
+    #anything is left
+    def _flush(self, subscriber):
+        try:
+            self._send(subscriber)
+        except OSError:
+            self._disconnect(subscriber)
+            return
+
+        events = selectors.EVENT_READ
+        if subscriber.frames or (subscriber.offset < len(subscriber.out)):
+            events |= selectors.EVENT_WRITE
+
+        if events != subscriber.events:
+            subscriber.events = events
+            self._selector.modify(subscriber.sock, events, subscriber)
+
+    def _send(self, subscriber):
+        while True:
+            if subscriber.offset >= len(subscriber.out):
+                if not subscriber.frames:
+                    return
+
+                #samples dropped since the last frame sent are reported where they would have been
+                chunks = [_frame(FRAME_DROPPED, device, DROPPED.pack(min(count, 0xFFFFFFFF)))
+                          for device, count in subscriber.unreported.items()]
+                subscriber.unreported.clear()
+                size = 0
+
+                while subscriber.frames and (size < SEND_SIZE):
+                    frame_type, device, data, num_samples = subscriber.frames.popleft()
+                    chunks.append(data)
+                    size += len(data)
+
+                self.frames_sent += len(chunks)
+                subscriber.buffered -= size
+                subscriber.out = b''.join(chunks)
+                subscriber.offset = 0
+
+            try:
+                sent = subscriber.sock.send(memoryview(subscriber.out)[subscriber.offset:])
+            except (BlockingIOError, InterruptedError):
+                return
+
+            subscriber.offset += sent
+            self.bytes_sent += sent
+
+
+class StreamSubscriber(object):
+    #connection to a StreamServer at 'host':'port'. 'timeout' (seconds) applies to connecting. With 'decode' False,
+    #sample frames are only counted, not unpacked
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None, decode=True):
+        self.host = host
+        self.port = port
+        self.decode = decode
+
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.settimeout(None)
+
+        #schema of each device (by device number, from 0), as (name, field names), and the timestamp of the newest
+        #sample received from it
+        self.schemas = {}
+        self.last_timestamps = {}
+
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.samples_received = 0
+        self.samples_dropped = 0    #reported by the server
+
+        self._buf = bytearray()
+        self._structs = {}
+        self._hello = False
+
+    def close(self):
+        self.sock.close()
+
+    #wait up to 'timeout' seconds (None to wait for as long as it takes, 0 not to wait) for data, and return the frames
+    #it completes as a list of (frame type, device, data) tuples. 'data' is (name, field names) for FRAME_SCHEMA, a list
+    #of samples (tuples of numbers in column order) for FRAME_SAMPLES (or their number, if not decoding) and a number of
+    #samples for FRAME_DROPPED. Raises StreamClosed once the server has closed the stream
+    def receive(self, timeout=None):
+        if timeout is not None:
+            readable = select.select([self.sock], [], [], timeout)[0]
+            if not readable:
+                return []
+
+        data = self.sock.recv(RECV_SIZE)
+
+        if not data:
+            raise StreamClosed('Stream closed: ' + self.host + ':' + str(self.port))
+
+        self.bytes_received += len(data)
+        self._buf += data
+
+        return self._takeFrames()
+
+    def _takeFrames(self):
+        frames = []
+        buf = self._buf
+        pos = 0
+
+        while len(buf) - pos >= FRAME_HEADER.size:
+            length, frame_type, device = FRAME_HEADER.unpack_from(buf, pos)
+            end = pos + FRAME_HEADER.size + length
+
+            if len(buf) < end:
+                break
+
+            payload = bytes(buf[pos + FRAME_HEADER.size:end])
+            pos = end
+            self.frames_received += 1
+
+            frame = self._decodeFrame(frame_type, device, payload)
+            if frame is not None:
+                frames.append(frame)
+
+        del buf[:pos]
+
+        return frames
+
+    def _decodeFrame(self, frame_type, device, payload):
+        if not self._hello:
+            if (frame_type != FRAME_HELLO) or (len(payload) < HELLO.size):
+                raise ValueError('Not a ventsense stream: ' + self.host + ':' + str(self.port))
+
+            magic, version = HELLO.unpack_from(payload)
+            if magic != MAGIC:
+                raise ValueError('Not a ventsense stream: ' + self.host + ':' + str(self.port))
+            if version != VERSION:
+                raise ValueError('Unsupported ventsense stream version: ' + str(version))
+
+            self._hello = True
+            return None
+
+        if frame_type == FRAME_SCHEMA:
+            schema = json.loads(payload.decode('utf-8'))
+            self.schemas[device] = (schema['device'], schema['fields'])
+            self._structs[device] = struct.Struct('<I' + 'f' * (len(schema['fields']) - 1))
+            return (frame_type, device, self.schemas[device])
+
+        if frame_type == FRAME_SAMPLES:
+            record = self._structs.get(device)
+            if record is None:
+                return None
+
+            num_samples = len(payload) // record.size
+            self.samples_received += num_samples
+
+            if num_samples:
+                self.last_timestamps[device] = struct.unpack_from('<I', payload, (num_samples - 1) * record.size)[0]
+
+            if not self.decode:
+                return (frame_type, device, num_samples)
+
+            return (frame_type, device, list(record.iter_unpack(payload)))
+
+        if frame_type == FRAME_DROPPED:
+            count = DROPPED.unpack_from(payload)[0]
+            self.samples_dropped += count
+            return (frame_type, device, count)
+
+        #frame types from later versions are skipped
+        return None
+
+
+class StreamSerial(object):
+    #pySerial-like port reading one device's samples from a StreamServer, opened from a
+    #stream://<host>:<port>[?device=<number>] URL (the device counted from 1). The samples come out as the firmware's
+    #lines, each schema frame as its header line, so the client handles them exactly like a serial port
+    def __init__(self, url, timeout=None):
+        self.url = url
+        self.timeout = timeout
+        self.dtr = 0
+        self.rts = 0
+
+        parts = urlsplit(url)
+        self.host = parts.hostname or DEFAULT_HOST
+        self.port = parts.port or DEFAULT_PORT
+
+        options = dict(parse_qsl(parts.query))
+        self.device = int(options.get('device', 1)) - 1
+        if self.device < 0:
+            raise ValueError('device must be at least 1')
+
+        self.lines_received = 0
+        self.samples_dropped = 0
+
+        self.subscriber = None
+        self._pending = bytearray()
+        self._format = None
+        self._closed = False
+        self._start_time = None
+        self._end_time = None
+        self.is_open = False
+
+    def open(self):
+        self.subscriber = StreamSubscriber(self.host, self.port, self.timeout)
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+        if self.subscriber is not None:
+            self.subscriber.close()
+
+    def flushInput(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+    #number of bytes received and ready to read right now
+    @property
+    def in_waiting(self):
+        if not self._pending:
+            self._fill(0)
+        return len(self._pending)
+
+    def readline(self):
+        idx = self._pending.find(b'\n')
+
+        if idx < 0:
+            self._fill(self.timeout)
+            idx = self._pending.find(b'\n')
+
+        if idx < 0:
+            if self._closed:
+                if self._pending:
+                    return self._take(len(self._pending))
+                self._finish()
+            return b''
+
+        return self._take(idx + 1)
+
+    def read(self, size=1):
+        if not self._pending:
+            self._fill(self.timeout)
+
+        if not self._pending:
+            if self._closed:
+                self._finish()
+            return b''
+
+        return self._take(min(size, len(self._pending)))
+
+    #summary of the stream, for printing at the end of a session
+    def summary(self):
+        elapsed = 0.0
+        if self._start_time is not None:
+            elapsed = (self._end_time or time.perf_counter()) - self._start_time
+
+        rate = self.lines_received / elapsed if elapsed > 0 else 0.0
+
+        return ('Received ' + str(self.lines_received) + ' lines from ' + self.host + ':' + str(self.port) + ' in ' +
+                '{:.2f}'.format(elapsed) + ' s (' + '{:.0f}'.format(rate) + ' samples/s), ' +
+                str(self.samples_dropped) + ' dropped by the server')
+
+    def _finish(self):
+        if self._end_time is None:
+            self._end_time = time.perf_counter()
+        raise StreamClosed('End of stream: ' + self.url)
+
+    def _take(self, size):
+        out = bytes(self._pending[:size])
+        del self._pending[:size]
+        return out
+
+    #receive whatever arrives within 'timeout' seconds and turn this device's frames into lines
+    def _fill(self, timeout):
+        if self._closed:
+            return
+
+        if self._start_time is None:
+            self._start_time = time.perf_counter()
+
+        try:
+            frames = self.subscriber.receive(timeout)
+        except StreamClosed:
+            self._closed = True
+            return
+
+        for frame_type, device, data in frames:
+            if device != self.device:
+                continue
+
+            if frame_type == FRAME_SCHEMA:
+                name, field_names = data
+                self._format = lineFormat(len(field_names))
+                self._pending += (','.join(field_names) + '\r\n').encode('utf-8')
+                self.lines_received += 1
+
+            elif frame_type == FRAME_SAMPLES:
+                fmt = self._format
+                self._pending += ''.join(fmt % sample for sample in data).encode('ascii')
+                self.lines_received += len(data)
+
+            elif frame_type == FRAME_DROPPED:
+                self.samples_dropped += data
+
+
+def printHelp():
+    print('usage: python stream.py [--host=<host>] [--port=<port>] [--device=<number>] [--count=<number>] [--quiet]')
+
+
+def main(argv):
+    try:
+        opts, args = getopt.getopt(argv, "h", ["host=", "port=", "device=", "count=", "quiet"])
+    except getopt.GetoptError:
+        printHelp()
+        sys.exit(2)
+
+    host = DEFAULT_HOST
+    port = DEFAULT_PORT
+    device = 1
+    count = 0
+    quiet = False
+
+    for opt, arg in opts:
+        if opt == '-h':
+            printHelp()
+            sys.exit()
+        elif opt == '--host':
+            host = arg
+        elif opt == '--port':
+            port = int(arg)
+        elif opt == '--device':
+            device = int(arg)
+        elif opt == '--count':
+            count = int(arg)
+        elif opt == '--quiet':
+            quiet = True
+
+    try:
+        subscriber = StreamSubscriber(host, port, decode=not quiet)
+    except OSError as e:
+        print('Cannot connect to ' + host + ':' + str(port) + ': ' + str(e), file=sys.stderr)
+        sys.exit(1)
+
+    num_samples = 0
+    num_dropped = 0
+    fmt = None
+    start = time.perf_counter()
+
+    try:
+        while (count <= 0) or (num_samples < count):
+            for frame_type, frame_device, data in subscriber.receive():
+                if frame_device != device - 1:
+                    continue
+
+                if frame_type == FRAME_SCHEMA:
+                    fmt = lineFormat(len(data[1])).replace('\r', '')
+                    if not quiet:
+                        sys.stdout.write(','.join(data[1]) + '\n')
+
+                elif frame_type == FRAME_SAMPLES:
+                    if quiet:
+                        num_samples += data
+                    else:
+                        num_samples += len(data)
+                        sys.stdout.write(''.join(fmt % sample for sample in data))
+
+                elif frame_type == FRAME_DROPPED:
+                    num_dropped += data
+
+    except (KeyboardInterrupt, StreamClosed):
+        pass
+
+    except OSError as e:
+        #e.g. the reader closed the pipe
+        print(e, file=sys.stderr)
+
+    finally:
+        subscriber.close()
+
+    elapsed = time.perf_counter() - start
+    print('Received ' + str(num_samples) + ' samples in ' + '{:.2f}'.format(elapsed) + ' s, ' + str(num_dropped) +
+          ' dropped by the server', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# timing.py
+# Helpful Engineering
+#
+# Purpose:
+# Sample timing for the ventsense client, taken from the timestamp the firmware sends with every
+# sample (its millis() count). SampleClock turns the timestamps of one device into a continuous
+# time, through millis() wraparound and Arduino resets, and keeps track of how regular they are:
+# the sample rate and its jitter, gaps (samples lost between the firmware and the client), repeated
+# timestamps and resets. The client plots against this time, rather than assuming a fixed rate,
+# and shows the figures as it runs, so lost data shows up where it happens.
+#
+# Notes:
+# millis() is an unsigned long, so it wraps around to 0 after 2^32 ms (about 49.7 days). A step back
+# from near the wrap point to near 0 is taken as a wraparound; any other step back in time (or a
+# header line, see reset()) starts a new session. The continuous time carries on across a new
+# session one sample interval after the last sample of the previous one, so it never goes back.
+#
+# The sample interval is learned from the timestamps, as a running average of the intervals that
+# are not gaps. An interval of GAP_FACTOR times that or more (plus ROUNDING_ALLOWANCE, see
+# gapLimit()) is a gap, and the number of samples that would have fit in it are counted as lost.
+# The allowance matters at rates whose interval is not a whole number of milliseconds: at 400 Hz
+# the timestamps step by 2 and 3 ms, and if the first interval seen is 2 ms, a 3 ms one must not
+# be taken for a gap (or the average would never learn the real 2.5 ms).
+#
+# NumPy is only needed for addSamples() (bulk ingest and the plot), so it is only imported there.
+
+MILLIS_WRAP = 2 ** 32
+
+#a step back from within this much of the wrap point to within this much of 0 is a wraparound
+WRAP_WINDOW = 60000 #ms
+
+#an interval this many times the usual one or more, plus ROUNDING_ALLOWANCE, is a gap
+GAP_FACTOR = 1.5
+
+#timestamps are whole milliseconds, so intervals are rounded
+ROUNDING_ALLOWANCE = 0.5 #ms
+
+#weight of each new interval in the running average interval and jitter
+INTERVAL_SMOOTHING = 0.02
+
+#the recent sample rate is measured over at least this much time
+RATE_PERIOD = 1000.0 #ms
+
+
+class SampleClock(object):
+    #continuous time and timing statistics of the timestamps (ms) of one device's samples
+    def __init__(self):
+        self.interval = None        #running average sample interval (ms), once there have been two samples
+        self.jitter = 0.0           #running standard deviation of the sample interval (ms)
+        self.rate = None            #samples per second received over the last RATE_PERIOD or more, gaps included
+
+        self.samples = 0
+        self.intervals = 0          #intervals that are not gaps
+        self.gaps = 0
+        self.lost = 0               #samples that would have fit in the gaps
+        self.max_gap = 0.0          #longest interval between two samples (ms)
+        self.duplicates = 0         #samples with the same timestamp as the one before
+        self.resets = 0             #new sessions: header lines, and steps back in time
+        self.wraps = 0              #millis() wraparounds
+
+        self._offset = 0.0          #continuous time minus timestamp, in the current session
+        self._last = None           #timestamp of the newest sample
+        self._last_time = None      #continuous time of the newest sample
+        self._restart = False
+        self._rate_start = None     #continuous time and sample count at the start of the current rate period
+        self._rate_samples = 0
+
+    #the device has reset (e.g. its header line was received), so its timestamps start over
+    def reset(self):
+        if (self._last is not None) and (not self._restart):
+            self.resets += 1
+            self._restart = True
+
+    #add the timestamp of one sample and return its continuous time (ms)
+    def addSample(self, timestamp):
+        self.samples += 1
+
+        if self._last is None:
+            return self._start(timestamp)
+
+        dt = timestamp - self._last
+
+        if (dt < 0) and (self._last >= MILLIS_WRAP - WRAP_WINDOW) and (timestamp < WRAP_WINDOW):
+            self.wraps += 1
+            self._offset += MILLIS_WRAP
+            dt += MILLIS_WRAP
+
+        if self._restart or (dt < 0):
+            if not self._restart:
+                self.resets += 1
+
+            #carry on one interval after the previous session
+            self._offset = self._last_time + (self.interval or 0.0) - timestamp
+            self._restart = False
+            self._last = timestamp
+            self._last_time = timestamp + self._offset
+            self._rate_start = None
+            return self._last_time
+
+        self._addInterval(dt)
+
+        self._last = timestamp
+        self._last_time = timestamp + self._offset
+        self._updateRate()
+
+        return self._last_time
+
+    #add the timestamps of a batch of samples (oldest first) and return their continuous times, as a NumPy array
+    def addSamples(self, timestamps):
+        import numpy as np
+
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        n = len(timestamps)
+
+        if n == 0:
+            return timestamps
+
+        if (self._last is None) or self._restart:
+            times = np.empty(n)
+            times[0] = self.addSample(float(timestamps[0]))
+            times[1:] = self.addSamples(timestamps[1:])
+            return times
+
+        dts = np.diff(np.concatenate(([self._last], timestamps)))
+
+        #a step back in time (wraparound or reset) is rare, so it is left to addSample()
+        if (dts < 0).any():
+            return np.array([self.addSample(float(t)) for t in timestamps])
+
+        self.samples += n
+        self.max_gap = max(self.max_gap, float(dts.max()))
+
+        dups = (dts == 0)
+        self.duplicates += int(dups.sum())
+
+        if self.interval is None:
+            first = np.flatnonzero(~dups)
+            if len(first) == 0:
+                self._last = float(timestamps[-1])
+                self._last_time = self._last + self._offset
+                return timestamps + self._offset
+
+            self.interval = float(dts[first[0]])
+
+        gaps = dts >= self.gapLimit()
+        num_gaps = int(gaps.sum())
+
+        if num_gaps:
+            self.gaps += num_gaps
+            self.lost += int(np.maximum(np.round(dts[gaps] / self.interval) - 1, 0).sum())
+
+        #the running average over the batch's intervals, as if they had been added one by one with the same weight
+        regular = dts[~gaps & ~dups]
+        if len(regular):
+            keep = (1.0 - INTERVAL_SMOOTHING) ** len(regular)
+            mean = float(regular.mean())
+            var = float(((regular - self.interval) ** 2).mean())
+
+            self.interval = self.interval * keep + mean * (1.0 - keep)
+            self.jitter = (self.jitter ** 2 * keep + var * (1.0 - keep)) ** 0.5
+            self.intervals += len(regular)
+
+        self._last = float(timestamps[-1])
+        self._last_time = self._last + self._offset
+        self._rate_samples += n
+        self._updateRate()
+
+        return timestamps + self._offset
+
+    #shortest interval (ms) that is a gap, or None if the usual interval is not known yet
+    def gapLimit(self):
+        if self.interval is None:
+            return None
+
+        return GAP_FACTOR * self.interval + ROUNDING_ALLOWANCE
+
+    #sample rate (Hz) implied by the average interval, or None if not known yet
+    def nominalRate(self):
+        if not self.interval:
+            return None
+
+        return 1000.0 / self.interval
+
+    #one line for the plot or console, e.g. '10.0 Hz, jitter 0.4 ms, max gap 0.10 s, lost 0'
+    def summary(self):
+        if self.rate is None:
+            return 'timing: waiting for samples'
+
+        return ('{:.1f}'.format(self.rate) + ' Hz, jitter ' + '{:.1f}'.format(self.jitter) + ' ms, max gap ' +
+                '{:.2f}'.format(self.max_gap / 1000.0) + ' s, lost ' + str(self.lost) +
+                (', resets ' + str(self.resets) if self.resets else ''))
+
+    def stats(self):
+        nominal = self.nominalRate()
+
+        return ('samples: ' + str(self.samples) + ', rate: ' +
+                ('{:.2f}'.format(nominal) + ' Hz' if nominal is not None else 'unknown') +
+                ', jitter: ' + '{:.2f}'.format(self.jitter) + ' ms, max gap: ' + '{:.3f}'.format(self.max_gap / 1000.0) +
+                ' s, gaps: ' + str(self.gaps) + ', lost: ' + str(self.lost) + ', duplicates: ' + str(self.duplicates) +
+                ', resets: ' + str(self.resets) + ', wraps: ' + str(self.wraps))
+
+    def _start(self, timestamp):
+        self._last = timestamp
+        self._last_time = timestamp + self._offset
+        return self._last_time
+
+    def _addInterval(self, dt):
+        self._rate_samples += 1
+
+        if dt > self.max_gap:
+            self.max_gap = float(dt)
+
+        if dt == 0:
+            self.duplicates += 1
+            return
+
+        if self.interval is None:
+            self.interval = float(dt)
+            self.intervals += 1
+        elif dt >= self.gapLimit():
+            self.gaps += 1
+            self.lost += max(int(round(dt / self.interval)) - 1, 0)
+        else:
+            self.jitter = (self.jitter ** 2 * (1.0 - INTERVAL_SMOOTHING) +
+                           (dt - self.interval) ** 2 * INTERVAL_SMOOTHING) ** 0.5
+            self.interval += (dt - self.interval) * INTERVAL_SMOOTHING
+            self.intervals += 1
+
+    #the recent rate counts the samples received over each RATE_PERIOD of device time
+    def _updateRate(self):
+        if self._rate_start is None:
+            self._rate_start = self._last_time
+            self._rate_samples = 0
+            return
+
+        span = self._last_time - self._rate_start
+        if span >= RATE_PERIOD:
+            self.rate = self._rate_samples * 1000.0 / span
+            self._rate_start = self._last_time
+            self._rate_samples = 0
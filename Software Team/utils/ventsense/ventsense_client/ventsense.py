@@ -8,7 +8,7 @@
 # Purpose:
 # Reads streaming temperature and pressure sensor data from serial port and saves it to a Comma-
 # Separated Value (.csv) file. It is intended to interface with an Arduino reading sensor
-# data from up to 3 BMP-388 sensors. 
+# data from BMP-388 sensors (3 by default; see the -n option). 
 #
 # Requirements:
 #   Hardware
@@ -49,68 +49,345 @@
 # the Arduino IDE over serial port access. So, the best thing to do is load the Arduino, then run this 
 # app, and then reset the Arduino.
 # 
-# A .csv file will be created when you launch this script and then another one will be created each 
-# time you reset the Arduino.
+# A .csv file will be created when this script starts receiving data and then another one will be
+# created each time you reset the Arduino, and each time the file reaches the size or age set with
+# --log-rotate-size or --log-rotate-time.
 #
 # The .csv files are named as follows, based on the date and time at creation:
 #     ventsense_log_<YYYY-MM-DD_hhmmss>.csv
+#
+# Log files are written and synced to disk by a thread of their own (see logwriter.py), at least
+# every --log-sync milliseconds, so a crash or power loss loses no more than about that much data.
+#
+# matplotlib and numpy are only imported once there is something to plot, after the serial port has
+# been opened and logging has started. With --show-plot=false (and --ingest=line, --log-format=csv)
+# they are never imported at all, so a logging-only client starts quickly and stays small. See
+# benchmarks/bench_startup.py to measure startup time and memory use.
+#
+# Several Arduinos can be read at once by giving more than one serial port (e.g. -p COM10 -p COM11).
+# Each one is read on its own thread and gets its own log files, named after its port. Only one of
+# them (selected with --plot-device) is plotted.
+#
+# The number and order of the sensors is taken from the header line the firmware prints at startup
+# (see channels.py). Until the client has seen one, it assumes the number of sensors set with -n.
+#
+# With --breath-sensor, the pressure of that sensor relative to the atmospheric sensor is split into
+# breaths as it is received (see breath.py). Each breath's PIP, PEEP, plateau pressure, rate and I:E
+# ratio are printed to the console, shown on the plot and written to a breath file named as follows:
+#     ventsense_breaths_<YYYY-MM-DD_hhmmss>.csv
+#
+# With --flow, the pressure difference across a flow element between two sensors is turned into flow
+# (see flow.py), which is plotted along with its volume. The volume starts again from zero at every
+# breath when breath analysis is on, and the tidal volume of each breath is added to the breath file.
+#
+# With --filter, the samples are filtered (moving median, IIR low-pass or decimating FIR; see filters.py)
+# as they are received, before they are plotted and analyzed. The log files keep the raw values.
+#
+# With --alarms, every sample is checked against alarm rules (over-pressure, pressure collapse, rate of
+# change, dropout; see alarms.py) as soon as it is received. Alarms go to the sinks chosen with
+# --alarm-sinks; the log sink writes an alarm file named as follows:
+#     ventsense_alarms_<YYYY-MM-DD_hhmmss>.csv
+# On exit, the number of alarms and the latency from reading a sample to acting on it are printed.
+#
+# With a long --x-width, the window holds many more samples than the plot is pixels wide. The lines
+# are then drawn from the first, min, max and last sample of each pixel column's worth of samples
+# (see decimate.py), which looks the same, spikes included, but keeps the cost of each frame down.
+#
+# The plot's time axis comes from the timestamps the firmware sends with every sample (its millis()
+# count), made continuous across millis() wraparound and Arduino resets (see timing.py), rather than
+# from an assumed sample rate. Samples lost on the way show up as gaps in the lines, and the measured
+# sample rate, jitter and number of lost samples are shown on the plot and printed on exit. The log
+# files keep the timestamps as they were received.
+#
+# With --serve, the parsed samples of every device are also published on a local TCP port (see
+# stream.py), so that other tools, or other instances of this client given -p stream://<host>:<port>,
+# can use the live data while this one holds the serial port. A subscriber that does not keep up
+# has its oldest samples dropped, without holding up acquisition or the other subscribers.
+#
+# With --profile, each stage of reading, logging and plotting is timed (see profiling.py). A breakdown
+# of where the time goes, with the plot queue depth and samples per second, is printed every so many
+# seconds, and a summary of the whole run is written on exit to a file named as follows:
+#     ventsense_profile_<YYYY-MM-DD_hhmmss>.json
+#
+# With --wire=frames, the client asks the firmware to send compact binary frames instead of lines of
+# text (see framing.py), so the same link carries several hundred samples per second. The frames are
+# turned back into the firmware's lines as they are received, so the logs are the same either way.
+# Firmware without frame support carries on sending text, which is read as usual.
+#
+# To compute statistics over a directory of logs instead (see analyze.py):
+#     python ventsense.py analyze <log directory>
 
 
 import serial
 import time
+import collections
 import csv
 import sys
 import getopt
 import traceback
-from matplotlib.ticker import (MultipleLocator, FormatStrFormatter, AutoLocator, AutoMinorLocator)
-import matplotlib.pyplot as plt
-import numpy as np
 import configparser
+import re
+from acquisition import (AcquisitionThread, SampleQueue, OVERFLOW_POLICIES, INGEST_MODES, READ_TIMEOUT,
+                         ACQUISITION_STAGES)
+from channels import (ChannelSchema, TEMP_IDX, PRESS_IDX, DEFAULT_NUM_SENSORS, MAX_NUM_SENSORS)
+from breath import (BreathAnalyzer, formatBreath)
+from alarms import (AlarmEngine, ConsoleAlarmSink, LogAlarmSink, JsonAlarmSink, UdpAlarmSink, parseAlarmRules,
+                    formatAlarmRules, parseAlarmSinks, SINK_CONSOLE, SINK_LOG, SINK_JSON, DEFAULT_LATENCY_BUDGET)
+from flow import (FlowCalibration, FlowChannels, VolumeIntegrator, breathVolumes, parseSensorPairs, formatSensorPairs,
+                  DEFAULT_FLOW_K, DEFAULT_FLOW_EXPONENT, DEFAULT_FLOW_OFFSET)
+from logwriter import (LogWriter, DEFAULT_SYNC_INTERVAL, DEFAULT_SYNC_BYTES)
+from timing import SampleClock
+from filters import (FilterChain, parseFilters, formatFilters)
+from profiling import (Profiler, clock)
+from framing import (FrameSerial, WIRE_MODES, WIRE_TEXT, WIRE_FRAMES, DEFAULT_FRAME_INTERVAL, MIN_FRAME_INTERVAL,
+                     MAX_FRAME_INTERVAL)
+import replay
+import simulator
+import stream
 
 SW_VERSION = 'v0.2-2'
 
 SENSOR_1 = 0
-SENSOR_2 = 1
-SENSOR_3 = 2
-MAX_SENSORS = 3
 
-TEMP_IDX = 0
-PRESS_IDX = 1
+#line colors, one per sensor (repeated if there are more sensors than colors)
+PRESS_COLORS = ['red', 'green', 'blue', 'purple', 'orange', 'brown', 'black', 'gray']
+TEMP_COLORS = ['pink', 'olive', 'cyan', 'violet', 'gold', 'tan', 'dimgray', 'silver']
+FLOW_COLORS = ['teal', 'magenta', 'navy', 'crimson']
 
+#sample rate assumed until it has been measured from the timestamps of the plotted device
 SAMPLE_RATE = 10.0 #Hz
 
+#the plot history is resized for the measured sample rate once it has been measured over this many sample intervals,
+#and again whenever it has changed by more than RATE_TOLERANCE (as a fraction). Its length is capped at MAX_WINDOW_LEN
+RATE_MIN_INTERVALS = 20
+RATE_TOLERANCE = 0.25
+MAX_WINDOW_LEN = 200001 #samples
+
 ATMOSPHERIC_BASELINE = 1013 #hPa at sea level
 
+BUFFER_HEADROOM = 1.25 #plot history capacity, as a multiple of the visible window
+
+DEFAULT_RENDER_FPS = 30.0 #plot frames per second
+MAX_RENDER_FPS = 120.0
+LOG_FORMAT_CSV = 'csv'
+LOG_FORMAT_BIN = 'bin'
+LOG_FORMATS = [LOG_FORMAT_CSV, LOG_FORMAT_BIN]
+
+#how long a change in the autoscaled Y range must persist before the axis is rescaled. Small changes wait longer,
+#so that the axes do not keep jumping around (every full redraw also slows down the animation)
+Y_SMALL_RESCALE_DELAY = 5.0 #seconds
+Y_LARGE_RESCALE_DELAY = 2.0 #seconds
+
+#smallest Y ranges of the flow and volume plots, when autoscaling
+FLOW_MIN_RANGE = 20.0 #L/min
+VOLUME_MIN_RANGE = 100.0 #mL
+
+#number of breath starts remembered for the volume plot, for a short window. Long windows remember one per second of
+#the window, enough for any breathing rate up to 60/min
+VOLUME_BREATHS = 64
+
+#the plot lines are drawn from four points (first, min, max and last) of each pixel column's worth of samples once a
+#pixel column holds at least this many samples (see decimate.py). Shorter windows are drawn sample by sample
+MIN_DECIMATION = 8 #samples
+
+HEADLESS_POLL_TIME = 0.1 #seconds between checks that the acquisition thread is still running, when not plotting
+
+#stages of the render loop timed with --profile (see profiling.py)
+STAGE_WAIT = 0          #waiting for the next frame, handling window events in the meantime
+STAGE_DRAIN = 1         #taking the samples (and breaths) that have arrived since the previous frame
+STAGE_CONVERT = 2       #converting the samples to channel values, with flows, units and relative pressures
+STAGE_HISTORY = 3       #adding them to the plot history, its running min/max and the decimator
+STAGE_LINES = 4         #line data for the window: decimated envelope, volumes, timing text
+STAGE_AUTOSCALE = 5     #Y autoscale ranges
+STAGE_DRAW = 6          #drawing the lines (or the whole figure, when rescaled)
+STAGE_BLIT = 7          #copying the redrawn axes to the window
+STAGE_EVENTS = 8        #flushing window events
+RENDER_STAGES = ['wait', 'drain', 'convert', 'history', 'lines', 'autoscale', 'draw', 'blit', 'events']
+
 #if running python 3, import open
 if (sys.version_info > (3, 0)):
     from io import open
 
-list = []
+#import the modules that are only needed for plotting. These are slow to import, so this is not done
+#until the plot is actually needed
+def importPlotModules():
+    global MultipleLocator, FormatStrFormatter, AutoLocator, AutoMinorLocator, plt, np, SampleRingBuffer, SlidingMinMax
+    global MinMaxDecimator
+
+    from matplotlib.ticker import (MultipleLocator, FormatStrFormatter, AutoLocator, AutoMinorLocator)
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from samplebuffer import SampleRingBuffer
+    from windowminmax import SlidingMinMax
+    from decimate import MinMaxDecimator
+
+#min/max decimator of the first 'num_rows' rows of 'samples' (a SampleRingBuffer), for a plot window of 'window_len'
+#samples drawn 'plot_width' pixels wide, filled with the samples already in 'samples'. None if the window is short
+#enough to draw every sample
+def startDecimator(samples, num_rows, window_len, plot_width):
+    bucket_len = window_len // max(int(plot_width), 1)
+
+    if bucket_len < MIN_DECIMATION:
+        return None
+
+    decimator = MinMaxDecimator(num_rows, window_len, bucket_len)
+    decimator.clear(samples.total - len(samples))
+    decimator.extend(samples.window()[1][:num_rows])
+
+    return decimator
+
+#plot history (a SampleRingBuffer of 'num_rows' rows) for a plot window of 'window_len' samples, and the running min/max
+#of its first 'num_channels' rows over the window. If 'old' (the plot history being replaced) is given, its samples are
+#carried over
+def startPlotHistory(window_len, num_rows, num_channels, old=None):
+    samples = SampleRingBuffer(int(window_len * BUFFER_HEADROOM) + 1, num_rows)
+    extremes = SlidingMinMax(num_channels, window_len)
+
+    if (old is not None) and len(old):
+        t, data = old.window()
+        samples.extend(t, data)
+        extremes.extend(data[:num_channels])
+
+    return samples, extremes
+
+#x values (seconds before the newest sample, by the device timestamps) of the points 'ages' samples before the newest
+#sample, given the times 't' (ms, oldest first) of the samples in the plot history
+def sampleAges(t, ages):
+    return (t[-1] - t[-1 - np.minimum(ages, len(t) - 1)]) / 1000.0
+
+#ages (as for sampleAges()) of the gaps in the plot history, oldest last, given the times 't' (ms, oldest first) of its
+#samples and the times 'gap_times' (ms, oldest first) of the samples that came right after a gap. A gap at age g lies
+#between the samples g and g + 1 samples before the newest
+def gapAges(t, gap_times):
+    idx = np.searchsorted(t, np.asarray(gap_times, dtype=np.float64))
+    idx = idx[(idx > 0) & (idx < len(t))]
+
+    return (len(t) - 1 - idx)[::-1]
+
+#break the lines at the gaps in the data: returns x values and 'y' (one row per line) with a NaN point between each pair
+#of neighbouring points on either side of a gap. 'ages' are the ages of the points (one row per line, or one row for
+#all of them), newest first, and 'gap_ages' those of the gaps (see gapAges()). Lines with fewer breaks than others are
+#padded with NaN points at the end
+def breakLines(x, y, ages, gap_ages):
+    x = np.broadcast_to(x, y.shape)
+
+    if (len(gap_ages) == 0) or (y.shape[1] < 2):
+        return x, y
+
+    gaps_before = np.searchsorted(gap_ages, ages)
+    breaks = np.zeros(gaps_before.shape, dtype=np.int64)
+    breaks[..., 1:] = np.cumsum(np.diff(gaps_before) > 0, axis=-1)
+
+    if not breaks[..., -1].any():
+        return x, y
+
+    cols = np.arange(y.shape[1]) + np.broadcast_to(breaks, y.shape)
+    rows = np.arange(y.shape[0])[:, None]
+
+    broken_x = np.full((y.shape[0], y.shape[1] + int(breaks[..., -1].max())), np.nan)
+    broken_y = np.full(broken_x.shape, np.nan)
+    broken_x[rows, cols] = x
+    broken_y[rows, cols] = y
+
+    return broken_x, broken_y
 
 def printHelp():
     print ('ventsense_client ' + SW_VERSION)
     print ('')
     print ('usage: python ventsense.py -p <serial port> [OPTIONS]')
+    print ('   or: python ventsense.py analyze <log directory> [OPTIONS] (see python analyze.py -h)')
     print ('')
     print ('options:')
-    print ('    -a, --atmospheric=<sensor ID>   Set the sensor which is used as the base for relative pressure plot. Must be 1, \n' +
-           '                                    2, or 3. Defaults to 1')
+    print ('    -a, --atmospheric=<sensor ID>   Set the sensor which is used as the base for relative pressure plot. Must be\n' +
+           '                                    between 1 and the number of sensors. Defaults to 1')
     print ('    -c, --show-console=<true/false> If true, echo sensor data to the console. Else, hide console output')
     print ('    -d, --show-plot=<true/false>    If true, draw plot of sensor data in a new window. Else, hide plot')
+    print ('    -f, --fps=<number>              Number of times per second the plot is redrawn. Every sample received since the\n' +
+           '                                    previous frame is added in one update. Must be between 1 and 120. Defaults to 30')
     print ('    -h                              Help. I.e., print this screen')
-    print ('    -p <serial port>                Name of serial port Arduino is attached to (required)')
+    print ('    -n, --sensors=<number>          Number of sensors to expect until the Arduino\'s header line is received (the\n' +
+           '                                    header line, printed when the Arduino starts, always takes precedence). Defaults to 3')
+    print ('    -p <serial port>                Name of serial port Arduino is attached to (required). To replay a recorded log\n' +
+           '                                    file instead, use replay://<path to ventsense_log .csv or .bin file>. For simulated\n' +
+           '                                    data, use sim://?<options> (see simulator.py). To read the samples another client\n' +
+           '                                    publishes with --serve, use stream://<host>:<port>[?device=<number>]. To read\n' +
+           '                                    several Arduinos at once, repeat -p or separate the port names with commas')
     print ('    -r, --relative=<true/false>     If true, plot pressures relative to atmospheric sensor. Else, plot\n' + 
            '                                    absolute pressure values')
     print ('    -w, --x-width=<seconds>         Number of seconds worth of data to display on plot')
+    print ('    --alarm-budget=<ms>             Latency budget for alarms, from reading a sample to raising its alarm. Alarms\n' +
+           '                                    over budget are counted on exit. Defaults to 100')
+    print ('    --alarm-sinks=<sinks>           Where alarms go: any of console, log (a ventsense_alarms .csv file), json (JSON\n' +
+           '                                    lines on stdout) and udp://<host>:<port>, separated by commas. Defaults to\n' +
+           '                                    console,log')
+    print ('    --alarms=<rules>                Alarm rules, separated by commas: high:<sensor ID>:<pressure>, low:<sensor ID>:\n' +
+           '                                    <pressure>, rate:<sensor ID>:<pressure per second> and dropout:<ms>, e.g.\n' +
+           '                                    high:3:40,low:3:2,dropout:500. Pressures are relative to the atmospheric sensor,\n' +
+           '                                    in the plot units. none turns alarms off. Defaults to none')
+    print ('    --breath-sensor=<sensor ID>     Sensor whose pressure, relative to the atmospheric sensor, is analyzed breath by\n' +
+           '                                    breath (PIP, PEEP, plateau, rate and I:E). 0 turns breath analysis off. Defaults\n' +
+           '                                    to 0')
     print ('    --combined=<true/false>         If true, plot all sensors on one pressure and one temperature plot, respectively. \n' +
            '                                    Else, draw a separate plot for each sensor')
+    print ('    --flow=<sensor pairs>           Pairs of sensors on either side of a flow element, upstream first (e.g. 2-3, or\n' +
+           '                                    1-3,2-3 for several), whose pressure difference is plotted as flow, with its\n' +
+           '                                    volume. The first pair is used for the tidal volume of breath analysis. none turns\n' +
+           '                                    flow off. Defaults to none')
+    print ('    --filter=<filters>              Noise filters for the plot and breath analysis, applied in order and separated by\n' +
+           '                                    commas: median:<channels>:<width>, lowpass:<channels>:<Hz> (one-pole),\n' +
+           '                                    biquad:<channels>:<Hz> (Butterworth) and decimate:<factor>, where <channels> is\n' +
+           '                                    p, t, p<sensor ID>, t<sensor ID> or all, joined with + (see filters.py), e.g.\n' +
+           '                                    median:p:5,biquad:p:8. The logs keep the raw values. none turns filtering off.\n' +
+           '                                    Defaults to none')
+    print ('    --flow-exponent=<number>        Exponent of the flow element calibration (0.5 for an orifice or venturi, 1 for a\n' +
+           '                                    laminar flow element). Defaults to 0.5')
+    print ('    --flow-k=<number>               Flow element calibration: flow in L/min = k * (pressure difference in hPa)^exponent.\n' +
+           '                                    Defaults to 100')
+    print ('    --flow-offset=<hPa>             Pressure difference between the flow sensors when there is no flow, subtracted\n' +
+           '                                    before calculating flow. Defaults to 0')
+    print ('    --ingest=<line/bulk>            How the serial port is read. line reads and parses one line at a time. bulk reads\n' +
+           '                                    everything available at once and parses it as a batch, for high sample rates.\n' +
+           '                                    Defaults to line')
+    print ('    --log-format=<csv/bin>          Format of the log files. csv writes the serial data as received. bin writes a\n' +
+           '                                    compact binary file that can be converted to csv with binlog.py. Defaults to csv')
+    print ('    --log-rotate-size=<MB>          Start a new log file once the current one reaches this size. 0 only starts a new\n' +
+           '                                    file when the Arduino resets. Defaults to 0')
+    print ('    --log-rotate-time=<minutes>     Start a new log file once the current one is this old. 0 only starts a new file\n' +
+           '                                    when the Arduino resets. Defaults to 0')
+    print ('    --log-sync=<ms>                 Longest time logged data waits before it is written and synced to disk (fsync),\n' +
+           '                                    i.e. the most that can be lost if the computer crashes or loses power. Defaults\n' +
+           '                                    to 1000')
+    print ('    --log-sync-size=<kB>            Also sync a log file to disk whenever this much data has been written to it since\n' +
+           '                                    it was last synced. Defaults to 1024')
+    print ('    --plot-device=<number>          When reading several serial ports, the one to plot (1 for the first -p, 2 for the\n' +
+           '                                    second, and so on). The others are only logged. Defaults to 1')
     print ('    --press-y-max=<number>          Set the upper bound on the pressure plot\'s Y axis. Ignored if y-autoscale=True')
     print ('    --press-y-min=<number>          Set the lower bound on the pressure plot\'s Y axis. Ignored if y-autoscale=True')
     print ('    --press-y-min-range=<number>    Set the minimum range of the pressure plot\'s Y axis. Ignored if y-autoscale=False')
+    print ('    --profile=<seconds>             Time each stage of reading, logging and plotting, print a breakdown of where the\n' +
+           '                                    time goes every this many seconds, and write a summary of the run to a\n' +
+           '                                    ventsense_profile_<date>.json file on exit (see profiling.py). 0 turns profiling\n' +
+           '                                    off. Defaults to 0')
+    print ('    --queue-overflow=<policy>       What to do with new plot samples when the plot falls behind and its queue is full.\n' +
+           '                                    Must be drop-oldest or drop-newest. Logging is never affected. Defaults to drop-oldest')
+    print ('    --queue-size=<number>           Maximum number of samples waiting to be plotted. Defaults to 1000')
+    print ('    --serve=<[host:]port>           Publish the parsed samples of every device on this TCP port (on localhost, unless\n' +
+           '                                    a host is given), for other tools and clients to subscribe to (see stream.py).\n' +
+           '                                    none turns the server off. Defaults to none')
+    print ('    --serve-buffer=<kB>             Most data waiting to be sent to one subscriber. A subscriber that falls further\n' +
+           '                                    behind has its oldest samples dropped. Defaults to 1024')
+    print ('    --speed=<number/max>            Replay speed, as a multiple of real time (e.g. 1 or 10). max replays as fast as\n' +
+           '                                    possible and reports the number of samples processed per second. Only used with\n' +
+           '                                    replay:// and sim://. Defaults to 1')
     print ('    --temp-y-max=<number>           Set the upper bound on the temperature plot\'s Y axis. Ignored if y-autoscale=True')
     print ('    --temp-y-min=<number>           Set the lower bound on the temperature plot\'s Y axis. Ignored if y-autoscale=True')
     print ('    --temp-y-min-range=<number>     Set the minimum range of the temperature plot\'s Y axis. Ignored if y-autoscale=False')
     print ('    --use-cmh2o=<true/false>        If true, display pressure data in cmH2O on plot. Else, use hPa')
+    print ('    --wire=<text/frames>            How the firmware sends its samples. text is a line of text per sample. frames asks\n' +
+           '                                    the firmware for compact binary frames with a CRC (see framing.py), for sample\n' +
+           '                                    rates of several hundred Hz; firmware without them carries on sending text. Only\n' +
+           '                                    used with serial ports and sim://. Defaults to text')
+    print ('    --wire-interval=<ms>            Sample interval to ask of the firmware with --wire=frames. Defaults to 5')
     print ('    --y-autoscale=<true/false>      If true, automatically scale Y axis to the plot data, to a minimum of y-min-range. \n' +
            '                                    Else, use selected y upper and lower bounds')
     print ('')
@@ -119,19 +396,124 @@ def printHelp():
            '      editing settings.ini directly.')
     
 
-def startNewLogFile():
+#start a new log, written by 'log_writer' (a logwriter.LogWriter). 'field_names' are the column names of the data to
+#be logged, timestamp first; every file of the log starts with them. 'device_name', if given, is added to the file
+#name, so that each device gets its own log files when several are read at once
+def startNewLogFile(log_writer, log_format=LOG_FORMAT_CSV, field_names=None, device_name=None):
+    if field_names is None:
+        field_names = ChannelSchema.forSensors(DEFAULT_NUM_SENSORS).field_names
+
+    if log_format == LOG_FORMAT_BIN:
+        from binlog import BinLogWriter, fileHeader
+
+        #samples are passed straight on to the log writer, which does the buffering
+        log_file = log_writer.open("ventsense_log", LOG_FORMAT_BIN, fileHeader(field_names), device_name)
+        return BinLogWriter(None, field_names, 0, log_file)
+
+    return log_writer.open("ventsense_log", LOG_FORMAT_CSV, ','.join(field_names) + '\n', device_name)
+
+#file for the breaths found by breath analysis, named like the log files
+def startBreathLog(device_name=None):
     timestr = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
-    csv_str = "ventsense_log_" + timestr + ".csv"
 
-    return open(csv_str, "a");
+    if device_name is not None:
+        timestr += "_" + device_name
+
+    return open("ventsense_breaths_" + timestr + ".csv", "a")
+
+#sinks for the alarms of one device, as named in the --alarm-sinks option (see alarms.py)
+def startAlarmSinks(sink_names, device_name=None):
+    sinks = []
+
+    for name in sink_names:
+        if name == SINK_CONSOLE:
+            sinks.append(ConsoleAlarmSink())
+        elif name == SINK_LOG:
+            timestr = time.strftime("%Y-%m-%d_%Hh%Mm%Ss")
+
+            if device_name is not None:
+                timestr += "_" + device_name
+
+            sinks.append(LogAlarmSink(open("ventsense_alarms_" + timestr + ".csv", "a")))
+        elif name == SINK_JSON:
+            sinks.append(JsonAlarmSink())
+        else:
+            sinks.append(UdpAlarmSink(name))
+
+    return sinks
     
+#open the data source named by the -p option: either a serial port (or any pySerial URL), a recorded
+#log file to replay, simulated sensor data, or the stream of another client. With 'wire_mode' WIRE_FRAMES, a serial
+#port or simulator is asked for binary frames every 'frame_interval' ms
+def openDataSource(port_name, replay_speed, wire_mode=WIRE_TEXT, frame_interval=DEFAULT_FRAME_INTERVAL):
+    if port_name.startswith(replay.URL_PREFIX):
+        ser = replay.ReplaySerial(port_name[len(replay.URL_PREFIX):], replay_speed, timeout=READ_TIMEOUT)
+        ser.open()
+        return ser
+
+    if port_name.startswith(simulator.URL_PREFIX):
+        ser = simulator.SimulatedSerial(port_name, replay_speed, timeout=READ_TIMEOUT)
+        ser.open()
+        return openWire(ser, wire_mode, frame_interval)
+
+    if port_name.startswith(stream.URL_PREFIX):
+        ser = stream.StreamSerial(port_name, timeout=READ_TIMEOUT)
+        ser.open()
+        return ser
+
+    #open serial port (we have to use this roundabout way of opening the serial port in order to avoid
+    #resetting the Arduino upon opening the serial port. See https://github.com/pyserial/pyserial/issues/124
+    #for more info)
+    ser = serial.serial_for_url(port_name, 115200,rtscts=False,dsrdtr=False,do_not_open=True,timeout=READ_TIMEOUT)
+    ser.dtr = 0
+    ser.rts = 0
+    ser.open()
+    ser.flushInput()
+
+    return openWire(ser, wire_mode, frame_interval)
+
+#the open data source 'ser', read through a FrameSerial if the firmware is to be asked for binary frames
+def openWire(ser, wire_mode, frame_interval):
+    if wire_mode != WIRE_FRAMES:
+        return ser
+
+    ser = FrameSerial(ser, frame_interval)
+    ser.open()
+    return ser
+
+#split a -p argument (or the serial_port setting) into the names of the serial ports it lists
+def splitPortNames(port_arg):
+    return [name.strip() for name in port_arg.split(',') if name.strip()]
+
+#short names for several data sources, for log file names and console output. The last part of each port name
+#is used (e.g. ttyACM0 for /dev/ttyACM0), or dev<n> if that is empty, already taken or a number (which would read as
+#the number of a log started within the same second as another, see logwriter.py)
+def deviceNames(port_names):
+    names = []
+
+    for idx, port_name in enumerate(port_names):
+        base = port_name.split('?')[0].rstrip('/\\')
+        name = re.sub(r'[^A-Za-z0-9_.-]', '', re.split(r'[/\\]', base)[-1])
+
+        if (not name) or name.isdigit() or (name in names):
+            name = 'dev' + str(idx + 1)
+
+        names.append(name)
+
+    return names
+
 def isStrTrue(in_str):
     return in_str.lower() in ['true', 'yes', 'y', '1', 'show', 'enable', 'on']
 
 def main(argv):
     global ATMOSPHERIC_BASELINE
-    ser_str = u''
-    first_read = True
+
+    #batch analysis of the logs in a directory, rather than reading a serial port
+    if argv and (argv[0] == 'analyze'):
+        import analyze
+        analyze.main(argv[1:])
+        return
+
     units_cmh2o = False
     y_min_range = [None, None]
     
@@ -153,32 +535,155 @@ def main(argv):
     y_min_range[PRESS_IDX] = config.getfloat('SETTINGS', 'pressure_y_min_range', fallback=20.0)
     y_min_range[TEMP_IDX] = config.getfloat('SETTINGS', 'temperature_y_min_range', fallback=5.0)
     serial_port_name = config.get('SETTINGS', 'serial_port', fallback=None)
+    queue_size = config.getint('SETTINGS', 'queue_size', fallback=1000)
+    queue_overflow = config.get('SETTINGS', 'queue_overflow', fallback=OVERFLOW_POLICIES[0])
+    render_fps = config.getfloat('SETTINGS', 'render_fps', fallback=DEFAULT_RENDER_FPS)
+    ingest_mode = config.get('SETTINGS', 'ingest_mode', fallback=INGEST_MODES[0])
+    log_format = config.get('SETTINGS', 'log_format', fallback=LOG_FORMAT_CSV)
+    replay_speed_str = config.get('SETTINGS', 'replay_speed', fallback='1')
+    num_sensors = config.getint('SETTINGS', 'num_sensors', fallback=DEFAULT_NUM_SENSORS)
+    plot_device = config.getint('SETTINGS', 'plot_device', fallback=1)
+    breath_sensor = config.getint('SETTINGS', 'breath_sensor', fallback=0)
+    flow_pairs_str = config.get('SETTINGS', 'flow_pairs', fallback='none')
+    flow_k = config.getfloat('SETTINGS', 'flow_k', fallback=DEFAULT_FLOW_K)
+    flow_exponent = config.getfloat('SETTINGS', 'flow_exponent', fallback=DEFAULT_FLOW_EXPONENT)
+    flow_offset = config.getfloat('SETTINGS', 'flow_offset', fallback=DEFAULT_FLOW_OFFSET)
+    alarm_rules_str = config.get('SETTINGS', 'alarms', fallback='none')
+    filters_str = config.get('SETTINGS', 'filters', fallback='none')
+    alarm_sinks_str = config.get('SETTINGS', 'alarm_sinks', fallback=SINK_CONSOLE + ',' + SINK_LOG)
+    alarm_budget = config.getfloat('SETTINGS', 'alarm_budget', fallback=DEFAULT_LATENCY_BUDGET * 1000.0)
+    log_sync = config.getfloat('SETTINGS', 'log_sync', fallback=DEFAULT_SYNC_INTERVAL * 1000.0)
+    log_sync_size = config.getfloat('SETTINGS', 'log_sync_size', fallback=DEFAULT_SYNC_BYTES / 1024.0)
+    log_rotate_size = config.getfloat('SETTINGS', 'log_rotate_size', fallback=0.0)
+    log_rotate_time = config.getfloat('SETTINGS', 'log_rotate_time', fallback=0.0)
+    serve_str = config.get('SETTINGS', 'serve', fallback='none')
+    serve_buffer = config.getfloat('SETTINGS', 'serve_buffer', fallback=stream.DEFAULT_BUFFER_BYTES / 1024.0)
+    profile_interval = config.getfloat('SETTINGS', 'profile_interval', fallback=0.0)
+    wire_mode = config.get('SETTINGS', 'wire_mode', fallback=WIRE_TEXT)
+    frame_interval = config.getint('SETTINGS', 'frame_interval', fallback=DEFAULT_FRAME_INTERVAL)
     
-    if (atmospheric_sensor > 3) or (atmospheric_sensor < 1):
+    if (atmospheric_sensor > MAX_NUM_SENSORS) or (atmospheric_sensor < 1):
         atmospheric_sensor = 1
     atmospheric_sensor = atmospheric_sensor - 1
     
     if (x_width > 1000.0) or (x_width < 0):
         x_width = 20.0
         
+    if queue_size < 1:
+        queue_size = 1000
+
+    if (num_sensors > MAX_NUM_SENSORS) or (num_sensors < 1):
+        num_sensors = DEFAULT_NUM_SENSORS
+
+    if plot_device < 1:
+        plot_device = 1
+
+    if (breath_sensor > MAX_NUM_SENSORS) or (breath_sensor < 0):
+        breath_sensor = 0
+
+    try:
+        flow_pairs = parseSensorPairs(flow_pairs_str)
+    except ValueError:
+        flow_pairs = []
+
+    if flow_k <= 0:
+        flow_k = DEFAULT_FLOW_K
+
+    if flow_exponent <= 0:
+        flow_exponent = DEFAULT_FLOW_EXPONENT
+
+    try:
+        alarm_rules = parseAlarmRules(alarm_rules_str)
+    except ValueError:
+        alarm_rules = []
+
+    try:
+        filter_specs = parseFilters(filters_str)
+    except ValueError:
+        filter_specs = []
+
+    try:
+        alarm_sinks = parseAlarmSinks(alarm_sinks_str)
+    except ValueError:
+        alarm_sinks = [SINK_CONSOLE, SINK_LOG]
+
+    if alarm_budget <= 0:
+        alarm_budget = DEFAULT_LATENCY_BUDGET * 1000.0
+
+    if queue_overflow not in OVERFLOW_POLICIES:
+        queue_overflow = OVERFLOW_POLICIES[0]
+
+    if (render_fps > MAX_RENDER_FPS) or (render_fps < 1.0):
+        render_fps = DEFAULT_RENDER_FPS
+
+    if ingest_mode not in INGEST_MODES:
+        ingest_mode = INGEST_MODES[0]
+
+    if log_format not in LOG_FORMATS:
+        log_format = LOG_FORMAT_CSV
+
+    if log_sync <= 0:
+        log_sync = DEFAULT_SYNC_INTERVAL * 1000.0
+
+    if log_sync_size <= 0:
+        log_sync_size = DEFAULT_SYNC_BYTES / 1024.0
+
+    if log_rotate_size < 0:
+        log_rotate_size = 0.0
+
+    if log_rotate_time < 0:
+        log_rotate_time = 0.0
+
+    serve_address = None
+    if serve_str.lower() != 'none':
+        try:
+            serve_address = stream.parseAddress(serve_str)
+        except ValueError:
+            serve_str = 'none'
+
+    if serve_buffer <= 0:
+        serve_buffer = stream.DEFAULT_BUFFER_BYTES / 1024.0
+
+    if profile_interval < 0:
+        profile_interval = 0.0
+
+    if wire_mode not in WIRE_MODES:
+        wire_mode = WIRE_TEXT
+
+    if (frame_interval < MIN_FRAME_INTERVAL) or (frame_interval > MAX_FRAME_INTERVAL):
+        frame_interval = DEFAULT_FRAME_INTERVAL
+
+    try:
+        replay_speed = replay.parseSpeed(replay_speed_str)
+    except ValueError:
+        replay_speed_str = '1'
+        replay_speed = 1.0
+
     x_upper_bound = x_width
     x_lower_bound = 0.0
     
     #parse command line options
     try:
-        opts, args = getopt.getopt(argv,"hc:r:w:p:a:d:", ["combined=", "relative=", "atmospheric=", "press-y-max=", "press-y-min=", 
+        opts, args = getopt.getopt(argv,"hc:r:w:p:a:d:f:n:", ["combined=", "relative=", "atmospheric=", "press-y-max=", "press-y-min=", 
                                                           "temp-y-max=", "temp-y-min=", "x-width=", "use-cmh2o=", "show-plot=","show-console=",
-                                                          "y-autoscale=", "press-y-min-range=", "temp-y-min-range="])
+                                                          "y-autoscale=", "press-y-min-range=", "temp-y-min-range=",
+                                                          "queue-size=", "queue-overflow=", "fps=", "ingest=", "log-format=", "speed=",
+                                                          "sensors=", "plot-device=", "breath-sensor=", "flow=", "flow-k=",
+                                                          "flow-exponent=", "flow-offset=", "alarms=", "alarm-sinks=",
+                                                          "alarm-budget=", "log-sync=", "log-sync-size=", "log-rotate-size=",
+                                                          "log-rotate-time=", "serve=", "serve-buffer=", "profile=", "filter=", "wire=",
+                                                          "wire-interval="])
     except getopt.GetoptError:
         printHelp()
         sys.exit(2)
+    port_args = []
     for opt, arg in opts:
         opt = opt.lower()
         if opt == '-h':
             printHelp()
             sys.exit()
         elif opt == '-p':
-            serial_port_name = arg
+            port_args.append(arg)
         elif opt in ('-c','--show-console'):
             console_output = isStrTrue(arg)
         elif opt == '-p':
@@ -188,16 +693,69 @@ def main(argv):
         elif opt in ('-r', '--relative'):
             relative_plot = isStrTrue(arg)
         elif opt in ('-a', '--atmospheric'):
-            if (arg == '1'):
-                atmospheric_sensor = SENSOR_1
-            elif (arg == '2'):
-                atmospheric_sensor = SENSOR_2
-            elif (arg == '3'):
-                atmospheric_sensor = SENSOR_3
+            if arg.isdigit() and (1 <= int(arg) <= MAX_NUM_SENSORS):
+                atmospheric_sensor = int(arg) - 1
             else:
-                print("Sensor value be equal to 1, 2, or 3. Invalid sensor: " + arg)
+                print("Sensor value must be between 1 and " + str(MAX_NUM_SENSORS) + ". Invalid sensor: " + arg)
                 printHelp()
                 sys.exit()
+        elif opt == '--plot-device':
+            plot_device = int(arg)
+            if plot_device < 1:
+                print("plot-device value must be at least 1")
+                sys.exit()
+        elif opt == '--breath-sensor':
+            if arg.isdigit() and (int(arg) <= MAX_NUM_SENSORS):
+                breath_sensor = int(arg)
+            else:
+                print("breath-sensor value must be between 0 and " + str(MAX_NUM_SENSORS) + ". Invalid sensor: " + arg)
+                sys.exit()
+        elif opt == '--flow':
+            try:
+                flow_pairs = parseSensorPairs(arg)
+            except ValueError as e:
+                print(str(e) + '. flow value must be pairs of sensor IDs, e.g. 2-3 or 1-3,2-3, or none')
+                sys.exit()
+        elif opt == '--flow-k':
+            flow_k = float(arg)
+            if flow_k <= 0:
+                print("flow-k value must be greater than 0")
+                sys.exit()
+        elif opt == '--flow-exponent':
+            flow_exponent = float(arg)
+            if flow_exponent <= 0:
+                print("flow-exponent value must be greater than 0")
+                sys.exit()
+        elif opt == '--flow-offset':
+            flow_offset = float(arg)
+        elif opt == '--alarms':
+            try:
+                alarm_rules = parseAlarmRules(arg)
+            except ValueError as e:
+                print(str(e) + '. alarms value must be rules like high:3:40,low:3:2,rate:3:200,dropout:500, or none')
+                sys.exit()
+        elif opt == '--filter':
+            try:
+                filter_specs = parseFilters(arg)
+            except ValueError as e:
+                print(str(e) + '. filter value must be filters like median:p:5,biquad:p2+p3:8,decimate:2, or none')
+                sys.exit()
+        elif opt == '--alarm-sinks':
+            try:
+                alarm_sinks = parseAlarmSinks(arg)
+            except ValueError as e:
+                print(str(e) + '. alarm-sinks value must be any of console, log, json and udp://<host>:<port>')
+                sys.exit()
+        elif opt == '--alarm-budget':
+            alarm_budget = float(arg)
+            if alarm_budget <= 0:
+                print("alarm-budget value must be greater than 0")
+                sys.exit()
+        elif opt in ('-n', '--sensors'):
+            num_sensors = int(arg)
+            if (num_sensors > MAX_NUM_SENSORS) or (num_sensors < 1):
+                print("sensors value must be between 1 and " + str(MAX_NUM_SENSORS))
+                sys.exit()
         elif opt == '--press-y-max':
             y_upper_bound_press = float(arg)
         elif opt == '--press-y-min':
@@ -217,18 +775,110 @@ def main(argv):
             units_cmh2o = isStrTrue(arg)
         elif opt in ('-d', '--show-plot'):
             plot_enabled = isStrTrue(arg)
+        elif opt in ('-f', '--fps'):
+            render_fps = float(arg)
+            if (render_fps > MAX_RENDER_FPS) or (render_fps < 1.0):
+                print("fps value must be between 1 and " + str(int(MAX_RENDER_FPS)))
+                sys.exit()
         elif opt == '--y-autoscale':
             y_autoscale = isStrTrue(arg)
         elif opt == '--press-y-min-range':
             y_min_range[PRESS_IDX] = float(arg)
         elif opt == '--temp-y-min-range':
             y_min_range[TEMP_IDX] = float(arg)
+        elif opt == '--ingest':
+            ingest_mode = arg.lower()
+            if ingest_mode not in INGEST_MODES:
+                print("ingest value must be one of: " + ', '.join(INGEST_MODES))
+                sys.exit()
+        elif opt == '--log-format':
+            log_format = arg.lower()
+            if log_format not in LOG_FORMATS:
+                print("log-format value must be one of: " + ', '.join(LOG_FORMATS))
+                sys.exit()
+        elif opt == '--log-sync':
+            log_sync = float(arg)
+            if log_sync <= 0:
+                print("log-sync value must be greater than 0")
+                sys.exit()
+        elif opt == '--log-sync-size':
+            log_sync_size = float(arg)
+            if log_sync_size <= 0:
+                print("log-sync-size value must be greater than 0")
+                sys.exit()
+        elif opt == '--log-rotate-size':
+            log_rotate_size = float(arg)
+            if log_rotate_size < 0:
+                print("log-rotate-size value must be at least 0")
+                sys.exit()
+        elif opt == '--log-rotate-time':
+            log_rotate_time = float(arg)
+            if log_rotate_time < 0:
+                print("log-rotate-time value must be at least 0")
+                sys.exit()
+        elif opt == '--serve':
+            serve_address = None
+            if arg.lower() != 'none':
+                try:
+                    serve_address = stream.parseAddress(arg)
+                except ValueError:
+                    print("serve value must be a port number, or <host>:<port>, or none")
+                    sys.exit()
+            serve_str = arg.lower()
+        elif opt == '--serve-buffer':
+            serve_buffer = float(arg)
+            if serve_buffer <= 0:
+                print("serve-buffer value must be greater than 0")
+                sys.exit()
+        elif opt == '--profile':
+            profile_interval = float(arg)
+            if profile_interval < 0:
+                print("profile value must be at least 0")
+                sys.exit()
+        elif opt == '--wire':
+            wire_mode = arg.lower()
+            if wire_mode not in WIRE_MODES:
+                print("wire value must be one of: " + ', '.join(WIRE_MODES))
+                sys.exit()
+        elif opt == '--wire-interval':
+            frame_interval = int(arg)
+            if (frame_interval < MIN_FRAME_INTERVAL) or (frame_interval > MAX_FRAME_INTERVAL):
+                print("wire-interval value must be between " + str(MIN_FRAME_INTERVAL) + " and " + str(MAX_FRAME_INTERVAL))
+                sys.exit()
+        elif opt == '--speed':
+            try:
+                replay_speed = replay.parseSpeed(arg)
+            except ValueError:
+                print("speed value must be a number greater than 0, or max")
+                sys.exit()
+            replay_speed_str = arg.lower()
+        elif opt == '--queue-size':
+            queue_size = int(arg)
+            if queue_size < 1:
+                print("queue-size value must be at least 1")
+                sys.exit()
+        elif opt == '--queue-overflow':
+            queue_overflow = arg.lower()
+            if queue_overflow not in OVERFLOW_POLICIES:
+                print("queue-overflow value must be one of: " + ', '.join(OVERFLOW_POLICIES))
+                sys.exit()
         else:
             print("Unknown argument: " + opt)
             printHelp()
             sys.exit()
 
-    if not serial_port_name:
+    #serial ports given on the command line replace the saved ones
+    if port_args:
+        serial_port_name = ','.join(port_args)
+
+    port_names = []
+    if serial_port_name:
+        port_names = splitPortNames(serial_port_name)
+
+    if plot_device > len(port_names):
+        plot_device = 1
+
+    if not port_names:
         print('Please specify serial port with -p option on command line or with "SerialPort" value in settings.ini')
         printHelp()
         sys.exit(2)
@@ -252,40 +902,61 @@ def main(argv):
         config.set('SETTINGS', 'y_autoscale', str(y_autoscale))
         config.set('SETTINGS', 'pressure_y_min_range', str(y_min_range[PRESS_IDX]))
         config.set('SETTINGS', 'temperature_y_min_range', str(y_min_range[TEMP_IDX]))
-        config.set('SETTINGS', 'serial_port', serial_port_name)
+        config.set('SETTINGS', 'serial_port', ','.join(port_names))
+        config.set('SETTINGS', 'queue_size', str(queue_size))
+        config.set('SETTINGS', 'queue_overflow', queue_overflow)
+        config.set('SETTINGS', 'render_fps', str(render_fps))
+        config.set('SETTINGS', 'ingest_mode', ingest_mode)
+        config.set('SETTINGS', 'log_format', log_format)
+        config.set('SETTINGS', 'replay_speed', replay_speed_str)
+        config.set('SETTINGS', 'num_sensors', str(num_sensors))
+        config.set('SETTINGS', 'plot_device', str(plot_device))
+        config.set('SETTINGS', 'breath_sensor', str(breath_sensor))
+        config.set('SETTINGS', 'flow_pairs', formatSensorPairs(flow_pairs) if flow_pairs else 'none')
+        config.set('SETTINGS', 'flow_k', str(flow_k))
+        config.set('SETTINGS', 'flow_exponent', str(flow_exponent))
+        config.set('SETTINGS', 'flow_offset', str(flow_offset))
+        config.set('SETTINGS', 'alarms', formatAlarmRules(alarm_rules) if alarm_rules else 'none')
+        config.set('SETTINGS', 'alarm_sinks', ','.join(alarm_sinks) if alarm_sinks else 'none')
+        config.set('SETTINGS', 'alarm_budget', str(alarm_budget))
+        config.set('SETTINGS', 'filters', formatFilters(filter_specs) if filter_specs else 'none')
+        config.set('SETTINGS', 'log_sync', str(log_sync))
+        config.set('SETTINGS', 'log_sync_size', str(log_sync_size))
+        config.set('SETTINGS', 'log_rotate_size', str(log_rotate_size))
+        config.set('SETTINGS', 'log_rotate_time', str(log_rotate_time))
+        config.set('SETTINGS', 'serve', serve_str)
+        config.set('SETTINGS', 'serve_buffer', str(serve_buffer))
+        config.set('SETTINGS', 'profile_interval', str(profile_interval))
+        config.set('SETTINGS', 'wire_mode', wire_mode)
+        config.set('SETTINGS', 'frame_interval', str(frame_interval))
         
         with open('settings.ini', 'w') as configfile:
             config.write(configfile)
-        
-        #open serial port (we have to use this roundabout way of opening the serial port in order to avoid
-        #resetting the Arduino upon opening the serial port. See https://github.com/pyserial/pyserial/issues/124
-        #for more info)
-        ser = serial.serial_for_url(serial_port_name, 115200,rtscts=False,dsrdtr=False,do_not_open=True)
-        ser.dtr = 0
-        ser.rts = 0
-        ser.open()
-        ser.flushInput()
 
-        file = startNewLogFile()
-        
-        fig = None
-        axs = [[None, None],[None, None],[None, None]]
-        axs_idx = [SENSOR_1, SENSOR_2, SENSOR_3]
-        lines = [[None, None],[None, None],[None, None]]
-        y_data = [[None, None],[None, None],[None, None]]
-        x_data = None
-        leg = [None, None]
-        y_low_prev = [[0, 0],[0, 0],[0, 0]]
-        y_high_prev = [[0, 0],[0, 0],[0, 0]]
-        y_large_rescale_debounce = [[0, 0],[0, 0],[0, 0]]
-        y_small_rescale_debounce = [[0, 0],[0, 0],[0, 0]]
-        
-        if (combined_plot):
-            axs = [[None, None]]
-            axs_idx = [SENSOR_1, SENSOR_1, SENSOR_1]
-        
-        i=0
+        #the stream server takes its port before anything else starts, so that a port already in use is reported
+        #straight away
+        stream_server = None
+        if serve_address is not None:
+            try:
+                stream_server = stream.StreamServer(serve_address[1], serve_address[0], int(serve_buffer * 1024))
+            except OSError as e:
+                print('Cannot serve on ' + serve_address[0] + ':' + str(serve_address[1]) + ': ' + str(e))
+                sys.exit(2)
         
+        sources = [openDataSource(port_name, replay_speed, wire_mode, frame_interval) for port_name in port_names]
+
+        #devices only need names to tell them apart when there is more than one
+        device_names = [None]
+        if len(port_names) > 1:
+            device_names = deviceNames(port_names)
+
+        #reading the serial port and logging to CSV happen on the acquisition thread, so they keep running at full
+        #rate even while the plot is being redrawn. The plot only sees parsed samples, through a bounded queue. With
+        #several serial ports, each has its own acquisition thread, but only the plotted one has a queue
+        sample_queue = None
+        if plot_enabled:
+            sample_queue = SampleQueue(queue_size, queue_overflow)
+
         #set up unit string and conversion factor, based on user selection
         units_str = 'hPa'
         c = 1.0
@@ -295,274 +966,692 @@ def main(argv):
             
         ATMOSPHERIC_BASELINE = ATMOSPHERIC_BASELINE * c
 
-        #continually listen to serial stream and pass it through to CSV log file
+        flow_calibration = FlowCalibration(flow_k, flow_exponent, flow_offset)
+
+        #breath analysis runs on the acquisition threads, so that it sees every sample even when the plot falls behind
+        analyzers = [None] * len(sources)
+        if breath_sensor > 0:
+            if breath_sensor - 1 == atmospheric_sensor:
+                print('The breath sensor cannot be the atmospheric sensor. Breath analysis is off')
+            else:
+                analyzers = [BreathAnalyzer(breath_sensor - 1, atmospheric_sensor, c, units_str,
+                                            startBreathLog(device_names[idx] if len(sources) > 1 else None),
+                                            flow_pair=flow_pairs[0] if flow_pairs else None,
+                                            flow_calibration=flow_calibration)
+                             for idx in range(len(sources))]
+
+        #alarms are checked on the acquisition threads too, as soon as each sample is parsed
+        alarm_engines = [None] * len(sources)
+        if alarm_rules:
+            alarm_engines = [AlarmEngine(alarm_rules, atmospheric_sensor, c, units_str,
+                                         startAlarmSinks(alarm_sinks, device_names[idx] if len(sources) > 1 else None),
+                                         device_names[idx] if len(sources) > 1 else None, alarm_budget / 1000.0)
+                             for idx in range(len(sources))]
+
+        #the samples of each device are filtered on its acquisition thread too, before breath analysis and the plot
+        filter_chains = [None] * len(sources)
+        if filter_specs:
+            filter_chains = [FilterChain(filter_specs, ChannelSchema.forSensors(num_sensors)) for _ in sources]
+
+        #the log files of every device are written and synced to disk on a thread of their own, so that neither a slow
+        #disk nor a sync holds up the serial ports
+        log_writer = LogWriter(log_sync / 1000.0, int(log_sync_size * 1024), int(log_rotate_size * 1024 * 1024),
+                               log_rotate_time * 60.0)
+        log_writer.start()
+
+        #every device's samples are published in the order of the -p options, named after their ports
+        publishers = [None] * len(sources)
+        if stream_server is not None:
+            publishers = [stream_server.publisher(port_name) for port_name in port_names]
+            stream_server.start()
+
+        #with --profile, every acquisition thread and the render loop time their stages (see profiling.py)
+        profiler = None
+        profiles = [None] * len(sources)
+        render_profile = None
+        if profile_interval > 0:
+            profiler = Profiler(profile_interval)
+            profiles = [profiler.addProfile('acquisition' + ('.' + device_names[idx] if len(sources) > 1 else ''),
+                                            ACQUISITION_STAGES)
+                        for idx in range(len(sources))]
+
+            if plot_enabled:
+                render_profile = profiler.addProfile('plot', RENDER_STAGES)
+
+        acqs = []
+        for idx, ser in enumerate(sources):
+            device_name = device_names[idx] if len(sources) > 1 else None
+
+            acqs.append(AcquisitionThread(ser, lambda field_names, device_name=device_name:
+                                              startNewLogFile(log_writer, log_format, field_names, device_name),
+                                          console_output, sample_queue if (idx == plot_device - 1) else None,
+                                          ingest_mode, ChannelSchema.forSensors(num_sensors), device_name,
+                                          analyzers[idx], alarm_engines[idx], publishers[idx], profiles[idx],
+                                          filter_chains[idx]))
+
+        #acquisition thread (and breath analyzer) of the plotted device
+        acq = acqs[plot_device - 1]
+        analyzer = analyzers[plot_device - 1]
+        errors_reported = set()
+        
+        #the plot is laid out for the channel schema in use when it is created, and is created again if the schema
+        #changes (see below)
+        schema = None
+        fig = None
+        axs = None
+        y_data = None
+        x_data = None
+
+        #newest breath of the plotted device, and the text showing it on the plot
+        last_breath = None
+        breath_text = None
+
+        #timing of the plotted device (see timing.py), shown in the bottom left corner of the first pressure plot
+        timing_text = None
+
+        #flow and volume plots (see below). The volume plot starts again from zero at each breath start
+        num_flows = 0
+        breath_start_times = collections.deque(maxlen=max(VOLUME_BREATHS, int(x_width)))
+        breath_start_volumes = collections.deque(maxlen=max(VOLUME_BREATHS, int(x_width)))
+        pending_breath_starts = []
+        
+        #plot history is kept in a fixed-size ring buffer holding one channel per sensor value, sized to
+        #the visible window plus some headroom (created on the first frame, see below). The x axis is the time before
+        #the newest sample in seconds (newest at x = 0), from the device's own timestamps made continuous by
+        #plot_clock, so lost samples leave room rather than squeezing the line, and the lines are broken there (the times
+        #of the samples after each gap are kept in plot_gaps, see breakLines()). The window is sized for the sample
+        #rate measured by plot_clock, once it is known. The Y autoscale range comes from a running min/max of each
+        #channel over the visible window, updated as samples arrive, so it can be checked on every frame
+        sample_rate = SAMPLE_RATE
+        window_len = int(x_width * sample_rate) + 1
+        samples = None
+        extremes = None
+        plot_clock = None
+        plot_gaps = collections.deque()
+        plot_sessions = 0
+
+        #when the window holds many samples per pixel column of the plot, the lines are drawn from a min/max
+        #envelope of the window, updated as samples arrive (see decimate.py), so the cost of drawing a frame is set by
+        #the width of the plot rather than the length of the window. Set up along with the plot (see below)
+        decimator = None
+        plot_width = None
+
+        #frame pacing. The plot is updated at most render_fps times per second, no matter how fast samples
+        #arrive, so drawing cost is set by the frame rate rather than the sample rate
+        frame_period = 1.0 / render_fps
+        next_frame = time.perf_counter()
+        frames = 0
+
+        for a in acqs:
+            a.start()
+
+        #serial ports are open and logging has started
+        if len(port_names) > 1:
+            print('Listening on ' + ', '.join(device_names[idx] + ' (' + port_name + ')'
+                                              for idx, port_name in enumerate(port_names)) + ' (CTRL+C to exit)')
+        else:
+            print('Listening on ' + port_names[0] + ' (CTRL+C to exit)')
+
+        if stream_server is not None:
+            print('Serving samples on ' + stream_server.host + ':' + str(stream_server.port))
+        sys.stdout.flush()
+
+        #render loop. Each frame takes every sample that has arrived since the previous frame, adds them all to
+        #the plot history and then updates the plot once
         while True:
             try:
-                #read serial data
-                ser_bytes = ser.readline()
-                
-                #if running python 3, convert bytes to string
-                if (sys.version_info > (3, 0)):
-                    ser_str = ser_bytes.decode('utf-8', 'ignore')
+                alive = [a for a in acqs if a.is_alive()]
 
+                #an error on an acquisition thread ends that device's session. With several devices, the others carry on
+                for a in acqs:
+                    if (a.error is not None) and (a not in alive) and (a not in errors_reported):
+                        errors_reported.add(a)
+                        if a.device_name is not None:
+                            print(a.device_name + ': ' + str(a.error))
+                        else:
+                            print(a.error)
+                        print(a.error_traceback)
+
+                if (profiler is not None) and profiler.due():
+                    print(profiler.report(sum(a.clock.samples for a in acqs), frames, sample_queue))
+                    sys.stdout.flush()
+
+                #stop once acquisition has ended (e.g. at the end of a replayed log) and everything it
+                #produced has been drawn
+                if (not alive) and ((sample_queue is None) or (len(sample_queue) == 0)):
+                    break
+
+                if not plot_enabled:
+                    alive[0].join(HEADLESS_POLL_TIME)
+                    continue
+
+                #the plotting modules are imported here rather than at startup, so that no samples are
+                #missed while they load. Samples received in the meantime wait in the queue
+                if samples is None:
+                    importPlotModules()
+
+                if render_profile is not None:
+                    t_stage = clock()
+
+                #wait for the next frame, keeping the plot window responsive in the meantime
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    if fig is not None:
+                        fig.canvas.start_event_loop(delay)
+                    else:
+                        time.sleep(delay)
+
+                #if the previous frame overran, start counting again from now instead of trying to catch up
+                next_frame = max(next_frame + frame_period, time.perf_counter())
+
+                if render_profile is not None:
+                    t_stage = render_profile.lap(STAGE_WAIT, t_stage)
+
+                batch = sample_queue.drain()
+
+                if analyzer is not None:
+                    breaths = analyzer.takeRecent()
+
+                    if breaths:
+                        last_breath = breaths[-1]
+
+                        #each breath ends where the next one starts
+                        if num_flows:
+                            pending_breath_starts.extend(breath.end for breath in breaths)
+
+                        if breath_text is not None:
+                            breath_text.set_text(formatBreath(last_breath, units_str))
+
+                if render_profile is not None:
+                    t_stage = render_profile.lap(STAGE_DRAIN, t_stage)
+
+                if not batch:
+                    continue
+
+                frames += 1
+
+                #start the plot over if the Arduino has reset with a different set of sensors. The acquisition thread
+                #switches schema before it queues any sample of the new schema, so checking after the drain means
+                #the batch cannot hold samples newer than the schema
+                if schema is not acq.schema:
+                    schema = acq.schema
+                    num_sensors = schema.num_sensors
+
+                    if fig is not None:
+                        plt.close(fig)
+                        fig = None
+                        breath_text = None
+                        timing_text = None
+
+                    #flow through each flow sensor pair, and its running volume, are kept after the sensor channels
+                    flow_channels = None
+                    num_flows = 0
+                    if flow_pairs:
+                        flow_channels = FlowChannels(schema, flow_pairs, flow_calibration)
+                        num_flows = flow_channels.num_flows
+
+                        if flow_channels.missing:
+                            print('Flow sensors not present: ' + formatSensorPairs(flow_channels.missing))
+
+                    flow_rows = list(range(schema.num_channels, schema.num_channels + num_flows))
+                    volume_rows = list(range(schema.num_channels + num_flows, schema.num_channels + 2 * num_flows))
+                    volumes = VolumeIntegrator(num_flows)
+                    breath_start_times.clear()
+                    breath_start_volumes.clear()
+                    del pending_breath_starts[:]
+                    flow_rescale_debounce = [0, 0]
+
+                    samples, extremes = startPlotHistory(window_len, schema.num_channels + 2 * num_flows, schema.num_channels)
+                    decimator = None
+                    plot_clock = SampleClock()
+                    plot_gaps.clear()
+                    plot_sessions = 0
+
+                    press_channels = np.array(schema.press_channels)
+
+                    if atmospheric_sensor < num_sensors:
+                        atmospheric_channel = schema.channel(atmospheric_sensor, PRESS_IDX)
+                    else:
+                        print('Atmospheric sensor ' + str(atmospheric_sensor + 1) + ' not present, using sensor 1')
+                        atmospheric_channel = schema.channel(SENSOR_1, PRESS_IDX)
+
+                    axs_idx = list(range(num_sensors))
+                    if (combined_plot):
+                        axs_idx = [SENSOR_1] * num_sensors
+
+                    lines = [[None, None] for j in range(num_sensors)]
+                    leg = [None, None]
+                    y_low_prev = [[0, 0] for j in range(num_sensors)]
+                    y_high_prev = [[0, 0] for j in range(num_sensors)]
+                    y_large_rescale_debounce = [[0, 0] for j in range(num_sensors)]
+                    y_small_rescale_debounce = [[0, 0] for j in range(num_sensors)]
+                    derived_axs = []
+                    derived_lines = []
+                    derived_legs = []
+
+                #samples queued before a schema change no longer fit the plot
+                batch = [sample for sample in batch if len(sample) == schema.num_fields]
+
+                if not batch:
+                    continue
+
+                #convert the whole batch to channel values (temp 1, press 1, temp 2, press 2, ...) at once, one row per
+                #channel and one column per sample
+                batch = np.array(batch, dtype=np.float64)
+                values = batch[:, 1:].T
+                t = plot_clock.addSamples(batch[:, 0])
+
+                #flows are calibrated in hPa, so they are calculated before the unit conversion
+                if num_flows:
+                    flows = flow_channels.compute(values)
+                    flow_volumes = volumes.integrate(t, flows)
+
+                values[press_channels] *= c
+
+                #if relative plot is selected, recalculate y data from absolute to relative values
+                if (relative_plot):
+                    rel_base = values[atmospheric_channel].copy()
+                    values[press_channels] -= rel_base
+                    values[atmospheric_channel] = rel_base - ATMOSPHERIC_BASELINE
+
+                if render_profile is not None:
+                    t_stage = render_profile.lap(STAGE_CONVERT, t_stage)
+
+                #once the sample rate is known, or if it changes, the plot history is resized to hold the window at
+                #that rate (keeping what it holds), and the decimator starts over for the new window length. This comes
+                #before the batch is added, as the running min/max is rebuilt from the samples carried over
+                measured_rate = plot_clock.nominalRate()
+                if ((measured_rate is not None) and (plot_clock.intervals >= RATE_MIN_INTERVALS) and
+                        (abs(measured_rate - sample_rate) > sample_rate * RATE_TOLERANCE)):
+                    sample_rate = measured_rate
+                    window_len = min(int(x_width * sample_rate) + 1, MAX_WINDOW_LEN)
+                    samples, extremes = startPlotHistory(window_len, schema.num_channels + 2 * num_flows,
+                                                         schema.num_channels, samples)
+                    decimator = None
+                    plot_width = None
+
+                extremes.extend(values)
+
+                if num_flows:
+                    values = np.vstack((values, flows, flow_volumes))
+
+                #note the samples that come after a gap (as plot_clock tells them), counting the one between the newest
+                #sample plotted and the batch
+                if plot_clock.interval:
+                    t_gaps = np.concatenate(([samples.latest()[0]], t)) if len(samples) else t
+                    plot_gaps.extend(t_gaps[1:][np.diff(t_gaps) >= plot_clock.gapLimit()].tolist())
+
+                samples.extend(t, values)
+
+                #the decimator's buckets are set by the width of the plot, so it starts over if the window is resized
+                if (fig is not None) and (int(axs[SENSOR_1][PRESS_IDX].bbox.width) != plot_width):
+                    plot_width = int(axs[SENSOR_1][PRESS_IDX].bbox.width)
+                    decimator = startDecimator(samples, schema.num_channels + num_flows, window_len, plot_width)
+                elif decimator is not None:
+                    decimator.extend(values[:decimator.num_channels])
+
+                if render_profile is not None:
+                    t_stage = render_profile.lap(STAGE_HISTORY, t_stage)
+
+                #newest samples are drawn at x = 0 and scroll from right to left, so the line data is
+                #the newest part of the buffer in reverse order, plotted against the time before the newest sample.
+                #Each row of x_data holds the x values of the same row of y_data, and the lines are broken at gaps
+                n = min(len(samples), window_len)
+                t_data = samples.window()[0]
+
+                while plot_gaps and (plot_gaps[0] <= t_data[0]):
+                    plot_gaps.popleft()
+                gap_ages = gapAges(t_data, plot_gaps)
+
+                if decimator is not None:
+                    point_ages, y_data = decimator.envelope(n)
                 else:
-                    ser_str = ser_bytes
-
-                #remove whitespace and line endings
-                ser_str = ser_str.strip()
-
-                #if string is empty, skip the rest
-                if ser_str:
-                    #echo data on console, if requested
-                    if console_output:
-                        print(ser_str)
-
-                    #if Arduino resets while listening, then start a new log file
-                    if ser_str[0:4] == 'time':
-                        file.close()
-                        file = startNewLogFile()
-                    #if Arduino was already running when we started listening, write 
-                    #table heading to log file
-                    elif first_read:
-                        file.write("timestamp,temp 1,press 1,temp 2,press 2,temp 3,press 3\n")
-                        
-                    first_read = False
-                    
-                    #log data to CSV
-                    file.write(ser_str + '\n')
+                    point_ages = np.arange(n)
+                    y_data = samples.window(n)[1][:, ::-1]
+
+                x_data, y_data = breakLines(sampleAges(t_data, point_ages), y_data, point_ages, gap_ages)
+
+                if num_flows:
+                    t_data, data = samples.window()
+
+                    #the Arduino has reset (or millis() has wrapped around), so the breath starts are from the previous
+                    #session
+                    if plot_clock.resets + plot_clock.wraps != plot_sessions:
+                        plot_sessions = plot_clock.resets + plot_clock.wraps
+                        breath_start_times.clear()
+                        breath_start_volumes.clear()
+                        del pending_breath_starts[:]
+
+                    #breath starts are device timestamps of the current session, which are offset from the plot's
+                    #continuous time by the same amount as the newest sample
+                    offset = t_data[-1] - batch[-1, 0]
+
+                    #note the running volume at each breath start, once its sample has been plotted
+                    while pending_breath_starts and (pending_breath_starts[0] + offset <= t_data[-1]):
+                        t_start = pending_breath_starts.pop(0) + offset
+
+                        if t_start >= t_data[0]:
+                            breath_start_times.append(t_start)
+                            breath_start_volumes.append([np.interp(t_start, t_data, data[row]) for row in volume_rows])
+
+                    volume_data = breathVolumes(t_data[-n:], data[volume_rows, -n:], np.array(breath_start_times),
+                                                np.array(breath_start_volumes).T)
+
+                    #the volumes start over at breath starts that are only found a little later, so they are decimated
+                    #from the whole window on every frame
+                    if decimator is not None:
+                        volume_ages, volume_data = decimator.envelopeOf(volume_data)
+                    else:
+                        volume_ages, volume_data = point_ages, volume_data[:, ::-1]
+
+                    volume_x, volume_data = breakLines(sampleAges(t_data, volume_ages), volume_data, volume_ages,
+                                                       gap_ages)
+
+                    derived_data = [y_data[flow_rows], volume_data]
+                    derived_x = [x_data[flow_rows], volume_x]
+
+                if timing_text is not None:
+                    timing_text.set_text(acq.clock.summary() + (', plot dropped ' + str(sample_queue.dropped)
+                                                                if sample_queue.dropped else ''))
+
+                if render_profile is not None:
+                    t_stage = render_profile.lap(STAGE_LINES, t_stage)
+
+                if fig is not None:
+                    #each time through after the first, update the line data and redraw only the area inside the axes (unless rescaling due 
+                    #to autoscale). We save time and thereby acheive smoother animation by redrawing only the graphical elements that have changed
+                    redraw = False
                     
-                    #plot data
-                    str_tokens = ser_str.split(',')
+                    #if Y autoscale is enabled, recalculate the axis range. Note: the axis is only drawn to the newly-rescaled
+                    #range if certain conditions are met (see below), to avoid rescaling too often. The debounce counters
+                    #count the number of samples for which a condition has held
+                    if y_autoscale:
+                        channel_low, channel_high = extremes.extremes()
+                        
+                        for k in (PRESS_IDX, TEMP_IDX):
+                            y_low = channel_low[schema.kind_channels[k]]
+                            y_high = channel_high[schema.kind_channels[k]]
 
-                    if ((len(str_tokens) >= 7) and (ser_str[0:4] != 'time')) and plot_enabled:
-                        if i > 0:
-                            #each time through after the first, update the line data and redraw only the area inside the axes (unless rescaling due 
-                            #to autoscale). We save time and thereby acheive smoother animation by redrawing only the graphical elements that have changed
-                            
-                            #add new y data to front of series (this allows data to scroll from right to left)
-                            y_data[SENSOR_1][PRESS_IDX] = [float(str_tokens[2]) * c] + y_data[SENSOR_1][PRESS_IDX]
-                            y_data[SENSOR_2][PRESS_IDX] = [float(str_tokens[4]) * c] + y_data[SENSOR_2][PRESS_IDX]
-                            y_data[SENSOR_3][PRESS_IDX] = [float(str_tokens[6]) * c] + y_data[SENSOR_3][PRESS_IDX]
-                            
-                            y_data[SENSOR_1][TEMP_IDX] = [float(str_tokens[1])] + y_data[SENSOR_1][TEMP_IDX]
-                            y_data[SENSOR_2][TEMP_IDX] = [float(str_tokens[3])] + y_data[SENSOR_2][TEMP_IDX]
-                            y_data[SENSOR_3][TEMP_IDX] = [float(str_tokens[5])] + y_data[SENSOR_3][TEMP_IDX]
-                            
-                            x_data = np.append(x_data,float(i)/SAMPLE_RATE)
+                            #combined plot has a single pair of axes, scaled to fit all sensors
+                            if combined_plot:
+                                y_low = [float(y_low.min())]
+                                y_high = [float(y_high.max())]
+                            else:
+                                y_low = y_low.tolist()
+                                y_high = y_high.tolist()
+
+                            y_range = [y_high[j] - y_low[j] for j in range(len(y_low))]
                             
-                            #if relative plot is selected, recalculate y data from absolute to relative values
-                            if (relative_plot):
-                                rel_base = y_data[atmospheric_sensor][PRESS_IDX][0]
-                                
-                                rel_sen_1 = atmospheric_sensor + 1
-                                rel_sen_2 = atmospheric_sensor + 2
-                                
-                                if rel_sen_1 > 2:
-                                    rel_sen_1 = rel_sen_1 - 3
-                                if rel_sen_2 > 2:
-                                    rel_sen_2 = rel_sen_2 - 3
-                                    
-                                y_data[rel_sen_1][PRESS_IDX][0] = y_data[rel_sen_1][PRESS_IDX][0] - rel_base
-                                y_data[rel_sen_2][PRESS_IDX][0] = y_data[rel_sen_2][PRESS_IDX][0] - rel_base
-                                y_data[atmospheric_sensor][PRESS_IDX][0] = y_data[atmospheric_sensor][PRESS_IDX][0] - ATMOSPHERIC_BASELINE
+                            for j in range(len(axs)):
+                                y_high_raw = y_high[j]
+                                y_low_raw = y_low[j]
                                 
-                            redraw = False
-                            
-                            #if Y autoscale is enabled, recalculate the axis range once per second. Note: the axis is only drawn to the newly-
-                            #rescaled range if certain conditions are met (see below), to avoid rescaling too often
-                            if (y_autoscale) and ((i % SAMPLE_RATE) == 0):
-                                y_low = [0, 0, 0]
-                                y_high = [0, 0, 0]
-                                y_range = [0, 0, 0]
+                                #if Y range is smaller than minimum, resize it to the minimum
+                                if (y_range[j] < y_min_range[k]):
+                                    y_avg = (y_high[j] + y_low[j]) / 2
+                                    y_high[j] = y_avg + (y_min_range[k] / 2)
+                                    y_low[j] = y_avg - (y_min_range[k] / 2)
+                                    y_range[j] = y_high[j] - y_low[j]
+                                else:
+                                    #if Y range is greater than min, add 5% margin, so the high and low points aren't up against the border
+                                    y_high[j] = y_high[j] + (y_range[j] * 0.05)
+                                    y_low[j] = y_low[j] - (y_range[j] * 0.05)
+
+                                y_prev_range = y_high_prev[j][k] - y_low_prev[j][k]
                                 
-                                for k in (PRESS_IDX, TEMP_IDX):
-                                    for j in range(len(y_data)):
-                                        y_low[j] = min(y_data[j][k][0:int(x_width*SAMPLE_RATE)])
-                                        y_high[j] = max(y_data[j][k][0:int(x_width*SAMPLE_RATE)])
-                                        y_range[j] = y_high[j] - y_low[j]
-
-                                        if combined_plot:
-                                            y_low[SENSOR_1] = min([y_low[SENSOR_1], y_low[j]])
-                                            y_high[SENSOR_1] = max([y_high[SENSOR_1], y_high[j]])
-                                            y_range[SENSOR_1] = y_high[SENSOR_1] - y_low[SENSOR_1]
+                                #if the Y range is already at the minimum, do not rescale unless the lines extend outside of the existing range
+                                if (not ((y_prev_range == y_min_range[k]) and (y_range[j] == y_min_range[k])) or
+                                        (y_high_raw > y_high_prev[j][k]) or 
+                                        (y_low_raw < y_low_prev[j][k])):
+                                    y_high_diff = abs(y_high_prev[j][k] - y_high[j])
+                                    y_low_diff = abs(y_low_prev[j][k] - y_low[j])
+                                    y_large_diff = y_range[j] * 0.20
+                                    y_small_diff = y_range[j] * 0.01
                                     
-                                    for j in range(len(axs)):
-                                        y_high_raw = y_high[j]
-                                        y_low_raw = y_low[j]
+                                    #ensure that we are not redrawing the whole plot too often, as it slows down animation. Rescale more often
+                                    #for large differences and less often for small differences
+                                    if (y_high_diff > y_small_diff) or (y_low_diff > y_small_diff):
+                                        y_small_rescale_debounce[j][k] += len(batch)
                                         
-                                        #if Y range is smaller than minimum, resize it to the minimum
-                                        if (y_range[j] < y_min_range[k]):
-                                            y_avg = (y_high[j] + y_low[j]) / 2
-                                            y_high[j] = y_avg + (y_min_range[k] / 2)
-                                            y_low[j] = y_avg - (y_min_range[k] / 2)
-                                            y_range[j] = y_high[j] - y_low[j]
-                                        else:
-                                            #if Y range is greater than min, add 5% margin, so the high and low points aren't up against the border
-                                            y_high[j] = y_high[j] + (y_range[j] * 0.05)
-                                            y_low[j] = y_low[j] - (y_range[j] * 0.05)
-
-                                        y_prev_range = y_high_prev[j][k] - y_low_prev[j][k]
-                                        
-                                        #if the Y range is already at the minimum, do not rescale unless the lines extend outside of the existing range
-                                        if (not ((y_prev_range == y_min_range[k]) and (y_range[j] == y_min_range[k])) or
-                                                (y_high_raw > y_high_prev[j][k]) or 
-                                                (y_low_raw < y_low_prev[j][k])):
-                                            y_high_diff = abs(y_high_prev[j][k] - y_high[j])
-                                            y_low_diff = abs(y_low_prev[j][k] - y_low[j])
-                                            y_large_diff = y_range[j] * 0.20
-                                            y_small_diff = y_range[j] * 0.01
-                                            
-                                            #ensure that we are not redrawing the whole plot too often, as it slows down animation. Rescale more often
-                                            #for large differences and less often for small differences
-                                            if (y_high_diff > y_small_diff) or (y_low_diff > y_small_diff):
-                                                y_small_rescale_debounce[j][k] += 1
-                                                
-                                                if (y_small_rescale_debounce[j][k] >= 5):
-                                                    redraw = True
-                                                    axs[j][k].set_ylim(y_low[j], y_high[j])
-                                                    y_high_prev[j][k] = y_high[j]
-                                                    y_low_prev[j][k] = y_low[j]
-                                                    y_small_rescale_debounce[j][k] = 0
-                                            else:
-                                                y_small_rescale_debounce[j][k] = 0
-                                                
-                                            if (y_high_diff > y_large_diff) or (y_low_diff > y_large_diff):
-                                                y_large_rescale_debounce[j][k] += 1
-
-                                                if (y_large_rescale_debounce[j][k] >= 2):
-                                                    redraw = True
-                                                    axs[j][k].set_ylim(y_low[j], y_high[j])
-                                                    y_high_prev[j][k] = y_high[j]
-                                                    y_low_prev[j][k] = y_low[j]
-                                                    y_large_rescale_debounce[j][k] = 0
-                                            else:
-                                                y_large_rescale_debounce[j][k] = 0
-                                        else:
+                                        if (y_small_rescale_debounce[j][k] >= Y_SMALL_RESCALE_DELAY * sample_rate):
+                                            redraw = True
+                                            axs[j][k].set_ylim(y_low[j], y_high[j])
+                                            y_high_prev[j][k] = y_high[j]
+                                            y_low_prev[j][k] = y_low[j]
                                             y_small_rescale_debounce[j][k] = 0
+                                    else:
+                                        y_small_rescale_debounce[j][k] = 0
+                                        
+                                    if (y_high_diff > y_large_diff) or (y_low_diff > y_large_diff):
+                                        y_large_rescale_debounce[j][k] += len(batch)
+
+                                        if (y_large_rescale_debounce[j][k] >= Y_LARGE_RESCALE_DELAY * sample_rate):
+                                            redraw = True
+                                            axs[j][k].set_ylim(y_low[j], y_high[j])
+                                            y_high_prev[j][k] = y_high[j]
+                                            y_low_prev[j][k] = y_low[j]
                                             y_large_rescale_debounce[j][k] = 0
+                                    else:
+                                        y_large_rescale_debounce[j][k] = 0
+                                else:
+                                    y_small_rescale_debounce[j][k] = 0
+                                    y_large_rescale_debounce[j][k] = 0
 
-                            if redraw:
-                                for j in range(len(lines)):
-                                    lines[j][k].set_ydata(y_data[j][k])
-                                    lines[j][k].set_xdata(x_data)
-                                    
-                                fig.canvas.draw()
+                    #the flow and volume plots are rescaled as soon as a line leaves the plot, or once the lines have
+                    #only used less than half of the plot for a while. Their ranges come from a scan of the visible window
+                    if y_autoscale and num_flows:
+                        for i, min_range in enumerate((FLOW_MIN_RANGE, VOLUME_MIN_RANGE)):
+                            y_low = float(np.nanmin(derived_data[i]))
+                            y_high = float(np.nanmax(derived_data[i]))
+                            y_range = max(y_high - y_low, min_range)
+                            y_avg = (y_high + y_low) / 2
+
+                            y_bottom, y_top = derived_axs[i].get_ylim()
+                            rescale = (y_low < y_bottom) or (y_high > y_top)
+
+                            if y_range * 1.1 < (y_top - y_bottom) / 2:
+                                flow_rescale_debounce[i] += len(batch)
+                                rescale = rescale or (flow_rescale_debounce[i] >= Y_LARGE_RESCALE_DELAY * sample_rate)
                             else:
-                                for k in (PRESS_IDX, TEMP_IDX):
-                                    for j in range(len(axs)):
-                                        axs[j][k].draw_artist(axs[j][k].patch)
-                                    
-                                    for j in range(len(lines)):
-                                        lines[j][k].set_ydata(y_data[j][k])
-                                        lines[j][k].set_xdata(x_data)
-                                        axs[axs_idx[j]][k].draw_artist(lines[j][k])
-                                        
-                                    if combined_plot:
-                                        axs[SENSOR_1][k].draw_artist(leg[k])
-                                    
-                                    for j in range(len(axs)):
-                                        fig.canvas.blit(axs[j][k].bbox)
-                                
-                                fig.canvas.flush_events()
-                        else:
-                            #on the first time through, initialize and draw the plot
-                            y_data[SENSOR_1][PRESS_IDX] = [float(str_tokens[2]) * c]
-                            y_data[SENSOR_2][PRESS_IDX] = [float(str_tokens[4]) * c]
-                            y_data[SENSOR_3][PRESS_IDX] = [float(str_tokens[6]) * c]
-                            
-                            y_data[SENSOR_1][TEMP_IDX] = [float(str_tokens[1])]
-                            y_data[SENSOR_2][TEMP_IDX] = [float(str_tokens[3])]
-                            y_data[SENSOR_3][TEMP_IDX] = [float(str_tokens[5])]
+                                flow_rescale_debounce[i] = 0
+
+                            if rescale:
+                                redraw = True
+                                derived_axs[i].set_ylim(y_avg - y_range * 0.55, y_avg + y_range * 0.55)
+                                flow_rescale_debounce[i] = 0
+
+                    if render_profile is not None:
+                        t_stage = render_profile.lap(STAGE_AUTOSCALE, t_stage)
+
+                    if redraw:
+                        for k in (PRESS_IDX, TEMP_IDX):
+                            for j in range(len(lines)):
+                                lines[j][k].set_ydata(y_data[schema.channel(j, k)])
+                                lines[j][k].set_xdata(x_data[schema.channel(j, k)])
+
+                        for i in range(len(derived_lines)):
+                            for ch in range(num_flows):
+                                derived_lines[i][ch].set_ydata(derived_data[i][ch])
+                                derived_lines[i][ch].set_xdata(derived_x[i][ch])
                             
-                            x_data = np.array(float(i))
+                        fig.canvas.draw()
+
+                        if render_profile is not None:
+                            t_stage = render_profile.lap(STAGE_DRAW, t_stage)
+                    else:
+                        #every axes is drawn first and then blitted, so that drawing and blitting can be timed apart
+                        for k in (PRESS_IDX, TEMP_IDX):
+                            for j in range(len(axs)):
+                                axs[j][k].draw_artist(axs[j][k].patch)
                             
-                            #if relative plot is selected, recalculate y data from absolute to relative values
-                            if (relative_plot):
-                                rel_base = y_data[atmospheric_sensor][PRESS_IDX][0]
+                            for j in range(len(lines)):
+                                lines[j][k].set_ydata(y_data[schema.channel(j, k)])
+                                lines[j][k].set_xdata(x_data[schema.channel(j, k)])
+                                axs[axs_idx[j]][k].draw_artist(lines[j][k])
                                 
-                                rel_sen_1 = atmospheric_sensor + 1
-                                rel_sen_2 = atmospheric_sensor + 2
-                                
-                                if rel_sen_1 > 2:
-                                    rel_sen_1 = rel_sen_1 - 3
-                                if rel_sen_2 > 2:
-                                    rel_sen_2 = rel_sen_2 - 3
-                                    
-                                y_data[rel_sen_1][PRESS_IDX][0] = y_data[rel_sen_1][PRESS_IDX][0] - rel_base
-                                y_data[rel_sen_2][PRESS_IDX][0] = y_data[rel_sen_2][PRESS_IDX][0] - rel_base
-                                y_data[atmospheric_sensor][PRESS_IDX][0] = y_data[atmospheric_sensor][PRESS_IDX][0] - ATMOSPHERIC_BASELINE
-        
-                            #if combined plot is selected, only two plots - one for temperature and one for pressure. Else, draw six plots, one
-                            #for temperature and one for pressure for each sensor.
-                            if (combined_plot):
-                                fig, axs2 = plt.subplots(1, 2, figsize=(10,6), gridspec_kw={'width_ratios': [1, 5]})
-                                axs[axs_idx[SENSOR_1]] = axs2
-                            else:
-                                fig, axs = plt.subplots(MAX_SENSORS, 2, figsize=(10,6), gridspec_kw={'width_ratios': [1, 5]})
-                            
-                            fig.subplots_adjust(hspace=.5)
-                            
-                            lines[SENSOR_1][PRESS_IDX], = axs[axs_idx[SENSOR_1]][PRESS_IDX].plot(x_data, y_data[SENSOR_1][PRESS_IDX],'red', label='press 1')
-                            lines[SENSOR_2][PRESS_IDX], = axs[axs_idx[SENSOR_2]][PRESS_IDX].plot(x_data, y_data[SENSOR_2][PRESS_IDX],'green', label='press 2')
-                            lines[SENSOR_3][PRESS_IDX], = axs[axs_idx[SENSOR_3]][PRESS_IDX].plot(x_data, y_data[SENSOR_3][PRESS_IDX],'blue', label='press 3')
-                            
-                            lines[SENSOR_1][TEMP_IDX], = axs[axs_idx[SENSOR_1]][TEMP_IDX].plot(x_data, y_data[SENSOR_1][TEMP_IDX],'pink', label='temp 1')
-                            lines[SENSOR_2][TEMP_IDX], = axs[axs_idx[SENSOR_2]][TEMP_IDX].plot(x_data, y_data[SENSOR_2][TEMP_IDX],'olive', label='temp 2')
-                            lines[SENSOR_3][TEMP_IDX], = axs[axs_idx[SENSOR_3]][TEMP_IDX].plot(x_data, y_data[SENSOR_3][TEMP_IDX],'cyan', label='temp 3')
-                            
-                            if (combined_plot):
-                                axs[axs_idx[SENSOR_1]][PRESS_IDX].set_title('Pressure')
-                            else:
-                                axs[axs_idx[SENSOR_1]][PRESS_IDX].set_title('Pressure 1')
-                                axs[axs_idx[SENSOR_2]][PRESS_IDX].set_title('Pressure 2')
-                                axs[axs_idx[SENSOR_3]][PRESS_IDX].set_title('Pressure 3')
-                            
-                            axs[axs_idx[SENSOR_2]][PRESS_IDX].set_ylabel(units_str)
-                            axs[axs_idx[SENSOR_2]][PRESS_IDX].yaxis.set_label_position("right")
-                            axs[axs_idx[SENSOR_3]][PRESS_IDX].set_xlabel('t - seconds')
-                            
-                            if (combined_plot):
-                                axs[axs_idx[SENSOR_1]][TEMP_IDX].set_title('Temperature')
-                            else:
-                                axs[axs_idx[SENSOR_1]][TEMP_IDX].set_title('Temperature 1')
-                                axs[axs_idx[SENSOR_2]][TEMP_IDX].set_title('Temperature 2')
-                                axs[axs_idx[SENSOR_3]][TEMP_IDX].set_title('Temperature 3')
-                            
-                            axs[axs_idx[SENSOR_2]][TEMP_IDX].set_ylabel('°C')
-                            
+                            if combined_plot:
+                                axs[SENSOR_1][k].draw_artist(leg[k])
+
+                            if (breath_text is not None) and (k == PRESS_IDX):
+                                breath_text.axes.draw_artist(breath_text)
+
+                            if (timing_text is not None) and (k == PRESS_IDX):
+                                timing_text.axes.draw_artist(timing_text)
+
+                        for i in range(len(derived_lines)):
+                            derived_axs[i].draw_artist(derived_axs[i].patch)
+
+                            for ch in range(num_flows):
+                                derived_lines[i][ch].set_ydata(derived_data[i][ch])
+                                derived_lines[i][ch].set_xdata(derived_x[i][ch])
+                                derived_axs[i].draw_artist(derived_lines[i][ch])
+
+                            if derived_legs[i] is not None:
+                                derived_axs[i].draw_artist(derived_legs[i])
+
+                        if render_profile is not None:
+                            t_stage = render_profile.lap(STAGE_DRAW, t_stage)
+
+                        for k in (PRESS_IDX, TEMP_IDX):
                             for j in range(len(axs)):
-                                axs[j][PRESS_IDX].set_xlim(x_upper_bound, x_lower_bound)
-                                axs[j][PRESS_IDX].set_ylim(y_lower_bound_press, y_upper_bound_press)
-                                axs[j][TEMP_IDX].set_xlim(x_upper_bound, x_lower_bound)
-                                axs[j][TEMP_IDX].set_ylim(y_lower_bound_temp, y_upper_bound_temp)
-                                
-                                axs[j][PRESS_IDX].yaxis.set_major_locator(AutoLocator())
-                                axs[j][PRESS_IDX].yaxis.set_major_formatter(FormatStrFormatter('%d'))
-                                axs[j][PRESS_IDX].yaxis.set_minor_locator(AutoMinorLocator())
-                                axs[j][PRESS_IDX].yaxis.tick_right()
-                                axs[j][PRESS_IDX].xaxis.set_minor_locator(AutoMinorLocator())
-                                
-                                axs[j][TEMP_IDX].yaxis.set_major_locator(AutoLocator())
-                                axs[j][TEMP_IDX].yaxis.set_major_formatter(FormatStrFormatter('%d'))
-                                axs[j][TEMP_IDX].yaxis.set_minor_locator(AutoMinorLocator())
-                                
-                                #draw legend only if using combined plot. Otherwise, plot labels alone are sufficient
-                                if (combined_plot):
-                                    leg[PRESS_IDX] = axs[j][PRESS_IDX].legend()
-                                    leg[TEMP_IDX] = axs[j][TEMP_IDX].legend()
-                                
-                                axs[j][PRESS_IDX].spines['top'].set_color('lightgray')
-                                axs[j][PRESS_IDX].spines['left'].set_color('lightgray')
-                                axs[j][TEMP_IDX].spines['top'].set_color('lightgray')
-                                axs[j][TEMP_IDX].spines['left'].set_color('lightgray')
-                            
-                            plt.show(block=False)
-                            
-                            fig.canvas.set_window_title('Ventsense ' + SW_VERSION)
-   
-                            fig.canvas.draw()
-                            
-                        i+=1
+                                fig.canvas.blit(axs[j][k].bbox)
+
+                        for i in range(len(derived_lines)):
+                            fig.canvas.blit(derived_axs[i].bbox)
+
+                        if render_profile is not None:
+                            t_stage = render_profile.lap(STAGE_BLIT, t_stage)
+                        
+                        fig.canvas.flush_events()
+
+                        if render_profile is not None:
+                            render_profile.lap(STAGE_EVENTS, t_stage)
+                else:
+                    #on the first time through, initialize and draw the plot
+                    #if combined plot is selected, only two plots - one for temperature and one for pressure. Else, draw two plots
+                    #for each sensor, one for temperature and one for pressure.
+                    if (combined_plot):
+                        num_rows = 1
+                    else:
+                        num_rows = num_sensors
+
+                    #flow and volume get a row each, below the sensors, using only the wide column
+                    num_plot_rows = num_rows
+                    if num_flows:
+                        num_plot_rows += 2
+
+                    fig, all_axs = plt.subplots(num_plot_rows, 2, figsize=(10, max(6, 2 * num_plot_rows)), squeeze=False,
+                                                gridspec_kw={'width_ratios': [1, 5]})
+                    axs = all_axs[:num_rows]
+                    
+                    fig.subplots_adjust(hspace=.5)
+                    
+                    for j in range(num_sensors):
+                        lines[j][PRESS_IDX], = axs[axs_idx[j]][PRESS_IDX].plot(x_data[schema.channel(j, PRESS_IDX)],
+                                                                             y_data[schema.channel(j, PRESS_IDX)],
+                                                                             PRESS_COLORS[j % len(PRESS_COLORS)],
+                                                                             label=schema.channelName(j, PRESS_IDX))
+                        lines[j][TEMP_IDX], = axs[axs_idx[j]][TEMP_IDX].plot(x_data[schema.channel(j, TEMP_IDX)],
+                                                                           y_data[schema.channel(j, TEMP_IDX)],
+                                                                           TEMP_COLORS[j % len(TEMP_COLORS)],
+                                                                           label=schema.channelName(j, TEMP_IDX))
+                    
+                    if (combined_plot):
+                        axs[SENSOR_1][PRESS_IDX].set_title('Pressure')
+                        axs[SENSOR_1][TEMP_IDX].set_title('Temperature')
+                    else:
+                        for j in range(num_sensors):
+                            axs[j][PRESS_IDX].set_title('Pressure ' + schema.sensorLabel(j))
+                            axs[j][TEMP_IDX].set_title('Temperature ' + schema.sensorLabel(j))
+                    
+                    #units on the middle row, time on the bottom row
+                    axs[num_rows // 2][PRESS_IDX].set_ylabel(units_str)
+                    axs[num_rows // 2][PRESS_IDX].yaxis.set_label_position("right")
+                    all_axs[num_plot_rows - 1][PRESS_IDX].set_xlabel('t - seconds')
+                    axs[num_rows // 2][TEMP_IDX].set_ylabel('°C')
+                    
+                    for j in range(len(axs)):
+                        axs[j][PRESS_IDX].set_xlim(x_upper_bound, x_lower_bound)
+                        axs[j][PRESS_IDX].set_ylim(y_lower_bound_press, y_upper_bound_press)
+                        axs[j][TEMP_IDX].set_xlim(x_upper_bound, x_lower_bound)
+                        axs[j][TEMP_IDX].set_ylim(y_lower_bound_temp, y_upper_bound_temp)
+                        
+                        axs[j][PRESS_IDX].yaxis.set_major_locator(AutoLocator())
+                        axs[j][PRESS_IDX].yaxis.set_major_formatter(FormatStrFormatter('%d'))
+                        axs[j][PRESS_IDX].yaxis.set_minor_locator(AutoMinorLocator())
+                        axs[j][PRESS_IDX].yaxis.tick_right()
+                        axs[j][PRESS_IDX].xaxis.set_minor_locator(AutoMinorLocator())
+                        
+                        axs[j][TEMP_IDX].yaxis.set_major_locator(AutoLocator())
+                        axs[j][TEMP_IDX].yaxis.set_major_formatter(FormatStrFormatter('%d'))
+                        axs[j][TEMP_IDX].yaxis.set_minor_locator(AutoMinorLocator())
+                        
+                        #draw legend only if using combined plot. Otherwise, plot labels alone are sufficient
+                        if (combined_plot):
+                            leg[PRESS_IDX] = axs[j][PRESS_IDX].legend()
+                            leg[TEMP_IDX] = axs[j][TEMP_IDX].legend()
+                        
+                        axs[j][PRESS_IDX].spines['top'].set_color('lightgray')
+                        axs[j][PRESS_IDX].spines['left'].set_color('lightgray')
+                        axs[j][TEMP_IDX].spines['top'].set_color('lightgray')
+                        axs[j][TEMP_IDX].spines['left'].set_color('lightgray')
+
+                    derived_axs = []
+                    derived_lines = []
+                    derived_legs = []
+                    if num_flows:
+                        for i, (title, ylabel, names, min_range) in enumerate((('Flow', 'L/min', flow_channels.flow_names, FLOW_MIN_RANGE),
+                                                                               ('Volume', 'mL', flow_channels.volume_names, VOLUME_MIN_RANGE))):
+                            ax = all_axs[num_rows + i][PRESS_IDX]
+                            all_axs[num_rows + i][TEMP_IDX].axis('off')
+
+                            derived_axs.append(ax)
+                            derived_lines.append([ax.plot(derived_x[i][ch], derived_data[i][ch], FLOW_COLORS[ch % len(FLOW_COLORS)],
+                                                          label=names[ch])[0] for ch in range(num_flows)])
+
+                            ax.set_title(title)
+                            ax.set_ylabel(ylabel)
+                            ax.yaxis.set_label_position("right")
+                            ax.set_xlim(x_upper_bound, x_lower_bound)
+                            ax.set_ylim(-min_range / 2, min_range / 2)
+                            ax.yaxis.set_major_locator(AutoLocator())
+                            ax.yaxis.set_major_formatter(FormatStrFormatter('%d'))
+                            ax.yaxis.set_minor_locator(AutoMinorLocator())
+                            ax.yaxis.tick_right()
+                            ax.xaxis.set_minor_locator(AutoMinorLocator())
+                            ax.spines['top'].set_color('lightgray')
+                            ax.spines['left'].set_color('lightgray')
+
+                            #legend only needed to tell several flows apart
+                            derived_legs.append(ax.legend() if num_flows > 1 else None)
+
+                    #latest breath, in the top left corner of the analyzed sensor's pressure plot
+                    if (analyzer is not None) and (breath_sensor - 1 < num_sensors):
+                        breath_text = axs[axs_idx[breath_sensor - 1]][PRESS_IDX].text(0.01, 0.95, '', va='top', fontsize='small',
+                                                                                       transform=axs[axs_idx[breath_sensor - 1]][PRESS_IDX].transAxes)
+                        if last_breath is not None:
+                            breath_text.set_text(formatBreath(last_breath, units_str))
+
+                    #sample rate, jitter and lost samples, in the bottom left corner of the first pressure plot
+                    timing_text = axs[SENSOR_1][PRESS_IDX].text(0.01, 0.05, acq.clock.summary(), va='bottom',
+                                                                fontsize='small', transform=axs[SENSOR_1][PRESS_IDX].transAxes)
+                    
+                    plt.show(block=False)
+                    
+                    if acq.device_name is not None:
+                        fig.canvas.manager.set_window_title('Ventsense ' + SW_VERSION + ' - ' + acq.device_name)
+                    else:
+                        fig.canvas.manager.set_window_title('Ventsense ' + SW_VERSION)
+
+                    fig.canvas.draw()
+
+                    if render_profile is not None:
+                        t_stage = render_profile.lap(STAGE_DRAW, t_stage)
+
+                    #the lines are drawn sample by sample on this first frame, and from here on decimated if the
+                    #window is long enough
+                    plot_width = int(axs[SENSOR_1][PRESS_IDX].bbox.width)
+                    decimator = startDecimator(samples, schema.num_channels + num_flows, window_len, plot_width)
 
 
             except KeyboardInterrupt:
@@ -575,7 +1664,105 @@ def main(argv):
                 print(traceback.format_exc())
                 break
 
-        file.close()
+        for a in acqs:
+            a.stop()
+        for a in acqs:
+            a.join()
+
+        #write and sync whatever is left of the logs
+        log_writer.close()
+
+        if log_writer.error is not None:
+            print(log_writer.error)
+            print(log_writer.error_traceback)
+
+        #subscribers get what is left, then the end of the stream
+        if stream_server is not None:
+            stream_server.close()
+
+            if stream_server.error is not None:
+                print(stream_server.error)
+                print(stream_server.error_traceback)
+
+        for a, ser in zip(acqs, sources):
+            if (a.error is not None) and (a not in errors_reported):
+                print(a.error)
+                print(a.error_traceback)
+
+            if a.device_name is not None:
+                print('Serial ' + a.device_name + ' ' + a.stats())
+                print('Timing ' + a.device_name + ' ' + a.clock.stats())
+            else:
+                print('Serial ' + a.stats())
+                print('Timing ' + a.clock.stats())
+
+            if a.breath_analyzer is not None:
+                if a.device_name is not None:
+                    print('Breaths ' + a.device_name + ': ' + str(a.breath_analyzer.detector.breaths_detected))
+                else:
+                    print('Breaths: ' + str(a.breath_analyzer.detector.breaths_detected))
+
+                a.breath_analyzer.close()
+
+            if a.alarm_engine is not None:
+                if a.alarm_engine.missing:
+                    print('Alarm sensors not present: ' + formatAlarmRules(a.alarm_engine.missing))
+
+                if a.device_name is not None:
+                    print('Alarms ' + a.device_name + ' ' + a.alarm_engine.stats())
+                else:
+                    print('Alarms ' + a.alarm_engine.stats())
+
+                a.alarm_engine.close()
+
+            if a.filters is not None:
+                if a.filters.missing:
+                    print('Filter sensors not present: ' + formatFilters(a.filters.missing))
+
+                if a.device_name is not None:
+                    print('Filters ' + a.device_name + ' ' + a.filters.stats())
+                else:
+                    print('Filters ' + a.filters.stats())
+
+            if isinstance(ser, FrameSerial):
+                if a.device_name is not None:
+                    print('Wire ' + a.device_name + ' ' + ser.stats())
+                else:
+                    print('Wire ' + ser.stats())
+
+            #replay://, sim:// and stream:// sources
+            source = ser.port if isinstance(ser, FrameSerial) else ser
+            if isinstance(source, (replay.ReplaySerial, stream.StreamSerial)):
+                print(source.summary())
+
+            ser.close()
+
+        print('Log ' + log_writer.stats())
+
+        if stream_server is not None:
+            print('Stream ' + stream_server.stats())
+
+        if sample_queue is not None:
+            print('Plot samples ' + sample_queue.stats())
+
+            if frames > 0:
+                print('Plot frames: ' + str(frames) + ', average samples per frame: ' + 
+                      '{:.1f}'.format(float(sample_queue.drained) / frames))
+
+        #the last part of the run, and the summary of the whole run for other tools to compare
+        if profiler is not None:
+            samples_read = sum(a.clock.samples for a in acqs)
+            print(profiler.report(samples_read, frames, sample_queue))
+
+            profile_path = 'ventsense_profile_' + time.strftime("%Y-%m-%d_%Hh%Mm%Ss") + '.json'
+            profiler.dump(profile_path, samples_read, frames, sample_queue, version=SW_VERSION, ports=port_names,
+                          ingest_mode=ingest_mode, log_format=log_format, wire_mode=wire_mode,
+                          plot_enabled=plot_enabled, render_fps=render_fps,
+                          devices=[{'name': a.device_name or port_names[idx], 'lines': a.lines_read,
+                                    'malformed': a.bad_lines, 'samples': a.clock.samples, 'lost': a.clock.lost,
+                                    'elapsed_s': a.elapsed()}
+                                   for idx, a in enumerate(acqs)])
+            print('Profile written to ' + profile_path)
 
 
 if __name__ == "__main__":
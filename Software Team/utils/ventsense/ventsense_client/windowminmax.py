@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# windowminmax.py
+# Helpful Engineering
+#
+# Purpose:
+# Running minimum and maximum of each plot channel over the visible window (the newest window_len
+# samples), used by the client's Y autoscale. Instead of scanning the whole window every time the
+# axes are checked, a min/max summary of each block of samples is kept up to date as samples
+# arrive, so reading the window extremes only has to look at the block summaries plus the part of
+# the oldest block that is still in the window.
+#
+# Notes:
+# All channels are handled together with NumPy, one batch of samples at a time, so the cost per
+# sample barely depends on the number of channels. With the default block length of
+# sqrt(window_len), adding a sample is O(1) and reading the extremes is O(sqrt(window_len)).
+#
+# Samples are kept in a ring of whole blocks, block b at slots (b % num_blocks) * block_len
+# onwards, so that any part of one block is a contiguous slice. The summary of the newest block
+# covers the samples written to it so far.
+
+import numpy as np
+
+
+class SlidingMinMax(object):
+    #track the minimum and maximum of each of 'num_channels' channels over the newest 'window_len'
+    #samples
+    def __init__(self, num_channels, window_len, block_len=None):
+        if window_len < 1:
+            raise ValueError('window_len must be at least 1')
+
+        self.num_channels = int(num_channels)
+        self.window_len = int(window_len)
+
+        if block_len is None:
+            block_len = int(np.sqrt(self.window_len))
+        self.block_len = max(1, int(block_len))
+
+        #enough whole blocks to hold the window wherever it starts within a block
+        self.num_blocks = -(-self.window_len // self.block_len) + 1
+        self.capacity = self.num_blocks * self.block_len
+
+        self._data = np.zeros((self.num_channels, self.capacity), dtype=np.float64)
+        self._block_min = np.zeros((self.num_channels, self.num_blocks), dtype=np.float64)
+        self._block_max = np.zeros((self.num_channels, self.num_blocks), dtype=np.float64)
+
+        self.total = 0      #number of samples appended since creation/clear
+
+    def __len__(self):
+        return min(self.total, self.window_len)
+
+    def clear(self):
+        self.total = 0
+
+    #add one sample. 'values' is a sequence of num_channels numbers
+    def append(self, values):
+        self.extend(np.asarray(values, dtype=np.float64).reshape(self.num_channels, 1))
+
+    #add a batch of samples. 'values' has shape (num_channels, n), oldest sample first
+    def extend(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        n = values.shape[1]
+
+        if n == 0:
+            return
+
+        #only the newest window_len samples matter. Skip the rest, but keep the write position at a block
+        #boundary, so that no stale block summary gets merged with new samples
+        if n > self.capacity:
+            start = ((self.total + n - self.window_len) // self.block_len) * self.block_len
+            values = values[:, start - self.total:]
+            n = values.shape[1]
+            self.total = start
+
+        b_len = self.block_len
+        done = 0
+
+        while done < n:
+            offset = self.total % b_len
+            block = (self.total // b_len) % self.num_blocks
+            pos = block * b_len + offset
+
+            m = min(n - done, b_len - offset)
+            chunk = values[:, done:done + m]
+
+            self._data[:, pos:pos + m] = chunk
+
+            chunk_min = chunk.min(axis=1)
+            chunk_max = chunk.max(axis=1)
+
+            if offset == 0:
+                self._block_min[:, block] = chunk_min
+                self._block_max[:, block] = chunk_max
+            else:
+                np.minimum(self._block_min[:, block], chunk_min, out=self._block_min[:, block])
+                np.maximum(self._block_max[:, block], chunk_max, out=self._block_max[:, block])
+
+            self.total += m
+            done += m
+
+    #return (mins, maxs), the minimum and maximum of every channel over the window, as arrays of
+    #length num_channels
+    def extremes(self):
+        if self.total == 0:
+            raise IndexError('no samples')
+
+        b_len = self.block_len
+        start = max(self.total - self.window_len, 0)
+
+        #the part of the oldest block that is still in the window...
+        first_full = -(-start // b_len)
+        head_end = min(first_full * b_len, self.total)
+
+        mins = None
+        maxs = None
+
+        if head_end > start:
+            pos = ((start // b_len) % self.num_blocks) * b_len + (start % b_len)
+            head = self._data[:, pos:pos + head_end - start]
+            mins = head.min(axis=1)
+            maxs = head.max(axis=1)
+
+        #...and the summaries of every block from there to the newest
+        last = (self.total - 1) // b_len
+        if last >= first_full:
+            blocks = np.arange(first_full, last + 1) % self.num_blocks
+            block_mins = self._block_min[:, blocks].min(axis=1)
+            block_maxs = self._block_max[:, blocks].max(axis=1)
+
+            if mins is None:
+                mins = block_mins
+                maxs = block_maxs
+            else:
+                mins = np.minimum(mins, block_mins)
+                maxs = np.maximum(maxs, block_maxs)
+
+        return mins, maxs
+
+    #minimum of a channel over the window
+    def min(self, ch):
+        return self.extremes()[0][ch]
+
+    #maximum of a channel over the window
+    def max(self, ch):
+        return self.extremes()[1][ch]
@@ -113,6 +113,23 @@
 * <timestamp>,<temp 1>,<pressure 1>,<temp 2>,<pressure 2>,<temp 3>,<pressure 3>
 * 
 * The temperature is in degrees Celsius and the pressure is in hPa.
+*
+* The client can ask for compact binary frames instead of lines of text, by
+* sending the command line "F<interval>" (e.g. "F5"), where <interval> is the
+* sample period in ms. The firmware replies "#frames <interval>" and then
+* sends one frame per sample, little-endian:
+*   sync      2 bytes  0xA5 0x5A
+*   sensors   uint8    number of sensors
+*   sequence  uint16   frame number, counting up from 0
+*   millis    uint32   timestamp
+*   then for each sensor:
+*   temp      int16    temperature, in 0.01 degrees Celsius
+*   press     uint32   pressure, in Pa
+*   crc       uint16   CRC-16/CCITT-FALSE of everything after the sync word
+* A frame is 29 bytes for 3 sensors, against about 50 for a line of text, so
+* the link has room for several hundred samples per second (see framing.py in
+* the client). The sensors give a new reading every 5 ms. The command line "T"
+* goes back to text (reply "#text"), as does a reset.
 */
 
 // the sensor communicates using SPI, so include the library:
@@ -139,7 +156,8 @@ const int SENSOR_DATA_READ_LEN = 6;
 byte rxBuffer[CAL_DATA_READ_LEN+2] = {0};
 
 unsigned long previousMillis = 0;
-const long interval = 100;          // 100 ms sample period
+const unsigned long TEXT_INTERVAL = 100;  // 100 ms sample period
+unsigned long interval = TEXT_INTERVAL;
 
 typedef enum
 {
@@ -149,6 +167,30 @@ typedef enum
     MAX_SENSORS
 } sensor_ID_t;
 
+// serial commands from the client, one per line
+const char CMD_FRAMES = 'F';
+const char CMD_TEXT = 'T';
+const int CMD_MAX_LEN = 16;
+
+char command[CMD_MAX_LEN + 1];
+int commandLen = 0;
+
+// binary frames (see Notes above)
+const byte FRAME_SYNC_0 = 0xA5;
+const byte FRAME_SYNC_1 = 0x5A;
+const int FRAME_HEADER_LEN = 9;     // sync, sensors, sequence, millis
+const int FRAME_SENSOR_LEN = 6;     // temp, press
+const int FRAME_CRC_LEN = 2;
+const int FRAME_LEN = FRAME_HEADER_LEN + MAX_SENSORS * FRAME_SENSOR_LEN + FRAME_CRC_LEN;
+
+const unsigned long DEFAULT_FRAME_INTERVAL = 5;   // ms
+const unsigned long MIN_FRAME_INTERVAL = 1;       // ms
+const unsigned long MAX_FRAME_INTERVAL = 1000;    // ms
+
+bool frameMode = false;
+uint16_t frameSequence = 0;
+byte frame[FRAME_LEN];
+
 // pins used for the connection with the sensor
 // the other you need are controlled by the SPI library):
 const int chipSelects[3] = {8, 9, 10};
@@ -228,6 +270,8 @@ void setup() {
 }
 
 void loop() {
+  readCommands();
+
   unsigned long currentMillis = millis();
 
   if (currentMillis - previousMillis >= interval) {
@@ -249,24 +293,135 @@ void loop() {
     #endif 
     
     // display the sensor data
-    Serial.print(currentMillis);
-    Serial.print(",");
-    Serial.print(temperature[SENSOR_1]);
-    Serial.print(",");
-    Serial.print(pressure[SENSOR_1] / 100.0);
-    Serial.print(",");
-    Serial.print(temperature[SENSOR_2]);
-    Serial.print(",");
-    Serial.print(pressure[SENSOR_2] / 100.0);
-    Serial.print(",");
-    Serial.print(temperature[SENSOR_3]);
-    Serial.print(",");
-    Serial.println(pressure[SENSOR_3] / 100.0);
+    if (frameMode) {
+      sendFrame(currentMillis, temperature, pressure);
+    }
+    else {
+      Serial.print(currentMillis);
+      Serial.print(",");
+      Serial.print(temperature[SENSOR_1]);
+      Serial.print(",");
+      Serial.print(pressure[SENSOR_1] / 100.0);
+      Serial.print(",");
+      Serial.print(temperature[SENSOR_2]);
+      Serial.print(",");
+      Serial.print(pressure[SENSOR_2] / 100.0);
+      Serial.print(",");
+      Serial.print(temperature[SENSOR_3]);
+      Serial.print(",");
+      Serial.println(pressure[SENSOR_3] / 100.0);
+    }
 
     previousMillis = currentMillis;
   }
 }
 
+// collect command lines from the client and handle each one once it is complete
+void readCommands()
+{
+  while (Serial.available() > 0)
+  {
+    char c = Serial.read();
+
+    if ((c == '\n') || (c == '\r'))
+    {
+      command[commandLen] = '\0';
+
+      if (commandLen > 0)
+        handleCommand(command);
+
+      commandLen = 0;
+    }
+    else if (commandLen < CMD_MAX_LEN)
+    {
+      command[commandLen++] = c;
+    }
+  }
+}
+
+void handleCommand(const char* cmd)
+{
+  if (cmd[0] == CMD_FRAMES)
+  {
+    long requested = atol(&cmd[1]);
+
+    if (requested <= 0)
+      interval = DEFAULT_FRAME_INTERVAL;
+    else
+      interval = constrain((unsigned long)requested, MIN_FRAME_INTERVAL, MAX_FRAME_INTERVAL);
+
+    // the reply goes out as text, before the first frame
+    Serial.print("#frames ");
+    Serial.println(interval);
+    frameMode = true;
+  }
+  else if (cmd[0] == CMD_TEXT)
+  {
+    frameMode = false;
+    interval = TEXT_INTERVAL;
+    Serial.println("#text");
+  }
+}
+
+// store the lowest 'numBytes' bytes of 'value' at 'pos' in 'buf', least significant first, and return the position after them
+int putLittleEndian(byte* buf, int pos, unsigned long value, int numBytes)
+{
+  for (int i = 0; i < numBytes; i++)
+  {
+    buf[pos++] = (byte)(value & 0xFF);
+    value >>= 8;
+  }
+
+  return pos;
+}
+
+// CRC-16/CCITT-FALSE (polynomial 0x1021, initial value 0xFFFF)
+uint16_t crc16(const byte* data, int len)
+{
+  uint16_t crc = 0xFFFF;
+
+  for (int i = 0; i < len; i++)
+  {
+    crc ^= (uint16_t)data[i] << 8;
+
+    for (int bit = 0; bit < 8; bit++)
+    {
+      if (crc & 0x8000)
+        crc = (uint16_t)((crc << 1) ^ 0x1021);
+      else
+        crc = (uint16_t)(crc << 1);
+    }
+  }
+
+  return crc;
+}
+
+// send one sample as a binary frame (see Notes above)
+void sendFrame(unsigned long timestamp, const double* temperature, const double* pressure)
+{
+  int len = 0;
+
+  frame[len++] = FRAME_SYNC_0;
+  frame[len++] = FRAME_SYNC_1;
+  frame[len++] = MAX_SENSORS;
+  len = putLittleEndian(frame, len, frameSequence, 2);
+  len = putLittleEndian(frame, len, timestamp, 4);
+
+  for (int i = 0; i < MAX_SENSORS; i++)
+  {
+    long temp = lround(constrain(temperature[i] * 100.0, -32768.0, 32767.0));   // 0.01 degrees C
+    long press = lround(max(pressure[i], 0.0));                                 // Pa
+
+    len = putLittleEndian(frame, len, (unsigned long)temp, 2);
+    len = putLittleEndian(frame, len, (unsigned long)press, 4);
+  }
+
+  len = putLittleEndian(frame, len, crc16(&frame[2], len - 2), 2);
+
+  Serial.write(frame, len);
+  frameSequence++;
+}
+
 unsigned int readRegisters(sensor_ID_t sensor, byte thisRegister, int bytesToRead, byte* rxbuff)
 {
   unsigned int result = 0;   // result to return